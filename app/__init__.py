@@ -4,17 +4,19 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_mail import Mail
-from flask_migrate import Migrate
 from flask_cors import CORS
+from app.utils.startup import StartupTimer, detect_role, runs_background_workers, WEB
 
 # Initialize extensions
 db = SQLAlchemy()
 login_manager = LoginManager()
 bcrypt = Bcrypt()
 mail = Mail()
-migrate = Migrate()
+migrate = None  # Flask-Migrate, created outside the web role (it imports alembic)
 
 def create_app(config_class=None):
+    global migrate
+    
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
     
     # Load configuration
@@ -22,22 +24,34 @@ def create_app(config_class=None):
         app.config.from_object('config.DevelopmentConfig')
     else:
         app.config.from_object(config_class)
+    role = app.config['APP_ROLE'] = detect_role(app.config)
+    startup = app.extensions['startup'] = StartupTimer(role)
+    startup.mark('config')
     
     # Setup logging
     from app.utils.logging_config import setup_logging
     setup_logging(app)
+    startup.mark('logging')
     
     # Initialize extensions with app
     db.init_app(app)
     login_manager.init_app(app)
     bcrypt.init_app(app)
     mail.init_app(app)
-    migrate.init_app(app, db)
+    if role != WEB:
+        # `flask db` needs it; web workers never run migrations
+        from flask_migrate import Migrate
+        if migrate is None:
+            migrate = Migrate()
+        migrate.init_app(app, db)
     CORS(app)
+    startup.mark('extensions')
     
     # Set login view
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
+    from app.utils.user_cache import user_cache
+    user_cache.configure(app.config)
     
     # Register blueprints
     from app.routes.main import main_bp
@@ -67,6 +81,10 @@ def create_app(config_class=None):
     from app.routes.integrations import integrations_bp
     app.register_blueprint(integrations_bp, url_prefix='/integrations')
     
+    from app.routes.admin import admin_bp
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    startup.mark('blueprints')
+    
     # Setup monitoring endpoints
     from app.utils.monitoring import create_health_endpoint
     create_health_endpoint(app)
@@ -76,30 +94,46 @@ def create_app(config_class=None):
     register_error_handlers(app)
     register_api_error_handlers(app)
     
-    # Create database tables if they don't exist
-    with app.app_context():
-        db.create_all()
+    # Create database tables if they don't exist (CLI commands leave the schema to migrations)
+    if role == WEB:
+        with app.app_context():
+            db.create_all()
+        startup.mark('create_all')
     
     # Initialize performance monitoring
     from app.utils.performance_monitor import init_performance_monitoring
     init_performance_monitoring(app)
+    from app.utils.prometheus import init_prometheus
+    init_prometheus(app)
+    startup.mark('monitoring')
     
     # Initialize database optimizations
     from app.utils.database_optimization import DatabaseConnectionPool, optimize_sqlite_settings
     DatabaseConnectionPool.configure_pool(app)
     
     # Apply database optimizations in production
-    if not app.config.get('TESTING', False):
+    if runs_background_workers(app):
         with app.app_context():
             optimize_sqlite_settings()
+        startup.mark('sqlite_settings')
     
     # Initialize CLI commands
     from app.cli.performance import init_performance_cli
     init_performance_cli(app)
+    from app.cli.catalog import init_catalog_cli
+    init_catalog_cli(app)
+    startup.mark('cli')
     
-    # Initialize scheduler if not in testing mode
-    if not app.config.get('TESTING', False):
+    # Initialize scheduler and webhook queue workers in web processes, not in tests or CLI commands
+    if runs_background_workers(app):
         from app.utils.scheduler import init_scheduler
         init_scheduler(app)
+        
+        from app.services.webhook_queue import init_webhook_queue
+        init_webhook_queue(app)
+        
+        from app.utils.error_reporting import init_error_reporting
+        init_error_reporting(app)
+        startup.mark('background_workers')
     
     return app
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+CLI commands for importing store catalogs.
+"""
+
+import click
+from flask.cli import with_appcontext
+
+# Keys of catalog_ingest.CATALOG_SOURCES; the service (and its HTTP stack) is imported when a command runs
+CATALOG_PLATFORMS = ('magento', 'shopify', 'woocommerce')
+
+@click.group()
+def catalog():
+    """Catalog import commands."""
+    pass
+
+@catalog.command()
+@click.argument('platform', type=click.Choice(CATALOG_PLATFORMS))
+@click.option('--batch-size', default=None, type=int, help='Products written per transaction')
+@click.option('--concurrency', default=None, type=int, help='Pages fetched in parallel')
+@with_appcontext
+def ingest(platform, batch_size, concurrency):
+    """Stream a store catalog into the products table."""
+    from app.services.catalog_ingest import ingest_catalog
+    
+    click.echo(f"Ingesting {platform} catalog...")
+    try:
+        stats = ingest_catalog(platform, batch_size=batch_size, concurrency=concurrency)
+    except Exception as e:
+        click.echo(f"❌ Error ingesting catalog: {str(e)}")
+        return
+    
+    click.echo(f"✅ {stats['inserted']} inserted, {stats['updated']} updated, "
+               f"{stats['duplicates']} duplicates, {stats['skipped']} skipped")
+    click.echo(f"   {stats['pages']} pages, {stats['http_calls']} HTTP calls in "
+               f"{stats['elapsed_seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s)")
+
+def init_catalog_cli(app):
+    """Initialize catalog CLI commands."""
+    app.cli.add_command(catalog)
@@ -2,6 +2,7 @@
 CLI commands for performance optimization.
 """
 
+import json
 import click
 from flask import current_app
 from flask.cli import with_appcontext
@@ -66,6 +67,34 @@ def vacuum_db():
     except Exception as e:
         click.echo(f"❌ Error during database maintenance: {str(e)}")
 
+@performance.command()
+@click.option('--days', default=None, type=int, help='Archive errors older than this (default ERROR_LOG_RETENTION_DAYS)')
+@click.option('--directory', type=click.Path(file_okay=False), help='Archive directory (default ERROR_LOG_ARCHIVE_DIR)')
+@with_appcontext
+def archive_errors(days, directory):
+    """Archive old error logs to compressed NDJSON and delete them."""
+    from datetime import datetime, timedelta
+    from app.services.error_retention import ErrorLogRetention
+    
+    days = current_app.config.get('ERROR_LOG_RETENTION_DAYS', 90) if days is None else days
+    if not days:
+        click.echo("Error log retention is disabled (ERROR_LOG_RETENTION_DAYS=0)")
+        return
+    
+    click.echo(f"Archiving error logs older than {days} days...")
+    try:
+        result = ErrorLogRetention.archive(
+            datetime.utcnow() - timedelta(days=days),
+            directory or ErrorLogRetention.archive_directory(current_app),
+            chunk_size=current_app.config.get('ERROR_LOG_RETENTION_CHUNK_SIZE', 1000)
+        )
+        if result['archived']:
+            click.echo(f"✅ Archived and deleted {result['archived']} error logs to {result['path']}")
+        else:
+            click.echo("✅ No error logs old enough to archive")
+    except Exception as e:
+        click.echo(f"❌ Error archiving error logs: {str(e)}")
+
 @performance.command()
 @with_appcontext
 def compress_assets():
@@ -153,6 +182,35 @@ def clear_cache():
     except Exception as e:
         click.echo(f"❌ Error clearing cache: {str(e)}")
 
+@performance.command()
+@click.option('--clear', is_flag=True, help='Remove stored responses and reset the counters')
+@with_appcontext
+def http_cache_stats(clear):
+    """Show store API HTTP cache statistics."""
+    from app.utils.http_cache import get_http_cache
+    
+    click.echo("HTTP Cache Statistics:")
+    try:
+        cache = get_http_cache()
+        if cache is None:
+            click.echo("ℹ️  HTTP cache is disabled")
+            return
+        
+        stats = cache.get_stats()
+        click.echo(f"  Requests: {stats['requests']}")
+        click.echo(f"  Hit ratio: {stats['hit_ratio']:.1%} "
+                   f"({stats['revalidated_hits']} revalidated, {stats['ttl_hits']} TTL)")
+        click.echo(f"  Bytes saved: {stats['bytes_saved'] / 1024:.1f} KB "
+                   f"(fetched {stats['bytes_fetched'] / 1024:.1f} KB)")
+        click.echo(f"  Stored entries: {stats['entries']}")
+        
+        if clear:
+            cache.clear()
+            click.echo("✅ HTTP cache cleared")
+        
+    except Exception as e:
+        click.echo(f"❌ Error getting HTTP cache stats: {str(e)}")
+
 @performance.command()
 @click.option('--minutes', default=60, help='Time period in minutes to analyze')
 @with_appcontext
@@ -169,6 +227,11 @@ def monitor_summary(minutes):
         click.echo(f"  Average response time: {req_stats['avg_response_time']:.3f}s")
         click.echo(f"  Max response time: {req_stats['max_response_time']:.3f}s")
         click.echo(f"  Requests per minute: {req_stats['requests_per_minute']:.1f}")
+        overall = summary['latency_percentiles']['overall']
+        for window in ('1m', '5m', '60m'):
+            stats = overall[window]
+            click.echo(f"  Latency {window}: p50 {stats['p50']:.3f}s, p90 {stats['p90']:.3f}s, "
+                       f"p99 {stats['p99']:.3f}s, p999 {stats['p999']:.3f}s ({stats['count']} requests)")
         
         # Database statistics
         db_stats = summary['database_stats']
@@ -191,6 +254,24 @@ def monitor_summary(minutes):
             click.echo(f"  CPU usage: {sys_stats['cpu_percent']:.1f}%")
             click.echo(f"  Memory usage: {sys_stats['memory_percent']:.1f}%")
             click.echo(f"  Disk usage: {sys_stats['disk_percent']:.1f}%")
+            click.echo(f"  Process: {sys_stats['process_cpu_percent']:.1f}% CPU, "
+                       f"{sys_stats['rss_bytes'] / (1024 * 1024):.1f} MB RSS, "
+                       f"{sys_stats['open_fds']} open files, {sys_stats['threads']} threads")
+            click.echo(f"  GC: {sys_stats['gc_collections']} collections, "
+                       f"{sys_stats['gc_pause_seconds'] * 1000:.1f}ms paused")
+            if sys_stats['db_pool_checked_out'] >= 0:
+                click.echo(f"  DB pool: {sys_stats['db_pool_checked_out']} checked out, "
+                           f"{sys_stats['db_pool_checkouts']} checkouts")
+        
+        # Outbound HTTP statistics
+        if summary['outbound_stats']:
+            from app.utils.http_transport import get_transport
+            circuits = get_transport().get_status()
+            click.echo(f"\n🌐 Outbound HTTP Statistics:")
+            for host, stats in sorted(summary['outbound_stats'].items()):
+                state = circuits.get(host, {}).get('state', 'closed')
+                click.echo(f"  {host}: {stats['count']} calls, p50 ≤{stats['p50']}s, p99 ≤{stats['p99']}s, "
+                           f"{stats['error_rate']:.1%} errors, circuit {state}")
         
     except Exception as e:
         click.echo(f"❌ Error getting performance summary: {str(e)}")
@@ -239,10 +320,205 @@ def slow_endpoints(threshold, minutes):
             click.echo(f"   Count: {stats['count']}")
             click.echo(f"   Average: {stats['avg_time']:.3f}s")
             click.echo(f"   Maximum: {stats['max_time']:.3f}s")
+            if stats['p99_time'] is not None:
+                click.echo(f"   p99 (all requests): {stats['p99_time']:.3f}s")
             
     except Exception as e:
         click.echo(f"❌ Error getting slow endpoints: {str(e)}")
 
+@performance.command()
+@click.argument('exports', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--window', default='5m', type=click.Choice(['1m', '5m', '60m']), help='Window to rank endpoints by')
+@click.option('--limit', default=20, help='Number of endpoints to show')
+@with_appcontext
+def latency(exports, window, limit):
+    """Show p50/p90/p99/p999 latency per endpoint.
+    
+    With EXPORTS (files written by export_metrics in each worker), their
+    histograms are merged first, giving percentiles across all workers.
+    """
+    from app.utils.latency_histogram import merge_exports, summarize_windows
+    
+    try:
+        if exports:
+            histograms = []
+            for path in exports:
+                with open(path) as f:
+                    histograms.append(json.load(f).get('latency_histograms', {}))
+            report = summarize_windows(merge_exports(histograms))
+            click.echo(f"Latency Percentiles ({len(exports)} workers merged, ranked by {window} p99):")
+        else:
+            report = performance_monitor.get_latency_percentiles()
+            click.echo(f"Latency Percentiles (ranked by {window} p99):")
+        
+        overall = report['overall'][window]
+        click.echo(f"  All endpoints: p50 {overall['p50']:.3f}s, p90 {overall['p90']:.3f}s, "
+                   f"p99 {overall['p99']:.3f}s, p999 {overall['p999']:.3f}s ({overall['count']} requests)")
+        
+        ranked = sorted(
+            ((endpoint, windows[window]) for endpoint, windows in report['endpoints'].items()
+             if windows[window]['count']),
+            key=lambda item: item[1]['p99'],
+            reverse=True
+        )[:limit]
+        if not ranked:
+            click.echo("ℹ️  No requests recorded in this window")
+            return
+        
+        click.echo(f"\n{'Endpoint':<40} {'Count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'p999':>8}")
+        click.echo("-" * 83)
+        for endpoint, stats in ranked:
+            click.echo(f"{endpoint[:40]:<40} {stats['count']:>7} {stats['p50']:>8.3f} {stats['p90']:>8.3f} "
+                       f"{stats['p99']:>8.3f} {stats['p999']:>8.3f}")
+            
+    except Exception as e:
+        click.echo(f"❌ Error getting latency percentiles: {str(e)}")
+
+@performance.command()
+@click.option('--seconds', default=10.0, help='How long to profile')
+@click.option('--hz', default=None, type=int, help='Samples per second (default PROFILER_DEFAULT_HZ)')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write collapsed stacks (flamegraph input) here')
+@click.option('--all-threads', is_flag=True, help='Also sample background threads')
+@click.option('--limit', default=5, help='Top functions to show per endpoint')
+@with_appcontext
+def profile(seconds, hz, output, all_threads, limit):
+    """Profile the running workers (started with PROFILER_ENABLED) and merge their stacks."""
+    import os
+    import time
+    from app.utils.sampling_profiler import request_profile, collect_profiles, stop_watcher
+
+    try:
+        stop_watcher()  # This process serves no requests
+        directory = current_app.config['PROFILER_DIR']
+        hz = hz or current_app.config.get('PROFILER_DEFAULT_HZ', 100)
+        profile_id = request_profile(directory, seconds, hz, all_threads)
+        click.echo(f"🔬 Profiling workers for {seconds:.0f}s at {hz} Hz (request {profile_id})...")
+
+        # Workers poll for requests every second and need a moment to write their stacks
+        time.sleep(seconds + 3)
+        result = collect_profiles(directory, profile_id)
+        if result is None:
+            click.echo(f"❌ No worker answered; are they running with PROFILER_ENABLED and PROFILER_DIR={directory}?")
+            return
+
+        summary = result.summary(limit=limit)
+        click.echo(f"✅ {summary['samples']} samples from {summary['processes']} workers, "
+                   f"sampler overhead {summary['overhead_percent']:.2f}%")
+        for endpoint, stats in summary['endpoints'].items():
+            click.echo(f"\n{endpoint}: {stats['samples']} samples")
+            for function, count in stats['top_functions']:
+                click.echo(f"  {count / stats['samples'] * 100:5.1f}%  {function}")
+
+        if output:
+            with open(output, 'w') as f:
+                f.write(result.collapsed())
+            click.echo(f"\n🔥 Collapsed stacks written to {os.path.abspath(output)} (flamegraph.pl / speedscope)")
+
+    except Exception as e:
+        click.echo(f"❌ Error profiling: {str(e)}")
+
+@performance.command('startup-profile')
+@click.option('--config', 'config_name', default=None, help='Config class to boot with (default config.DevelopmentConfig)')
+@click.option('--role', default='web', type=click.Choice(['web', 'cli']), help='Role to boot as')
+@click.option('--limit', default=15, help='Number of import components to show')
+@click.option('--target-ms', default=300, help='Boot time to compare against')
+@with_appcontext
+def startup_profile(config_name, role, limit, target_ms):
+    """Boot the app in a fresh interpreter and report import and init time per component."""
+    import os
+    import subprocess
+    import sys
+    from app.utils.startup import parse_importtime
+    
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "from app import create_app\n"
+        "app = create_app(sys.argv[1] or None)\n"
+        "print(json.dumps({'boot_seconds': time.perf_counter() - start, **app.extensions['startup'].to_dict()}))\n"
+    )
+    root = os.path.dirname(current_app.root_path)
+    env = {key: value for key, value in os.environ.items() if key != 'FLASK_RUN_FROM_CLI'}
+    env['APP_ROLE'] = role
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    
+    try:
+        click.echo(f"⏱️  Booting the app as {role} in a fresh interpreter...")
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script, config_name or ''],
+                                cwd=root, env=env, capture_output=True, text=True, timeout=120)
+        lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+        if result.returncode != 0 or not lines:
+            click.echo(f"❌ The app failed to boot:\n{result.stderr[-2000:]}")
+            return
+        
+        report = json.loads(lines[-1])
+        boot_ms = report['boot_seconds'] * 1000
+        status = '✅' if boot_ms <= target_ms else '⚠️ '
+        click.echo(f"{status} Booted in {boot_ms:.0f} ms (target {target_ms} ms; -X importtime adds some overhead)")
+        
+        click.echo("\nInit steps:")
+        click.echo(f"  {'import app':<24} {(report['boot_seconds'] - report['total_seconds']) * 1000:8.1f} ms")
+        for step in report['steps']:
+            click.echo(f"  {step['name']:<24} {step['seconds'] * 1000:8.1f} ms")
+        
+        components = sorted(parse_importtime(result.stderr).items(), key=lambda item: item[1], reverse=True)
+        click.echo("\nImports by component (self time, part of the steps above):")
+        for component, seconds in components[:limit]:
+            click.echo(f"  {component:<40} {seconds * 1000:8.1f} ms")
+    
+    except Exception as e:
+        click.echo(f"❌ Error profiling startup: {str(e)}")
+
+@performance.command()
+@click.option('--days', default=7, help='Time period in days to analyze')
+@click.option('--limit', default=20, help='Number of stores to show')
+@with_appcontext
+def sync_report(days, limit):
+    """Rank stores by the API cost of their syncs."""
+    from app.utils.sync_telemetry import get_sync_cost_report
+    
+    click.echo(f"Sync Cost by Store (last {days} days):")
+    try:
+        report = get_sync_cost_report(days=days, limit=limit)
+        
+        if not report['stores']:
+            click.echo("ℹ️  No sync runs recorded")
+            return
+        
+        click.echo(f"📡 {report['total_http_calls']} HTTP calls, "
+                   f"{report['total_bytes_transferred'] / 1024:.1f} KB transferred")
+        
+        for rank, store in enumerate(report['stores'], 1):
+            click.echo(f"\n{rank}. {store['store_url']} ({store['platform']}, integration {store['integration_id']})")
+            click.echo(f"   HTTP calls: {store['http_calls']} ({store['share_of_calls']:.1%} of total)")
+            click.echo(f"   Transferred: {store['bytes_transferred'] / 1024:.1f} KB over {store['pages']} pages")
+            click.echo(f"   Runs: {store['runs']} ({store['failed_runs']} failed)")
+            click.echo(f"   Retries: {store['retries']}, rate-limit waits: {store['rate_limit_waits']} "
+                       f"({store['rate_limit_wait_seconds']:.1f}s)")
+            click.echo(f"   Inserted: {store['orders_inserted']} orders, {store['products_inserted']} products")
+            
+    except Exception as e:
+        click.echo(f"❌ Error building sync report: {str(e)}")
+
+@performance.command()
+@click.argument('integration_id', type=int)
+@with_appcontext
+def sync_integration(integration_id):
+    """Ask the scheduler leader to sync an integration now."""
+    from app.models.store_integration import StoreIntegration
+    from app.utils.scheduler import request_sync
+    
+    try:
+        integration = StoreIntegration.query.get(integration_id)
+        if not integration:
+            click.echo(f"❌ Integration not found: {integration_id}")
+            return
+        
+        request_sync(integration.id)
+        click.echo(f"✅ Sync requested for {integration.store_url}; the scheduler leader picks it up shortly")
+    except Exception as e:
+        click.echo(f"❌ Error requesting sync: {str(e)}")
+
 @performance.command()
 @with_appcontext
 def table_stats():
@@ -0,0 +1,108 @@
+"""
+Asyncio clients for the Shopify and WooCommerce REST APIs.
+
+Counterparts of ``ShopifyClient`` and ``WooCommerceClient`` for the calls a
+sync makes (customer, orders, products), running on a shared
+``AsyncHTTPTransport``. They only fetch; writing is left to the caller.
+"""
+
+import base64
+
+from app.utils import sync_telemetry
+
+def _base_url(store_url):
+    if store_url.startswith(('http://', 'https://')):
+        return store_url.rstrip('/')
+    return f"https://{store_url.rstrip('/')}"
+
+class AsyncShopifyClient:
+    """Async client for the Shopify Admin REST API."""
+    
+    def __init__(self, transport, store_url, access_token, api_version='2023-01', page_size=50, max_pages=10):
+        self.transport = transport
+        self.base_url = f"{_base_url(store_url)}/admin/api/{api_version}"
+        self.headers = {
+            'X-Shopify-Access-Token': access_token,
+            'Accept': 'application/json'
+        }
+        self.page_size = page_size
+        self.max_pages = max_pages
+    
+    async def _get_json(self, url, params=None):
+        response = await self.transport.request('GET', url, params=params, headers=self.headers)
+        response.raise_for_status()
+        return response
+    
+    async def get_orders(self, customer_email=None, status='any'):
+        """Get a customer's orders, following cursor pagination up to ``max_pages``."""
+        url = f"{self.base_url}/orders.json"
+        params = {'limit': self.page_size, 'status': status}
+        if customer_email:
+            params['email'] = customer_email
+        
+        orders = []
+        for _ in range(self.max_pages):
+            response = await self._get_json(url, params)
+            sync_telemetry.record_page()
+            orders.extend((response.json() or {}).get('orders', []))
+            
+            # The next-page URL already carries the cursor and filters
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                break
+            url, params = next_url, None
+        return orders
+    
+    async def get_product(self, product_id):
+        """Get product details by ID."""
+        response = await self._get_json(f"{self.base_url}/products/{product_id}.json")
+        return (response.json() or {}).get('product')
+
+class AsyncWooCommerceClient:
+    """Async client for the WooCommerce REST API (HTTP Basic auth)."""
+    
+    def __init__(self, transport, store_url, consumer_key, consumer_secret, api_version='wc/v3',
+                 page_size=50, max_pages=10):
+        self.transport = transport
+        self.base_url = f"{_base_url(store_url)}/wp-json/{api_version}"
+        credentials = base64.b64encode(f"{consumer_key}:{consumer_secret}".encode('utf-8')).decode('ascii')
+        self.headers = {
+            'Authorization': f"Basic {credentials}",
+            'Accept': 'application/json'
+        }
+        self.page_size = page_size
+        self.max_pages = max_pages
+    
+    async def _get_json(self, endpoint, params=None):
+        response = await self.transport.request('GET', f"{self.base_url}/{endpoint}",
+                                                params=params, headers=self.headers)
+        response.raise_for_status()
+        return response
+    
+    async def get_customer_by_email(self, email):
+        """Get customer by email."""
+        customers = (await self._get_json('customers', {'email': email})).json()
+        return customers[0] if customers else None
+    
+    async def get_orders(self, customer_id):
+        """Get a customer's orders across pages, using X-WP-TotalPages."""
+        orders = []
+        page = 1
+        while page <= self.max_pages:
+            response = await self._get_json('orders', {
+                'customer': customer_id,
+                'page': page,
+                'per_page': self.page_size
+            })
+            sync_telemetry.record_page()
+            orders.extend(response.json() or [])
+            
+            total_pages = response.headers.get('X-WP-TotalPages', '1')
+            if not total_pages.isdigit() or page >= int(total_pages):
+                break
+            page += 1
+        return orders
+    
+    async def get_product_by_id(self, product_id):
+        """Get product details by ID."""
+        return (await self._get_json(f"products/{product_id}")).json()
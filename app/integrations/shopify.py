@@ -11,6 +11,10 @@ from app.models.store_integration import StoreIntegration
 from app.models.product import Product
 from app.models.purchase import Purchase
 from app.models.user import User
+from app.utils.bulk_upsert import upsert_products
+from app.utils import sync_telemetry
+from app.utils.http_cache import get_http_cache, credential_fingerprint
+from app.utils.http_transport import get_transport
 from datetime import datetime
 
 class ShopifyClient:
@@ -48,7 +52,12 @@ class ShopifyClient:
             'code': code
         }
         
-        response = requests.post(url, json=payload)
+        try:
+            response = get_transport().post(url, json=payload)
+        except requests.exceptions.RequestException as e:
+            current_app.logger.error(f"Failed to get access token: {e}")
+            return None
+        
         if response.status_code == 200:
             return response.json().get('access_token')
         else:
@@ -57,6 +66,9 @@ class ShopifyClient:
     
     def verify_webhook(self, data, hmac_header):
         """Verify that webhook request is from Shopify."""
+        if not self.api_secret or not hmac_header:
+            return False
+        
         digest = hmac.new(
             self.api_secret.encode('utf-8'),
             data,
@@ -70,8 +82,14 @@ class ShopifyClient:
         """Generate a random nonce for OAuth state."""
         return hashlib.sha256(str(time.time()).encode('utf-8')).hexdigest()
     
-    def _make_api_request(self, endpoint, method='GET', data=None, params=None):
-        """Make a request to the Shopify API."""
+    def _make_api_request(self, endpoint, method='GET', data=None, params=None, cache_ttl=0):
+        """
+        Make a request to the Shopify API.
+        
+        GETs go through the HTTP cache: they are revalidated with the stored
+        ETag/Last-Modified, or served without a request for ``cache_ttl``
+        seconds after they were fetched.
+        """
         if not self.store_url or not self.access_token:
             raise ValueError("Store URL and access token are required")
         
@@ -81,17 +99,27 @@ class ShopifyClient:
             'Content-Type': 'application/json'
         }
         
-        try:
+        cache = get_http_cache() if method == 'GET' else None
+        transport = get_transport()
+        
+        def send(conditional_headers):
+            # The transport retries 429s (honoring Shopify's Retry-After) and 5xx responses
             if method == 'GET':
-                response = requests.get(url, headers=headers, params=params)
+                return transport.get(url, headers=dict(headers, **conditional_headers), params=params)
             elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data)
+                return transport.post(url, headers=headers, json=data)
             elif method == 'PUT':
-                response = requests.put(url, headers=headers, json=data)
+                return transport.put(url, headers=headers, json=data)
             elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
+                return transport.delete(url, headers=headers)
+            raise ValueError(f"Unsupported method: {method}")
+        
+        try:
+            if cache is not None:
+                response = cache.fetch(url, send, params=params, ttl=cache_ttl,
+                                       vary=credential_fingerprint(self.access_token))
             else:
-                raise ValueError(f"Unsupported method: {method}")
+                response = send({})
             
             response.raise_for_status()
             return response.json()
@@ -132,6 +160,120 @@ class ShopifyClient:
         return self._make_api_request('customers/search.json', params=params)
 
 
+def ingest_shopify_orders(integration, user, orders, client=None):
+    """
+    Create purchases for a batch of Shopify orders.
+    
+    Existing purchases and products are looked up with one query each for
+    the whole batch, so this is shared by the periodic sync and the webhook
+    queue. The caller is responsible for committing the session.
+    
+    Returns the number of purchases created.
+    """
+    order_ids = {str(order['id']) for order in orders}
+    seen_order_ids = {
+        row.order_id for row in db.session.query(Purchase.order_id).filter(
+            Purchase.user_id == user.id,
+            Purchase.store_name == integration.store_url,
+            Purchase.order_id.in_(order_ids)
+        )
+    } if order_ids else set()
+    
+    line_items = {}
+    for order in orders:
+        for item in order.get('line_items', []):
+            if item.get('product_id'):
+                line_items.setdefault(str(item['product_id']), (item, order))
+    
+    products = {
+        product.external_id: product for product in Product.query.filter(
+            Product.source == 'shopify',
+            Product.external_id.in_(line_items)
+        )
+    } if line_items else {}
+    
+    # Create all missing products with one upsert, so a webhook and a sync
+    # racing on the same product converge on a single row
+    missing_rows = []
+    for external_id, (item, order) in line_items.items():
+        if external_id in products:
+            continue
+        
+        row = {
+            'external_id': external_id,
+            'source': 'shopify',
+            'title': item['title'],
+            'description': item.get('name', ''),
+            'price': float(item['price']),
+            'currency': order['currency'],
+            'category': '',  # Shopify doesn't provide category in orders
+            'product_metadata': {},  # Using product_metadata instead of metadata
+            'image_url': None
+        }
+        
+        # Try to get product image
+        if client is not None:
+            try:
+                product_data = client._make_api_request(
+                    f"products/{external_id}.json",
+                    cache_ttl=current_app.config.get('HTTP_CACHE_TTL_SECONDS', 0)
+                )
+                if product_data and 'product' in product_data and product_data['product']['images']:
+                    row['image_url'] = product_data['product']['images'][0]['src']
+            except Exception as e:
+                current_app.logger.error(f"Error fetching product image: {e}")
+        
+        missing_rows.append(row)
+    
+    if missing_rows:
+        # Keep whatever a concurrent writer stored; only fill in missing products
+        upsert_products(missing_rows, update_columns=[])
+        sync_telemetry.record_products_inserted(len(missing_rows))
+        products.update({
+            product.external_id: product for product in Product.query.filter(
+                Product.source == 'shopify',
+                Product.external_id.in_([row['external_id'] for row in missing_rows])
+            )
+        })
+    
+    created = 0
+    new_orders = 0
+    for order in orders:
+        order_id = str(order['id'])
+        
+        # Skip orders we already have (or saw earlier in this batch)
+        if order_id in seen_order_ids:
+            continue
+        seen_order_ids.add(order_id)
+        new_orders += 1
+        
+        purchase_date = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
+        
+        # Process line items
+        for item in order.get('line_items', []):
+            if not item.get('product_id'):
+                continue
+            
+            product = products.get(str(item['product_id']))
+            
+            # Create purchase
+            purchase = Purchase(
+                user_id=user.id,
+                product=product,
+                purchase_date=purchase_date,
+                store_name=integration.store_url,
+                order_id=order_id,
+                is_shared=False  # Default to not shared
+            )
+            
+            db.session.add(purchase)
+            created += 1
+    
+    db.session.flush()
+    sync_telemetry.record_orders_inserted(new_orders)
+    return created
+
+
 def sync_shopify_orders(integration_id):
     """Sync orders from Shopify for a specific integration."""
     integration = StoreIntegration.query.get(integration_id)
@@ -142,6 +284,7 @@ def sync_shopify_orders(integration_id):
     user = User.query.get(integration.user_id)
     if not user:
         current_app.logger.error(f"User not found for integration: {integration_id}")
+        sync_telemetry.record_failure("User not found")
         return False
     
     client = ShopifyClient(
@@ -153,67 +296,11 @@ def sync_shopify_orders(integration_id):
     orders_data = client.get_orders(customer_email=user.email)
     if not orders_data or 'orders' not in orders_data:
         current_app.logger.error(f"Failed to get orders for integration: {integration_id}")
+        sync_telemetry.record_failure("Failed to get orders")
         return False
+    sync_telemetry.record_page()
     
-    orders = orders_data['orders']
-    for order in orders:
-        # Process each order
-        order_id = order['id']
-        order_name = order['name']
-        
-        # Check if order already exists
-        existing_purchase = Purchase.query.filter_by(
-            user_id=user.id,
-            order_id=str(order_id),
-            store_name=integration.store_url
-        ).first()
-        
-        if existing_purchase:
-            continue
-        
-        # Process line items
-        for item in order['line_items']:
-            # Check if product exists
-            product = Product.query.filter_by(
-                external_id=str(item['product_id']),
-                source='shopify'
-            ).first()
-            
-            if not product:
-                # Create new product
-                product = Product(
-                    external_id=str(item['product_id']),
-                    source='shopify',
-                    title=item['title'],
-                    description=item.get('name', ''),
-                    price=float(item['price']),
-                    currency=order['currency'],
-                    category='',  # Shopify doesn't provide category in orders
-                    product_metadata={}  # Using product_metadata instead of metadata
-                )
-                
-                # Try to get product image
-                try:
-                    product_data = client._make_api_request(f"products/{item['product_id']}.json")
-                    if product_data and 'product' in product_data and product_data['product']['images']:
-                        product.image_url = product_data['product']['images'][0]['src']
-                except Exception as e:
-                    current_app.logger.error(f"Error fetching product image: {e}")
-                
-                db.session.add(product)
-                db.session.commit()
-            
-            # Create purchase
-            purchase = Purchase(
-                user_id=user.id,
-                product_id=product.id,
-                purchase_date=datetime.fromisoformat(order['created_at'].replace('Z', '+00:00')),
-                store_name=integration.store_url,
-                order_id=str(order_id),
-                is_shared=False  # Default to not shared
-            )
-            
-            db.session.add(purchase)
+    ingest_shopify_orders(integration, user, orders_data['orders'], client=client)
     
     # Update last sync time
     integration.last_sync = datetime.utcnow()
@@ -4,6 +4,7 @@ import time
 import hmac
 import hashlib
 import base64
+import secrets
 from urllib.parse import urlencode, quote_plus
 from flask import current_app, url_for, request, redirect, session
 from app import db
@@ -12,7 +13,10 @@ from app.models.product import Product
 from app.models.purchase import Purchase
 from app.models.user import User
 from datetime import datetime
-from woocommerce import API
+from requests.auth import HTTPBasicAuth
+from app.utils import sync_telemetry
+from app.utils.http_cache import get_http_cache, credential_fingerprint
+from app.utils.http_transport import get_transport
 
 class WooCommerceClient:
     """Client for interacting with the WooCommerce API."""
@@ -23,23 +27,64 @@ class WooCommerceClient:
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
         self.api_version = current_app.config.get('WOOCOMMERCE_API_VERSION', 'wc/v3')
+    
+    def _request(self, method, endpoint, params=None, data=None, headers=None):
+        """
+        Call an API endpoint through the shared HTTP transport.
         
-        if store_url and consumer_key and consumer_secret:
-            self.wcapi = API(
-                url=store_url,
-                consumer_key=consumer_key,
-                consumer_secret=consumer_secret,
-                version=self.api_version,
-                wp_api=True,
-                timeout=30
-            )
+        Authenticates like the woocommerce package: HTTP Basic over https,
+        an OAuth 1.0a signed URL over plain http.
+        """
+        url = f"{self.store_url.rstrip('/')}/wp-json/{self.api_version}/{endpoint}"
+        request_headers = {
+            'Accept': 'application/json',
+            'User-Agent': 'BuyRoll/1.0'
+        }
+        request_headers.update(headers or {})
+        auth = None
+        
+        if url.startswith('https'):
+            auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
         else:
-            self.wcapi = None
+            from woocommerce.oauth import OAuth  # Only plain-http stores sign requests
+            
+            if params:
+                url = f"{url}?{urlencode(params)}"
+            url = OAuth(
+                url=url,
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret,
+                version=self.api_version,
+                method=method,
+                oauth_timestamp=int(time.time())
+            ).get_oauth_url()
+            params = None
+        
+        return get_transport().request(method, url, params=params, json=data, headers=request_headers, auth=auth)
+    
+    def _get(self, endpoint, params=None, cache_ttl=0):
+        """
+        GET an API endpoint through the HTTP cache.
+        
+        Responses are revalidated with their stored ETag/Last-Modified, or
+        served without a request for ``cache_ttl`` seconds after they were
+        fetched. Only endpoints that pass a ``cache_ttl`` are cached.
+        """
+        cache = get_http_cache() if cache_ttl else None
+        
+        def send(conditional_headers):
+            return self._request('GET', endpoint, params=dict(params or {}), headers=conditional_headers)
+        
+        if cache is None:
+            return send({})
+        url = f"{self.store_url.rstrip('/')}/wp-json/{self.api_version}/{endpoint}"
+        return cache.fetch(url, send, params=params, ttl=cache_ttl,
+                           vary=credential_fingerprint(self.consumer_key, self.consumer_secret))
     
     def verify_credentials(self):
         """Verify that the API credentials are valid."""
         try:
-            response = self.wcapi.get("products", params={"per_page": 1})
+            response = self._get("products", params={"per_page": 1})
             return response.status_code == 200
         except Exception as e:
             current_app.logger.error(f"WooCommerce API verification failed: {e}")
@@ -48,7 +93,7 @@ class WooCommerceClient:
     def get_products(self, page=1, per_page=50):
         """Get products from the store."""
         try:
-            response = self.wcapi.get("products", params={
+            response = self._get("products", params={
                 "page": page,
                 "per_page": per_page
             })
@@ -62,18 +107,20 @@ class WooCommerceClient:
             current_app.logger.error(f"Error getting products: {e}")
             return None
     
-    def get_orders(self, page=1, per_page=50, customer_email=None):
+    def get_orders(self, page=1, per_page=50, customer_email=None, customer_id=None):
         """Get orders from the store."""
         params = {
             "page": page,
             "per_page": per_page
         }
         
-        if customer_email:
+        if customer_id:
+            params["customer"] = customer_id
+        elif customer_email:
             params["customer"] = customer_email
         
         try:
-            response = self.wcapi.get("orders", params=params)
+            response = self._get("orders", params=params)
             
             if response.status_code == 200:
                 return response.json()
@@ -87,9 +134,9 @@ class WooCommerceClient:
     def get_customer_by_email(self, email):
         """Get customer by email."""
         try:
-            response = self.wcapi.get("customers", params={
+            response = self._get("customers", params={
                 "email": email
-            })
+            }, cache_ttl=current_app.config.get('HTTP_CACHE_TTL_SECONDS', 0))
             
             if response.status_code == 200:
                 customers = response.json()
@@ -106,7 +153,8 @@ class WooCommerceClient:
     def get_product_by_id(self, product_id):
         """Get product details by ID."""
         try:
-            response = self.wcapi.get(f"products/{product_id}")
+            response = self._get(f"products/{product_id}",
+                                 cache_ttl=current_app.config.get('HTTP_CACHE_TTL_SECONDS', 0))
             
             if response.status_code == 200:
                 return response.json()
@@ -118,6 +166,118 @@ class WooCommerceClient:
             return None
 
 
+def ingest_woocommerce_orders(integration, user, orders, client=None):
+    """
+    Create purchases for a batch of WooCommerce orders.
+    
+    Existing purchases and products are looked up with one query each for
+    the whole batch, so this is shared by the periodic sync and the webhook
+    queue. Products missing locally are fetched through ``client`` when one
+    is given. The caller is responsible for committing the session.
+    
+    Returns the number of purchases created.
+    """
+    order_ids = {str(order['id']) for order in orders}
+    seen_order_ids = {
+        row.order_id for row in db.session.query(Purchase.order_id).filter(
+            Purchase.user_id == user.id,
+            Purchase.store_name == integration.store_url,
+            Purchase.order_id.in_(order_ids)
+        )
+    } if order_ids else set()
+    
+    product_ids = {
+        str(item['product_id'])
+        for order in orders
+        for item in order.get('line_items', [])
+        if item.get('product_id')
+    }
+    products = {
+        product.external_id: product for product in Product.query.filter(
+            Product.source == 'woocommerce',
+            Product.external_id.in_(product_ids)
+        )
+    } if product_ids else {}
+    
+    # Fetch and create all missing products in one batch
+    missing_ids = [product_id for product_id in product_ids if product_id not in products]
+    if missing_ids and client is not None:
+        from app.services.woocommerce_image_service import WooCommerceImageService
+        
+        products_data = [client.get_product_by_id(product_id) for product_id in missing_ids]
+        created_products = WooCommerceImageService.create_products_from_wc_data(
+            [product_data for product_data in products_data if product_data], source='woocommerce'
+        )
+        products.update(created_products)
+        sync_telemetry.record_products_inserted(len(created_products))
+    
+    created = 0
+    new_orders = 0
+    for order in orders:
+        order_id = str(order['id'])
+        
+        # Skip orders we already have (or saw earlier in this batch)
+        if order_id in seen_order_ids:
+            continue
+        seen_order_ids.add(order_id)
+        new_orders += 1
+        
+        purchase_date = datetime.fromisoformat(order['date_created'].replace('Z', '+00:00'))
+        
+        # Process line items
+        for item in order.get('line_items', []):
+            if not item.get('product_id'):
+                continue
+            
+            product = products.get(str(item['product_id']))
+            if not product:
+                continue  # Product details could not be fetched
+            
+            # Create purchase
+            purchase = Purchase(
+                user_id=user.id,
+                product_id=product.id,
+                purchase_date=purchase_date,
+                store_name=integration.store_url,
+                order_id=order_id,
+                is_shared=False  # Default to not shared
+            )
+            
+            db.session.add(purchase)
+            created += 1
+    
+    db.session.flush()
+    sync_telemetry.record_orders_inserted(new_orders)
+    return created
+
+
+def get_woocommerce_client(integration):
+    """Build a WooCommerceClient from an integration's stored credentials."""
+    store_metadata = integration.store_metadata or {}
+    consumer_key = store_metadata.get('consumer_key')
+    consumer_secret = store_metadata.get('consumer_secret')
+    
+    if not consumer_key or not consumer_secret:
+        current_app.logger.error(f"Missing WooCommerce credentials for integration: {integration.id}")
+        return None
+    
+    return WooCommerceClient(
+        store_url=integration.store_url,
+        consumer_key=consumer_key,
+        consumer_secret=consumer_secret
+    )
+
+
+def verify_woocommerce_webhook(data, signature, secret):
+    """Verify that a webhook request was signed with the integration's secret."""
+    if not secret or not signature:
+        return False
+    
+    digest = hmac.new(secret.encode('utf-8'), data, hashlib.sha256).digest()
+    computed_signature = base64.b64encode(digest).decode('utf-8')
+    return hmac.compare_digest(computed_signature, signature)
+
+
 def sync_woocommerce_orders(integration_id):
     """Sync orders from WooCommerce for a specific integration."""
     integration = StoreIntegration.query.get(integration_id)
@@ -128,84 +288,30 @@ def sync_woocommerce_orders(integration_id):
     user = User.query.get(integration.user_id)
     if not user:
         current_app.logger.error(f"User not found for integration: {integration_id}")
+        sync_telemetry.record_failure("User not found")
         return False
     
-    # Parse metadata for credentials
-    store_metadata = integration.store_metadata or {}
-    consumer_key = store_metadata.get('consumer_key')
-    consumer_secret = store_metadata.get('consumer_secret')
-    
-    if not consumer_key or not consumer_secret:
-        current_app.logger.error(f"Missing WooCommerce credentials for integration: {integration_id}")
+    client = get_woocommerce_client(integration)
+    if not client:
+        sync_telemetry.record_failure("Missing WooCommerce credentials")
         return False
     
-    client = WooCommerceClient(
-        store_url=integration.store_url,
-        consumer_key=consumer_key,
-        consumer_secret=consumer_secret
-    )
-    
     # Get customer ID by email
     customer = client.get_customer_by_email(user.email)
     if not customer:
         current_app.logger.error(f"Customer not found for email: {user.email}")
+        sync_telemetry.record_failure("Customer not found")
         return False
     
-    customer_id = customer['id']
-    
     # Get orders for the customer
-    orders = client.get_orders(customer=customer_id)
+    orders = client.get_orders(customer_id=customer['id'])
     if not orders:
         current_app.logger.error(f"Failed to get orders for integration: {integration_id}")
+        sync_telemetry.record_failure("Failed to get orders")
         return False
+    sync_telemetry.record_page()
     
-    for order in orders:
-        order_id = order['id']
-        
-        # Check if order already exists
-        existing_purchase = Purchase.query.filter_by(
-            user_id=user.id,
-            order_id=str(order_id),
-            store_name=integration.store_url
-        ).first()
-        
-        if existing_purchase:
-            continue
-        
-        # Process line items
-        for item in order['line_items']:
-            # Check if product exists
-            product = Product.query.filter_by(
-                external_id=str(item['product_id']),
-                source='woocommerce'
-            ).first()
-            
-            if not product:
-                # Get product details
-                product_data = client.get_product_by_id(item['product_id'])
-                
-                if not product_data:
-                    continue
-                
-                # Create new product with high-quality images
-                from app.services.woocommerce_image_service import WooCommerceImageService
-                
-                product = WooCommerceImageService.create_product_from_wc_data(
-                    product_data, source='woocommerce'
-                )
-            
-            # Create purchase
-            purchase_date = datetime.fromisoformat(order['date_created'].replace('Z', '+00:00'))
-            purchase = Purchase(
-                user_id=user.id,
-                product_id=product.id,
-                purchase_date=purchase_date,
-                store_name=integration.store_url,
-                order_id=str(order_id),
-                is_shared=False  # Default to not shared
-            )
-            
-            db.session.add(purchase)
+    ingest_woocommerce_orders(integration, user, orders, client=client)
     
     # Update last sync time
     integration.last_sync = datetime.utcnow()
@@ -221,34 +327,28 @@ def setup_woocommerce_webhook(integration_id):
         current_app.logger.error(f"Invalid integration ID: {integration_id}")
         return False
     
-    # Parse metadata for credentials
-    store_metadata = integration.store_metadata or {}
-    consumer_key = store_metadata.get('consumer_key')
-    consumer_secret = store_metadata.get('consumer_secret')
-    
-    if not consumer_key or not consumer_secret:
-        current_app.logger.error(f"Missing WooCommerce credentials for integration: {integration_id}")
+    client = get_woocommerce_client(integration)
+    if not client:
         return False
     
-    client = WooCommerceClient(
-        store_url=integration.store_url,
-        consumer_key=consumer_key,
-        consumer_secret=consumer_secret
-    )
+    store_metadata = dict(integration.store_metadata or {})
     
-    # Set up order creation webhook
-    webhook_url = url_for('integrations.woocommerce_webhook', _external=True)
+    # Set up order creation webhook, signed with a per-integration secret
+    webhook_url = url_for('integrations.woocommerce_webhook', integration_id=integration.id, _external=True)
+    webhook_secret = store_metadata.get('webhook_secret') or secrets.token_hex(32)
     
     try:
-        response = client.wcapi.post("webhooks", {
+        response = client._request("POST", "webhooks", data={
             "name": "BuyRoll Order Created",
             "topic": "order.created",
-            "delivery_url": webhook_url
+            "delivery_url": webhook_url,
+            "secret": webhook_secret
         })
         
         if response.status_code in (200, 201):
-            # Store webhook ID in metadata
+            # Store webhook ID and secret in metadata
             store_metadata['webhook_id'] = response.json()['id']
+            store_metadata['webhook_secret'] = webhook_secret
             integration.store_metadata = store_metadata
             db.session.commit()
             return True
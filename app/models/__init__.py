@@ -1,7 +1,11 @@
 from app.models.user import User
 from app.models.product import Product
+from app.models.product_image import ProductImage
 from app.models.purchase import Purchase
 from app.models.connection import Connection
 from app.models.interaction import Interaction
 from app.models.store_integration import StoreIntegration
-from app.models.notification import Notification
\ No newline at end of file
+from app.models.notification import Notification
+from app.models.webhook_event import WebhookEvent
+from app.models.scheduler_lease import SchedulerLease, SyncRequest
+from app.models.sync_run import SyncRun
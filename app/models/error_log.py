@@ -2,17 +2,27 @@
 Error logging models for tracking application errors
 """
 from datetime import datetime
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session, defer
 from app import db
 
 class ErrorLog(db.Model):
     """Model for storing application error logs"""
     
     __tablename__ = 'error_logs'
+    __table_args__ = (
+        # Admin list filters, each ordered by newest first; timestamp alone serves retention
+        db.Index('idx_error_logs_timestamp', 'timestamp'),
+        db.Index('idx_error_logs_severity_timestamp', 'severity', 'timestamp'),
+        db.Index('idx_error_logs_resolved_timestamp', 'resolved', 'timestamp'),
+        db.Index('idx_error_logs_error_type_timestamp', 'error_type', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     error_type = db.Column(db.String(100), nullable=False)
     error_message = db.Column(db.Text, nullable=False)
     severity = db.Column(db.String(20), nullable=False, default='medium')
+    fingerprint = db.Column(db.String(16), index=True)  # Groups occurrences of the same error
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     context = db.Column(db.Text)  # JSON string
     request_data = db.Column(db.Text)  # JSON string
@@ -32,26 +42,32 @@ class ErrorLog(db.Model):
     def __repr__(self):
         return f'<ErrorLog {self.id}: {self.error_type}>'
     
-    def to_dict(self):
-        """Convert error log to dictionary"""
+    def to_dict(self, feedback_count=None, include_details=True):
+        """Convert error log to dictionary; lists pass counts from feedback_counts() and skip the details"""
         import json
         
-        return {
+        if feedback_count is None:
+            feedback_count = self.feedback.count()
+        
+        data = {
             'id': self.id,
             'error_type': self.error_type,
             'error_message': self.error_message,
             'severity': self.severity,
+            'fingerprint': self.fingerprint,
             'user_id': self.user_id,
-            'context': json.loads(self.context) if self.context else None,
-            'request_data': json.loads(self.request_data) if self.request_data else None,
             'environment': self.environment,
             'resolved': self.resolved,
             'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
             'resolved_by': self.resolved_by,
             'resolution_notes': self.resolution_notes,
             'timestamp': self.timestamp.isoformat(),
-            'feedback_count': self.feedback.count()
+            'feedback_count': feedback_count
         }
+        if include_details:
+            data['context'] = json.loads(self.context) if self.context else None
+            data['request_data'] = json.loads(self.request_data) if self.request_data else None
+        return data
     
     def mark_resolved(self, resolver_id, notes=None):
         """Mark error as resolved"""
@@ -61,10 +77,25 @@ class ErrorLog(db.Model):
         self.resolution_notes = notes
         db.session.commit()
     
+    @classmethod
+    def without_large_columns(cls):
+        """Query that loads the large text columns only when accessed (for lists)"""
+        return cls.query.options(defer(cls.context), defer(cls.request_data), defer(cls.traceback))
+    
+    @classmethod
+    def feedback_counts(cls, error_ids):
+        """Feedback count per error id with one grouped query"""
+        if not error_ids:
+            return {}
+        rows = db.session.query(ErrorFeedback.error_id, db.func.count(ErrorFeedback.id)).filter(
+            ErrorFeedback.error_id.in_(error_ids)
+        ).group_by(ErrorFeedback.error_id).all()
+        return {error_id: count for error_id, count in rows}
+    
     @classmethod
     def get_unresolved_errors(cls, severity=None, limit=50):
         """Get unresolved errors, optionally filtered by severity"""
-        query = cls.query.filter_by(resolved=False)
+        query = cls.without_large_columns().filter_by(resolved=False)
         
         if severity:
             query = query.filter_by(severity=severity)
@@ -73,35 +104,36 @@ class ErrorLog(db.Model):
     
     @classmethod
     def get_error_stats(cls, days=30):
-        """Get error statistics for the last N days"""
+        """Get error statistics for the last N days (whole days, from the daily rollup)"""
         from datetime import timedelta
         
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        total_errors = cls.query.filter(cls.timestamp >= cutoff_date).count()
-        resolved_errors = cls.query.filter(
-            cls.timestamp >= cutoff_date,
-            cls.resolved == True
-        ).count()
+        cutoff_day = (datetime.utcnow() - timedelta(days=days)).date()
         
-        severity_counts = db.session.query(
-            cls.severity,
-            db.func.count(cls.id)
-        ).filter(cls.timestamp >= cutoff_date).group_by(cls.severity).all()
+        rows = db.session.query(
+            ErrorStatDaily.error_type,
+            ErrorStatDaily.severity,
+            db.func.sum(ErrorStatDaily.error_count),
+            db.func.sum(ErrorStatDaily.resolved_count)
+        ).filter(ErrorStatDaily.day >= cutoff_day).group_by(
+            ErrorStatDaily.error_type, ErrorStatDaily.severity
+        ).all()
         
-        error_type_counts = db.session.query(
-            cls.error_type,
-            db.func.count(cls.id)
-        ).filter(cls.timestamp >= cutoff_date).group_by(cls.error_type).order_by(
-            db.func.count(cls.id).desc()
-        ).limit(10).all()
+        total_errors = resolved_errors = 0
+        severity_counts = {}
+        error_type_counts = {}
+        for error_type, severity, count, resolved in rows:
+            total_errors += count
+            resolved_errors += resolved or 0
+            severity_counts[severity] = severity_counts.get(severity, 0) + count
+            error_type_counts[error_type] = error_type_counts.get(error_type, 0) + count
+        top_error_types = sorted(error_type_counts.items(), key=lambda item: item[1], reverse=True)[:10]
         
         return {
             'total_errors': total_errors,
             'resolved_errors': resolved_errors,
             'resolution_rate': (resolved_errors / total_errors * 100) if total_errors > 0 else 0,
-            'severity_breakdown': dict(severity_counts),
-            'top_error_types': dict(error_type_counts)
+            'severity_breakdown': severity_counts,
+            'top_error_types': dict(top_error_types)
         }
 
 class ErrorFeedback(db.Model):
@@ -187,4 +219,81 @@ class ErrorPattern(db.Model):
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class ErrorStatDaily(db.Model):
+    """Error counts per day, type and severity, kept up to date as error logs are written"""
+    
+    __tablename__ = 'error_stats_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    error_type = db.Column(db.String(100), primary_key=True)
+    severity = db.Column(db.String(20), primary_key=True)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    resolved_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ErrorStatDaily {self.day} {self.error_type} {self.severity}: {self.error_count}>'
+    
+    @classmethod
+    def increment(cls, connection, increments):
+        """Add ``{(day, error_type, severity): (errors, resolved)}`` to the rollup on ``connection``"""
+        table = cls.__table__
+        rows = [
+            {'day': day, 'error_type': error_type, 'severity': severity,
+             'error_count': errors, 'resolved_count': resolved}
+            for (day, error_type, severity), (errors, resolved) in increments.items()
+        ]
+        dialect = connection.dialect.name
+        
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            
+            stmt = insert(table)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=['day', 'error_type', 'severity'],
+                set_={
+                    'error_count': table.c.error_count + stmt.excluded.error_count,
+                    'resolved_count': table.c.resolved_count + stmt.excluded.resolved_count
+                }
+            ), rows)
+            return
+        
+        # No native upsert: update, then insert the keys that had no row
+        for row in rows:
+            result = connection.execute(update(table).where(
+                table.c.day == row['day'],
+                table.c.error_type == row['error_type'],
+                table.c.severity == row['severity']
+            ).values(
+                error_count=table.c.error_count + row['error_count'],
+                resolved_count=table.c.resolved_count + row['resolved_count']
+            ))
+            if not result.rowcount:
+                connection.execute(table.insert().values(**row))
+
+@event.listens_for(Session, 'after_flush')
+def _update_error_stats(session, flush_context):
+    """Count new and newly (un)resolved error logs in the daily rollup, in the same transaction"""
+    increments = {}
+    
+    def add(error_log, errors, resolved):
+        timestamp = error_log.timestamp or datetime.utcnow()
+        key = (timestamp.date(), error_log.error_type, error_log.severity)
+        current = increments.get(key, (0, 0))
+        increments[key] = (current[0] + errors, current[1] + resolved)
+    
+    for instance in session.new:
+        if isinstance(instance, ErrorLog):
+            add(instance, 1, 1 if instance.resolved else 0)
+    for instance in session.dirty:
+        if isinstance(instance, ErrorLog):
+            history = inspect(instance).attrs.resolved.history
+            if history.has_changes() and bool(history.added and history.added[0]) != bool(history.deleted and history.deleted[0]):
+                add(instance, 0, 1 if instance.resolved else -1)
+    
+    if increments:
+        ErrorStatDaily.increment(session.connection(), increments)
@@ -4,6 +4,11 @@ from datetime import datetime
 class Product(db.Model):
     """Product model for storing product information."""
     
+    __table_args__ = (
+        # One row per store product; bulk upserts conflict on this key
+        db.Index('uq_product_source_external_id', 'source', 'external_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     external_id = db.Column(db.String(255), nullable=True)
     source = db.Column(db.String(50), nullable=False)  # e.g., 'shopify', 'woocommerce'
@@ -23,6 +23,7 @@ class ProductImage(db.Model):
     # WooCommerce specific fields
     external_image_id = db.Column(db.String(100), nullable=True)  # WooCommerce image ID
     source_metadata = db.Column(db.JSON, nullable=True)  # Store original WooCommerce image data
+    content_hash = db.Column(db.String(64), nullable=True)  # Hash of src/alt/position for change detection
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -52,6 +53,19 @@ class ProductImage(db.Model):
         
         return None
     
+    def get_webp_url(self, preferred_size='large'):
+        """Get the WebP variant of a locally stored image, if one was generated."""
+        from app.utils.image_storage import get_image_url_prefix
+        
+        url = self.get_best_quality_url(preferred_size)
+        try:
+            local = bool(url) and url.startswith(get_image_url_prefix())
+        except ValueError:
+            local = False  # Misconfigured image root; nothing can have been stored locally
+        if not local:
+            return None
+        return url.rsplit('.', 1)[0] + '.webp'
+    
     def to_dict(self):
         """Convert to dictionary for API responses."""
         return {
@@ -63,5 +77,6 @@ class ProductImage(db.Model):
             'alt_text': self.alt_text,
             'image_order': self.image_order,
             'is_primary': self.is_primary,
-            'best_quality_url': self.get_best_quality_url('large')
+            'best_quality_url': self.get_best_quality_url('large'),
+            'webp_url': self.get_webp_url('large')
         }
\ No newline at end of file
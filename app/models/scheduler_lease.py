@@ -0,0 +1,27 @@
+from app import db
+from datetime import datetime
+
+class SchedulerLease(db.Model):
+    """Time-limited lease naming the process that currently leads a background job."""
+    
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(100), primary_key=True)  # e.g., 'integration-scheduler'
+    holder = db.Column(db.String(255), nullable=False)  # host:pid:token of the leader
+    expires_at = db.Column(db.DateTime, nullable=False)
+    renewed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"SchedulerLease('{self.name}', '{self.holder}', '{self.expires_at}')"
+
+class SyncRequest(db.Model):
+    """Ad-hoc integration sync requested by a process that is not the scheduler leader."""
+    
+    __tablename__ = 'sync_requests'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    integration_id = db.Column(db.Integer, db.ForeignKey('store_integration.id'), nullable=False)
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"SyncRequest('{self.integration_id}', '{self.requested_at}')"
@@ -0,0 +1,56 @@
+from app import db
+from datetime import datetime
+
+class SyncRun(db.Model):
+    """Telemetry for one execution of an integration sync."""
+    
+    __tablename__ = 'sync_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    integration_id = db.Column(db.Integer, db.ForeignKey('store_integration.id'), nullable=False, index=True)
+    platform = db.Column(db.String(50), nullable=False)  # e.g., 'shopify', 'woocommerce'
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, success, failed
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    pages = db.Column(db.Integer, nullable=False, default=0)  # Result pages fetched from the store API
+    orders_inserted = db.Column(db.Integer, nullable=False, default=0)
+    products_inserted = db.Column(db.Integer, nullable=False, default=0)
+    http_calls = db.Column(db.Integer, nullable=False, default=0)
+    bytes_transferred = db.Column(db.BigInteger, nullable=False, default=0)  # Response bodies received
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    rate_limit_waits = db.Column(db.Integer, nullable=False, default=0)
+    rate_limit_wait_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    failure_reason = db.Column(db.Text, nullable=True)
+    
+    integration = db.relationship('StoreIntegration', backref=db.backref('sync_runs', lazy='dynamic'))
+    
+    @property
+    def duration_seconds(self):
+        """Wall-clock duration, or None while the run is in progress."""
+        if not self.finished_at:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+    
+    def to_dict(self):
+        """Convert sync run to dictionary."""
+        return {
+            'id': self.id,
+            'integration_id': self.integration_id,
+            'platform': self.platform,
+            'status': self.status,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_seconds': self.duration_seconds,
+            'pages': self.pages,
+            'orders_inserted': self.orders_inserted,
+            'products_inserted': self.products_inserted,
+            'http_calls': self.http_calls,
+            'bytes_transferred': self.bytes_transferred,
+            'retries': self.retries,
+            'rate_limit_waits': self.rate_limit_waits,
+            'rate_limit_wait_seconds': self.rate_limit_wait_seconds,
+            'failure_reason': self.failure_reason
+        }
+    
+    def __repr__(self):
+        return f"SyncRun('{self.integration_id}', '{self.status}', '{self.started_at}')"
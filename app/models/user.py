@@ -2,12 +2,15 @@ from datetime import datetime, timedelta
 from flask import current_app
 from flask_login import UserMixin
 from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from app import db, login_manager, bcrypt
+from app.utils.user_cache import user_cache
 import uuid
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id), User)
 
 class User(db.Model, UserMixin):
     """User model for authentication and profile information."""
@@ -79,4 +82,20 @@ class User(db.Model, UserMixin):
         return str(self.id)
     
     def __repr__(self):
-        return f"User('{self.name}', '{self.email}')"
\ No newline at end of file
+        return f"User('{self.name}', '{self.email}')"
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    """Drop the cached snapshot on profile, password, settings or any other change."""
+    user_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('updated_user_ids', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _invalidate_committed_users(session):
+    # Again once the change is visible, in case a request cached the old row in between
+    for user_id in session.info.pop('updated_user_ids', ()):
+        user_cache.invalidate(user_id)
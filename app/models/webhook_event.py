@@ -0,0 +1,29 @@
+from app import db
+from datetime import datetime
+
+class WebhookEvent(db.Model):
+    """Durable queue entry for an incoming store webhook awaiting processing."""
+    
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        db.UniqueConstraint('platform', 'webhook_id', name='uq_webhook_event_platform_webhook_id'),
+        db.Index('idx_webhook_event_status_id', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(50), nullable=False)  # e.g., 'shopify', 'woocommerce'
+    webhook_id = db.Column(db.String(255), nullable=False)  # Delivery/webhook ID used for deduplication
+    topic = db.Column(db.String(100), nullable=True)  # e.g., 'orders/create', 'order.created'
+    integration_id = db.Column(db.Integer, db.ForeignKey('store_integration.id'), nullable=True)
+    shop_domain = db.Column(db.String(255), nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # Raw request body
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'processing', 'done', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    claimed_by = db.Column(db.String(64), nullable=True)  # Worker token holding the event
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"WebhookEvent('{self.platform}', '{self.webhook_id}', '{self.status}')"
@@ -4,7 +4,7 @@ Admin routes for error management and system monitoring
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import login_required, current_user
 from functools import wraps
-from app.models.error_log import ErrorLog, ErrorFeedback, ErrorPattern
+from app.models.error_log import ErrorLog, ErrorFeedback, ErrorPattern, ErrorStatDaily
 from app.utils.monitoring import HealthChecker, MetricsCollector
 from app import db
 
@@ -48,19 +48,12 @@ def dashboard():
                          error_stats=error_stats,
                          recent_errors=recent_errors)
 
-@admin_bp.route('/errors')
-@login_required
-@admin_required
-def error_list():
-    """List all errors with filtering options"""
+def _paginate_errors(severity, resolved, error_type):
+    """Page of errors matching the admin filters, without the large columns"""
     page = request.args.get('page', 1, type=int)
-    severity = request.args.get('severity')
-    resolved = request.args.get('resolved')
-    error_type = request.args.get('error_type')
-    
-    query = ErrorLog.query
+    query = ErrorLog.without_large_columns()
     
-    # Apply filters
+    # Apply filters (each has a matching index ordered by timestamp)
     if severity:
         query = query.filter_by(severity=severity)
     
@@ -68,16 +61,29 @@ def error_list():
         query = query.filter_by(resolved=resolved.lower() == 'true')
     
     if error_type:
-        query = query.filter(ErrorLog.error_type.contains(error_type))
+        query = query.filter(ErrorLog.error_type == error_type)
     
     # Paginate results
-    errors = query.order_by(ErrorLog.timestamp.desc()).paginate(
+    return query.order_by(ErrorLog.timestamp.desc()).paginate(
         page=page, per_page=20, error_out=False
     )
+
+@admin_bp.route('/errors')
+@login_required
+@admin_required
+def error_list():
+    """List all errors with filtering options"""
+    severity = request.args.get('severity')
+    resolved = request.args.get('resolved')
+    error_type = request.args.get('error_type')
+    
+    errors = _paginate_errors(severity, resolved, error_type)
     
-    # Get filter options
-    severity_options = db.session.query(ErrorLog.severity).distinct().all()
-    error_type_options = db.session.query(ErrorLog.error_type).distinct().limit(20).all()
+    # Get filter options from the daily rollup rather than scanning error_logs
+    severity_options = db.session.query(ErrorStatDaily.severity).distinct().all()
+    error_type_options = db.session.query(ErrorStatDaily.error_type).group_by(ErrorStatDaily.error_type).order_by(
+        db.func.sum(ErrorStatDaily.error_count).desc()
+    ).limit(20).all()
     
     return render_template('admin/error_list.html',
                          errors=errors,
@@ -123,6 +129,37 @@ def error_stats_api():
     stats = ErrorLog.get_error_stats(days=days)
     return jsonify(stats)
 
+@admin_bp.route('/api/errors')
+@login_required
+@admin_required
+def error_list_api():
+    """API endpoint listing errors with the same filters as the error list"""
+    errors = _paginate_errors(request.args.get('severity'), request.args.get('resolved'),
+                              request.args.get('error_type'))
+    feedback_counts = ErrorLog.feedback_counts([error.id for error in errors.items])
+    
+    return jsonify({
+        'errors': [error.to_dict(feedback_count=feedback_counts.get(error.id, 0), include_details=False)
+                   for error in errors.items],
+        'page': errors.page,
+        'pages': errors.pages,
+        'total': errors.total
+    })
+
+@admin_bp.route('/api/errors/groups')
+@login_required
+@admin_required
+def error_groups_api():
+    """API endpoint for error groups in their current digest window"""
+    from app.utils.error_reporting import error_report_worker
+    
+    return jsonify({
+        'groups': error_report_worker.get_groups(),
+        'queued': error_report_worker.queue.qsize(),
+        'dropped': error_report_worker.dropped,
+        'window_seconds': error_report_worker.window_seconds
+    })
+
 @admin_bp.route('/api/health')
 @login_required
 @admin_required
@@ -139,6 +176,74 @@ def metrics_api():
     metrics = MetricsCollector.get_all_metrics()
     return jsonify(metrics)
 
+@admin_bp.route('/api/webhooks')
+@login_required
+@admin_required
+def webhook_metrics_api():
+    """API endpoint for webhook queue depth and lag"""
+    from app.services.webhook_queue import WebhookQueue
+    
+    return jsonify(WebhookQueue.get_metrics())
+
+@admin_bp.route('/api/sync-report')
+@login_required
+@admin_required
+def sync_report_api():
+    """API endpoint ranking stores by integration sync cost"""
+    from app.utils.sync_telemetry import get_sync_cost_report
+    
+    days = request.args.get('days', 7, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(get_sync_cost_report(days=days, limit=limit))
+
+@admin_bp.route('/api/profile')
+@login_required
+@admin_required
+def profile_api():
+    """Profile this worker process; returns collapsed stacks or a per-endpoint summary"""
+    from flask import current_app, Response
+    from app.utils.sampling_profiler import sampling_profiler
+    
+    seconds = min(request.args.get('seconds', 10, type=float), current_app.config.get('PROFILER_MAX_SECONDS', 300))
+    hz = min(request.args.get('hz', current_app.config.get('PROFILER_DEFAULT_HZ', 100), type=int),
+             current_app.config.get('PROFILER_MAX_HZ', 250))
+    all_threads = request.args.get('all_threads', 'false').lower() in ['true', '1']
+    
+    try:
+        sampling_profiler.start(seconds, hz, all_threads)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    sampling_profiler.leave()  # This thread is waiting, not serving; keep it out of the profile
+    result = sampling_profiler.wait()
+    
+    if request.args.get('format') == 'collapsed':
+        return Response(result.collapsed(), mimetype='text/plain')
+    return jsonify(result.summary(limit=request.args.get('limit', 10, type=int)))
+
+@admin_bp.route('/api/traces')
+@login_required
+@admin_required
+def traces_api():
+    """Slow request traces kept by this worker, slowest first"""
+    from app.utils.tracing import tracer
+    
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'threshold_seconds': tracer.slow_threshold, 'traces': tracer.slow_traces(limit=limit)})
+
+@admin_bp.route('/api/traces/<trace_id>')
+@login_required
+@admin_required
+def trace_detail_api(trace_id):
+    """Span tree of one slow trace, or its Chrome trace events with format=chrome"""
+    from app.utils.tracing import tracer
+    
+    trace = tracer.get_trace(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    if request.args.get('format') == 'chrome':
+        return jsonify({'traceEvents': trace.chrome_events(), 'displayTimeUnit': 'ms'})
+    return jsonify(trace.to_dict())
+
 @admin_bp.route('/patterns')
 @login_required
 @admin_required
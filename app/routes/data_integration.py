@@ -1,8 +1,6 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, current_app
 from flask_login import login_required
-from services.fetch_shopify import fetch_products_from_shopify, save_products as save_shopify_products
-from services.fetch_woocommerce import fetch_products_from_woocommerce, save_products as save_woocommerce_products
-from services.fetch_magento import fetch_products_from_magento, save_products as save_magento_products
+from app.services.catalog_ingest import ingest_catalog
 
 data_integration = Blueprint('data_integration', __name__)
 
@@ -11,29 +9,25 @@ data_integration = Blueprint('data_integration', __name__)
 def dashboard():
     return render_template('dashboard.html')
 
+def _ingest(platform, label):
+    try:
+        stats = ingest_catalog(platform)
+    except Exception as e:
+        current_app.logger.error(f"Catalog ingest from {label} failed: {e}")
+        return jsonify({"error": f"Failed to fetch products from {label}"}), 500
+    return jsonify({"success": "Products fetched and saved successfully", "stats": stats}), 200
+
 @data_integration.route('/fetch_shopify')
 @login_required
 def fetch_shopify():
-    products = fetch_products_from_shopify()
-    if products:
-        save_shopify_products(products)
-        return jsonify({"success": "Products fetched and saved successfully"}), 200
-    return jsonify({"error": "Failed to fetch products from Shopify"}), 500
+    return _ingest('shopify', 'Shopify')
 
 @data_integration.route('/fetch_woocommerce')
 @login_required
 def fetch_woocommerce():
-    products = fetch_products_from_woocommerce()
-    if products:
-        save_woocommerce_products(products)
-        return jsonify({"success": "Products fetched and saved successfully"}), 200
-    return jsonify({"error": "Failed to fetch products from WooCommerce"}), 500
+    return _ingest('woocommerce', 'WooCommerce')
 
 @data_integration.route('/fetch_magento')
 @login_required
 def fetch_magento():
-    products = fetch_products_from_magento()
-    if products:
-        save_magento_products(products)
-        return jsonify({"success": "Products fetched and saved successfully"}), 200
-    return jsonify({"error": "Failed to fetch products from Magento"}), 500
+    return _ingest('magento', 'Magento')
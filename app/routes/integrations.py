@@ -1,7 +1,77 @@
-from flask import Blueprint
+import hashlib
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required, current_user
+from app.models.store_integration import StoreIntegration
+from app.services.webhook_queue import WebhookQueue
 
 integrations_bp = Blueprint('integrations', __name__)
 
 @integrations_bp.route('/test')
 def test():
-    return "Integrations blueprint working"
\ No newline at end of file
+    return "Integrations blueprint working"
+
+@integrations_bp.route('/<int:integration_id>/sync', methods=['POST'])
+@login_required
+def request_integration_sync(integration_id):
+    """Sync one of the user's integrations now, through the scheduler leader."""
+    integration = StoreIntegration.query.get(integration_id)
+    if not integration or integration.user_id != current_user.id:
+        return jsonify({'error': 'Unknown integration'}), 404
+    
+    from app.utils.scheduler import request_sync
+    request_sync(integration.id)
+    
+    return jsonify({'status': 'requested'}), 202
+
+@integrations_bp.route('/webhooks/shopify', methods=['POST'])
+def shopify_webhook():
+    """Verify a Shopify webhook and queue it for background processing."""
+    data = request.get_data()
+    
+    from app.integrations.shopify import ShopifyClient
+    client = ShopifyClient()
+    if not client.verify_webhook(data, request.headers.get('X-Shopify-Hmac-Sha256', '')):
+        current_app.logger.warning("Rejected Shopify webhook with invalid signature")
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    webhook_id = request.headers.get('X-Shopify-Webhook-Id') or hashlib.sha256(data).hexdigest()
+    _, created = WebhookQueue.enqueue(
+        'shopify',
+        webhook_id,
+        data,
+        topic=request.headers.get('X-Shopify-Topic'),
+        shop_domain=request.headers.get('X-Shopify-Shop-Domain')
+    )
+    
+    return jsonify({'status': 'queued' if created else 'duplicate'}), 200
+
+@integrations_bp.route('/webhooks/woocommerce/<int:integration_id>', methods=['POST'])
+def woocommerce_webhook(integration_id):
+    """Verify a WooCommerce webhook and queue it for background processing."""
+    integration = StoreIntegration.query.get(integration_id)
+    if not integration or integration.platform != 'woocommerce':
+        return jsonify({'error': 'Unknown integration'}), 404
+    
+    data = request.get_data()
+    
+    # WooCommerce pings the delivery URL with a form-encoded body when the webhook is created
+    if not request.headers.get('X-WC-Webhook-Topic'):
+        return jsonify({'status': 'ok'}), 200
+    
+    from app.integrations.woocommerce import verify_woocommerce_webhook
+    secret = (integration.store_metadata or {}).get('webhook_secret')
+    if not verify_woocommerce_webhook(data, request.headers.get('X-WC-Webhook-Signature', ''), secret):
+        current_app.logger.warning(f"Rejected WooCommerce webhook with invalid signature for integration {integration_id}")
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    webhook_id = request.headers.get('X-WC-Webhook-Delivery-ID') or hashlib.sha256(data).hexdigest()
+    _, created = WebhookQueue.enqueue(
+        'woocommerce',
+        webhook_id,
+        data,
+        topic=request.headers.get('X-WC-Webhook-Topic'),
+        integration_id=integration.id,
+        shop_domain=request.headers.get('X-WC-Webhook-Source')
+    )
+    
+    return jsonify({'status': 'queued' if created else 'duplicate'}), 200
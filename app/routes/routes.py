@@ -2,7 +2,7 @@ from flask import request, jsonify, render_template, current_app as app
 from .. import db
 from ..models import Product, User
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.services.fetch_shopify import fetch_products_from_shopify, save_products
+from app.services.catalog_ingest import ingest_catalog
 
 @app.route('/orders')
 def orders():
@@ -48,8 +48,9 @@ def login():
 
 @app.route('/fetch_shopify')
 def fetch_shopify():
-    products = fetch_products_from_shopify()
-    if products:
-        save_products(products)
-        return jsonify({"success": "Products fetched and saved successfully"}), 200
-    return jsonify({"error": "Failed to fetch products from Shopify"}), 500
+    try:
+        stats = ingest_catalog('shopify')
+    except Exception as e:
+        app.logger.error(f"Catalog ingest from Shopify failed: {e}")
+        return jsonify({"error": "Failed to fetch products from Shopify"}), 500
+    return jsonify({"success": "Products fetched and saved successfully", "stats": stats}), 200
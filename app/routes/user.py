@@ -1,6 +1,5 @@
 import os
 import secrets
-from PIL import Image
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user, logout_user
 from app import db, bcrypt
@@ -18,6 +17,8 @@ user_bp = Blueprint('user', __name__)
 
 def save_profile_picture(form_picture):
     """Save profile picture with a random name."""
+    from PIL import Image  # Only needed for uploads, so not imported at startup
+    
     random_hex = secrets.token_hex(8)
     _, f_ext = os.path.splitext(form_picture.filename)
     picture_fn = random_hex + f_ext
@@ -0,0 +1,397 @@
+"""
+Concurrent integration syncs on a single event loop.
+
+``AsyncSyncRunner`` fetches customers, orders and missing products for many
+stores at once through the asyncio clients, while all database work runs on
+a small thread pool: integration lookups as individual reads, and the
+fetched orders in batches, through the same bulk ingest functions the
+synchronous sync uses.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import db
+from app.integrations.async_clients import AsyncShopifyClient, AsyncWooCommerceClient
+from app.integrations.shopify import ingest_shopify_orders
+from app.integrations.woocommerce import ingest_woocommerce_orders
+from app.models.product import Product
+from app.models.store_integration import StoreIntegration
+from app.models.sync_run import SyncRun
+from app.models.user import User
+from app.utils import prometheus, sync_telemetry
+from app.utils.async_http import AsyncHTTPTransport, AsyncHTTPError
+
+logger = logging.getLogger(__name__)
+
+class PrefetchedShopifyClient:
+    """Answers the product lookups of ``ingest_shopify_orders`` from asynchronously fetched data."""
+    
+    def __init__(self, products):
+        self.products = products
+    
+    def _make_api_request(self, endpoint, **kwargs):
+        product_id = endpoint[len('products/'):-len('.json')]
+        product = self.products.get(product_id)
+        return {'product': product} if product else None
+
+class PrefetchedWooCommerceClient:
+    """Answers the product lookups of ``ingest_woocommerce_orders`` from asynchronously fetched data."""
+    
+    def __init__(self, products):
+        self.products = products
+    
+    def get_product_by_id(self, product_id):
+        return self.products.get(str(product_id))
+
+class SyncResult:
+    """Data fetched for one integration, waiting to be written."""
+    
+    def __init__(self, integration_id, platform):
+        self.integration_id = integration_id
+        self.platform = platform
+        self.user_id = None
+        self.orders = []
+        self.products = {}
+        self.recorder = sync_telemetry.SyncRunRecorder()
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+
+def _load_integration(integration_id):
+    """Snapshot what the fetch needs, so no ORM objects cross into the event loop."""
+    integration = StoreIntegration.query.get(integration_id)
+    if not integration:
+        return None
+    
+    user = User.query.get(integration.user_id)
+    store_metadata = integration.store_metadata or {}
+    return {
+        'platform': integration.platform,
+        'store_url': integration.store_url,
+        'access_token': integration.access_token,
+        'consumer_key': store_metadata.get('consumer_key'),
+        'consumer_secret': store_metadata.get('consumer_secret'),
+        'user_id': user.id if user else None,
+        'email': user.email if user else None
+    }
+
+def _known_product_ids(source, external_ids):
+    if not external_ids:
+        return set()
+    return {
+        row.external_id for row in db.session.query(Product.external_id).filter(
+            Product.source == source,
+            Product.external_id.in_(external_ids)
+        )
+    }
+
+class AsyncSyncRunner:
+    """
+    Drives integration syncs concurrently from one background event loop.
+    
+    Args:
+        app: Flask app used for database work
+        concurrency: Syncs fetching at the same time
+        connections_per_host: Concurrent requests to one store
+        max_retries: HTTP retries per request
+        timeout: Seconds allowed per HTTP request
+        batch_size: Fetched syncs written per database transaction
+        batch_delay: Seconds a partial batch waits for more syncs
+        db_workers: Threads for database reads and batch writes
+    """
+    
+    def __init__(self, app, concurrency=200, connections_per_host=4, max_retries=3, timeout=30,
+                 batch_size=50, batch_delay=0.5, db_workers=2):
+        self.app = app
+        self.concurrency = concurrency
+        self.connections_per_host = connections_per_host
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.db_workers = db_workers
+        
+        self._loop = None
+        self._thread = None
+        self._transport = None
+        self._slots = None
+        self._db_executor = None
+        self._pending = []  # (SyncResult, asyncio.Future) waiting to be written
+        self._flush = None
+        self._writer_task = None
+    
+    @classmethod
+    def from_app(cls, app):
+        """Build a runner from the app config."""
+        config = app.config
+        return cls(
+            app,
+            concurrency=config.get('SYNC_ASYNC_CONCURRENCY', 200),
+            connections_per_host=config.get('ASYNC_HTTP_CONNECTIONS_PER_HOST', 4),
+            max_retries=config.get('ASYNC_HTTP_MAX_RETRIES', 3),
+            timeout=config.get('ASYNC_HTTP_TIMEOUT', 30),
+            batch_size=config.get('SYNC_DB_BATCH_SIZE', 50),
+            batch_delay=config.get('SYNC_DB_BATCH_DELAY', 0.5),
+            db_workers=config.get('SYNC_DB_WORKERS', 2)
+        )
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        """Start the event loop thread."""
+        if self.running:
+            return
+        
+        db_workers = self.db_workers
+        with self.app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                db_workers = 1  # One writer at a time; in-memory databases even share one connection
+        
+        self._db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix='sync-db')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-sync-loop')
+        self._thread.daemon = True
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+        logger.info(f"Async sync runner started (concurrency {self.concurrency})")
+    
+    async def _setup(self):
+        self._transport = AsyncHTTPTransport(
+            max_connections_per_host=self.connections_per_host,
+            max_retries=self.max_retries,
+            timeout=self.timeout
+        )
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._flush = asyncio.Event()
+        self._writer_task = asyncio.ensure_future(self._writer())
+    
+    def stop(self, timeout=10):
+        """Write what was fetched, close connections and stop the loop."""
+        if not self.running:
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout)
+        except Exception as e:
+            logger.error(f"Error stopping async sync runner: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop.close()
+        self._db_executor.shutdown(wait=True)
+        self._thread = None
+        logger.info("Async sync runner stopped")
+    
+    async def _shutdown(self):
+        self._writer_task.cancel()
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        await self._write_pending()
+        await self._transport.close()
+    
+    def submit(self, integration_id):
+        """Schedule a sync; returns a ``concurrent.futures.Future`` resolving to success."""
+        return asyncio.run_coroutine_threadsafe(self.sync(integration_id), self._loop)
+    
+    def run(self, integration_ids):
+        """Sync integrations concurrently and block until all are written; returns id -> success."""
+        started = not self.running
+        if started:
+            self.start()
+        try:
+            futures = {integration_id: self.submit(integration_id) for integration_id in integration_ids}
+            results = {}
+            for integration_id, future in futures.items():
+                try:
+                    results[integration_id] = future.result()
+                except Exception as e:
+                    logger.error(f"Error syncing integration {integration_id}: {e}")
+                    results[integration_id] = False
+            return results
+        finally:
+            if started:
+                self.stop()
+    
+    async def _run_db(self, func, *args):
+        def call():
+            with self.app.app_context():
+                try:
+                    return func(*args)
+                finally:
+                    db.session.remove()
+        
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, call)
+    
+    async def sync(self, integration_id):
+        """Fetch one integration's orders and wait until they are written."""
+        async with self._slots:
+            snapshot = await self._run_db(_load_integration, integration_id)
+            if snapshot is None:
+                logger.error(f"Integration not found: {integration_id}")
+                return False
+            
+            result = SyncResult(integration_id, snapshot['platform'])
+            result.user_id = snapshot['user_id']
+            with sync_telemetry.recording(result.recorder):
+                try:
+                    await self._fetch(result, snapshot)
+                except Exception as e:
+                    logger.error(f"Error fetching integration {integration_id}: {e}")
+                    sync_telemetry.record_failure(f"{type(e).__name__}: {e}")
+            result.finished_at = datetime.utcnow()
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((result, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush.set()
+        return await future
+    
+    async def _fetch(self, result, snapshot):
+        config = self.app.config
+        
+        if not snapshot['user_id']:
+            sync_telemetry.record_failure("User not found")
+            return
+        
+        try:
+            if snapshot['platform'] == 'shopify':
+                client = AsyncShopifyClient(self._transport, snapshot['store_url'], snapshot['access_token'],
+                                            api_version=config.get('SHOPIFY_API_VERSION', '2023-01'))
+                result.orders = await client.get_orders(customer_email=snapshot['email'])
+                fetch_product = client.get_product
+            elif snapshot['platform'] == 'woocommerce':
+                if not snapshot['consumer_key'] or not snapshot['consumer_secret']:
+                    sync_telemetry.record_failure("Missing WooCommerce credentials")
+                    return
+                client = AsyncWooCommerceClient(self._transport, snapshot['store_url'], snapshot['consumer_key'],
+                                                snapshot['consumer_secret'],
+                                                api_version=config.get('WOOCOMMERCE_API_VERSION', 'wc/v3'))
+                customer = await client.get_customer_by_email(snapshot['email'])
+                if not customer:
+                    sync_telemetry.record_failure("Customer not found")
+                    return
+                result.orders = await client.get_orders(customer['id'])
+                fetch_product = client.get_product_by_id
+            else:
+                sync_telemetry.record_failure(f"Unknown platform: {snapshot['platform']}")
+                return
+        except AsyncHTTPError as e:
+            sync_telemetry.record_failure(f"Failed to get orders: {e}")
+            return
+        
+        # Only fetch products we don't have yet, all at once
+        product_ids = {
+            str(item['product_id'])
+            for order in result.orders
+            for item in order.get('line_items', [])
+            if item.get('product_id')
+        }
+        missing = sorted(product_ids - await self._run_db(_known_product_ids, snapshot['platform'], product_ids))
+        fetched = await asyncio.gather(*[fetch_product(product_id) for product_id in missing],
+                                       return_exceptions=True)
+        for product_id, product in zip(missing, fetched):
+            if isinstance(product, Exception):
+                logger.warning(f"Could not fetch product {product_id} for integration {result.integration_id}: {product}")
+            elif product:
+                result.products[product_id] = product
+    
+    async def _writer(self):
+        """Write fetched syncs whenever a batch fills up or ``batch_delay`` passes."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush.wait(), self.batch_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._flush.clear()
+            await self._write_pending()
+    
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            results = [result for result, _ in batch]
+            try:
+                outcomes = await asyncio.get_running_loop().run_in_executor(
+                    self._db_executor, self._write_batch, results
+                )
+            except Exception as e:
+                logger.error(f"Error writing sync batch: {e}")
+                outcomes = [False] * len(batch)
+            
+            for (_, future), success in zip(batch, outcomes):
+                if not future.done():
+                    future.set_result(success)
+    
+    def _write_batch(self, results):
+        """
+        Ingest a batch of fetched syncs and store their SyncRuns with one commit.
+        
+        If the batch fails, it is rolled back and written again one
+        integration at a time, so a single bad store only fails itself.
+        """
+        counters = [(result.recorder.orders_inserted, result.recorder.products_inserted) for result in results]
+        
+        with self.app.app_context():
+            try:
+                try:
+                    outcomes = [self._write_result(result) for result in results]
+                    db.session.commit()
+                    return outcomes
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"Sync batch of {len(results)} failed ({e}), writing integrations one by one")
+                
+                outcomes = []
+                for result, (orders_inserted, products_inserted) in zip(results, counters):
+                    result.recorder.orders_inserted = orders_inserted
+                    result.recorder.products_inserted = products_inserted
+                    try:
+                        outcomes.append(self._write_result(result))
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Error ingesting orders for integration {result.integration_id}: {e}")
+                        result.recorder.failure_reason = f"{type(e).__name__}: {e}"
+                        self._add_sync_run(result, success=False)
+                        db.session.commit()
+                        outcomes.append(False)
+                return outcomes
+            finally:
+                db.session.remove()
+    
+    def _write_result(self, result):
+        """Ingest one integration's orders and add its SyncRun; returns success."""
+        success = result.recorder.failure_reason is None
+        if success:
+            integration = StoreIntegration.query.get(result.integration_id)
+            user = User.query.get(result.user_id)
+            with sync_telemetry.recording(result.recorder):
+                if result.platform == 'shopify':
+                    ingest_shopify_orders(integration, user, result.orders,
+                                          client=PrefetchedShopifyClient(result.products))
+                else:
+                    ingest_woocommerce_orders(integration, user, result.orders,
+                                              client=PrefetchedWooCommerceClient(result.products))
+            integration.last_sync = datetime.utcnow()
+        
+        self._add_sync_run(result, success)
+        return success
+    
+    @staticmethod
+    def _add_sync_run(result, success):
+        sync_run = SyncRun(
+            integration_id=result.integration_id,
+            platform=result.platform,
+            status='success' if success else 'failed',
+            started_at=result.started_at,
+            finished_at=result.finished_at,
+            failure_reason=result.recorder.failure_reason
+        )
+        result.recorder.apply_to(sync_run)
+        db.session.add(sync_run)
+        prometheus.observe_sync_run(sync_run)
@@ -0,0 +1,383 @@
+"""
+Streaming catalog ingest from store APIs.
+
+Each platform has a source adapter that yields product pages lazily. The
+pipeline chains generator stages (fetch -> normalize -> dedupe -> batch ->
+upsert), so only a bounded number of pages and one write batch are held in
+memory at a time, whatever the size of the catalog.
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app import db
+from app.models.product import Product
+from app.utils.bulk_upsert import bulk_upsert, PRODUCT_KEY_COLUMNS
+from app.utils.http_transport import get_transport
+from app.utils.product_normalizer import normalize_product_data
+
+logger = logging.getLogger(__name__)
+
+# One page of raw products; next_page is a page number or cursor URL
+CatalogPage = namedtuple('CatalogPage', ['items', 'next_page', 'total_pages'])
+
+_END = object()
+
+class CatalogSource:
+    """
+    Base class for platform product sources.
+    
+    Subclasses implement ``first_page`` and ``fetch_page``. Sources that
+    report a total page count have their remaining pages fetched
+    concurrently; cursor-paginated sources are followed one page at a time.
+    """
+    
+    source = None
+    
+    def __init__(self, page_size=100, timeout=30):
+        self.page_size = page_size
+        self.timeout = timeout
+        self.http_calls = 0
+        self._lock = threading.Lock()
+    
+    def _get(self, url, **kwargs):
+        # The shared transport pools connections per host, so page fetchers reuse them
+        with self._lock:
+            self.http_calls += 1
+        response = get_transport().get(url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+    
+    def first_page(self):
+        """Page number or cursor of the first page."""
+        return 1
+    
+    def fetch_page(self, page):
+        """Fetch one page and return a ``CatalogPage``."""
+        raise NotImplementedError
+    
+    def external_id(self, item):
+        """Stable product id on the platform."""
+        product_id = item.get('id')
+        return str(product_id) if product_id is not None else None
+    
+    def prepare(self, item):
+        """Map a raw item into the shape ``normalize_product_data`` expects."""
+        return item
+    
+    def pages(self, concurrency=1):
+        """Yield the items of each page in order."""
+        page = self.fetch_page(self.first_page())
+        yield page.items
+        
+        if page.total_pages and concurrency > 1:
+            yield from self._fetch_numbered(2, page.total_pages, concurrency)
+            return
+        
+        while page.next_page is not None and page.items:
+            page = self.fetch_page(page.next_page)
+            yield page.items
+    
+    def _fetch_numbered(self, start, total_pages, concurrency):
+        """Fetch pages start..total_pages with at most ``concurrency`` requests in flight."""
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'catalog-{self.source}') as executor:
+            pending = []
+            next_page = start
+            
+            while pending or next_page <= total_pages:
+                while next_page <= total_pages and len(pending) < concurrency:
+                    pending.append(executor.submit(self.fetch_page, next_page))
+                    next_page += 1
+                
+                # Yield in page order; later pages keep downloading meanwhile
+                yield pending.pop(0).result().items
+
+class ShopifyCatalogSource(CatalogSource):
+    """Products from the Shopify Admin API, following cursor pagination."""
+    
+    source = 'shopify'
+    
+    def __init__(self, shop_name, access_token, api_version='2023-01', page_size=250, **kwargs):
+        super().__init__(page_size=min(page_size, 250), **kwargs)
+        self.shop_name = shop_name
+        self.access_token = access_token
+        self.api_version = api_version
+    
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(os.getenv('SHOPIFY_SHOP_NAME'), os.getenv('SHOPIFY_ACCESS_TOKEN'), **kwargs)
+    
+    def first_page(self):
+        return (f"https://{self.shop_name}.myshopify.com/admin/api/{self.api_version}"
+                f"/products.json?limit={self.page_size}")
+    
+    def fetch_page(self, page):
+        response = self._get(page, headers={'X-Shopify-Access-Token': self.access_token})
+        next_link = response.links.get('next', {}).get('url')
+        return CatalogPage(response.json().get('products', []), next_link, None)
+
+class WooCommerceCatalogSource(CatalogSource):
+    """Products from the WooCommerce REST API, using numbered pages."""
+    
+    source = 'woocommerce'
+    
+    def __init__(self, store_url, consumer_key, consumer_secret, page_size=100, **kwargs):
+        super().__init__(page_size=min(page_size, 100), **kwargs)
+        self.store_url = (store_url or '').rstrip('/')
+        self.auth = (consumer_key, consumer_secret)
+    
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(os.getenv('WC_STORE_URL'), os.getenv('WC_CONSUMER_KEY'),
+                   os.getenv('WC_CONSUMER_SECRET'), **kwargs)
+    
+    def fetch_page(self, page):
+        response = self._get(
+            f"{self.store_url}/wp-json/wc/v3/products",
+            params={'page': page, 'per_page': self.page_size},
+            auth=self.auth
+        )
+        items = response.json()
+        total_pages = int(response.headers.get('X-WP-TotalPages', 0)) or None
+        next_page = page + 1 if len(items) == self.page_size else None
+        return CatalogPage(items, next_page, total_pages)
+
+class MagentoCatalogSource(CatalogSource):
+    """Products from the Magento 2 REST API, using numbered pages."""
+    
+    source = 'magento'
+    
+    def __init__(self, base_url, api_key, page_size=100, **kwargs):
+        super().__init__(page_size=page_size, **kwargs)
+        self.base_url = (base_url or '').rstrip('/')
+        self.api_key = api_key
+    
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(os.getenv('MAGENTO_BASE_URL'), os.getenv('MAGENTO_API_KEY'), **kwargs)
+    
+    def fetch_page(self, page):
+        response = self._get(
+            f"{self.base_url}/rest/V1/products",
+            params={
+                'searchCriteria[pageSize]': self.page_size,
+                'searchCriteria[currentPage]': page
+            },
+            headers={'Authorization': f"Bearer {self.api_key}"}
+        )
+        data = response.json()
+        items = data.get('items', [])
+        total_count = data.get('total_count') or 0
+        total_pages = -(-total_count // self.page_size) if total_count else None
+        next_page = page + 1 if len(items) == self.page_size else None
+        return CatalogPage(items, next_page, total_pages)
+    
+    def external_id(self, item):
+        return item.get('sku') or super().external_id(item)
+    
+    def prepare(self, item):
+        attributes = {attr.get('attribute_code'): attr.get('value')
+                      for attr in item.get('custom_attributes', [])}
+        
+        image_url = None
+        for entry in item.get('media_gallery_entries', []):
+            if entry.get('file'):
+                image_url = f"{self.base_url}/media/catalog/product{entry['file']}"
+                break
+        
+        return {
+            'name': item.get('name', ''),
+            'description': attributes.get('description', ''),
+            'price': item.get('price', 0),
+            'image_url': image_url
+        }
+
+CATALOG_SOURCES = {
+    'shopify': ShopifyCatalogSource,
+    'woocommerce': WooCommerceCatalogSource,
+    'magento': MagentoCatalogSource
+}
+
+def _read_ahead(iterable, depth):
+    """Run a generator on a background thread, buffering at most ``depth`` items."""
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    
+    def producer():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        buffer.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put(_END)
+        except Exception as e:
+            buffer.put(e)
+    
+    thread = threading.Thread(target=producer, name='catalog-fetch')
+    thread.daemon = True
+    thread.start()
+    
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+class CatalogIngestPipeline:
+    """Stream a store catalog into the products table in batches."""
+    
+    def __init__(self, source, batch_size=500, concurrency=4, progress_interval=5000):
+        self.source = source
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.stats = {
+            'source': source.source,
+            'pages': 0,
+            'fetched': 0,
+            'skipped': 0,
+            'duplicates': 0,
+            'inserted': 0,
+            'updated': 0,
+            'http_calls': 0,
+            'elapsed_seconds': 0.0,
+            'rows_per_second': 0.0
+        }
+        self._started_at = None
+    
+    def fetch(self):
+        """Stage 1: yield raw products while pages download in the background."""
+        for items in _read_ahead(self.source.pages(self.concurrency), self.concurrency):
+            self.stats['pages'] += 1
+            for item in items:
+                self.stats['fetched'] += 1
+                yield item
+    
+    def normalize(self, items):
+        """Stage 2: yield (external_id, normalized product data)."""
+        for item in items:
+            external_id = self.source.external_id(item)
+            if not external_id:
+                self.stats['skipped'] += 1
+                continue
+            
+            try:
+                yield external_id, normalize_product_data(self.source.prepare(item), self.source.source)
+            except Exception as e:
+                self.stats['skipped'] += 1
+                logger.warning(f"Skipping {self.source.source} product {external_id}: {e}")
+    
+    def dedupe(self, rows):
+        """Stage 3: drop products already seen in this run (only the keys are kept)."""
+        seen = set()
+        for external_id, normalized in rows:
+            if external_id in seen:
+                self.stats['duplicates'] += 1
+                continue
+            seen.add(external_id)
+            yield external_id, normalized
+    
+    def batches(self, rows):
+        """Stage 4: group rows into write batches."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def upsert(self, batch):
+        """Stage 5: write the batch with one INSERT ... ON CONFLICT DO UPDATE statement."""
+        source = self.source.source
+        external_ids = [external_id for external_id, _ in batch]
+        
+        # Only used to report inserted vs. updated counts
+        existing = db.session.query(db.func.count(Product.id)).filter(
+            Product.source == source,
+            Product.external_id.in_(external_ids)
+        ).scalar()
+        
+        rows = []
+        for external_id, normalized in batch:
+            rows.append({
+                'external_id': external_id,
+                'source': source,
+                'title': (normalized['title'] or '')[:255],
+                'description': normalized['description'],
+                'price': normalized['price'],
+                'currency': normalized['currency'],
+                'category': normalized['category'],
+                'image_url': normalized['image_url'],
+                'product_metadata': normalized['metadata']
+            })
+        
+        bulk_upsert(Product, rows, PRODUCT_KEY_COLUMNS, chunk_size=self.batch_size)
+        db.session.commit()
+        
+        self.stats['inserted'] += len(rows) - existing
+        self.stats['updated'] += existing
+    
+    def _update_rate(self):
+        elapsed = time.perf_counter() - self._started_at
+        written = self.stats['inserted'] + self.stats['updated']
+        self.stats['elapsed_seconds'] = round(elapsed, 3)
+        self.stats['rows_per_second'] = round(written / elapsed, 1) if elapsed > 0 else 0.0
+        self.stats['http_calls'] = self.source.http_calls
+    
+    def run(self):
+        """Run the pipeline and return ingest statistics."""
+        self._started_at = time.perf_counter()
+        next_report = self.progress_interval
+        
+        try:
+            for batch in self.batches(self.dedupe(self.normalize(self.fetch()))):
+                self.upsert(batch)
+                
+                written = self.stats['inserted'] + self.stats['updated']
+                if written >= next_report:
+                    self._update_rate()
+                    logger.info(f"Ingested {written} {self.source.source} products "
+                                f"({self.stats['rows_per_second']:.0f} rows/s)")
+                    next_report += self.progress_interval
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self._update_rate()
+        
+        logger.info(
+            f"Catalog ingest from {self.source.source} finished: {self.stats['inserted']} inserted, "
+            f"{self.stats['updated']} updated, {self.stats['duplicates']} duplicates in "
+            f"{self.stats['elapsed_seconds']:.1f}s ({self.stats['rows_per_second']:.0f} rows/s)"
+        )
+        return self.stats
+
+def ingest_catalog(platform, batch_size=None, concurrency=None, **source_kwargs):
+    """Ingest the catalog of a platform whose credentials come from environment variables."""
+    source_class = CATALOG_SOURCES.get(platform)
+    if source_class is None:
+        raise ValueError(f"Unknown catalog platform: {platform}")
+    
+    batch_size = batch_size or current_app.config.get('CATALOG_INGEST_BATCH_SIZE', 500)
+    concurrency = concurrency or current_app.config.get('CATALOG_INGEST_CONCURRENCY', 4)
+    source = source_class.from_env(**source_kwargs)
+    return CatalogIngestPipeline(source, batch_size=batch_size, concurrency=concurrency).run()
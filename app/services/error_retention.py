@@ -0,0 +1,101 @@
+"""
+Error log retention.
+
+Rows of ``error_logs`` older than ``ERROR_LOG_RETENTION_DAYS`` are archived
+to gzip-compressed NDJSON files in ``ERROR_LOG_ARCHIVE_DIR``, together with
+their user feedback, and deleted in chunks of
+``ERROR_LOG_RETENTION_CHUNK_SIZE`` rows with one short transaction each.
+Every chunk is appended to the archive as a complete gzip member and synced
+to disk before its rows are deleted; ``zcat`` and ``gzip.open`` read the
+members as one file. Daily counts stay in ``error_stats_daily``.
+"""
+
+import gzip
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from app import db
+from app.models.error_log import ErrorLog, ErrorFeedback
+from app.utils.logging_config import json_dumps
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorLogRetention:
+    """Service for archiving and deleting old error logs."""
+    
+    @staticmethod
+    def archive_directory(app) -> str:
+        return app.config.get('ERROR_LOG_ARCHIVE_DIR') or os.path.join(app.instance_path, 'error_archive')
+    
+    @staticmethod
+    def _append_chunk(path: str, lines):
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                archive.write(''.join(lines).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+    
+    @staticmethod
+    def archive(before: datetime, directory: str, chunk_size: int = 1000,
+                max_chunks: Optional[int] = None) -> Dict:
+        """
+        Archive and delete error logs older than ``before``.
+        
+        Returns the number of rows archived and the archive path (None when
+        nothing was old enough).
+        """
+        errors = ErrorLog.__table__
+        feedback = ErrorFeedback.__table__
+        path = None
+        archived = 0
+        chunks = 0
+        last_id = 0
+        
+        while max_chunks is None or chunks < max_chunks:
+            rows = db.session.execute(
+                select(errors).where(errors.c.timestamp < before, errors.c.id > last_id)
+                .order_by(errors.c.id).limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+            
+            ids = [row['id'] for row in rows]
+            feedback_by_error = {}
+            for row in db.session.execute(select(feedback).where(feedback.c.error_id.in_(ids))).mappings():
+                feedback_by_error.setdefault(row['error_id'], []).append(dict(row))
+            
+            if path is None:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"error_logs-{datetime.utcnow():%Y%m%dT%H%M%S}.ndjson.gz")
+            ErrorLogRetention._append_chunk(
+                path, [json_dumps({**row, 'feedback': feedback_by_error.get(row['id'], [])}) + '\n' for row in rows]
+            )
+            
+            db.session.execute(feedback.delete().where(feedback.c.error_id.in_(ids)))
+            db.session.execute(errors.delete().where(errors.c.id.in_(ids)))
+            db.session.commit()
+            
+            archived += len(ids)
+            chunks += 1
+            last_id = ids[-1]
+        
+        if archived:
+            logger.info(f"Archived {archived} error logs older than {before:%Y-%m-%d} to {path}")
+        return {'archived': archived, 'path': path}
+    
+    @staticmethod
+    def run(app, days: Optional[int] = None) -> Dict:
+        """Apply the configured retention; ``days`` overrides ERROR_LOG_RETENTION_DAYS."""
+        days = app.config.get('ERROR_LOG_RETENTION_DAYS', 90) if days is None else days
+        if not days:
+            return {'archived': 0, 'path': None}
+        return ErrorLogRetention.archive(
+            datetime.utcnow() - timedelta(days=days),
+            ErrorLogRetention.archive_directory(app),
+            chunk_size=app.config.get('ERROR_LOG_RETENTION_CHUNK_SIZE', 1000)
+        )
@@ -0,0 +1,332 @@
+"""
+Durable webhook ingestion queue.
+
+Webhook handlers only verify the signature and persist the raw payload as a
+``WebhookEvent``; a pool of background workers drains the queue in batches and
+hands the orders to the bulk order-ingest path of each integration.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.store_integration import StoreIntegration
+from app.models.user import User
+from app.models.webhook_event import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookQueue:
+    """Service for enqueuing and processing store webhooks."""
+    
+    # In-process counters, reset on restart; durable state lives in webhook_events
+    _stats_lock = threading.Lock()
+    _stats = {
+        'processed_total': 0,
+        'failed_total': 0,
+        'duplicates_total': 0,
+        'batches_total': 0,
+        'last_batch_seconds': 0.0
+    }
+    
+    @staticmethod
+    def _increment(name, amount=1):
+        with WebhookQueue._stats_lock:
+            WebhookQueue._stats[name] += amount
+    
+    @staticmethod
+    def enqueue(platform: str, webhook_id: str, payload: bytes, topic: Optional[str] = None,
+                integration_id: Optional[int] = None, shop_domain: Optional[str] = None) -> Tuple[Optional[WebhookEvent], bool]:
+        """
+        Persist a verified webhook delivery.
+        
+        Args:
+            platform: Store platform ('shopify' or 'woocommerce')
+            webhook_id: Delivery ID used to drop retried deliveries
+            payload: Raw request body
+            topic: Webhook topic reported by the store
+            integration_id: Integration the webhook was registered for, if known
+            shop_domain: Shop domain reported by the store, if known
+        
+        Returns:
+            Tuple of (event, created); created is False for duplicates
+        """
+        event = WebhookEvent(
+            platform=platform,
+            webhook_id=str(webhook_id),
+            topic=topic,
+            integration_id=integration_id,
+            shop_domain=shop_domain,
+            payload=payload.decode('utf-8') if isinstance(payload, bytes) else payload
+        )
+        
+        try:
+            db.session.add(event)
+            db.session.commit()
+            return event, True
+        except IntegrityError:
+            db.session.rollback()
+            WebhookQueue._increment('duplicates_total')
+            logger.info(f"Duplicate {platform} webhook {webhook_id} ignored")
+            return None, False
+    
+    @staticmethod
+    def claim_batch(batch_size: int = 50) -> List[WebhookEvent]:
+        """
+        Atomically claim up to ``batch_size`` pending events for this worker.
+        
+        The claim is a single UPDATE, so concurrent workers (threads or
+        processes) never receive the same event.
+        """
+        token = uuid.uuid4().hex
+        pending_ids = db.session.query(WebhookEvent.id).filter(
+            WebhookEvent.status == 'pending'
+        ).order_by(WebhookEvent.id).limit(batch_size).scalar_subquery()
+        
+        claimed = WebhookEvent.query.filter(
+            WebhookEvent.id.in_(pending_ids),
+            WebhookEvent.status == 'pending'
+        ).update({
+            'status': 'processing',
+            'claimed_by': token,
+            'claimed_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        if not claimed:
+            return []
+        
+        return WebhookEvent.query.filter_by(claimed_by=token).order_by(WebhookEvent.id).all()
+    
+    @staticmethod
+    def requeue_stale(stale_seconds: int = 300) -> int:
+        """Return events claimed by a worker that died mid-batch to the queue."""
+        cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+        count = WebhookEvent.query.filter(
+            WebhookEvent.status == 'processing',
+            WebhookEvent.claimed_at < cutoff
+        ).update({'status': 'pending', 'claimed_by': None}, synchronize_session=False)
+        db.session.commit()
+        
+        if count:
+            logger.warning(f"Requeued {count} stale webhook events")
+        return count
+    
+    @staticmethod
+    def process_batch(batch_size: int = 50, max_attempts: int = 5) -> int:
+        """
+        Claim and process one batch of pending webhook events.
+        
+        Orders are grouped per integration and deduplicated by order ID before
+        being passed to the bulk ingest functions.
+        
+        Returns:
+            Number of events claimed
+        """
+        events = WebhookQueue.claim_batch(batch_size)
+        if not events:
+            return 0
+        
+        start_time = time.time()
+        
+        # Group orders by (platform, integration) so each integration gets one ingest call
+        grouped: Dict[Tuple[str, int], Dict] = defaultdict(lambda: {'orders': {}, 'events': []})
+        
+        for event in events:
+            event.attempts += 1
+            try:
+                order = json.loads(event.payload)
+                integration = WebhookQueue._resolve_integration(event, order)
+                if integration is None:
+                    # Nobody on our side tracks this customer; nothing to ingest
+                    WebhookQueue._mark_done(event)
+                    continue
+                
+                group = grouped[(event.platform, integration.id)]
+                group['integration'] = integration
+                group['orders'].setdefault(str(order['id']), order)
+                group['events'].append(event)
+            except Exception as e:
+                WebhookQueue._mark_failed(event, e, max_attempts)
+        
+        # Persist attempt counts before ingesting so a failed group cannot roll them back
+        db.session.commit()
+        
+        for (platform, integration_id), group in grouped.items():
+            try:
+                WebhookQueue._ingest(platform, group['integration'], list(group['orders'].values()))
+                for event in group['events']:
+                    WebhookQueue._mark_done(event)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error ingesting webhooks for {platform} integration {integration_id}: {e}")
+                for event in group['events']:
+                    WebhookQueue._mark_failed(event, e, max_attempts)
+                db.session.commit()
+        
+        with WebhookQueue._stats_lock:
+            WebhookQueue._stats['batches_total'] += 1
+            WebhookQueue._stats['last_batch_seconds'] = round(time.time() - start_time, 3)
+        
+        return len(events)
+    
+    @staticmethod
+    def _resolve_integration(event: WebhookEvent, order: Dict) -> Optional[StoreIntegration]:
+        """Find the integration whose user placed the order in the webhook."""
+        if event.integration_id:
+            return StoreIntegration.query.get(event.integration_id)
+        
+        email = (order.get('email') or (order.get('customer') or {}).get('email') or '').lower()
+        if not email or not event.shop_domain:
+            return None
+        
+        return StoreIntegration.query.join(User, StoreIntegration.user_id == User.id).filter(
+            StoreIntegration.platform == event.platform,
+            StoreIntegration.store_url == event.shop_domain,
+            func.lower(User.email) == email
+        ).first()
+    
+    @staticmethod
+    def _ingest(platform: str, integration: StoreIntegration, orders: List[Dict]) -> int:
+        """Hand a batch of orders to the platform's bulk ingest function."""
+        user = User.query.get(integration.user_id)
+        if not user:
+            raise ValueError(f"User not found for integration: {integration.id}")
+        
+        if platform == 'shopify':
+            from app.integrations.shopify import ShopifyClient, ingest_shopify_orders
+            client = ShopifyClient(store_url=integration.store_url, access_token=integration.access_token)
+            return ingest_shopify_orders(integration, user, orders, client=client)
+        
+        if platform == 'woocommerce':
+            from app.integrations.woocommerce import get_woocommerce_client, ingest_woocommerce_orders
+            # Webhook orders are not filtered by customer, keep only this user's
+            email = user.email.lower()
+            orders = [
+                order for order in orders
+                if ((order.get('billing') or {}).get('email') or '').lower() == email
+            ]
+            return ingest_woocommerce_orders(integration, user, orders, client=get_woocommerce_client(integration))
+        
+        raise ValueError(f"Unknown platform: {platform}")
+    
+    @staticmethod
+    def _mark_done(event: WebhookEvent):
+        event.status = 'done'
+        event.processed_at = datetime.utcnow()
+        event.claimed_by = None
+        event.last_error = None
+        WebhookQueue._increment('processed_total')
+    
+    @staticmethod
+    def _mark_failed(event: WebhookEvent, error: Exception, max_attempts: int):
+        event.status = 'failed' if event.attempts >= max_attempts else 'pending'
+        event.claimed_by = None
+        event.last_error = str(error)[:1000]
+        WebhookQueue._increment('failed_total')
+        logger.error(f"Error processing {event.platform} webhook {event.webhook_id}: {error}")
+    
+    @staticmethod
+    def get_metrics() -> Dict:
+        """Get queue depth, lag and processing counters."""
+        status_counts = dict(
+            db.session.query(WebhookEvent.status, func.count(WebhookEvent.id)).group_by(WebhookEvent.status).all()
+        )
+        oldest_pending = db.session.query(func.min(WebhookEvent.received_at)).filter(
+            WebhookEvent.status == 'pending'
+        ).scalar()
+        
+        with WebhookQueue._stats_lock:
+            stats = dict(WebhookQueue._stats)
+        
+        return {
+            'queue_depth': status_counts.get('pending', 0),
+            'in_progress': status_counts.get('processing', 0),
+            'failed': status_counts.get('failed', 0),
+            'lag_seconds': round((datetime.utcnow() - oldest_pending).total_seconds(), 3) if oldest_pending else 0,
+            **stats
+        }
+
+
+class WebhookQueueWorker:
+    """Pool of background threads draining the webhook queue."""
+    
+    def __init__(self, workers=2, batch_size=50, poll_interval=2.0, max_attempts=5, stale_seconds=300):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_seconds = stale_seconds
+        self.threads = []
+        self._stop_event = threading.Event()
+    
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+    
+    def start(self, app):
+        """Start the worker threads."""
+        if self.running:
+            return
+        
+        self._stop_event.clear()
+        self.threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(app,), name=f"webhook-worker-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        
+        logger.info(f"Started {self.workers} webhook queue workers")
+    
+    def stop(self, timeout=5):
+        """Stop the worker threads."""
+        self._stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
+    
+    def _run(self, app):
+        """Worker loop: drain batches until the queue is empty, then poll."""
+        last_requeue = 0
+        
+        while not self._stop_event.is_set():
+            processed = 0
+            with app.app_context():
+                try:
+                    if time.time() - last_requeue > self.stale_seconds:
+                        WebhookQueue.requeue_stale(self.stale_seconds)
+                        last_requeue = time.time()
+                    processed = WebhookQueue.process_batch(self.batch_size, self.max_attempts)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error in webhook queue worker: {e}")
+                finally:
+                    db.session.remove()
+            
+            if not processed:
+                self._stop_event.wait(self.poll_interval)
+
+
+# Global webhook worker pool
+webhook_queue_worker = WebhookQueueWorker()
+
+def init_webhook_queue(app):
+    """Start the webhook queue workers for the Flask app."""
+    webhook_queue_worker.workers = app.config.get('WEBHOOK_QUEUE_WORKERS', 2)
+    webhook_queue_worker.batch_size = app.config.get('WEBHOOK_QUEUE_BATCH_SIZE', 50)
+    webhook_queue_worker.poll_interval = app.config.get('WEBHOOK_QUEUE_POLL_INTERVAL', 2.0)
+    webhook_queue_worker.max_attempts = app.config.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5)
+    webhook_queue_worker.stale_seconds = app.config.get('WEBHOOK_QUEUE_STALE_SECONDS', 300)
+    webhook_queue_worker.start(app)
@@ -4,11 +4,17 @@ WooCommerce Image Service for handling high-quality product images
 
 import requests
 import logging
+import hashlib
+import json
 from typing import List, Dict, Optional
+from flask import current_app
 from app import db
 from app.models.product import Product
 from app.models.product_image import ProductImage
-from datetime import datetime
+from app.utils.image_storage import store_images
+from app.utils.http_transport import get_transport
+from app.utils.bulk_upsert import upsert_products
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
@@ -20,46 +26,147 @@ class WooCommerceImageService:
         """
         Process and store images from WooCommerce product data.
         
+        Incoming images are matched against the stored ones by
+        ``external_image_id`` and compared through a content hash of their
+        src, alt text and position, so only new, changed or removed images
+        touch the database and only new or moved sources are probed.
+        
+        With ``PRODUCT_IMAGE_LOCAL_STORAGE`` enabled, those sources are
+        downloaded once and the stored URLs point at local derivatives.
+        
         Args:
             product: The Product instance to associate images with
             wc_product_data: Raw product data from WooCommerce API
             
         Returns:
-            List of created ProductImage instances
+            List of the product's ProductImage instances after the update
         """
         images_data = wc_product_data.get('images', [])
         if not images_data:
             logger.warning(f"No images found for product {product.id}")
             return []
         
-        # Remove existing images for this product
-        ProductImage.query.filter_by(product_id=product.id).delete()
+        existing_images = {
+            WooCommerceImageService._image_key(
+                image.external_image_id, WooCommerceImageService._remote_src(image)
+            ): image
+            for image in ProductImage.query.filter_by(product_id=product.id).all()
+        }
+        
+        stored_urls = {}
+        if current_app.config.get('PRODUCT_IMAGE_LOCAL_STORAGE', False):
+            # Download new and moved sources in one batch
+            pending_srcs = []
+            for image_data in images_data:
+                src = image_data.get('src')
+                existing = existing_images.get(WooCommerceImageService._image_key(image_data.get('id'), src))
+                if src and (existing is None or WooCommerceImageService._remote_src(existing) != src):
+                    pending_srcs.append(src)
+            stored_urls = store_images(pending_srcs)
         
-        created_images = []
+        current_images = []
+        inserted = updated = unchanged = 0
         
         for index, image_data in enumerate(images_data):
             try:
-                product_image = WooCommerceImageService._create_product_image(
-                    product, image_data, index
-                )
+                key = WooCommerceImageService._image_key(image_data.get('id'), image_data.get('src'))
+                content_hash = WooCommerceImageService._image_content_hash(image_data, index)
+                product_image = existing_images.pop(key, None)
+                
+                if product_image is None:
+                    product_image = WooCommerceImageService._create_product_image(
+                        product, image_data, index, stored_urls.get(image_data.get('src'))
+                    )
+                    if product_image:
+                        inserted += 1
+                elif product_image.content_hash == content_hash:
+                    unchanged += 1
+                else:
+                    WooCommerceImageService._update_product_image(
+                        product, product_image, image_data, index, stored_urls.get(image_data.get('src'))
+                    )
+                    updated += 1
+                
                 if product_image:
-                    created_images.append(product_image)
+                    current_images.append(product_image)
                     
             except Exception as e:
                 logger.error(f"Error processing image {index} for product {product.id}: {e}")
                 continue
         
+        # Anything left over is no longer present in WooCommerce
+        for stale_image in existing_images.values():
+            db.session.delete(stale_image)
+        deleted = len(existing_images)
+        
         # Set the first image as primary if no primary is set
-        if created_images and not any(img.is_primary for img in created_images):
-            created_images[0].is_primary = True
+        if current_images and not any(img.is_primary for img in current_images):
+            current_images[0].is_primary = True
+        
+        if inserted or updated or deleted:
+            db.session.commit()
         
-        db.session.commit()
-        logger.info(f"Processed {len(created_images)} images for product {product.id}")
+        logger.info(
+            f"Processed images for product {product.id}: {inserted} inserted, "
+            f"{updated} updated, {deleted} deleted, {unchanged} unchanged"
+        )
         
-        return created_images
+        return current_images
     
     @staticmethod
-    def _create_product_image(product: Product, image_data: Dict, order: int) -> Optional[ProductImage]:
+    def _image_key(external_image_id, src: Optional[str]) -> str:
+        """Key used to match an incoming image with a stored ProductImage."""
+        if external_image_id not in (None, ''):
+            return f"id:{external_image_id}"
+        return f"src:{src or ''}"
+    
+    @staticmethod
+    def _remote_src(product_image: ProductImage) -> Optional[str]:
+        """The WooCommerce source URL of a stored image, even when served locally."""
+        return (product_image.source_metadata or {}).get('src') or product_image.full_url
+    
+    @staticmethod
+    def _image_content_hash(image_data: Dict, order: int) -> str:
+        """Hash the fields of a WooCommerce image that we persist."""
+        content = json.dumps(
+            [image_data.get('src', ''), image_data.get('alt', ''), order],
+            separators=(',', ':')
+        )
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _build_size_urls(main_url: str) -> Dict[str, str]:
+        """
+        Build the thumbnail/medium/large URLs for a WooCommerce image.
+        
+        Args:
+            main_url: Full size image URL from WooCommerce
+            
+        Returns:
+            Dict with thumbnail_url, medium_url and large_url
+        """
+        # Generate different size URLs based on WooCommerce naming conventions
+        # WooCommerce typically uses suffixes like -150x150, -300x300, -600x600
+        base_url = main_url.rsplit('.', 1)[0]  # Remove file extension
+        extension = main_url.rsplit('.', 1)[1] if '.' in main_url else 'jpg'
+        
+        # Verify if generated URLs exist, fallback to main URL if not
+        return {
+            'thumbnail_url': WooCommerceImageService._verify_image_url(f"{base_url}-150x150.{extension}", main_url),
+            'medium_url': WooCommerceImageService._verify_image_url(f"{base_url}-300x300.{extension}", main_url),
+            'large_url': WooCommerceImageService._verify_image_url(f"{base_url}-600x600.{extension}", main_url)
+        }
+    
+    @staticmethod
+    def _image_urls(main_url: str, stored_urls: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """URL columns for an image: local derivatives when stored, WooCommerce sizes otherwise."""
+        if stored_urls:
+            return dict(stored_urls)
+        return {'full_url': main_url, **WooCommerceImageService._build_size_urls(main_url)}
+    
+    @staticmethod
+    def _create_product_image(product: Product, image_data: Dict, order: int,
+                              stored_urls: Optional[Dict[str, str]] = None) -> Optional[ProductImage]:
         """
         Create a ProductImage instance from WooCommerce image data.
         
@@ -67,6 +174,7 @@ class WooCommerceImageService:
             product: The Product instance
             image_data: Single image data from WooCommerce
             order: Order/position of the image
+            stored_urls: Local image URLs from ``store_images``, if downloaded
             
         Returns:
             ProductImage instance or None if creation failed
@@ -79,37 +187,16 @@ class WooCommerceImageService:
                 logger.warning(f"No src URL found in image data: {image_data}")
                 return None
             
-            # WooCommerce image size variations
-            # The main URL is typically the full size
-            full_url = main_url
-            
-            # Generate different size URLs based on WooCommerce naming conventions
-            # WooCommerce typically uses suffixes like -150x150, -300x300, -600x600
-            base_url = main_url.rsplit('.', 1)[0]  # Remove file extension
-            extension = main_url.rsplit('.', 1)[1] if '.' in main_url else 'jpg'
-            
-            # Common WooCommerce image sizes
-            thumbnail_url = f"{base_url}-150x150.{extension}"
-            medium_url = f"{base_url}-300x300.{extension}"
-            large_url = f"{base_url}-600x600.{extension}"
-            
-            # Verify if generated URLs exist, fallback to main URL if not
-            thumbnail_url = WooCommerceImageService._verify_image_url(thumbnail_url, main_url)
-            medium_url = WooCommerceImageService._verify_image_url(medium_url, main_url)
-            large_url = WooCommerceImageService._verify_image_url(large_url, main_url)
-            
             # Create ProductImage instance
             product_image = ProductImage(
                 product_id=product.id,
-                thumbnail_url=thumbnail_url,
-                medium_url=medium_url,
-                large_url=large_url,
-                full_url=full_url,
                 alt_text=image_data.get('alt', product.title),
                 image_order=order,
                 is_primary=(order == 0),  # First image is primary
                 external_image_id=str(image_data.get('id', '')),
-                source_metadata=image_data  # Store original WooCommerce data
+                source_metadata=image_data,  # Store original WooCommerce data
+                content_hash=WooCommerceImageService._image_content_hash(image_data, order),
+                **WooCommerceImageService._image_urls(main_url, stored_urls)
             )
             
             db.session.add(product_image)
@@ -121,6 +208,39 @@ class WooCommerceImageService:
             logger.error(f"Error creating ProductImage: {e}")
             return None
     
+    @staticmethod
+    def _update_product_image(product: Product, product_image: ProductImage, image_data: Dict,
+                              order: int, stored_urls: Optional[Dict[str, str]] = None) -> ProductImage:
+        """
+        Update a stored ProductImage whose WooCommerce data has changed.
+        
+        The size URLs are only re-probed when the image source moved; alt
+        text or position changes are applied in place.
+        
+        Args:
+            product: The Product instance
+            product_image: Existing ProductImage matched to image_data
+            image_data: Single image data from WooCommerce
+            order: Order/position of the image
+            stored_urls: Local image URLs from ``store_images``, if downloaded
+            
+        Returns:
+            The updated ProductImage instance
+        """
+        main_url = image_data.get('src', '')
+        if main_url and main_url != WooCommerceImageService._remote_src(product_image):
+            for field, url in WooCommerceImageService._image_urls(main_url, stored_urls).items():
+                setattr(product_image, field, url)
+        
+        product_image.alt_text = image_data.get('alt', product.title)
+        product_image.image_order = order
+        product_image.is_primary = (order == 0)
+        product_image.source_metadata = image_data
+        product_image.content_hash = WooCommerceImageService._image_content_hash(image_data, order)
+        
+        logger.debug(f"Updated ProductImage {product_image.id} for product {product.id}, order {order}")
+        return product_image
+    
     @staticmethod
     def _verify_image_url(url: str, fallback_url: str) -> str:
         """
@@ -135,7 +255,7 @@ class WooCommerceImageService:
         """
         try:
             # Quick HEAD request to check if image exists
-            response = requests.head(url, timeout=5)
+            response = get_transport().head(url, timeout=5)
             if response.status_code == 200:
                 return url
             else:
@@ -147,17 +267,54 @@ class WooCommerceImageService:
             return fallback_url
     
     @staticmethod
-    def update_product_with_wc_data(product: Product, wc_product_data: Dict) -> Product:
+    def _parse_wc_datetime(value: Optional[str]) -> Optional[datetime]:
+        """Parse a WooCommerce timestamp into a naive UTC datetime."""
+        if not value:
+            return None
+        
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    @staticmethod
+    def is_product_unchanged(product: Product, wc_product_data: Dict) -> bool:
+        """
+        Check whether WooCommerce reports no modification since the last update.
+        
+        Args:
+            product: Existing Product instance
+            wc_product_data: Complete WooCommerce product data
+            
+        Returns:
+            True if the stored date_modified matches the incoming one
+        """
+        if product.id is None or product.date_modified is None:
+            return False
+        
+        date_modified = WooCommerceImageService._parse_wc_datetime(wc_product_data.get('date_modified'))
+        return date_modified is not None and date_modified == product.date_modified
+    
+    @staticmethod
+    def update_product_with_wc_data(product: Product, wc_product_data: Dict, force: bool = False) -> Product:
         """
         Update product with comprehensive WooCommerce data including images.
         
+        Products whose WooCommerce ``date_modified`` matches the stored value
+        are returned untouched unless ``force`` is set.
+        
         Args:
             product: Existing Product instance
             wc_product_data: Complete WooCommerce product data
+            force: Update even if the product is unchanged in WooCommerce
             
         Returns:
             Updated Product instance
         """
+        if not force and WooCommerceImageService.is_product_unchanged(product, wc_product_data):
+            logger.debug(f"Product {product.id} unchanged in WooCommerce, skipping update")
+            return product
+        
         try:
             # Update basic product information
             product.title = wc_product_data.get('name', product.title)
@@ -199,13 +356,13 @@ class WooCommerceImageService:
             
             # Update timestamps
             if wc_product_data.get('date_created'):
-                product.date_created = datetime.fromisoformat(
-                    wc_product_data['date_created'].replace('Z', '+00:00')
+                product.date_created = WooCommerceImageService._parse_wc_datetime(
+                    wc_product_data['date_created']
                 )
             
             if wc_product_data.get('date_modified'):
-                product.date_modified = datetime.fromisoformat(
-                    wc_product_data['date_modified'].replace('Z', '+00:00')
+                product.date_modified = WooCommerceImageService._parse_wc_datetime(
+                    wc_product_data['date_modified']
                 )
             
             # Store complete metadata
@@ -229,44 +386,98 @@ class WooCommerceImageService:
             raise
     
     @staticmethod
-    def create_product_from_wc_data(wc_product_data: Dict, source: str = 'woocommerce') -> Product:
+    def create_products_from_wc_data(products_data: List[Dict], source: str = 'woocommerce') -> Dict[str, Product]:
         """
-        Create a new Product from WooCommerce data.
+        Create Products for a batch of WooCommerce products.
+        
+        The base rows are written with a single upsert keyed by
+        ``(source, external_id)``, so products created concurrently by a
+        sync and a webhook end up as one row; the full WooCommerce data and
+        images are then applied to each product.
         
         Args:
-            wc_product_data: Complete WooCommerce product data
+            products_data: Complete WooCommerce product data for each product;
+                entries without an id are skipped
             source: Source identifier (default: 'woocommerce')
             
         Returns:
-            New Product instance
+            Dict mapping external id to Product instance
         """
+        products_data = [data for data in products_data if data.get('id') not in (None, '')]
+        if not products_data:
+            return {}
+        
         try:
-            # Create basic product
-            product = Product(
-                external_id=str(wc_product_data.get('id', '')),
-                source=source,
-                title=wc_product_data.get('name', 'Untitled Product'),
-                description=wc_product_data.get('description', ''),
-                price=float(wc_product_data.get('price', 0)),
-                currency='USD'  # Default, should be configurable
-            )
-            
-            db.session.add(product)
-            db.session.flush()  # Get the product ID
-            
-            # Update with complete WooCommerce data
-            product = WooCommerceImageService.update_product_with_wc_data(product, wc_product_data)
+            rows = [{
+                'external_id': str(wc_product_data['id']),
+                'source': source,
+                'title': wc_product_data.get('name', 'Untitled Product'),
+                'description': wc_product_data.get('description', ''),
+                'price': float(wc_product_data.get('price', 0)),
+                'currency': 'USD'  # Default, should be configurable
+            } for wc_product_data in products_data]
+            
+            # Existing rows are left for update_product_with_wc_data below
+            product_ids = upsert_products(rows, update_columns=[])
+            stored = {
+                product.id: product
+                for product in Product.query.filter(Product.id.in_(list(product_ids.values())))
+            }
+            
+            products = {}
+            for wc_product_data in products_data:
+                external_id = str(wc_product_data['id'])
+                product = stored[product_ids[(source, external_id)]]
+                products[external_id] = WooCommerceImageService.update_product_with_wc_data(product, wc_product_data)
             
             db.session.commit()
             
-            logger.info(f"Created new product {product.id} from WooCommerce data")
-            return product
+            logger.info(f"Created {len(products_data)} products from WooCommerce data")
+            return products
             
         except Exception as e:
-            logger.error(f"Error creating product from WooCommerce data: {e}")
+            logger.error(f"Error creating products from WooCommerce data: {e}")
             db.session.rollback()
             raise
     
+    @staticmethod
+    def create_product_from_wc_data(wc_product_data: Dict, source: str = 'woocommerce') -> Product:
+        """
+        Create a new Product from WooCommerce data.
+        
+        Args:
+            wc_product_data: Complete WooCommerce product data
+            source: Source identifier (default: 'woocommerce')
+            
+        Returns:
+            New Product instance
+        """
+        if wc_product_data.get('id') in (None, ''):
+            try:
+                product = Product(
+                    external_id=None,
+                    source=source,
+                    title=wc_product_data.get('name', 'Untitled Product'),
+                    description=wc_product_data.get('description', ''),
+                    price=float(wc_product_data.get('price', 0)),
+                    currency='USD'  # Default, should be configurable
+                )
+                db.session.add(product)
+                db.session.flush()  # Get the product ID
+                
+                product = WooCommerceImageService.update_product_with_wc_data(product, wc_product_data)
+                db.session.commit()
+                return product
+            except Exception as e:
+                logger.error(f"Error creating product from WooCommerce data: {e}")
+                db.session.rollback()
+                raise
+        
+        products = WooCommerceImageService.create_products_from_wc_data([wc_product_data], source=source)
+        product = products[str(wc_product_data['id'])]
+        logger.info(f"Created new product {product.id} from WooCommerce data")
+        return product
+    
     @staticmethod
     def get_optimized_image_url(product: Product, size: str = 'large', format: str = 'webp') -> Optional[str]:
         """
@@ -0,0 +1,294 @@
+"""
+Asyncio HTTP/1.1 transport for store API clients.
+
+A small client built on ``asyncio`` streams so a single event loop can
+drive hundreds of store syncs at once. Connections are kept alive and
+pooled per host, a semaphore per host caps concurrent requests to one
+store, and 429/5xx responses and connection failures are retried with
+jittered exponential backoff (honoring ``Retry-After``). As in
+``HTTPTransport``, a POST or PATCH is only sent again after a 429 or when it
+never left the client (the connection could not be opened). Calls are
+reported to the sync telemetry of the task that made them, and their
+latencies to the per-host histograms of ``PerformanceMonitor``.
+
+It covers what the store APIs need and nothing more. Not supported:
+
+- Redirects: 3xx responses are returned as they are.
+- Proxies and the environment: ``HTTP(S)_PROXY``, ``NO_PROXY``, ``.netrc``
+  and ``REQUESTS_CA_BUNDLE`` are ignored; TLS uses the default context.
+- Content decoding: ``Accept-Encoding: identity`` is sent and a
+  compressed body would be returned undecoded.
+- HTTP/2, ``Expect: 100-continue``, cookies and streaming bodies.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+
+from app.utils import sync_telemetry
+from app.utils.http_transport import IDEMPOTENT_METHODS, RETRY_STATUSES
+from app.utils.performance_monitor import performance_monitor
+
+logger = logging.getLogger(__name__)
+
+class AsyncHTTPError(Exception):
+    """Raised when a request fails for good or ``raise_for_status`` sees an error status."""
+    
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+class AsyncResponse:
+    """Buffered response with the parts of the ``requests`` API the clients use."""
+    
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+    
+    @property
+    def ok(self):
+        return self.status_code < 400
+    
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+    
+    @property
+    def links(self):
+        """Parsed ``Link`` header keyed by rel, like ``requests.Response.links``."""
+        header = self.headers.get('Link')
+        if not header:
+            return {}
+        return {link.get('rel') or link.get('url'): link for link in parse_header_links(header)}
+    
+    def json(self):
+        return json.loads(self.content.decode('utf-8')) if self.content else None
+    
+    def raise_for_status(self):
+        if not self.ok:
+            raise AsyncHTTPError(f"HTTP {self.status_code} for {self.url}", response=self)
+
+class AsyncHTTPTransport:
+    """
+    Pooled, retrying HTTP/1.1 client for one event loop.
+    
+    Args:
+        max_connections_per_host: Concurrent requests (and pooled
+            connections) per host
+        max_retries: Retries after a 429/5xx response or connection error
+        backoff_base: First retry delay in seconds; doubled per attempt
+        backoff_max: Upper bound of a retry delay
+        timeout: Seconds allowed for one request/response exchange
+    """
+    
+    def __init__(self, max_connections_per_host=4, max_retries=3, backoff_base=0.5, backoff_max=30.0,
+                 timeout=30.0, user_agent='BuyRoll/1.0'):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.user_agent = user_agent
+        
+        self._idle = {}  # (scheme, host, port) -> idle (reader, writer) pairs
+        self._semaphores = {}
+        self._ssl_context = None
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'connections_opened': 0,
+            'connections_reused': 0
+        }
+    
+    def _semaphore(self, key):
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self.max_connections_per_host)
+        return semaphore
+    
+    def _backoff(self, attempt):
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return random.uniform(delay / 2, delay)  # Jitter so retrying stores don't synchronize
+    
+    async def request(self, method, url, params=None, headers=None, json_body=None):
+        """Send a request and return the buffered AsyncResponse."""
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        
+        target = parts.path or '/'
+        query = '&'.join(filter(None, [parts.query, urlencode(params, doseq=True) if params else '']))
+        if query:
+            target = f"{target}?{query}"
+        
+        default_port = 443 if scheme == 'https' else 80
+        request_headers = {
+            'Host': parts.hostname if port == default_port else f"{parts.hostname}:{port}",
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'identity',
+            'Connection': 'keep-alive'
+        }
+        request_headers.update(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+        if body is not None or method in ('POST', 'PUT', 'PATCH'):
+            request_headers['Content-Length'] = str(len(body or b''))
+        
+        idempotent = method in IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            sent = []  # Set once the request is written, so a failure before that is safe to retry
+            try:
+                async with self._semaphore(key):
+                    self.stats['requests'] += 1
+                    start = time.perf_counter()
+                    response = await asyncio.wait_for(
+                        self._exchange(key, method, target, request_headers, body, url, sent), self.timeout
+                    )
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                performance_monitor.record_outbound_request(parts.netloc, time.perf_counter() - start, error=True)
+                if (sent and not idempotent) or attempt == self.max_retries:
+                    raise AsyncHTTPError(f"{method} {url} failed: {e!r}") from e
+                delay = self._backoff(attempt)
+                logger.debug(f"{method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+            else:
+                performance_monitor.record_outbound_request(parts.netloc, time.perf_counter() - start,
+                                                            response.status_code)
+                sync_telemetry.record_http_response(response)
+                retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+                if not retryable or attempt == self.max_retries:
+                    return response
+                
+                if response.status_code == 429:
+                    delay = sync_telemetry.retry_after_seconds(
+                        response, default=self._backoff(attempt), maximum=self.backoff_max
+                    )
+                    sync_telemetry.record_rate_limit_wait(delay)
+                else:
+                    delay = self._backoff(attempt)
+            
+            self.stats['retries'] += 1
+            sync_telemetry.record_retry()
+            await asyncio.sleep(delay)
+    
+    async def _exchange(self, key, method, target, headers, body, url, sent):
+        connection, reused = await self._acquire(key)
+        try:
+            try:
+                result = await self._send_and_read(connection, method, target, headers, body, sent)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                if not reused or method not in IDEMPOTENT_METHODS:
+                    raise
+                # The server closed an idle keep-alive connection; try once on a fresh one
+                self._close(connection)
+                connection = await self._open(key)
+                result = await self._send_and_read(connection, method, target, headers, body, sent)
+        except BaseException:
+            self._close(connection)
+            raise
+        
+        status_code, response_headers, content, keep_alive = result
+        if keep_alive:
+            self._idle.setdefault(key, []).append(connection)
+        else:
+            self._close(connection)
+        return AsyncResponse(status_code, response_headers, content, url)
+    
+    async def _acquire(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.stats['connections_reused'] += 1
+                return (reader, writer), True
+            self._close((reader, writer))
+        return await self._open(key), False
+    
+    async def _open(self, key):
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context, server_hostname=host if ssl_context else None, limit=2 ** 20
+        )
+        self.stats['connections_opened'] += 1
+        return reader, writer
+    
+    @staticmethod
+    def _close(connection):
+        connection[1].close()
+    
+    @staticmethod
+    async def _send_and_read(connection, method, target, headers, body, sent):
+        reader, writer = connection
+        
+        head = [f"{method} {target} HTTP/1.1"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        sent.append(True)
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await writer.drain()
+        
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        version, status, *_ = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status_code = int(status)
+        
+        response_headers = CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip(), value.strip()
+            response_headers[name] = f"{response_headers[name]}, {value}" if name in response_headers else value
+        
+        keep_alive = version == 'HTTP/1.1' and response_headers.get('Connection', '').lower() != 'close'
+        
+        if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+            content = b''
+        elif 'chunked' in response_headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass  # Trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'Content-Length' in response_headers:
+            content = await reader.readexactly(int(response_headers['Content-Length']))
+        else:
+            content = await reader.read()  # Body delimited by connection close
+            keep_alive = False
+        
+        return status_code, response_headers, content, keep_alive
+    
+    async def close(self):
+        """Close all pooled connections."""
+        connections = [connection for idle in self._idle.values() for connection in idle]
+        self._idle.clear()
+        for connection in connections:
+            self._close(connection)
+        for _, writer in connections:
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
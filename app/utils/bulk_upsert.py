@@ -0,0 +1,144 @@
+"""
+Dialect-aware bulk upserts.
+
+Rows are written with one ``INSERT ... ON CONFLICT DO UPDATE`` statement
+per chunk on SQLite and PostgreSQL (``ON DUPLICATE KEY UPDATE`` on MySQL),
+so concurrent writers racing on the same natural key converge on a single
+row instead of raising or duplicating it.
+"""
+
+import logging
+from datetime import datetime
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_KEY_COLUMNS = ['source', 'external_id']
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def bulk_upsert(model, rows, conflict_columns, update_columns=None, chunk_size=500):
+    """
+    Insert rows, updating the existing row when the conflict key matches.
+    
+    Args:
+        model: Model class whose table has a unique index on conflict_columns
+        rows: List of column dicts; all rows must have the same keys
+        conflict_columns: Columns of the unique key
+        update_columns: Columns overwritten on conflict (default: all given
+            columns except the key, ``id`` and ``created_at``)
+        chunk_size: Rows per statement
+    
+    The session is not committed. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    
+    columns = list(rows[0])
+    if any(len(row) != len(columns) or any(column not in row for column in columns) for row in rows):
+        raise ValueError("All upserted rows must have the same columns")
+    
+    # One statement may not touch the same row twice (PostgreSQL rejects it); last row wins
+    deduped = {}
+    for index, row in enumerate(rows):
+        key = tuple(row[column] for column in conflict_columns)
+        deduped[key if None not in key else ('__row__', index)] = row
+    rows = list(deduped.values())
+    
+    table = model.__table__
+    if update_columns is None:
+        update_columns = [
+            column for column in columns
+            if column not in conflict_columns and column not in ('id', 'created_at')
+        ]
+    
+    dialect = db.session.get_bind().dialect.name
+    now = datetime.utcnow()
+    
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        
+        for chunk in _chunks(rows, chunk_size):
+            stmt = insert(table).values(chunk)
+            set_ = {column: stmt.excluded[column] for column in update_columns}
+            if 'updated_at' in table.c and 'updated_at' not in set_:
+                set_['updated_at'] = now  # onupdate does not fire for ON CONFLICT
+            if set_:
+                stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+            db.session.execute(stmt)
+    
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        
+        for chunk in _chunks(rows, chunk_size):
+            stmt = insert(table).values(chunk)
+            set_ = {column: stmt.inserted[column] for column in update_columns}
+            if 'updated_at' in table.c and 'updated_at' not in set_:
+                set_['updated_at'] = now
+            if not set_:
+                # MySQL has no DO NOTHING; a no-op assignment keeps the existing row
+                set_ = {conflict_columns[0]: table.c[conflict_columns[0]]}
+            db.session.execute(stmt.on_duplicate_key_update(**set_))
+    
+    else:
+        # No native upsert: look up existing keys per chunk, then insert or update
+        logger.debug(f"No native upsert for dialect {dialect}, falling back to select-then-write")
+        key_attrs = [getattr(model, column) for column in conflict_columns]
+        
+        for chunk in _chunks(rows, chunk_size):
+            existing = {}
+            for instance in model.query.filter(db.or_(*[
+                db.and_(*[attr == row[column] for attr, column in zip(key_attrs, conflict_columns)])
+                for row in chunk
+            ])):
+                existing[tuple(getattr(instance, column) for column in conflict_columns)] = instance
+            
+            for row in chunk:
+                instance = existing.get(tuple(row[column] for column in conflict_columns))
+                if instance is None:
+                    instance = model(**row)
+                    db.session.add(instance)
+                    existing[tuple(row[column] for column in conflict_columns)] = instance
+                else:
+                    for column in update_columns:
+                        setattr(instance, column, row[column])
+        db.session.flush()
+    
+    return len(rows)
+
+def upsert_products(rows, update_columns=None):
+    """
+    Upsert product rows keyed by ``(source, external_id)``.
+    
+    Returns a dict mapping ``(source, external_id)`` to the product id, read
+    back with one query per source.
+    """
+    from app.models.product import Product
+    
+    keyed_rows = [row for row in rows if row.get('external_id')]
+    if len(keyed_rows) != len(rows):
+        raise ValueError("Upserted products need an external_id")
+    
+    bulk_upsert(Product, keyed_rows, PRODUCT_KEY_COLUMNS, update_columns=update_columns)
+    
+    external_ids_by_source = {}
+    for row in keyed_rows:
+        external_ids_by_source.setdefault(row['source'], set()).add(row['external_id'])
+    
+    product_ids = {}
+    for source, external_ids in external_ids_by_source.items():
+        for external_id, product_id in db.session.query(Product.external_id, Product.id).filter(
+            Product.source == source,
+            Product.external_id.in_(external_ids)
+        ):
+            product_ids[(source, external_id)] = product_id
+    
+    return product_ids
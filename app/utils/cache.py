@@ -8,6 +8,8 @@ from functools import wraps
 from flask import current_app
 from typing import Any, Optional, Callable
 import hashlib
+from app.utils.prometheus import observe_cache
+from app.utils.tracing import span
 
 class MemoryCache:
     """Simple in-memory cache implementation."""
@@ -96,14 +98,20 @@ def cached(ttl: int = 300, key_prefix: str = ''):
             func_key = f"{key_prefix}{func.__name__}_{cache_key(*args, **kwargs)}"
             
             # Try to get from cache
-            cached_result = cache.get(func_key)
+            with span('cache.get', 'cache', key=func_key) as cache_span:
+                cached_result = cache.get(func_key)
+                if cache_span is not None:
+                    cache_span.set(hit=cached_result is not None)
             if cached_result is not None:
                 current_app.logger.debug(f"Cache hit for {func.__name__}")
+                observe_cache(func.__name__, hit=True)
                 return cached_result
             
             # Execute function and cache result
+            observe_cache(func.__name__, hit=False)
             result = func(*args, **kwargs)
-            cache.set(func_key, result, ttl)
+            with span('cache.set', 'cache', key=func_key):
+                cache.set(func_key, result, ttl)
             current_app.logger.debug(f"Cache miss for {func.__name__}, result cached")
             
             return result
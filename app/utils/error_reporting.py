@@ -1,15 +1,71 @@
 """
 Error reporting system for BuyRoll application
+
+``report_error`` only builds the report, logs it and hands it to a
+background worker, so an error storm costs the request threads nothing but
+a queue put. The worker stores ``ErrorLog`` rows and ``ErrorPattern``
+occurrence counts in batches and groups reports by fingerprint (error
+type, message with ids and numbers normalized, and the innermost frames).
+Each group collects occurrences for ``ERROR_DIGEST_WINDOW_SECONDS`` after
+its first one; when the window closes, high and critical groups get one
+digest email with the count, however many times the error occurred.
+Processes without the worker (CLI commands, tests) store reports as they
+come but group them the same way, and send the digests of still-open
+windows when they exit.
 """
 import os
+import re
 import json
+import queue
+import hashlib
 import smtplib
+import threading
+import time
+import traceback
 from datetime import datetime
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
-from flask import current_app, request, g
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from functools import lru_cache
+from flask import current_app, request, g, has_app_context
+from sqlalchemy import bindparam, func, update
 from app.utils.logging_config import app_logger
 
+LOGGED_REQUEST_FIELDS = ('method', 'url', 'endpoint', 'remote_addr', 'user_agent')
+
+SEVERITY_RANK = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+DIGEST_SEVERITIES = ('high', 'critical')
+FINGERPRINT_FRAMES = 3  # Innermost frames that identify where an error was raised
+
+_UUID = re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.IGNORECASE)
+_HEX = re.compile(r'\b0x[0-9a-f]+\b|\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{6,}\b', re.IGNORECASE)
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+def normalize_error_message(message):
+    """Replace ids, quoted values and numbers so occurrences of one error share a message."""
+    message = _UUID.sub('<uuid>', message or '')
+    message = _QUOTED.sub('<str>', message)
+    message = _HEX.sub('<hex>', message)
+    return _NUMBER.sub('<n>', message)[:500]
+
+def error_fingerprint(error_type, message, frames=()):
+    """Stable 16-character id of an error group."""
+    key = '|'.join((error_type, normalize_error_message(message), *frames))
+    return hashlib.sha1(key.encode('utf-8', 'replace')).hexdigest()[:16]
+
+def _innermost_frames(error):
+    # File and function of the frames closest to the raise; line numbers change with every edit
+    frames = [(frame.f_code.co_filename, frame.f_code.co_name)
+              for frame, _ in traceback.walk_tb(getattr(error, '__traceback__', None))]
+    return [f"{os.path.basename(filename)}:{name}" for filename, name in frames[-FINGERPRINT_FRAMES:]]
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern_regex):
+    try:
+        return re.compile(pattern_regex)
+    except re.error:
+        return None
+
 class ErrorReporter:
     """Centralized error reporting system"""
     
@@ -23,35 +79,33 @@ class ErrorReporter:
             context: Additional context about the error
             user_id: ID of the user who encountered the error
             severity: Error severity (low, medium, high, critical)
+        
+        Returns:
+            False if the report was dropped because the report queue is full
         """
         error_data = ErrorReporter._prepare_error_data(error, context, user_id, severity)
         
         # Log the error
         ErrorReporter._log_error(error_data)
         
-        # Send email notification for high/critical errors
-        if severity in ['high', 'critical']:
-            ErrorReporter._send_email_notification(error_data)
-        
-        # Send to external monitoring service (if configured)
-        ErrorReporter._send_to_monitoring_service(error_data)
-        
-        # Store in database for tracking
-        ErrorReporter._store_error_record(error_data)
+        # Storage, pattern counts, monitoring and digest emails happen on the worker
+        return error_report_worker.submit(error_data)
     
     @staticmethod
     def _prepare_error_data(error, context, user_id, severity):
         """Prepare error data for reporting"""
-        import traceback
+        error_type = type(error).__name__
+        has_traceback = getattr(error, '__traceback__', None) is not None
         
         error_data = {
             'timestamp': datetime.utcnow().isoformat(),
-            'error_type': type(error).__name__,
+            'error_type': error_type,
             'error_message': str(error),
             'severity': severity,
+            'fingerprint': error_fingerprint(error_type, str(error), _innermost_frames(error)),
             'context': context or {},
             'user_id': user_id,
-            'traceback': traceback.format_exc() if hasattr(error, '__traceback__') else None,
+            'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)) if has_traceback else None,
             'request_data': ErrorReporter._get_request_data(),
             'environment': os.environ.get('FLASK_ENV', 'unknown'),
             'app_version': '1.0.0'  # This could be dynamic
@@ -84,16 +138,22 @@ class ErrorReporter:
     @staticmethod
     def _log_error(error_data):
         """Log error using the application logger"""
+        # The full request (headers, form and JSON bodies) is stored with the ErrorLog record, not logged
+        request_data = error_data.get('request_data') or {}
         app_logger.log_event(
             'ERROR',
             'error_report',
             f"Error reported: {error_data['error_type']} - {error_data['error_message']}",
-            **error_data
+            **{key: value for key, value in error_data.items() if key != 'request_data'},
+            request={key: request_data.get(key) for key in LOGGED_REQUEST_FIELDS} if request_data else None
         )
     
     @staticmethod
-    def _send_email_notification(error_data):
-        """Send email notification for critical errors"""
+    def _send_digest_emails(digests):
+        """Send one email per digest over a single SMTP connection"""
+        if not digests:
+            return
+        
         try:
             # Get email configuration
             mail_server = current_app.config.get('MAIL_SERVER')
@@ -105,42 +165,43 @@ class ErrorReporter:
                 app_logger.log_event(
                     'WARNING',
                     'email_config_missing',
-                    'Email configuration missing, cannot send error notification'
+                    'Email configuration missing, cannot send error notification',
+                    digests=len(digests)
                 )
                 return
             
-            # Prepare email
-            msg = MimeMultipart()
-            msg['From'] = mail_username
-            msg['To'] = current_app.config.get('ERROR_NOTIFICATION_EMAIL', mail_username)
-            msg['Subject'] = f"[BuyRoll] {error_data['severity'].upper()} Error: {error_data['error_type']}"
-            
-            # Email body
-            body = ErrorReporter._format_error_email(error_data)
-            msg.attach(MimeText(body, 'html'))
-            
-            # Send email
-            server = smtplib.SMTP(mail_server, mail_port)
-            server.starttls()
-            server.login(mail_username, mail_password)
-            server.send_message(msg)
-            server.quit()
+            server = smtplib.SMTP(mail_server, mail_port, timeout=30)
+            try:
+                server.starttls()
+                server.login(mail_username, mail_password)
+                for digest in digests:
+                    error_data = digest['sample']
+                    msg = MIMEMultipart()
+                    msg['From'] = mail_username
+                    msg['To'] = current_app.config.get('ERROR_NOTIFICATION_EMAIL') or mail_username
+                    msg['Subject'] = (f"[BuyRoll] {digest['severity'].upper()} Error: {error_data['error_type']}"
+                                      f" ({digest['count']}x)")
+                    msg.attach(MIMEText(ErrorReporter._format_error_email(error_data, digest), 'html'))
+                    server.send_message(msg)
+            finally:
+                server.quit()
             
             app_logger.log_event(
                 'INFO',
                 'error_email_sent',
-                f"Error notification email sent for {error_data['error_type']}"
+                f"Error digest emails sent for {len(digests)} error groups",
+                fingerprints=[digest['fingerprint'] for digest in digests]
             )
-            
+        
         except Exception as e:
             app_logger.log_error(
                 e,
                 context='email_notification_failed',
-                original_error=error_data['error_type']
+                fingerprints=[digest['fingerprint'] for digest in digests]
             )
     
     @staticmethod
-    def _format_error_email(error_data):
+    def _format_error_email(error_data, digest=None):
         """Format error data for email notification"""
         return f"""
         <html>
@@ -156,6 +217,15 @@ class ErrorReporter:
                 <p><strong>Environment:</strong> {error_data['environment']}</p>
             </div>
             
+            {f'''
+            <div style="background-color: #fde68a; padding: 15px; border-radius: 5px; margin: 10px 0;">
+                <h3>Occurrences</h3>
+                <p><strong>Count:</strong> {digest['count']} between {digest['first_seen']} and {digest['last_seen']}</p>
+                <p><strong>Fingerprint:</strong> {digest['fingerprint']}</p>
+                <p>Details below are from the first occurrence.</p>
+            </div>
+            ''' if digest else ''}
+            
             {f'''
             <div style="background-color: #fef3c7; padding: 15px; border-radius: 5px; margin: 10px 0;">
                 <h3>User Information</h3>
@@ -215,35 +285,241 @@ class ErrorReporter:
             )
     
     @staticmethod
-    def _store_error_record(error_data):
-        """Store error record in database for tracking"""
+    def _store_error_records(reports):
+        """Store error records in database for tracking, one transaction per batch"""
+        from app.models.error_log import ErrorLog
+        from app import db
+        
         try:
-            from app.models.error_log import ErrorLog
-            from app import db
-            
-            error_log = ErrorLog(
-                error_type=error_data['error_type'],
-                error_message=error_data['error_message'],
-                severity=error_data['severity'],
-                user_id=error_data['user_id'],
-                context=json.dumps(error_data['context']),
-                request_data=json.dumps(error_data['request_data']),
-                traceback=error_data['traceback'],
-                environment=error_data['environment'],
-                timestamp=datetime.fromisoformat(error_data['timestamp'])
-            )
-            
-            db.session.add(error_log)
+            db.session.add_all([
+                ErrorLog(
+                    error_type=error_data['error_type'],
+                    error_message=error_data['error_message'],
+                    severity=error_data['severity'],
+                    fingerprint=error_data.get('fingerprint'),
+                    user_id=error_data['user_id'],
+                    context=json.dumps(error_data['context'], default=str, separators=(',', ':')),
+                    request_data=json.dumps(error_data['request_data'], default=str, separators=(',', ':')),
+                    traceback=error_data['traceback'],
+                    environment=error_data['environment'],
+                    timestamp=datetime.fromisoformat(error_data['timestamp'])
+                )
+                for error_data in reports
+            ])
             db.session.commit()
-            
+        
         except Exception as e:
             # Don't let error storage failure break the application
+            db.session.rollback()
             app_logger.log_error(
                 e,
                 context='error_storage_failed',
-                original_error=error_data['error_type']
+                reports=len(reports)
+            )
+    
+    @staticmethod
+    def _update_pattern_counts(reports):
+        """Add the batch's matches to ErrorPattern occurrence counts with one UPDATE per pattern"""
+        from app.models.error_log import ErrorPattern
+        from app import db
+        
+        try:
+            patterns = ErrorPattern.query.filter_by(is_active=True).all()
+            counts = {}
+            last_seen = {}
+            for error_data in reports:
+                for pattern in patterns:
+                    if pattern.error_type != error_data['error_type']:
+                        continue
+                    regex = _compile_pattern(pattern.pattern_regex) if pattern.pattern_regex else None
+                    if pattern.pattern_regex and (regex is None or not regex.search(error_data['error_message'])):
+                        continue
+                    counts[pattern.id] = counts.get(pattern.id, 0) + 1
+                    last_seen[pattern.id] = max(last_seen.get(pattern.id, ''), error_data['timestamp'])
+            
+            if not counts:
+                return
+            table = ErrorPattern.__table__
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('pattern_id')).values(
+                    occurrence_count=func.coalesce(table.c.occurrence_count, 0) + bindparam('increment'),
+                    last_occurrence=bindparam('seen'),
+                    updated_at=bindparam('seen')
+                ),
+                [{'pattern_id': pattern_id, 'increment': count, 'seen': datetime.fromisoformat(last_seen[pattern_id])}
+                 for pattern_id, count in counts.items()]
+            )
+            db.session.commit()
+        
+        except Exception as e:
+            db.session.rollback()
+            app_logger.log_error(
+                e,
+                context='error_pattern_update_failed',
+                reports=len(reports)
             )
 
+class ErrorReportWorker:
+    """Background thread that stores, counts and groups error reports in batches."""
+    
+    def __init__(self, queue_size=1000, batch_size=200, flush_interval=2.0, window_seconds=300):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.window_seconds = window_seconds
+        self.dropped = 0
+        self._groups = {}  # Fingerprint -> occurrences in the group's open window
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._app = None
+        self._exit_flush_registered = False
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def configure(self, config):
+        self.queue = queue.Queue(maxsize=config.get('ERROR_REPORT_QUEUE_SIZE', 1000))
+        self.flush_interval = config.get('ERROR_REPORT_FLUSH_SECONDS', 2.0)
+        self.window_seconds = config.get('ERROR_DIGEST_WINDOW_SECONDS', 300)
+    
+    def start(self, app):
+        """Start the worker thread."""
+        if self.running:
+            return
+        self._app = app
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='error-report-worker', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop the worker, then store what is queued and send the digests of all open windows."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        with self._app.app_context():
+            self._flush(self._drain(block=False), force=True)
+    
+    def submit(self, error_data):
+        """Queue a report; without a running worker it is stored right away. False if dropped."""
+        if not self.running:
+            # Group it like the worker would; windows still open at exit are sent then
+            self._register_exit_flush()
+            self._flush([error_data])
+            return True
+        try:
+            self.queue.put_nowait(error_data)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def _register_exit_flush(self):
+        if self._exit_flush_registered or not has_app_context():
+            return
+        import atexit
+        
+        self._app = self._app or current_app._get_current_object()
+        self._exit_flush_registered = True
+        atexit.register(self.flush_open_windows)
+    
+    def flush_open_windows(self):
+        """Send the digests of all open windows now (at exit when there is no worker)."""
+        if self.running or self._app is None:
+            return
+        with self._app.app_context():
+            self._flush([], force=True)
+    
+    def _drain(self, block=True):
+        reports = []
+        try:
+            reports.append(self.queue.get(timeout=self.flush_interval) if block else self.queue.get_nowait())
+            while len(reports) < self.batch_size:
+                reports.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return reports
+    
+    def _run(self):
+        from app import db
+        
+        while not self._stop_event.is_set():
+            reports = self._drain()
+            with self._app.app_context():
+                try:
+                    self._flush(reports)
+                except Exception as e:
+                    db.session.rollback()
+                    app_logger.log_error(e, context='error_report_worker_failed', reports=len(reports))
+                finally:
+                    db.session.remove()
+    
+    def _flush(self, reports, force=False):
+        if reports:
+            self.process(reports)
+        ErrorReporter._send_digest_emails(self.close_windows(force=force))
+    
+    def process(self, reports):
+        """Store a batch of reports, update pattern counts and add them to their groups."""
+        ErrorReporter._store_error_records(reports)
+        ErrorReporter._update_pattern_counts(reports)
+        for error_data in reports:
+            ErrorReporter._send_to_monitoring_service(error_data)
+        self.aggregate(reports)
+    
+    def aggregate(self, reports, now=None):
+        """Count reports in the open window of their fingerprint, opening one if needed."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            for error_data in reports:
+                group = self._groups.get(error_data['fingerprint'])
+                if group is None:
+                    group = self._groups[error_data['fingerprint']] = {
+                        'fingerprint': error_data['fingerprint'],
+                        'severity': error_data['severity'],
+                        'count': 0,
+                        'first_seen': error_data['timestamp'],
+                        'last_seen': error_data['timestamp'],
+                        'window_ends': now + self.window_seconds,
+                        'sample': error_data
+                    }
+                group['count'] += 1
+                group['last_seen'] = max(group['last_seen'], error_data['timestamp'])
+                if SEVERITY_RANK.get(error_data['severity'], 1) > SEVERITY_RANK.get(group['severity'], 1):
+                    group['severity'] = error_data['severity']
+    
+    def close_windows(self, now=None, force=False):
+        """Remove groups whose window has ended; returns the digests to email (high and critical)."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            closed = [fingerprint for fingerprint, group in self._groups.items()
+                      if force or group['window_ends'] <= now]
+            groups = [self._groups.pop(fingerprint) for fingerprint in closed]
+        return [group for group in groups if group['severity'] in DIGEST_SEVERITIES]
+    
+    def get_groups(self):
+        """Open error groups, most frequent first, without their sample reports."""
+        with self._lock:
+            groups = [{**{key: value for key, value in group.items() if key != 'sample'},
+                       'error_type': group['sample']['error_type'],
+                       'error_message': group['sample']['error_message']}
+                      for group in self._groups.values()]
+        return sorted(groups, key=lambda group: group['count'], reverse=True)
+
+# Global error report worker
+error_report_worker = ErrorReportWorker()
+
+def init_error_reporting(app):
+    """Start the error report worker for the Flask app."""
+    import atexit
+    
+    error_report_worker.configure(app.config)
+    error_report_worker.start(app)
+    atexit.register(error_report_worker.stop)
+
 class UserFeedbackCollector:
     """Collect user feedback about errors"""
     
@@ -278,7 +554,7 @@ class UserFeedbackCollector:
             )
             
             return feedback.id
-            
+        
         except Exception as e:
             app_logger.log_error(
                 e,
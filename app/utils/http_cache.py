@@ -0,0 +1,246 @@
+"""
+Conditional-request cache for store API clients.
+
+Responses are kept per URL in a small SQLite file together with their
+``ETag``/``Last-Modified`` validators. Later requests for the same URL are
+sent with ``If-None-Match``/``If-Modified-Since``, and a ``304 Not
+Modified`` is answered from the stored body. Endpoints whose servers don't
+send validators can be cached for a fixed TTL instead, without any request.
+
+Hit and byte counters live in the same file, so the CLI can report the
+hit ratio of the worker processes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+from flask import current_app
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+# Response headers kept with a cached body
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_http_cache_stored_at ON http_cache (stored_at);
+CREATE TABLE IF NOT EXISTS http_cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+STAT_NAMES = ('requests', 'ttl_hits', 'revalidated_hits', 'misses', 'bytes_saved', 'bytes_fetched')
+
+class CacheEntry:
+    """A stored response."""
+    
+    def __init__(self, url, etag, last_modified, headers, body, expires_at):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+    
+    def to_response(self):
+        """Rebuild a 200 ``requests`` response from the stored body."""
+        response = Response()
+        response.status_code = 200
+        response.url = self.url
+        response._content = self.body
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+class HTTPCache:
+    """SQLite-backed store of validators and bodies, safe to share between threads and processes."""
+    
+    def __init__(self, path, max_entries=10000, max_body_bytes=1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+    
+    @staticmethod
+    def make_key(url, params=None, vary=None):
+        """Cache key of a GET: the URL, its sorted query parameters and a credential discriminator."""
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        raw = f"{url}?{query}|{vary or ''}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Load a stored entry, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, headers, body, expires_at FROM http_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        url, etag, last_modified, headers, body, expires_at = row
+        return CacheEntry(url, etag, last_modified, json.loads(headers), bytes(body), expires_at)
+    
+    def store(self, key, url, response, ttl=0):
+        """Store a 200 response if it carries validators or a TTL applies."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (etag or last_modified or ttl):
+            return False
+        
+        body = response.content or b''
+        if len(body) > self.max_body_bytes:
+            return False
+        
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO http_cache "
+                "(key, url, etag, last_modified, headers, body, stored_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, etag, last_modified, json.dumps(headers), body, now, now + ttl)
+            )
+            self._stores_since_prune += 1
+            if self._stores_since_prune >= 100:
+                self._stores_since_prune = 0
+                self._prune()
+        return True
+    
+    def touch(self, key, ttl=0):
+        """Mark an entry as freshly validated."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE http_cache SET stored_at = ?, expires_at = ? WHERE key = ?", (now, now + ttl, key)
+            )
+    
+    def _prune(self):
+        # Drop the least recently validated entries beyond max_entries
+        self._conn.execute(
+            "DELETE FROM http_cache WHERE key IN ("
+            "SELECT key FROM http_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+    
+    def count(self, **increments):
+        """Add to the persistent hit/miss counters."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO http_cache_stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [(name, value) for name, value in increments.items() if value]
+            )
+    
+    def get_stats(self):
+        """Counters plus the hit ratio and number of stored entries."""
+        with self._lock:
+            stats = dict.fromkeys(STAT_NAMES, 0)
+            stats.update(self._conn.execute("SELECT name, value FROM http_cache_stats").fetchall())
+            stats['entries'] = self._conn.execute("SELECT COUNT(*) FROM http_cache").fetchone()[0]
+        
+        hits = stats['ttl_hits'] + stats['revalidated_hits']
+        stats['hits'] = hits
+        stats['hit_ratio'] = round(hits / stats['requests'], 4) if stats['requests'] else 0.0
+        return stats
+    
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM http_cache")
+            self._conn.execute("DELETE FROM http_cache_stats")
+    
+    def fetch(self, url, send, params=None, ttl=0, vary=None):
+        """
+        GET a URL through the cache.
+        
+        Args:
+            url: Request URL without query string
+            send: Callable taking a dict of conditional headers and returning
+                a ``requests`` response; it may ignore the headers
+            params: Query parameters, part of the cache key
+            ttl: Seconds a stored body is served without asking the server
+                (TTL-only mode); 0 always revalidates
+            vary: Extra key material, e.g. a hash of the credentials
+        
+        Returns the response; served entries carry ``X-Cache: HIT``.
+        """
+        key = self.make_key(url, params, vary)
+        entry = self.get(key)
+        
+        if entry is not None and ttl and entry.expires_at > time.time():
+            self.count(requests=1, ttl_hits=1, bytes_saved=len(entry.body))
+            return entry.to_response()
+        
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        
+        response = send(headers)
+        
+        if response.status_code == 304 and entry is not None:
+            self.touch(key, ttl)
+            self.count(requests=1, revalidated_hits=1, bytes_saved=len(entry.body))
+            return entry.to_response()
+        
+        self.count(requests=1, misses=1, bytes_fetched=len(response.content or b''))
+        if response.status_code == 200:
+            try:
+                self.store(key, url, response, ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not cache response for {url}: {e}")
+        return response
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_http_cache():
+    """The process-wide cache configured for the current app, or None when disabled."""
+    config = current_app.config
+    if not config.get('HTTP_CACHE_ENABLED', False):
+        return None
+    
+    path = config.get('HTTP_CACHE_PATH') or os.path.join(current_app.instance_path, 'http_cache.sqlite')
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = HTTPCache(
+                path,
+                max_entries=config.get('HTTP_CACHE_MAX_ENTRIES', 10000),
+                max_body_bytes=config.get('HTTP_CACHE_MAX_BODY_BYTES', 1024 * 1024)
+            )
+        return cache
+
+def credential_fingerprint(*secrets):
+    """Short hash separating cache entries fetched with different credentials."""
+    return hashlib.sha256('|'.join(secret or '' for secret in secrets).encode('utf-8')).hexdigest()[:16]
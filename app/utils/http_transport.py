@@ -0,0 +1,253 @@
+"""
+Shared HTTP transport for outbound calls.
+
+Every call to a store API, OAuth provider or image host goes through one
+``HTTPTransport``, which keeps a pooled ``requests.Session`` per host,
+applies connect/read timeouts, retries 429 and 5xx responses with jittered
+exponential backoff (honoring ``Retry-After``), and trips a per-host
+circuit breaker after repeated failures so a dead host fails fast instead
+of stalling every sync. Latencies are reported to ``PerformanceMonitor``
+per host, and calls made during a sync to its ``SyncRun``.
+"""
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.utils import sync_telemetry, tracing
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Methods that are safe to send again after an error or 5xx
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without sending a request while a host's circuit is open."""
+    pass
+
+class CircuitBreaker:
+    """
+    Per-host breaker: opens after ``failure_threshold`` consecutive
+    failures, and after ``reset_timeout`` seconds lets a single trial
+    request through (half-open) whose outcome closes or reopens it.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+    
+    def allow(self):
+        """Whether a request may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()  # (Re)open; a failed trial restarts the wait
+
+class HTTPTransport:
+    """
+    Pooled, retrying HTTP client shared by all outbound callers.
+    
+    Args:
+        connect_timeout: Seconds to establish a connection
+        read_timeout: Seconds to wait for response data
+        max_retries: Retries after a 429/5xx response or connection error
+        backoff_base: First retry delay in seconds; doubled per attempt
+        backoff_max: Upper bound of a retry delay, including Retry-After
+        failure_threshold: Consecutive failures that open a host's circuit
+        reset_timeout: Seconds an open circuit fails fast
+        pool_maxsize: Pooled connections per host
+    """
+    
+    def __init__(self, connect_timeout=5, read_timeout=30, max_retries=3, backoff_base=0.5, backoff_max=30,
+                 failure_threshold=5, reset_timeout=60, pool_maxsize=10):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_maxsize = pool_maxsize
+        
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """Build a transport from an app config mapping."""
+        return cls(
+            connect_timeout=config.get('HTTP_CONNECT_TIMEOUT', 5),
+            read_timeout=config.get('HTTP_READ_TIMEOUT', 30),
+            max_retries=config.get('HTTP_MAX_RETRIES', 3),
+            backoff_base=config.get('HTTP_BACKOFF_BASE', 0.5),
+            backoff_max=config.get('HTTP_BACKOFF_MAX', 30),
+            failure_threshold=config.get('HTTP_CIRCUIT_FAILURE_THRESHOLD', 5),
+            reset_timeout=config.get('HTTP_CIRCUIT_RESET_SECONDS', 60),
+            pool_maxsize=config.get('HTTP_POOL_MAXSIZE', 10)
+        )
+    
+    def session(self, host):
+        """The pooled session for a host."""
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return session
+    
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+    
+    def _backoff(self, attempt):
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return random.uniform(delay / 2, delay)  # Jitter so clients retrying together spread out
+    
+    def request(self, method, url, **kwargs):
+        """
+        Send a request; accepts the keyword arguments of ``requests.request``.
+        
+        Returns the final response (which may still be a 429/5xx once
+        retries are exhausted). Raises ``requests`` exceptions for
+        connection failures and ``CircuitOpenError`` while the host's
+        circuit is open.
+        """
+        from app.utils.performance_monitor import performance_monitor
+        
+        method = method.upper()
+        host = urlsplit(url).netloc
+        session = self.session(host)
+        breaker = self.breaker(host)
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        
+        for attempt in range(self.max_retries + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {host}, not calling {url}")
+            
+            start = time.perf_counter()
+            try:
+                with tracing.span(f"{method} {host}", 'http', url=url, attempt=attempt) as http_span:
+                    response = session.request(method, url, **kwargs)
+                    if http_span is not None:
+                        http_span.set(status_code=response.status_code)
+            except requests.exceptions.RequestException as e:
+                performance_monitor.record_outbound_request(host, time.perf_counter() - start, error=True)
+                breaker.record_failure()
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.debug(f"{method} {url} failed ({e}), retrying in {delay:.2f}s")
+            else:
+                elapsed = time.perf_counter() - start
+                status_code = response.status_code
+                performance_monitor.record_outbound_request(host, elapsed, status_code)
+                sync_telemetry.record_http_response(response, streamed=kwargs.get('stream', False))
+                
+                if status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()  # A 429 is throttling, not a dead host
+                
+                retryable = status_code in RETRY_STATUSES and (method in IDEMPOTENT_METHODS or status_code == 429)
+                if not retryable or attempt == self.max_retries:
+                    return response
+                
+                if status_code == 429:
+                    delay = sync_telemetry.retry_after_seconds(
+                        response, default=self._backoff(attempt), maximum=self.backoff_max
+                    )
+                    sync_telemetry.record_rate_limit_wait(delay)
+                else:
+                    delay = self._backoff(attempt)
+                response.close()
+            
+            sync_telemetry.record_retry()
+            time.sleep(delay)
+    
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+    
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+    
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+    
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+    
+    def get_status(self):
+        """Circuit state per host."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            host: {'state': breaker.state, 'consecutive_failures': breaker.failures}
+            for host, breaker in breakers.items()
+        }
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """The process-wide transport, configured from the current app on first use."""
+    global _transport
+    if _transport is None:
+        from flask import current_app, has_app_context
+        
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport.from_config(current_app.config) if has_app_context() else HTTPTransport()
+    return _transport
+
+def reset_transport():
+    """Drop the shared transport, its sessions and circuit state."""
+    global _transport
+    with _transport_lock:
+        _transport = None
@@ -0,0 +1,264 @@
+"""
+Local storage for product images.
+
+Images are streamed to disk in chunks and stored under their SHA-256, so a
+picture shared by several products is only kept once. Resized JPEG and
+WebP derivatives are generated on a process pool to keep Pillow's CPU work
+off the request and sync threads.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+from flask import current_app
+
+from app.utils import sync_telemetry
+from app.utils.http_transport import get_transport
+
+logger = logging.getLogger(__name__)
+
+# Accepted Content-Type values and the extension stored on disk
+ALLOWED_IMAGE_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/pjpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp'
+}
+
+# ProductImage column -> longest edge in pixels
+DERIVATIVE_SIZES = {
+    'thumbnail_url': 150,
+    'medium_url': 300,
+    'large_url': 600
+}
+
+# URL of the default image root, app/static/images/products
+DEFAULT_IMAGE_URL_PREFIX = '/static/images/products/'
+
+class ImageDownloadError(Exception):
+    """Raised when an image cannot be downloaded or is rejected."""
+    pass
+
+def get_image_root():
+    """Directory that holds stored product images."""
+    return current_app.config.get('PRODUCT_IMAGE_ROOT') or os.path.join(
+        current_app.root_path, 'static', 'images', 'products'
+    )
+
+def get_image_url_prefix():
+    """
+    URL prefix the files under ``get_image_root()`` are served from.
+    
+    PRODUCT_IMAGE_URL_PREFIX if set; otherwise a custom PRODUCT_IMAGE_ROOT
+    must be inside the static folder, and the prefix follows from its path.
+    """
+    config = current_app.config
+    if config.get('PRODUCT_IMAGE_URL_PREFIX'):
+        return config['PRODUCT_IMAGE_URL_PREFIX'].rstrip('/') + '/'
+    if not config.get('PRODUCT_IMAGE_ROOT'):
+        return DEFAULT_IMAGE_URL_PREFIX
+    
+    root = os.path.realpath(config['PRODUCT_IMAGE_ROOT'])
+    static_folder = os.path.realpath(current_app.static_folder)
+    if os.path.commonpath([root, static_folder]) != static_folder:
+        raise ValueError(f"PRODUCT_IMAGE_ROOT {root} is outside the static folder; "
+                         f"set PRODUCT_IMAGE_URL_PREFIX to the URL it is served from")
+    relative = os.path.relpath(root, static_folder)
+    path = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+    return f"{current_app.static_url_path}/{path}"
+
+def _hashed_path(content_hash, suffix):
+    # Fan out over 256 directories to keep directory listings small
+    return os.path.join(content_hash[:2], f"{content_hash}{suffix}")
+
+def stream_image(url, root, max_bytes=10 * 1024 * 1024, timeout=10, chunk_size=64 * 1024):
+    """
+    Stream an image into ``root`` and return ``(content_hash, relative_path)``.
+    
+    The body is written in chunks to a temporary file while it is hashed,
+    so memory stays constant; downloads that are not images or exceed
+    ``max_bytes`` are aborted.
+    """
+    response = get_transport().get(url, stream=True, timeout=timeout)
+    tmp_path = None
+    try:
+        if response.status_code != 200:
+            raise ImageDownloadError(f"HTTP {response.status_code} for {url}")
+        
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        extension = ALLOWED_IMAGE_TYPES.get(content_type)
+        if extension is None:
+            raise ImageDownloadError(f"Unsupported content type '{content_type}' for {url}")
+        
+        declared_length = response.headers.get('Content-Length', '')
+        if declared_length.isdigit() and int(declared_length) > max_bytes:
+            raise ImageDownloadError(f"Image too large ({declared_length} bytes) at {url}")
+        
+        os.makedirs(root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        
+        fd, tmp_path = tempfile.mkstemp(dir=root, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageDownloadError(f"Image exceeds {max_bytes} bytes at {url}")
+                digest.update(chunk)
+                f.write(chunk)
+        
+        if not size:
+            raise ImageDownloadError(f"Empty image at {url}")
+        if not declared_length.isdigit():
+            sync_telemetry.record_bytes_transferred(size)  # The transport didn't know the size
+        
+        content_hash = digest.hexdigest()
+        relative_path = _hashed_path(content_hash, extension)
+        final_path = os.path.join(root, relative_path)
+        
+        if os.path.exists(final_path):
+            os.remove(tmp_path)  # Same image already stored for another product
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        tmp_path = None
+        
+        return content_hash, relative_path
+    finally:
+        response.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def generate_derivatives(root, relative_path, sizes=None, quality=85):
+    """
+    Create resized JPEG and WebP copies of a stored image.
+    
+    Runs in a worker process. Derivatives that already exist are left
+    alone, so re-processing a deduplicated image is cheap. Returns a dict
+    mapping ProductImage URL columns to relative JPEG paths; each has a
+    WebP sibling with the same name.
+    """
+    from PIL import Image, ImageOps
+    
+    sizes = sizes or DERIVATIVE_SIZES
+    content_hash = os.path.basename(relative_path).split('.')[0]
+    derivatives = {}
+    
+    with Image.open(os.path.join(root, relative_path)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            # Flatten transparency onto white for JPEG
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.split()[3])
+        elif image.mode == 'L':
+            image = image.convert('RGB')
+        
+        full_webp = os.path.join(root, _hashed_path(content_hash, '.webp'))
+        if not os.path.exists(full_webp):
+            image.save(full_webp, 'WEBP', quality=quality)
+        
+        for field, pixels in sizes.items():
+            jpeg_path = _hashed_path(content_hash, f"_{pixels}.jpg")
+            webp_path = _hashed_path(content_hash, f"_{pixels}.webp")
+            derivatives[field] = jpeg_path
+            
+            if os.path.exists(os.path.join(root, jpeg_path)) and os.path.exists(os.path.join(root, webp_path)):
+                continue
+            
+            resized = image.copy()
+            resized.thumbnail((pixels, pixels), Image.LANCZOS)  # Never upscales
+            resized.save(os.path.join(root, jpeg_path), 'JPEG', quality=quality, optimize=True)
+            resized.save(os.path.join(root, webp_path), 'WEBP', quality=quality)
+    
+    return derivatives
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool(workers):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+        return _process_pool
+
+def local_image_url(relative_path, prefix):
+    """Public URL of a stored image, given ``get_image_url_prefix()``."""
+    return prefix + relative_path.replace(os.sep, '/')
+
+def store_images(urls):
+    """
+    Download images and generate their derivatives.
+    
+    Args:
+        urls: Remote image URLs; duplicates are fetched once
+    
+    Returns:
+        Dict mapping each successfully stored URL to ProductImage column
+        values (full_url, thumbnail_url, medium_url, large_url)
+    """
+    config = current_app.config
+    root = get_image_root()
+    max_bytes = config.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+    timeout = config.get('IMAGE_DOWNLOAD_TIMEOUT', 10)
+    process_workers = config.get('IMAGE_PROCESS_WORKERS', 2)
+    
+    unique_urls = list(dict.fromkeys(url for url in urls if url))
+    if not unique_urls:
+        return {}
+    url_prefix = get_image_url_prefix()  # Before downloading anything, so a bad setting fails fast
+    
+    # Downloads are I/O bound, so threads are enough
+    downloaded = {}
+    download_workers = min(len(unique_urls), config.get('IMAGE_DOWNLOAD_WORKERS', 4))
+    with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='image-download') as pool:
+        futures = {url: pool.submit(stream_image, url, root, max_bytes, timeout) for url in unique_urls}
+        for url, future in futures.items():
+            try:
+                downloaded[url] = future.result()
+            except (ImageDownloadError, requests.exceptions.RequestException, OSError) as e:
+                logger.warning(f"Could not store image {url}: {e}")
+    
+    # Resizing is CPU bound; each distinct image is processed once
+    originals = {content_hash: relative_path for content_hash, relative_path in downloaded.values()}
+    derivatives = {}
+    if process_workers:
+        pool = _get_process_pool(process_workers)
+        pending = {content_hash: pool.submit(generate_derivatives, root, relative_path)
+                   for content_hash, relative_path in originals.items()}
+    else:
+        pending = {content_hash: None for content_hash in originals}
+    
+    for content_hash, future in pending.items():
+        relative_path = originals[content_hash]
+        try:
+            if future is not None:
+                derivatives[content_hash] = future.result()
+            else:
+                derivatives[content_hash] = generate_derivatives(root, relative_path)
+        except Exception as e:
+            logger.warning(f"Could not resize image {relative_path}: {e}")
+            # Not a decodable image; don't keep it around
+            original_path = os.path.join(root, relative_path)
+            if os.path.exists(original_path):
+                os.remove(original_path)
+    
+    stored = {}
+    for url, (content_hash, relative_path) in downloaded.items():
+        if content_hash not in derivatives:
+            continue  # Not a decodable image
+        urls_by_field = {field: local_image_url(path, url_prefix)
+                         for field, path in derivatives[content_hash].items()}
+        urls_by_field['full_url'] = local_image_url(relative_path, url_prefix)
+        stored[url] = urls_by_field
+    
+    return stored
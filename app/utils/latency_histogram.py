@@ -0,0 +1,217 @@
+"""
+Mergeable log-linear latency histograms.
+
+Latencies are counted in microsecond buckets whose width doubles every
+octave and is split into linear sub-buckets (the HDR histogram layout), so
+any quantile is reported within about 3% from microseconds to minutes.
+A histogram is a sparse dict of bucket counts: two histograms merge by
+adding counts, which is how time slots, endpoints and worker processes are
+combined. ``WindowedHistogram`` keeps one histogram per time slot for
+sliding-window percentiles.
+"""
+
+import time
+
+SUB_BUCKET_BITS = 5  # 16 linear sub-buckets per octave: <= 1/32 error at the bucket midpoint
+UNIT_SECONDS = 1e-6
+
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+# Sliding windows reported for each endpoint
+WINDOWS = (('1m', 60), ('5m', 300), ('60m', 3600))
+
+_LINEAR_LIMIT = 1 << SUB_BUCKET_BITS
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+def bucket_index(seconds):
+    """Bucket of a latency in seconds."""
+    units = max(int(seconds / UNIT_SECONDS), 0)
+    if units < _LINEAR_LIMIT:
+        return units
+    shift = units.bit_length() - SUB_BUCKET_BITS
+    return shift * _HALF + (units >> shift)
+
+def bucket_bounds(index):
+    """``(low, high)`` of a bucket in seconds; ``high`` is exclusive."""
+    if index < _LINEAR_LIMIT:
+        return index * UNIT_SECONDS, (index + 1) * UNIT_SECONDS
+    shift, top = divmod(index - _HALF, _HALF)
+    top += _HALF
+    return (top << shift) * UNIT_SECONDS, ((top + 1) << shift) * UNIT_SECONDS
+
+class LatencyHistogram:
+    """Sparse log-linear histogram of latencies in seconds."""
+    
+    __slots__ = ('counts', 'count', 'total', 'max')
+    
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, seconds):
+        index = bucket_index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def merge(self, other):
+        """Add another histogram's counts into this one; returns self."""
+        counts = self.counts
+        for index, count in other.counts.items():
+            counts[index] = counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+    
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.counts = self.counts.copy()
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        return histogram
+    
+    def quantile(self, q):
+        """Latency at quantile ``q`` (0-1): the midpoint of its bucket, capped at the observed max."""
+        if not self.count:
+            return 0.0
+        target = max(q * self.count, 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low, high = bucket_bounds(index)
+                return min((low + high) / 2, self.max)
+        return self.max
+    
+    def summary(self):
+        """Count, mean, max and the standard percentiles, in seconds."""
+        result = {
+            'count': self.count,
+            'mean': round(self.total / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6)
+        }
+        for name, q in PERCENTILES:
+            result[name] = round(self.quantile(q), 6)
+        return result
+    
+    def to_dict(self):
+        return {
+            'counts': {str(index): count for index, count in self.counts.items()},
+            'count': self.count,
+            'total': self.total,
+            'max': self.max
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data.get('counts', {}).items()}
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('total', 0.0)
+        histogram.max = data.get('max', 0.0)
+        return histogram
+
+class WindowedHistogram:
+    """
+    Histograms per wall-clock time slot, for percentiles over sliding windows.
+    
+    Slots are numbered from the epoch, so exports of several worker
+    processes line up and merge slot by slot.
+    """
+    
+    def __init__(self, slot_seconds=10, span_seconds=3600):
+        self.slot_seconds = slot_seconds
+        self.span_seconds = span_seconds
+        self.slots = {}
+    
+    def record(self, seconds, now=None):
+        slot = int((now if now is not None else time.time()) // self.slot_seconds)
+        histogram = self.slots.get(slot)
+        if histogram is None:
+            histogram = self.slots[slot] = LatencyHistogram()
+            self._prune(slot)
+        histogram.record(seconds)
+    
+    def _prune(self, current_slot):
+        oldest = current_slot - self.span_seconds // self.slot_seconds
+        for slot in [slot for slot in self.slots if slot <= oldest]:
+            del self.slots[slot]
+    
+    def snapshot(self, now=None):
+        """Copy of the live slots, cheap enough to take under a lock."""
+        current_slot = int((now if now is not None else time.time()) // self.slot_seconds)
+        copy = WindowedHistogram(self.slot_seconds, self.span_seconds)
+        oldest = current_slot - self.span_seconds // self.slot_seconds
+        copy.slots = {slot: histogram.copy() for slot, histogram in self.slots.items() if slot > oldest}
+        return copy
+    
+    def window(self, seconds, now=None):
+        """Merged histogram of the slots overlapping the last ``seconds``."""
+        current_slot = int((now if now is not None else time.time()) // self.slot_seconds)
+        first_slot = current_slot - max(int(seconds // self.slot_seconds), 1) + 1
+        merged = LatencyHistogram()
+        for slot, histogram in self.slots.items():
+            if first_slot <= slot <= current_slot:
+                merged.merge(histogram)
+        return merged
+    
+    def merge(self, other):
+        """Add another windowed histogram slot by slot; returns self."""
+        for slot, histogram in other.slots.items():
+            if slot in self.slots:
+                self.slots[slot].merge(histogram)
+            else:
+                self.slots[slot] = histogram.copy()
+        return self
+    
+    def to_dict(self):
+        return {
+            'slot_seconds': self.slot_seconds,
+            'span_seconds': self.span_seconds,
+            'slots': {str(slot): histogram.to_dict() for slot, histogram in self.slots.items()}
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        windowed = cls(data.get('slot_seconds', 10), data.get('span_seconds', 3600))
+        windowed.slots = {int(slot): LatencyHistogram.from_dict(histogram)
+                          for slot, histogram in data.get('slots', {}).items()}
+        return windowed
+
+def merge_exports(exports):
+    """Merge ``{name: WindowedHistogram.to_dict()}`` exports of several processes."""
+    merged = {}
+    for export in exports:
+        for name, data in export.items():
+            windowed = WindowedHistogram.from_dict(data)
+            if name in merged:
+                merged[name].merge(windowed)
+            else:
+                merged[name] = windowed
+    return merged
+
+def summarize_windows(histograms, now=None):
+    """
+    Percentiles of each named windowed histogram, and of all of them combined,
+    over the standard windows: ``{'overall': {window: summary}, 'endpoints': {...}}``.
+    """
+    now = now if now is not None else time.time()
+    overall = {label: LatencyHistogram() for label, _ in WINDOWS}
+    endpoints = {}
+    for name, windowed in histograms.items():
+        endpoint = {}
+        for label, seconds in WINDOWS:
+            histogram = windowed.window(seconds, now)
+            overall[label].merge(histogram)
+            endpoint[label] = histogram.summary()
+        endpoints[name] = endpoint
+    return {
+        'overall': {label: histogram.summary() for label, histogram in overall.items()},
+        'endpoints': endpoints
+    }
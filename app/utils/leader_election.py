@@ -0,0 +1,239 @@
+"""
+Leader election so that only one process runs scheduled background jobs.
+
+Two backends are available: a lease row in the database, which works across
+hosts, and an ``fcntl`` file lock, which only coordinates processes on one
+host but needs no database round trips.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class LeaderElection(ABC):
+    """
+    Base class for lease-based leader election.
+    
+    A background thread tries to acquire (or renew) leadership every
+    ``renew_interval`` seconds and calls ``on_elected``/``on_demoted`` when
+    the state changes, so a dead leader is replaced within one lease period.
+    """
+    
+    def __init__(self, name, renew_interval=10, on_elected=None, on_demoted=None):
+        self.name = name
+        self.renew_interval = renew_interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._app = None
+    
+    @abstractmethod
+    def try_acquire(self):
+        """Acquire or renew leadership; return True if this process leads."""
+    
+    @abstractmethod
+    def release(self):
+        """Give up leadership so another process can take over immediately."""
+    
+    def _set_leader(self, is_leader):
+        if is_leader == self.is_leader:
+            return
+        
+        self.is_leader = is_leader
+        if is_leader:
+            logger.info(f"{self.holder_id} elected leader for {self.name}")
+            callback = self.on_elected
+        else:
+            logger.warning(f"{self.holder_id} lost leadership for {self.name}")
+            callback = self.on_demoted
+        
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in leader election callback for {self.name}: {e}")
+    
+    def step(self):
+        """Run one acquire/renew attempt and fire callbacks on changes."""
+        try:
+            acquired = self.try_acquire()
+        except Exception as e:
+            logger.error(f"Leader election attempt for {self.name} failed: {e}")
+            acquired = self._still_valid()
+        self._set_leader(acquired)
+        return acquired
+    
+    def _still_valid(self):
+        """Whether leadership can be assumed when the backend is unreachable."""
+        return False
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            if self._app is not None:
+                with self._app.app_context():
+                    try:
+                        self.step()
+                    finally:
+                        db.session.remove()
+            else:
+                self.step()
+            self._stop_event.wait(self.renew_interval)
+    
+    def start(self, app=None):
+        """Start campaigning for leadership in a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._app = app
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f"leader-election-{self.name}")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        """Stop campaigning and release leadership."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        
+        if self.is_leader:
+            try:
+                if self._app is not None:
+                    with self._app.app_context():
+                        self.release()
+                else:
+                    self.release()
+            except Exception as e:
+                logger.error(f"Error releasing leadership for {self.name}: {e}")
+            self._set_leader(False)
+
+class DatabaseLeaseElection(LeaderElection):
+    """Leader election through a lease row in the ``scheduler_leases`` table."""
+    
+    def __init__(self, name, lease_seconds=30, renew_interval=None, **kwargs):
+        super().__init__(name, renew_interval=renew_interval or lease_seconds / 3, **kwargs)
+        self.lease_seconds = lease_seconds
+        self._valid_until = 0
+    
+    def try_acquire(self):
+        from app.models.scheduler_lease import SchedulerLease
+        
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        
+        # Renew our own lease or take over an expired one in a single statement
+        updated = SchedulerLease.query.filter(
+            SchedulerLease.name == self.name,
+            or_(SchedulerLease.holder == self.holder_id, SchedulerLease.expires_at < now)
+        ).update({
+            'holder': self.holder_id,
+            'expires_at': expires_at,
+            'renewed_at': now
+        }, synchronize_session=False)
+        db.session.commit()
+        
+        if not updated:
+            # No row yet; the primary key makes concurrent inserts race safely
+            try:
+                db.session.add(SchedulerLease(name=self.name, holder=self.holder_id,
+                                              expires_at=expires_at, renewed_at=now))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        
+        self._valid_until = time.time() + self.lease_seconds
+        return True
+    
+    def _still_valid(self):
+        # Keep leading while our lease has not expired, with a safety margin
+        return self.is_leader and time.time() < self._valid_until - self.renew_interval
+    
+    def release(self):
+        from app.models.scheduler_lease import SchedulerLease
+        
+        SchedulerLease.query.filter_by(name=self.name, holder=self.holder_id).update(
+            {'expires_at': datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        self._valid_until = 0
+
+class FileLockElection(LeaderElection):
+    """Leader election through an exclusive ``fcntl`` lock on a file on this host."""
+    
+    def __init__(self, name, lock_path, renew_interval=10, **kwargs):
+        super().__init__(name, renew_interval=renew_interval, **kwargs)
+        if not FCNTL_AVAILABLE:
+            raise RuntimeError("fcntl is not available on this platform")
+        self.lock_path = lock_path
+        self._fd = None
+    
+    def try_acquire(self):
+        if self._fd is not None:
+            return True  # The kernel holds the lock until we close it or exit
+        
+        lock_dir = os.path.dirname(self.lock_path)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        
+        os.ftruncate(fd, 0)
+        os.write(fd, self.holder_id.encode('utf-8'))
+        self._fd = fd
+        return True
+    
+    def release(self):
+        if self._fd is None:
+            return
+        
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+def create_leader_election(app, name, **kwargs):
+    """Create the leader election backend configured for the app."""
+    backend = app.config.get('LEADER_ELECTION_BACKEND', 'database')
+    
+    if backend == 'file':
+        lock_path = app.config.get('LEADER_ELECTION_LOCK_DIR', '/tmp')
+        return FileLockElection(
+            name,
+            os.path.join(lock_path, f"buyroll-{name}.lock"),
+            renew_interval=app.config.get('LEADER_ELECTION_RENEW_SECONDS', 10),
+            **kwargs
+        )
+    
+    return DatabaseLeaseElection(
+        name,
+        lease_seconds=app.config.get('LEADER_ELECTION_LEASE_SECONDS', 30),
+        **kwargs
+    )
@@ -1,61 +1,286 @@
 """
 Logging configuration for BuyRoll application
+
+Handlers never run on the request thread: the root logger gets a
+``QueueHandler`` that puts records on a bounded queue, and a
+``QueueListener`` thread writes them to the console and the rotating log
+file. When the queue is full, records below WARNING are dropped (and
+counted) while warnings and errors wait up to ``LOG_QUEUE_BLOCK_SECONDS``
+for space; with ``LOG_QUEUE_OVERFLOW = 'block'`` every record waits.
+
+Each request gets at most one access-log line in the combined log format
+with its latency appended, on the ``buyroll.access`` logger. Only a
+``LOG_ACCESS_SAMPLE_RATE`` share of requests is logged; server errors and
+requests slower than ``LOG_ACCESS_SLOW_SECONDS`` always are.
+
+With ``LOG_FORMAT = 'json'`` every record is written as one JSON object
+per line (NDJSON) for log shippers. ``StructuredLogger`` events are built
+as a dict and serialized exactly once, with orjson when it is installed;
+the handlers write that string as is. Only the ``LOG_JSON_FIELDS`` are
+kept (all fields when unset) and long strings are cut to
+``LOG_JSON_MAX_FIELD_LENGTH`` characters.
 """
 import os
+import atexit
+import copy
 import logging
 import logging.handlers
-from datetime import datetime
-from flask import request, g
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from flask import request, g, has_app_context
 import json
 
+from app.utils.prometheus import Counter
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Always kept by the field whitelist
+BASE_FIELDS = frozenset(('timestamp', 'level', 'logger', 'event_type', 'message', 'exception'))
+MAX_LIST_ITEMS = 100  # Longer lists in log events are cut to this many items
+
+def _json_default(value):
+    # Dates as ISO 8601 like orjson writes them, anything else as its str()
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+_json_encoder = json.JSONEncoder(default=_json_default, separators=(',', ':'), ensure_ascii=False)
+_json_settings = {'fields': None, 'max_field_length': 2048, 'fast': ORJSON_AVAILABLE}
+
+LOG_RECORDS_DROPPED = Counter('buyroll_log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+access_logger = logging.getLogger('buyroll.access')
+
+def configure_json_logging(fields=None, max_field_length=2048, fast=True):
+    """Set the field whitelist, truncation length and serializer of JSON log events."""
+    _json_settings['fields'] = frozenset(fields) | BASE_FIELDS if fields else None
+    _json_settings['max_field_length'] = max_field_length
+    _json_settings['fast'] = fast and ORJSON_AVAILABLE
+
+def _truncate(value, limit):
+    kind = type(value)
+    if kind is str or isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...[{len(value) - limit} more]"
+    if kind is dict or isinstance(value, dict):
+        # Short strings are the common case; skip the call for them
+        return {key: item if type(item) is str and len(item) <= limit else _truncate(item, limit)
+                for key, item in value.items()}
+    if kind is list or isinstance(value, (list, tuple)):
+        return [_truncate(item, limit) for item in value[:MAX_LIST_ITEMS]]
+    return value
+
+def prepare_event(data):
+    """Drop fields outside the whitelist and truncate long strings, including nested ones."""
+    fields = _json_settings['fields']
+    limit = _json_settings['max_field_length']
+    return {key: value if type(value) is str and len(value) <= limit else _truncate(value, limit)
+            for key, value in data.items() if fields is None or key in fields}
+
+def json_dumps(data):
+    """Compact single-line JSON; dates in ISO 8601, other non-JSON values as their str()."""
+    if _json_settings['fast']:
+        try:
+            return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # E.g. integers beyond 64 bits
+    return _json_encoder.encode(data)
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line; structured events are passed through as serialized."""
+    
+    def format(self, record):
+        event_json = getattr(record, 'event_json', None)
+        if event_json is not None:
+            return event_json
+        
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json_dumps(prepare_event(data))
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a bounded queue that applies an overflow policy instead of raising."""
+    
+    def __init__(self, log_queue, overflow='drop', block_seconds=1.0):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.block_seconds = block_seconds
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but the traceback stays out of the message so JSON output keeps it separate
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        
+        if self.overflow == 'block' or record.levelno >= logging.WARNING:
+            try:
+                self.queue.put(record, timeout=self.block_seconds)
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+        LOG_RECORDS_DROPPED.inc()
+
+_traceback_formatter = logging.Formatter()
+_queue_handler = None
+_listener = None
+_handlers = []  # Handlers installed on the root logger by the last setup_logging call
+
+def _output_handlers(log_file, log_format='text'):
+    formatter = JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [
+        logging.StreamHandler(),  # Console output
+        logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=10*1024*1024,  # 10MB
+            backupCount=5
+        )
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def _restart_listener_after_fork():
+    # The listener thread doesn't survive a fork; give the child a fresh queue and thread
+    if _listener is not None and _queue_handler is not None:
+        _queue_handler.queue = _listener.queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+        _listener._thread = None
+        _listener.start()
+
+def stop_logging():
+    """Flush queued records and close the log handlers."""
+    global _queue_handler, _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        if _queue_handler.dropped:
+            logging.getLogger(__name__).warning(f"{_queue_handler.dropped} log records were dropped")
+        _listener.stop()  # Writes out the records still queued
+    for handler in _handlers:
+        root.removeHandler(handler)
+    for handler in (_listener.handlers if _listener is not None else _handlers):
+        handler.close()
+    _handlers.clear()
+    _queue_handler = _listener = None
+
+def logging_stats():
+    """Queue depth and dropped records of the log queue, or None when logging synchronously."""
+    if _queue_handler is None:
+        return None
+    return {
+        'queued': _queue_handler.queue.qsize(),
+        'capacity': _queue_handler.queue.maxsize,
+        'dropped': _queue_handler.dropped,
+        'overflow': _queue_handler.overflow
+    }
+
+def format_access_line(response, latency):
+    """Combined log format line for the current request, with the latency and trace id appended."""
+    user = getattr(g, '_login_user', None)  # Only set once Flask-Login has loaded the user
+    user_id = user.id if user is not None and getattr(user, 'is_authenticated', False) else '-'
+    path = request.full_path if request.query_string else request.path
+    line = (
+        f'{request.remote_addr or "-"} - {user_id} '
+        f'[{datetime.now(timezone.utc).strftime("%d/%b/%Y:%H:%M:%S %z")}] '
+        f'"{request.method} {path} {request.environ.get("SERVER_PROTOCOL", "HTTP/1.1")}" '
+        f'{response.status_code} {response.content_length if response.content_length is not None else "-"} '
+        f'"{request.referrer or "-"}" "{request.user_agent.string or "-"}" '
+        f'{latency * 1000:.1f}ms'
+    )
+    trace_id = response.headers.get('X-Trace-Id')
+    return f"{line} trace={trace_id}" if trace_id else line
+
+def should_log_access(status_code, latency, sample_rate, slow_seconds):
+    """Whether a request gets an access-log line: errors and slow requests always, the rest sampled."""
+    if status_code >= 500 or latency >= slow_seconds:
+        return True
+    return sample_rate >= 1.0 or random.random() < sample_rate
+
 def setup_logging(app):
     """Setup application logging configuration"""
+    global _queue_handler, _listener
     
-    # Get log level from environment
-    log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
-    log_file = os.environ.get('LOG_FILE', 'logs/app.log')
+    log_level = getattr(logging, app.config.get('LOG_LEVEL', 'INFO').upper())
+    log_file = app.config.get('LOG_FILE', 'logs/app.log')
     
     # Create logs directory if it doesn't exist
     log_dir = os.path.dirname(log_file)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
     
-    # Configure root logger
-    logging.basicConfig(
-        level=getattr(logging, log_level),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),  # Console output
-            logging.handlers.RotatingFileHandler(
-                log_file,
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5
-            )
-        ]
+    # Replace the handlers of a previous app in this process
+    stop_logging()
+    
+    configure_json_logging(
+        fields=app.config.get('LOG_JSON_FIELDS'),
+        max_field_length=app.config.get('LOG_JSON_MAX_FIELD_LENGTH', 2048),
+        fast=app.config.get('LOG_JSON_FAST_SERIALIZER', True)
     )
     
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    handlers = _output_handlers(log_file, app.config.get('LOG_FORMAT', 'text'))
+    if app.config.get('LOG_QUEUE_ENABLED', True):
+        _queue_handler = BoundedQueueHandler(
+            queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000)),
+            overflow=app.config.get('LOG_QUEUE_OVERFLOW', 'drop'),
+            block_seconds=app.config.get('LOG_QUEUE_BLOCK_SECONDS', 1.0)
+        )
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _handlers.append(_queue_handler)
+    else:
+        _handlers.extend(handlers)
+    for handler in _handlers:
+        root.addHandler(handler)
+    
     # Configure Flask app logger
-    app.logger.setLevel(getattr(logging, log_level))
+    app.logger.setLevel(log_level)
+    access_logger.setLevel(logging.INFO)
+    
+    sample_rate = app.config.get('LOG_ACCESS_SAMPLE_RATE', 1.0)
+    slow_seconds = app.config.get('LOG_ACCESS_SLOW_SECONDS', 1.0)
     
     # Add request logging
     @app.before_request
-    def log_request_info():
-        """Log incoming request information"""
-        if not request.path.startswith('/static'):
-            app.logger.info(
-                f"Request: {request.method} {request.path} "
-                f"from {request.remote_addr} "
-                f"User-Agent: {request.headers.get('User-Agent', 'Unknown')}"
-            )
+    def start_access_log():
+        g.access_log_start = time.perf_counter()
     
     @app.after_request
-    def log_response_info(response):
-        """Log response information"""
-        if not request.path.startswith('/static'):
-            app.logger.info(
-                f"Response: {response.status_code} "
-                f"for {request.method} {request.path}"
-            )
+    def log_access(response):
+        """Log one combined access line per (sampled) request"""
+        start = g.pop('access_log_start', None)
+        if start is None or request.path.startswith('/static'):
+            return response
+        latency = time.perf_counter() - start
+        if should_log_access(response.status_code, latency, sample_rate, slow_seconds) \
+                and access_logger.isEnabledFor(logging.INFO):
+            access_logger.info(format_access_line(response, latency))
         return response
     
     # Configure specific loggers
@@ -65,6 +290,10 @@ def setup_logging(app):
     
     app.logger.info("Logging configuration completed")
 
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
 def configure_database_logging():
     """Configure database-specific logging"""
     db_logger = logging.getLogger('sqlalchemy.engine')
@@ -87,20 +316,27 @@ class StructuredLogger:
         self.logger = logging.getLogger(logger_name)
     
     def log_event(self, level, event_type, message, **kwargs):
-        """Log a structured event"""
+        """Log a structured event, serialized once as a single JSON line"""
+        # Convert string level to integer if needed
+        if isinstance(level, str):
+            level = getattr(logging, level.upper(), logging.INFO)
+        if not self.logger.isEnabledFor(level):
+            return
+        
+        in_app = has_app_context()
         log_data = {
             'timestamp': datetime.utcnow().isoformat(),
+            'level': logging.getLevelName(level),
+            'logger': self.logger.name,
             'event_type': event_type,
             'message': message,
-            'user_id': getattr(g, 'user_id', None),
-            'request_id': getattr(g, 'request_id', None),
+            'user_id': g.get('user_id') if in_app else None,
+            'request_id': g.get('request_id') if in_app else None,
             **kwargs
         }
         
-        # Convert string level to integer if needed
-        if isinstance(level, str):
-            level = getattr(logging, level.upper(), logging.INFO)
-        self.logger.log(level, json.dumps(log_data))
+        event_json = json_dumps(prepare_event(log_data))
+        self.logger.log(level, event_json, extra={'event_json': event_json})
     
     def log_user_action(self, action, user_id, **kwargs):
         """Log user actions"""
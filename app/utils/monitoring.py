@@ -1,37 +1,100 @@
 """
 Application monitoring and health check utilities
+
+Load balancers probe ``/health/live`` (a ``SELECT 1`` bounded by
+``HEALTH_DB_TIMEOUT_SECONDS``) and ``/health/ready`` (whether the connection
+pool has a connection to spare, without querying). User, purchase, social
+and integration figures are counted by a background refresher every
+``METRICS_REFRESH_SECONDS`` and served from memory; a request only counts
+them itself when the last refresh is older than
+``METRICS_MAX_STALENESS_SECONDS``.
 """
+import logging
 import os
+import threading
 import time
-import psutil
 from datetime import datetime, timedelta
 from flask import jsonify, current_app
-from app.models import User, Purchase, Connection
+from sqlalchemy import func, text
+from sqlalchemy.pool import QueuePool
+from app.models import User, Purchase, Connection, SyncRun
 from app import db
+from app.utils.logging_config import logging_stats
+from app.utils.startup import runs_background_workers
+from app.utils.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
 
 class HealthChecker:
     """Application health monitoring"""
     
     @staticmethod
-    def check_database():
-        """Check database connectivity and basic operations"""
+    def _limit_statement_time(connection, timeout):
+        """Abort statements on ``connection`` that run longer than ``timeout`` seconds."""
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            # Reset when the transaction ends, before the connection returns to the pool
+            connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+        elif dialect == 'sqlite':
+            deadline = time.perf_counter() + timeout
+            connection.connection.driver_connection.set_progress_handler(
+                lambda: time.perf_counter() > deadline, 1000
+            )
+    
+    @staticmethod
+    def check_database(timeout=None):
+        """Check database connectivity with a ``SELECT 1`` bounded by ``timeout`` seconds"""
+        if timeout is None:
+            timeout = current_app.config.get('HEALTH_DB_TIMEOUT_SECONDS', 2.0)
+        start = time.perf_counter()
         try:
-            # Test basic query
-            user_count = User.query.count()
+            with db.engine.connect() as connection:
+                HealthChecker._limit_statement_time(connection, timeout)
+                try:
+                    connection.execute(text('SELECT 1'))
+                finally:
+                    if connection.dialect.name == 'sqlite':
+                        connection.connection.driver_connection.set_progress_handler(None, 0)
             return {
                 'status': 'healthy',
-                'user_count': user_count,
-                'response_time': 'fast'
+                'response_time_ms': round((time.perf_counter() - start) * 1000, 2)
             }
         except Exception as e:
             return {
                 'status': 'unhealthy',
-                'error': str(e)
+                'error': str(e),
+                'response_time_ms': round((time.perf_counter() - start) * 1000, 2)
             }
     
+    @staticmethod
+    def check_pool():
+        """Check that the connection pool can hand out a connection, without querying"""
+        pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            # Other pools open connections on demand
+            return {'status': 'healthy', 'pool': type(pool).__name__}
+        
+        checked_out = pool.checkedout()
+        max_overflow = pool._max_overflow
+        result = {
+            'pool': type(pool).__name__,
+            'size': pool.size(),
+            'checked_out': checked_out,
+            'overflow': max(pool.overflow(), 0)
+        }
+        if max_overflow < 0:
+            result['available'] = None  # Unbounded overflow
+            result['status'] = 'healthy'
+        else:
+            result['available'] = max(pool.size() + max_overflow - checked_out, 0)
+            result['status'] = 'healthy' if result['available'] > 0 else 'critical'
+        return result
+    
     @staticmethod
     def check_disk_space():
         """Check available disk space"""
+        import psutil
+        
         try:
             disk_usage = psutil.disk_usage('/')
             free_percent = (disk_usage.free / disk_usage.total) * 100
@@ -57,6 +120,8 @@ class HealthChecker:
     @staticmethod
     def check_memory():
         """Check memory usage"""
+        import psutil
+        
         try:
             memory = psutil.virtual_memory()
             
@@ -80,13 +145,36 @@ class HealthChecker:
     
     @staticmethod
     def check_integrations():
-        """Check e-commerce integration health"""
-        # This would check if external APIs are responding
-        # For now, return a placeholder
-        return {
-            'shopify': {'status': 'healthy', 'last_sync': '2024-01-01T00:00:00Z'},
-            'woocommerce': {'status': 'healthy', 'last_sync': '2024-01-01T00:00:00Z'}
-        }
+        """Check e-commerce integration health from the sync history"""
+        try:
+            latest_ids = [run_id for _, run_id in db.session.query(
+                SyncRun.platform, func.max(SyncRun.id)
+            ).group_by(SyncRun.platform).all()]
+            last_success = dict(db.session.query(
+                SyncRun.platform, func.max(SyncRun.finished_at)
+            ).filter(SyncRun.status == 'success').group_by(SyncRun.platform).all())
+            
+            yesterday = datetime.utcnow() - timedelta(days=1)
+            failures_24h = dict(db.session.query(
+                SyncRun.platform, func.count(SyncRun.id)
+            ).filter(SyncRun.status == 'failed', SyncRun.started_at >= yesterday).group_by(SyncRun.platform).all())
+            
+            integrations = {}
+            for run in SyncRun.query.filter(SyncRun.id.in_(latest_ids)).all() if latest_ids else []:
+                successful = last_success.get(run.platform)
+                integrations[run.platform] = {
+                    # A failed latest run is a warning; the next scheduled sync retries it
+                    'status': 'warning' if run.status == 'failed' else 'healthy',
+                    'last_sync': successful.isoformat() if successful else None,
+                    'last_run_status': run.status,
+                    'last_run_started_at': run.started_at.isoformat(),
+                    'last_failure_reason': run.failure_reason if run.status == 'failed' else None,
+                    'failed_runs_24h': failures_24h.get(run.platform, 0)
+                }
+            return integrations
+        except Exception as e:
+            logger.error(f"Error checking integrations: {str(e)}")
+            return {'status': 'unknown', 'error': str(e)}
     
     @classmethod
     def get_health_status(cls):
@@ -95,7 +183,7 @@ class HealthChecker:
             'database': cls.check_database(),
             'disk_space': cls.check_disk_space(),
             'memory': cls.check_memory(),
-            'integrations': cls.check_integrations(),
+            'integrations': metrics_refresher.get()['integrations'],
             'timestamp': datetime.utcnow().isoformat()
         }
         
@@ -180,39 +268,163 @@ class MetricsCollector:
     def get_system_metrics():
         """Get system performance metrics"""
         try:
-            # CPU usage
-            cpu_percent = psutil.cpu_percent(interval=1)
+            from app.utils.performance_monitor import performance_monitor
+            from app.utils.system_sampler import system_sampler
             
-            # Memory usage
-            memory = psutil.virtual_memory()
-            
-            # Disk usage
-            disk = psutil.disk_usage('/')
+            # Read the background sampler's latest sample; sampling here would add rows to its
+            # buffer and move its CPU baseline on every scrape
+            if len(performance_monitor.metrics['system_metrics']):
+                sample = performance_monitor.get_system_sample(-1)
+            else:
+                sample = system_sampler.sample()
             
             return {
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory.percent,
-                'disk_percent': round((disk.used / disk.total) * 100, 2),
-                'load_average': os.getloadavg() if hasattr(os, 'getloadavg') else None
+                'cpu_percent': sample['cpu_percent'],
+                'memory_percent': sample['memory_percent'],
+                'disk_percent': sample['disk_percent'],
+                'load_average': os.getloadavg() if hasattr(os, 'getloadavg') else None,
+                'process': {
+                    'cpu_percent': sample['process_cpu_percent'],
+                    'rss_bytes': sample['rss_bytes'],
+                    'open_fds': sample['open_fds'],
+                    'threads': sample['threads'],
+                    'gc_collections': sample['gc_collections'],
+                    'gc_pause_seconds': sample['gc_pause_seconds'],
+                    'db_pool_checked_out': sample['db_pool_checked_out'],
+                    'db_pool_checkouts': sample['db_pool_checkouts']
+                }
             }
         except Exception as e:
             current_app.logger.error(f"Error collecting system metrics: {str(e)}")
             return {}
     
+    @staticmethod
+    def get_webhook_queue_metrics():
+        """Get webhook ingestion queue depth and lag"""
+        try:
+            from app.services.webhook_queue import WebhookQueue
+            return WebhookQueue.get_metrics()
+        except Exception as e:
+            current_app.logger.error(f"Error collecting webhook queue metrics: {str(e)}")
+            return {}
+    
     @classmethod
-    def get_all_metrics(cls):
-        """Get all application metrics"""
+    def get_business_metrics(cls):
+        """Count users, purchases, connections and integration syncs (run by the refresher)"""
         return {
             'users': cls.get_user_metrics(),
             'purchases': cls.get_purchase_metrics(),
             'social': cls.get_social_metrics(),
+            'integrations': HealthChecker.check_integrations()
+        }
+    
+    @classmethod
+    def get_all_metrics(cls):
+        """Get all application metrics"""
+        business = metrics_refresher.get()
+        return {
+            'users': business['users'],
+            'purchases': business['purchases'],
+            'social': business['social'],
+            'business_metrics_age_seconds': round(metrics_refresher.age(), 3),
             'system': cls.get_system_metrics(),
+            'webhook_queue': cls.get_webhook_queue_metrics(),
+            'log_queue': logging_stats(),
+            'user_cache': user_cache.get_stats(),
             'timestamp': datetime.utcnow().isoformat()
         }
 
+class MetricsRefresher:
+    """Background thread that recomputes the database-backed metrics and keeps them in memory."""
+    
+    def __init__(self, interval=60, max_staleness=300):
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self._snapshot = None
+        self._refreshed_at = None  # time.monotonic() of the last refresh
+        self._refresh_lock = threading.Lock()
+        self._app = None
+        self._stopped = threading.Event()
+        self.thread = None
+    
+    def configure(self, config):
+        self.interval = config.get('METRICS_REFRESH_SECONDS', 60)
+        self.max_staleness = config.get('METRICS_MAX_STALENESS_SECONDS', 300)
+        self._snapshot = None  # Counted from another app's database
+        self._refreshed_at = None
+    
+    def age(self):
+        """Seconds since the last refresh (infinity before the first)."""
+        if self._refreshed_at is None:
+            return float('inf')
+        return time.monotonic() - self._refreshed_at
+    
+    def refresh(self):
+        """Recompute the metrics now."""
+        app = self._app or current_app._get_current_object()
+        with app.app_context():
+            snapshot = MetricsCollector.get_business_metrics()
+        self._snapshot = snapshot
+        self._refreshed_at = time.monotonic()
+        return snapshot
+    
+    def get(self):
+        """The latest metrics, recomputed first if older than ``max_staleness``."""
+        snapshot = self._snapshot
+        if snapshot is None or self.age() > self.max_staleness:
+            with self._refresh_lock:
+                # Concurrent callers wait for one refresh instead of each running the counts
+                if self._snapshot is snapshot:
+                    self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+    
+    def start(self, app):
+        """Start refreshing every ``interval`` seconds."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._app = app
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='metrics-refresher')
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        """Stop refreshing."""
+        if self.thread:
+            self._stopped.set()
+            self.thread.join()
+            self.thread = None
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing metrics: {str(e)}")
+
+# Global metrics refresher
+metrics_refresher = MetricsRefresher()
+
 def create_health_endpoint(app):
     """Create health check endpoint"""
     
+    metrics_refresher.configure(app.config)
+    if not app.debug and runs_background_workers(app):
+        metrics_refresher.start(app)
+    
+    @app.route('/health/live')
+    def liveness_check():
+        """Liveness probe: the database answers a SELECT 1 in time"""
+        database = HealthChecker.check_database()
+        return jsonify(database), 200 if database['status'] == 'healthy' else 503
+    
+    @app.route('/health/ready')
+    def readiness_check():
+        """Readiness probe: the connection pool has a connection to spare"""
+        pool = HealthChecker.check_pool()
+        return jsonify(pool), 200 if pool['status'] == 'healthy' else 503
+    
     @app.route('/health')
     def health_check():
         """Health check endpoint"""
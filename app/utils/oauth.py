@@ -1,10 +1,9 @@
 import os
 import json
-import requests
 from flask import current_app, url_for, redirect, request, session
-from oauthlib.oauth2 import WebApplicationClient
 from app import db
 from app.models.user import User
+from app.utils.http_transport import get_transport
 
 class OAuthSignIn:
     """Base class for OAuth sign-in providers."""
@@ -16,6 +15,8 @@ class OAuthSignIn:
         credentials = current_app.config[f'{provider_name.upper()}_OAUTH_CREDENTIALS']
         self.client_id = credentials['id']
         self.client_secret = credentials['secret']
+        
+        from oauthlib.oauth2 import WebApplicationClient
         self.client = WebApplicationClient(self.client_id)
     
     def authorize(self, state=None):
@@ -73,7 +74,7 @@ class GoogleSignIn(OAuthSignIn):
             redirect_url=redirect_uri,
             code=code
         )
-        token_response = requests.post(
+        token_response = get_transport().post(
             token_url,
             headers=headers,
             data=body,
@@ -85,7 +86,7 @@ class GoogleSignIn(OAuthSignIn):
         
         # Get user info
         uri, headers, body = self.client.add_token(self.user_info_url)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        userinfo_response = get_transport().get(uri, headers=headers, data=body)
         userinfo = userinfo_response.json()
         
         if userinfo.get('email'):
@@ -133,7 +134,7 @@ class FacebookSignIn(OAuthSignIn):
             redirect_url=redirect_uri,
             code=code
         )
-        token_response = requests.post(
+        token_response = get_transport().post(
             token_url,
             headers=headers,
             data=body,
@@ -147,7 +148,7 @@ class FacebookSignIn(OAuthSignIn):
         uri, headers, body = self.client.add_token(
             f"{self.user_info_url}?fields=id,name,email,picture.type(large)"
         )
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        userinfo_response = get_transport().get(uri, headers=headers, data=body)
         userinfo = userinfo_response.json()
         
         if userinfo.get('email'):
@@ -195,7 +196,7 @@ class AmazonSignIn(OAuthSignIn):
             redirect_url=redirect_uri,
             code=code
         )
-        token_response = requests.post(
+        token_response = get_transport().post(
             token_url,
             headers=headers,
             data=body,
@@ -207,7 +208,7 @@ class AmazonSignIn(OAuthSignIn):
         
         # Get user info
         uri, headers, body = self.client.add_token(self.user_info_url)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        userinfo_response = get_transport().get(uri, headers=headers, data=body)
         userinfo = userinfo_response.json()
         
         if userinfo.get('email'):
@@ -252,7 +253,7 @@ def save_profile_image(image_url, email):
         return 'default.jpg'
     
     try:
-        response = requests.get(image_url)
+        response = get_transport().get(image_url)
         if response.status_code == 200:
             # Generate a unique filename
             filename = f"{email.split('@')[0]}_{os.urandom(8).hex()}.jpg"
@@ -2,28 +2,131 @@
 Performance monitoring utilities for tracking application performance.
 """
 
+import logging
 import time
-import psutil
 import threading
 from functools import wraps
-from flask import request, g, current_app
+from flask import request, g
 from datetime import datetime, timedelta
 import json
 import os
 
+from app.utils.ring_buffer import RingBuffer, window_start, column_stats, grouped_stats, value_counts, select
+from app.utils.latency_histogram import WindowedHistogram, summarize_windows
+from app.utils.prometheus import observe_request, observe_system_sample
+from app.utils.system_sampler import system_sampler
+from app.utils.sampling_profiler import sampling_profiler, init_profiler
+from app.utils.tracing import tracer, current_trace, init_tracing
+from app.utils.startup import runs_background_workers
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the outbound latency histogram buckets; the last one catches the rest
+OUTBOUND_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
 class PerformanceMonitor:
-    """Monitor application performance metrics."""
+    """
+    Monitor application performance metrics.
+    
+    Requests and database queries are kept in fixed-capacity columnar ring
+    buffers with monotonic timestamps; endpoint, method, table and query
+    type names are interned to integer ids. Recording is an O(1) append
+    under the lock, and summaries copy the columns out of the lock before
+    computing anything.
+    
+    Each endpoint also has a windowed log-linear latency histogram, from
+    which tail percentiles over the last 1, 5 and 60 minutes are reported
+    (and merged across worker processes via ``export_latency_histograms``).
+    """
+    
+    # Distinct interned names; later names share one id so unrouted paths can't grow it forever
+    MAX_NAMES = 10000
+    OTHER_NAME = '<other>'
     
-    def __init__(self):
+    REQUEST_COLUMNS = (
+        ('timestamp', 'd'),
+        ('endpoint', 'I'),
+        ('method', 'I'),
+        ('response_time', 'd'),
+        ('status_code', 'H'),
+        ('user_id', 'q')
+    )
+    QUERY_COLUMNS = (
+        ('timestamp', 'd'),
+        ('query_type', 'I'),
+        ('table', 'I'),
+        ('execution_time', 'd')
+    )
+    SYSTEM_COLUMNS = (
+        ('timestamp', 'd'),
+        ('cpu_percent', 'd'),
+        ('process_cpu_percent', 'd'),
+        ('memory_percent', 'd'),
+        ('memory_available', 'q'),
+        ('disk_percent', 'd'),
+        ('disk_free', 'q'),
+        ('load_average', 'd'),
+        ('rss_bytes', 'q'),
+        ('open_fds', 'i'),
+        ('threads', 'i'),
+        ('gc_collections', 'q'),
+        ('gc_collected', 'q'),
+        ('gc_uncollectable', 'q'),
+        ('gc_pause_seconds', 'd'),
+        ('db_pool_checked_out', 'i'),
+        ('db_pool_checkouts', 'q')
+    )
+    
+    def __init__(self, request_capacity=10000, query_capacity=5000, system_capacity=1440):
+        self._lock = threading.RLock()
+        self._names = [None, self.OTHER_NAME]  # Id 0 stands for None
+        self._name_ids = {None: 0, self.OTHER_NAME: 1}
         self.metrics = {
-            'requests': [],
-            'database_queries': [],
+            'requests': RingBuffer(request_capacity, self.REQUEST_COLUMNS),
+            'database_queries': RingBuffer(query_capacity, self.QUERY_COLUMNS),
             'cache_hits': 0,
             'cache_misses': 0,
-            'system_metrics': []
+            'system_metrics': RingBuffer(system_capacity, self.SYSTEM_COLUMNS),
+            'outbound': {}
         }
+        self.latency = {}  # Endpoint -> WindowedHistogram
         self.monitoring_active = True
-        self._lock = threading.Lock()
+    
+    def configure(self, request_capacity=None, query_capacity=None, system_capacity=None):
+        """Resize the sample buffers; collected samples are dropped."""
+        with self._lock:
+            if request_capacity:
+                self.metrics['requests'] = RingBuffer(request_capacity, self.REQUEST_COLUMNS)
+            if query_capacity:
+                self.metrics['database_queries'] = RingBuffer(query_capacity, self.QUERY_COLUMNS)
+            if system_capacity:
+                self.metrics['system_metrics'] = RingBuffer(system_capacity, self.SYSTEM_COLUMNS)
+    
+    def _intern(self, name):
+        # Called with the lock held
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            if len(self._names) >= self.MAX_NAMES:
+                return self._name_ids[self.OTHER_NAME]
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+    
+    @staticmethod
+    def _to_datetime(monotonic_timestamp):
+        return datetime.now() - timedelta(seconds=time.monotonic() - monotonic_timestamp)
+    
+    def _cutoff(self, minutes):
+        return time.monotonic() - minutes * 60
+    
+    def _recent(self, buffer_name, minutes):
+        """Copy the samples of the last ``minutes`` out of a buffer, plus the id -> name table."""
+        with self._lock:
+            columns = self.metrics[buffer_name].snapshot()
+            names = list(self._names)
+        
+        start = window_start(columns['timestamp'], self._cutoff(minutes))
+        return {name: column[start:] for name, column in columns.items()}, names
     
     def record_request(self, endpoint, method, response_time, status_code, user_id=None):
         """Record request performance metrics."""
@@ -31,20 +134,34 @@ class PerformanceMonitor:
             return
         
         with self._lock:
-            metric = {
-                'timestamp': datetime.now().isoformat(),
-                'endpoint': endpoint,
-                'method': method,
-                'response_time': response_time,
-                'status_code': status_code,
-                'user_id': user_id
-            }
-            
-            self.metrics['requests'].append(metric)
+            endpoint_id = self._intern(endpoint)
+            histogram = self.latency.get(self._names[endpoint_id])
+            if histogram is None:
+                histogram = self.latency[self._names[endpoint_id]] = WindowedHistogram()
+            histogram.record(response_time)
             
-            # Keep only last 1000 requests to prevent memory issues
-            if len(self.metrics['requests']) > 1000:
-                self.metrics['requests'] = self.metrics['requests'][-1000:]
+            self.metrics['requests'].append(
+                time.monotonic(),  # Taken under the lock so the column stays sorted
+                endpoint_id,
+                self._intern(method),
+                response_time,
+                status_code,
+                user_id if user_id is not None else -1
+            )
+    
+    def get_request(self, index):
+        """One recorded request as a dict, in insertion order (negative counts from the newest)."""
+        with self._lock:
+            row = self.metrics['requests'].row(index)
+            names = self._names
+            return {
+                'timestamp': self._to_datetime(row['timestamp']).isoformat(),
+                'endpoint': names[row['endpoint']],
+                'method': names[row['method']],
+                'response_time': row['response_time'],
+                'status_code': row['status_code'],
+                'user_id': row['user_id'] if row['user_id'] >= 0 else None
+            }
     
     def record_database_query(self, query_type, execution_time, table=None):
         """Record database query performance."""
@@ -52,18 +169,97 @@ class PerformanceMonitor:
             return
         
         with self._lock:
-            metric = {
-                'timestamp': datetime.now().isoformat(),
-                'query_type': query_type,
-                'execution_time': execution_time,
-                'table': table
+            self.metrics['database_queries'].append(
+                time.monotonic(),
+                self._intern(query_type),
+                self._intern(table),
+                execution_time
+            )
+    
+    def get_database_query(self, index):
+        """One recorded query as a dict, in insertion order (negative counts from the newest)."""
+        with self._lock:
+            row = self.metrics['database_queries'].row(index)
+            return {
+                'timestamp': self._to_datetime(row['timestamp']).isoformat(),
+                'query_type': self._names[row['query_type']],
+                'execution_time': row['execution_time'],
+                'table': self._names[row['table']]
             }
+    
+    def _latency_snapshot(self):
+        # Slot copies are dict copies, so the lock is held only briefly
+        with self._lock:
+            return {endpoint: histogram.snapshot() for endpoint, histogram in self.latency.items()}
+    
+    def get_latency_percentiles(self):
+        """p50/p90/p99/p999 response times over 1m/5m/60m, overall and per endpoint."""
+        return summarize_windows(self._latency_snapshot())
+    
+    def export_latency_histograms(self):
+        """Per-endpoint histograms as JSON-ready dicts, mergeable with other workers' exports."""
+        return {endpoint: histogram.to_dict() for endpoint, histogram in self._latency_snapshot().items()}
+    
+    def record_outbound_request(self, host, elapsed, status_code=None, error=False):
+        """Record the latency of an outbound HTTP call in the host's histogram."""
+        if not self.monitoring_active:
+            return
+        
+        with self._lock:
+            stats = self.metrics['outbound'].get(host)
+            if stats is None:
+                stats = self.metrics['outbound'][host] = {
+                    'count': 0,
+                    'errors': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'buckets': [0] * len(OUTBOUND_LATENCY_BUCKETS)
+                }
             
-            self.metrics['database_queries'].append(metric)
-            
-            # Keep only last 500 queries
-            if len(self.metrics['database_queries']) > 500:
-                self.metrics['database_queries'] = self.metrics['database_queries'][-500:]
+            stats['count'] += 1
+            if error or (status_code is not None and status_code >= 500):
+                stats['errors'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            for index, bound in enumerate(OUTBOUND_LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    stats['buckets'][index] += 1
+                    break
+    
+    @staticmethod
+    def _bucket_percentile(buckets, count, percentile):
+        # Upper bound of the bucket holding the percentile; the overflow bucket reports the last finite bound
+        target = count * percentile
+        seen = 0
+        for bound, bucket_count in zip(OUTBOUND_LATENCY_BUCKETS, buckets):
+            seen += bucket_count
+            if seen >= target:
+                return bound if bound != float('inf') else OUTBOUND_LATENCY_BUCKETS[-2]
+        return OUTBOUND_LATENCY_BUCKETS[-2]
+    
+    def get_outbound_stats(self):
+        """Per-host call counts, error rates and latency percentiles of outbound HTTP calls."""
+        with self._lock:
+            outbound = {host: dict(stats, buckets=list(stats['buckets']))
+                        for host, stats in self.metrics['outbound'].items()}
+        
+        result = {}
+        for host, stats in outbound.items():
+            count = stats['count']
+            result[host] = {
+                'count': count,
+                'error_rate': round(stats['errors'] / count, 4) if count else 0,
+                'avg_time': round(stats['total_time'] / count, 3) if count else 0,
+                'max_time': round(stats['max_time'], 3),
+                'p50': self._bucket_percentile(stats['buckets'], count, 0.5),
+                'p90': self._bucket_percentile(stats['buckets'], count, 0.9),
+                'p99': self._bucket_percentile(stats['buckets'], count, 0.99),
+                'histogram': {
+                    ('+Inf' if bound == float('inf') else str(bound)): bucket_count
+                    for bound, bucket_count in zip(OUTBOUND_LATENCY_BUCKETS, stats['buckets'])
+                }
+            }
+        return result
     
     def record_cache_hit(self):
         """Record cache hit."""
@@ -76,188 +272,110 @@ class PerformanceMonitor:
             self.metrics['cache_misses'] += 1
     
     def record_system_metrics(self):
-        """Record system performance metrics."""
+        """Record a system metrics sample; CPU use is measured since the previous one, without waiting."""
         if not self.monitoring_active:
             return
         
         try:
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-            
-            metric = {
-                'timestamp': datetime.now().isoformat(),
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory.percent,
-                'memory_available': memory.available,
-                'disk_percent': disk.percent,
-                'disk_free': disk.free
-            }
-            
-            with self._lock:
-                self.metrics['system_metrics'].append(metric)
-                
-                # Keep only last 100 system metrics
-                if len(self.metrics['system_metrics']) > 100:
-                    self.metrics['system_metrics'] = self.metrics['system_metrics'][-100:]
-        
+            sample = system_sampler.sample()
         except Exception as e:
-            current_app.logger.error(f"Error recording system metrics: {str(e)}")
+            logger.error(f"Error recording system metrics: {str(e)}")
+            return
+        
+        with self._lock:
+            self.metrics['system_metrics'].append(*(sample[name] for name, _ in self.SYSTEM_COLUMNS))
+        observe_system_sample(sample)
+        return sample
+    
+    def get_system_sample(self, index):
+        """System metrics sample ``index`` (negative counts from the newest) as a dict."""
+        with self._lock:
+            sample = self.metrics['system_metrics'].row(index)
+        sample['timestamp'] = self._to_datetime(sample['timestamp']).isoformat()
+        return sample
     
     def get_performance_summary(self, minutes=60):
         """Get performance summary for the last N minutes."""
-        cutoff_time = datetime.now() - timedelta(minutes=minutes)
+        requests, names = self._recent('requests', minutes)
+        queries, _ = self._recent('database_queries', minutes)
+        
+        # Request statistics
+        total_requests, total_time, min_response_time, max_response_time = column_stats(requests['response_time'])
+        avg_response_time = total_time / total_requests if total_requests else 0
+        status_codes = value_counts(requests['status_code'])
+        
+        endpoint_stats = {}
+        for endpoint_id, (count, endpoint_total, endpoint_max) in grouped_stats(
+                requests['endpoint'], requests['response_time']).items():
+            endpoint_stats[names[endpoint_id]] = {
+                'count': count,
+                'total_time': endpoint_total,
+                'max_time': endpoint_max,
+                'avg_time': endpoint_total / count
+            }
+        
+        # Database query statistics
+        total_queries, total_query_time, _, max_query_time = column_stats(queries['execution_time'])
+        avg_query_time = total_query_time / total_queries if total_queries else 0
+        query_types = {names[type_id]: count for type_id, count in value_counts(queries['query_type']).items()}
         
         with self._lock:
-            # Filter recent requests
-            recent_requests = [
-                r for r in self.metrics['requests']
-                if datetime.fromisoformat(r['timestamp']) > cutoff_time
-            ]
-            
-            # Filter recent queries
-            recent_queries = [
-                q for q in self.metrics['database_queries']
-                if datetime.fromisoformat(q['timestamp']) > cutoff_time
-            ]
-            
-            # Calculate statistics
-            if recent_requests:
-                response_times = [r['response_time'] for r in recent_requests]
-                avg_response_time = sum(response_times) / len(response_times)
-                max_response_time = max(response_times)
-                min_response_time = min(response_times)
-                
-                # Status code distribution
-                status_codes = {}
-                for req in recent_requests:
-                    code = req['status_code']
-                    status_codes[code] = status_codes.get(code, 0) + 1
-                
-                # Endpoint performance
-                endpoint_stats = {}
-                for req in recent_requests:
-                    endpoint = req['endpoint']
-                    if endpoint not in endpoint_stats:
-                        endpoint_stats[endpoint] = {
-                            'count': 0,
-                            'total_time': 0,
-                            'max_time': 0
-                        }
-                    
-                    endpoint_stats[endpoint]['count'] += 1
-                    endpoint_stats[endpoint]['total_time'] += req['response_time']
-                    endpoint_stats[endpoint]['max_time'] = max(
-                        endpoint_stats[endpoint]['max_time'],
-                        req['response_time']
-                    )
-                
-                # Calculate average times
-                for endpoint in endpoint_stats:
-                    stats = endpoint_stats[endpoint]
-                    stats['avg_time'] = stats['total_time'] / stats['count']
-            else:
-                avg_response_time = 0
-                max_response_time = 0
-                min_response_time = 0
-                status_codes = {}
-                endpoint_stats = {}
-            
-            # Database query statistics
-            if recent_queries:
-                query_times = [q['execution_time'] for q in recent_queries]
-                avg_query_time = sum(query_times) / len(query_times)
-                max_query_time = max(query_times)
-                
-                # Query type distribution
-                query_types = {}
-                for query in recent_queries:
-                    qtype = query['query_type']
-                    query_types[qtype] = query_types.get(qtype, 0) + 1
-            else:
-                avg_query_time = 0
-                max_query_time = 0
-                query_types = {}
-            
             # Cache statistics
-            total_cache_requests = self.metrics['cache_hits'] + self.metrics['cache_misses']
-            cache_hit_rate = (
-                (self.metrics['cache_hits'] / total_cache_requests * 100)
-                if total_cache_requests > 0 else 0
-            )
+            cache_hits = self.metrics['cache_hits']
+            cache_misses = self.metrics['cache_misses']
             
             # Latest system metrics
-            latest_system = self.metrics['system_metrics'][-1] if self.metrics['system_metrics'] else None
-            
-            return {
-                'time_period_minutes': minutes,
-                'request_stats': {
-                    'total_requests': len(recent_requests),
-                    'avg_response_time': round(avg_response_time, 3),
-                    'max_response_time': round(max_response_time, 3),
-                    'min_response_time': round(min_response_time, 3),
-                    'requests_per_minute': len(recent_requests) / minutes,
-                    'status_codes': status_codes,
-                    'endpoint_performance': endpoint_stats
-                },
-                'database_stats': {
-                    'total_queries': len(recent_queries),
-                    'avg_query_time': round(avg_query_time, 3),
-                    'max_query_time': round(max_query_time, 3),
-                    'query_types': query_types
-                },
-                'cache_stats': {
-                    'cache_hits': self.metrics['cache_hits'],
-                    'cache_misses': self.metrics['cache_misses'],
-                    'cache_hit_rate': round(cache_hit_rate, 1)
-                },
-                'system_stats': latest_system
-            }
+            latest_system = self.get_system_sample(-1) if len(self.metrics['system_metrics']) else None
+        
+        total_cache_requests = cache_hits + cache_misses
+        cache_hit_rate = (cache_hits / total_cache_requests * 100) if total_cache_requests > 0 else 0
+        
+        return {
+            'time_period_minutes': minutes,
+            'request_stats': {
+                'total_requests': total_requests,
+                'avg_response_time': round(avg_response_time, 3),
+                'max_response_time': round(max_response_time, 3),
+                'min_response_time': round(min_response_time, 3),
+                'requests_per_minute': total_requests / minutes,
+                'status_codes': status_codes,
+                'endpoint_performance': endpoint_stats
+            },
+            'database_stats': {
+                'total_queries': total_queries,
+                'avg_query_time': round(avg_query_time, 3),
+                'max_query_time': round(max_query_time, 3),
+                'query_types': query_types
+            },
+            'cache_stats': {
+                'cache_hits': cache_hits,
+                'cache_misses': cache_misses,
+                'cache_hit_rate': round(cache_hit_rate, 1)
+            },
+            'system_stats': latest_system,
+            'latency_percentiles': self.get_latency_percentiles(),
+            'outbound_stats': self.get_outbound_stats()
+        }
     
     def get_slow_endpoints(self, threshold=1.0, minutes=60):
         """Get endpoints that are performing slowly."""
-        cutoff_time = datetime.now() - timedelta(minutes=minutes)
+        requests, names = self._recent('requests', minutes)
+        endpoint_ids, response_times = select(requests['endpoint'], requests['response_time'], threshold)
         
-        with self._lock:
-            recent_requests = [
-                r for r in self.metrics['requests']
-                if datetime.fromisoformat(r['timestamp']) > cutoff_time
-                and r['response_time'] > threshold
-            ]
-            
-            # Group by endpoint
-            slow_endpoints = {}
-            for req in recent_requests:
-                endpoint = req['endpoint']
-                if endpoint not in slow_endpoints:
-                    slow_endpoints[endpoint] = {
-                        'count': 0,
-                        'avg_time': 0,
-                        'max_time': 0,
-                        'times': []
-                    }
-                
-                slow_endpoints[endpoint]['count'] += 1
-                slow_endpoints[endpoint]['times'].append(req['response_time'])
-                slow_endpoints[endpoint]['max_time'] = max(
-                    slow_endpoints[endpoint]['max_time'],
-                    req['response_time']
-                )
-            
-            # Calculate averages
-            for endpoint in slow_endpoints:
-                times = slow_endpoints[endpoint]['times']
-                slow_endpoints[endpoint]['avg_time'] = sum(times) / len(times)
-                del slow_endpoints[endpoint]['times']  # Remove raw times
-            
-            # Sort by average time
-            sorted_endpoints = sorted(
-                slow_endpoints.items(),
-                key=lambda x: x[1]['avg_time'],
-                reverse=True
-            )
-            
-            return sorted_endpoints
+        latency = self._latency_snapshot()
+        slow_endpoints = {}
+        for endpoint_id, (count, total, maximum) in grouped_stats(endpoint_ids, response_times).items():
+            endpoint = names[endpoint_id]
+            histogram = latency.get(endpoint)
+            slow_endpoints[endpoint] = {
+                'count': count,
+                'avg_time': total / count,
+                'max_time': maximum,
+                'p99_time': round(histogram.window(minutes * 60).quantile(0.99), 3) if histogram else None
+            }
+        
+        # Sort by average time
+        return sorted(slow_endpoints.items(), key=lambda x: x[1]['avg_time'], reverse=True)
     
     def export_metrics(self, filename=None):
         """Export metrics to JSON file."""
@@ -265,21 +383,35 @@ class PerformanceMonitor:
             filename = f"performance_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
         with self._lock:
-            with open(filename, 'w') as f:
-                json.dump(self.metrics, f, indent=2)
+            exported = {
+                'requests': [self.get_request(i) for i in range(len(self.metrics['requests']))],
+                'database_queries': [
+                    self.get_database_query(i) for i in range(len(self.metrics['database_queries']))
+                ],
+                'cache_hits': self.metrics['cache_hits'],
+                'cache_misses': self.metrics['cache_misses'],
+                'system_metrics': [self.get_system_sample(i) for i in range(len(self.metrics['system_metrics']))],
+                'outbound': self.get_outbound_stats(),
+                'latency_histograms': self.export_latency_histograms()
+            }
+        
+        with open(filename, 'w') as f:
+            json.dump(exported, f, indent=2)
         
         return filename
     
     def clear_metrics(self):
         """Clear all collected metrics."""
         with self._lock:
-            self.metrics = {
-                'requests': [],
-                'database_queries': [],
+            self.metrics['requests'].clear()
+            self.metrics['database_queries'].clear()
+            self.metrics['system_metrics'].clear()
+            self.latency = {}
+            self.metrics.update({
                 'cache_hits': 0,
                 'cache_misses': 0,
-                'system_metrics': []
-            }
+                'outbound': {}
+            })
 
 # Global performance monitor instance
 performance_monitor = PerformanceMonitor()
@@ -300,14 +432,8 @@ def monitor_request_performance(f):
             end_time = time.time()
             response_time = end_time - start_time
             
-            # Get user ID if available
-            user_id = None
-            try:
-                from flask_login import current_user
-                if hasattr(current_user, 'id'):
-                    user_id = current_user.id
-            except:
-                pass
+            # The user Flask-Login loaded for this request, if any; current_user would load one
+            user_id = getattr(g.get('_login_user'), 'id', None)
             
             # Record the request
             performance_monitor.record_request(
@@ -359,7 +485,8 @@ class SystemMetricsCollector:
             return
         
         self.running = True
-        self.thread = threading.Thread(target=self._collect_metrics)
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._collect_metrics, name='system-metrics')
         self.thread.daemon = True
         self.thread.start()
     
@@ -367,46 +494,61 @@ class SystemMetricsCollector:
         """Stop collecting system metrics."""
         self.running = False
         if self.thread:
+            self._stopped.set()
             self.thread.join()
+            self.thread = None
     
     def _collect_metrics(self):
         """Background method to collect metrics."""
         while self.running:
             try:
                 performance_monitor.record_system_metrics()
-                time.sleep(self.interval)
             except Exception as e:
-                current_app.logger.error(f"Error in system metrics collection: {str(e)}")
-                time.sleep(self.interval)
+                logger.error(f"Error in system metrics collection: {str(e)}")
+            self._stopped.wait(self.interval)
 
 # Global system metrics collector
 system_metrics_collector = SystemMetricsCollector()
 
 def init_performance_monitoring(app):
     """Initialize performance monitoring for the Flask app."""
+    from app import db
+    
+    performance_monitor.configure(
+        request_capacity=app.config.get('PERFORMANCE_REQUEST_BUFFER_SIZE'),
+        query_capacity=app.config.get('PERFORMANCE_QUERY_BUFFER_SIZE'),
+        system_capacity=app.config.get('PERFORMANCE_SYSTEM_BUFFER_SIZE')
+    )
+    with app.app_context():
+        system_sampler.watch_engine(db.engine)
     
-    # Start system metrics collection in production
-    if not app.debug and not app.testing:
+    # Start system metrics collection in production web processes
+    system_metrics_collector.interval = app.config.get('PERFORMANCE_SYSTEM_SAMPLE_SECONDS', 60)
+    if not app.debug and runs_background_workers(app):
         system_metrics_collector.start()
+    init_profiler(app)
+    init_tracing(app)
     
     # Add performance monitoring to all requests
     @app.before_request
     def before_request():
         g.start_time = time.time()
+        sampling_profiler.enter(request.endpoint)
+        tracer.start_trace(f"{request.method} {request.endpoint or request.path}", request.headers.get('traceparent'),
+                           method=request.method, path=request.path)
+    
+    @app.teardown_request
+    def teardown_request(exception=None):
+        sampling_profiler.leave()
+        tracer.finish_trace()
     
     @app.after_request
     def after_request(response):
         if hasattr(g, 'start_time'):
             response_time = time.time() - g.start_time
             
-            # Get user ID if available
-            user_id = None
-            try:
-                from flask_login import current_user
-                if hasattr(current_user, 'id'):
-                    user_id = current_user.id
-            except:
-                pass
+            # The user Flask-Login loaded for this request, if any; current_user would load one
+            user_id = getattr(g.get('_login_user'), 'id', None)
             
             # Record the request
             performance_monitor.record_request(
@@ -416,6 +558,12 @@ def init_performance_monitoring(app):
                 status_code=response.status_code,
                 user_id=user_id
             )
+            observe_request(request.endpoint or 'unmatched', request.method, response.status_code, response_time)
+        
+        trace = current_trace()
+        if trace is not None:
+            trace.root.set(status_code=response.status_code)
+            response.headers['X-Trace-Id'] = trace.trace_id
         
         return response
     
@@ -440,12 +588,14 @@ def init_performance_monitoring(app):
         from flask import request, jsonify
         minutes = request.args.get('minutes', 60, type=int)
         
+        from app.utils.http_transport import get_transport
         summary = performance_monitor.get_performance_summary(minutes)
         slow_endpoints = performance_monitor.get_slow_endpoints(minutes=minutes)
         recommendations = get_performance_recommendations()
         
         return jsonify({
             **summary,
+            'outbound_circuits': get_transport().get_status(),
             'slow_endpoints': slow_endpoints,
             'recommendations': recommendations
         })
@@ -455,12 +605,19 @@ def get_performance_recommendations():
     summary = performance_monitor.get_performance_summary()
     recommendations = []
     
-    # Check response times
-    if summary['request_stats']['avg_response_time'] > 1.0:
+    # Check tail response times; an average hides the slow requests users notice
+    p99 = summary['latency_percentiles']['overall']['60m']['p99']
+    if p99 > 1.0:
+        slowest = sorted(
+            summary['latency_percentiles']['endpoints'].items(),
+            key=lambda item: item[1]['60m']['p99'],
+            reverse=True
+        )[:3]
         recommendations.append({
             'type': 'response_time',
             'severity': 'high',
-            'message': f"Average response time is {summary['request_stats']['avg_response_time']:.3f}s",
+            'message': f"p99 response time is {p99:.3f}s (slowest: " +
+                       ', '.join(f"{endpoint} {stats['60m']['p99']:.3f}s" for endpoint, stats in slowest) + ")",
             'suggestion': 'Consider implementing caching or optimizing database queries'
         })
     
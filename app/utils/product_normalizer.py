@@ -1,11 +1,11 @@
 import re
-import requests
-import os
+from functools import lru_cache
 from flask import current_app
-from urllib.parse import urlparse
 from datetime import datetime
 from app import db
 from app.models.product import Product
+from app.utils.image_storage import store_images
+from app.utils.bulk_upsert import upsert_products
 
 # Standard category mapping
 CATEGORY_MAPPING = {
@@ -93,26 +93,41 @@ CATEGORY_MAPPING = {
     'miscellaneous': 'Other',
 }
 
-def normalize_category(category_string):
-    """Normalize product category to a standard set."""
-    if not category_string:
-        return 'Other'
-    
-    # Convert to lowercase for matching
-    category_lower = category_string.lower()
-    
+VALID_CURRENCIES = frozenset(['USD', 'EUR', 'GBP', 'CAD', 'AUD', 'JPY', 'CNY', 'INR'])
+
+CURRENCY_SYMBOLS = {
+    '$': 'USD',
+    '€': 'EUR',
+    '£': 'GBP',
+    '¥': 'JPY',
+    '₹': 'INR'
+}
+
+_PRICE_STRIP_PATTERN = re.compile(r'[^\d.]')
+
+# Partial-match candidates in priority order, built once at import
+_CATEGORY_ITEMS = tuple(CATEGORY_MAPPING.items())
+
+@lru_cache(maxsize=8192)
+def _match_category(category_lower):
     # Try direct match first
     if category_lower in CATEGORY_MAPPING:
         return CATEGORY_MAPPING[category_lower]
     
-    # Try partial match
-    for key, value in CATEGORY_MAPPING.items():
+    # Partial match: the first mapping key contained anywhere in the string wins
+    for key, value in _CATEGORY_ITEMS:
         if key in category_lower:
             return value
     
-    # Default category
     return 'Other'
 
+def normalize_category(category_string):
+    """Normalize product category to a standard set."""
+    if not category_string:
+        return 'Other'
+    
+    return _match_category(category_string.lower())
+
 def normalize_price(price_value, currency='USD'):
     """Normalize price to a standard format."""
     if isinstance(price_value, (int, float)):
@@ -120,7 +135,7 @@ def normalize_price(price_value, currency='USD'):
     
     if isinstance(price_value, str):
         # Remove currency symbols and non-numeric characters
-        price_str = re.sub(r'[^\d.]', '', price_value)
+        price_str = _PRICE_STRIP_PATTERN.sub('', price_value)
         try:
             return float(price_str)
         except ValueError:
@@ -136,56 +151,75 @@ def normalize_currency(currency_code):
     # Convert to uppercase
     currency = currency_code.upper()
     
-    # List of valid currency codes
-    valid_currencies = ['USD', 'EUR', 'GBP', 'CAD', 'AUD', 'JPY', 'CNY', 'INR']
-    
-    if currency in valid_currencies:
+    if currency in VALID_CURRENCIES:
         return currency
     
     # Map common symbols to codes
-    currency_map = {
-        '$': 'USD',
-        '€': 'EUR',
-        '£': 'GBP',
-        '¥': 'JPY',
-        '₹': 'INR'
-    }
-    
-    if currency in currency_map:
-        return currency_map[currency]
+    if currency in CURRENCY_SYMBOLS:
+        return CURRENCY_SYMBOLS[currency]
     
     # Default to USD
     return 'USD'
 
+def normalize_prices(price_values):
+    """Normalize a batch of prices; numbers pass through without a function call each."""
+    prices = []
+    append = prices.append
+    strip = _PRICE_STRIP_PATTERN.sub
+    
+    for value in price_values:
+        if isinstance(value, (int, float)):
+            append(float(value))
+        elif isinstance(value, str):
+            try:
+                append(float(strip('', value)))
+            except ValueError:
+                append(0.0)
+        else:
+            append(0.0)
+    
+    return prices
+
+def normalize_currencies(currency_codes):
+    """Normalize a batch of currency codes, resolving each distinct code once."""
+    resolved = {}
+    currencies = []
+    append = currencies.append
+    
+    for code in currency_codes:
+        currency = resolved.get(code)
+        if currency is None:
+            currency = resolved[code] = normalize_currency(code)
+        append(currency)
+    
+    return currencies
+
+def normalize_categories(category_strings):
+    """Normalize a batch of category strings."""
+    return [normalize_category(category) for category in category_strings]
+
 def download_and_save_image(image_url, product_id):
-    """Download and save product image."""
+    """
+    Download and save product image.
+    
+    The image is streamed to disk and stored by content hash, so products
+    sharing a picture share the file; ``product_id`` is only used for logging.
+    Returns the path relative to the static folder, or None on failure.
+    """
     if not image_url:
         return None
     
     try:
-        response = requests.get(image_url, timeout=10)
-        if response.status_code != 200:
+        stored = store_images([image_url]).get(image_url)
+        if not stored:
             return None
         
-        # Parse URL to get file extension
-        parsed_url = urlparse(image_url)
-        path = parsed_url.path
-        ext = os.path.splitext(path)[1]
-        if not ext:
-            ext = '.jpg'  # Default extension
-        
-        # Create filename
-        filename = f"product_{product_id}{ext}"
-        filepath = os.path.join(current_app.root_path, 'static', 'images', 'products', filename)
-        
-        # Save the image
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
-        
-        # Return the relative path
-        return f"images/products/{filename}"
+        # Return the path relative to the static folder; an image root served elsewhere keeps its URL
+        static_prefix = current_app.static_url_path + '/'
+        full_url = stored['full_url']
+        return full_url[len(static_prefix):] if full_url.startswith(static_prefix) else full_url
     except Exception as e:
-        current_app.logger.error(f"Error downloading image: {e}")
+        current_app.logger.error(f"Error downloading image for product {product_id}: {e}")
         return None
 
 def normalize_product_data(product_data, source):
@@ -263,45 +297,36 @@ def normalize_product_data(product_data, source):
     
     return normalized
 
+def normalize_products(products, source):
+    """Lazily normalize an iterable of raw products from one source."""
+    for product_data in products:
+        yield normalize_product_data(product_data, source)
+
 def create_or_update_product(product_data, source, external_id=None):
     """Create or update a product in the database."""
     # Normalize the product data
     normalized = normalize_product_data(product_data, source)
     
-    # Check if product exists
+    fields = {
+        'title': normalized['title'],
+        'description': normalized['description'],
+        'price': normalized['price'],
+        'currency': normalized['currency'],
+        'category': normalized['category'],
+        'image_url': normalized['image_url'],
+        'product_metadata': normalized['metadata']
+    }
+    
     if external_id:
-        product = Product.query.filter_by(
-            external_id=str(external_id),
-            source=source
-        ).first()
+        # Insert or update in one statement so concurrent syncs can't duplicate the product
+        product_ids = upsert_products([dict(fields, external_id=str(external_id), source=source)])
+        db.session.commit()
+        product = Product.query.get(product_ids[(source, str(external_id))])
     else:
-        product = None
-    
-    if not product:
         # Create new product
-        product = Product(
-            external_id=str(external_id) if external_id else None,
-            source=source,
-            title=normalized['title'],
-            description=normalized['description'],
-            price=normalized['price'],
-            currency=normalized['currency'],
-            category=normalized['category'],
-            image_url=normalized['image_url'],
-            product_metadata=normalized['metadata']
-        )
+        product = Product(external_id=None, source=source, **fields)
         db.session.add(product)
-    else:
-        # Update existing product
-        product.title = normalized['title']
-        product.description = normalized['description']
-        product.price = normalized['price']
-        product.currency = normalized['currency']
-        product.category = normalized['category']
-        product.image_url = normalized['image_url']
-        product.product_metadata = normalized['metadata']
-    
-    db.session.commit()
+        db.session.commit()
     
     # Download and save image if URL is provided
     if product.image_url and not product.image_url.startswith('images/products/'):
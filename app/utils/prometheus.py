@@ -0,0 +1,558 @@
+"""
+Prometheus metrics in the text exposition format.
+
+Counters, gauges and histograms are declared once at import time and
+updated where the work happens: the request hooks, SQLAlchemy cursor
+events, the ``cached`` decorator, finished sync runs and the scheduler
+loop. Rendering ``/metrics/prometheus`` only formats values already held in
+memory, so a scrape never touches the database.
+
+With ``PROMETHEUS_MULTIPROC_DIR`` set, each process writes its values to a
+memory-mapped file in that directory and a scrape merges the files of all
+workers: counters and histograms are summed (including workers that have
+exited), gauges of live processes are combined per their
+``multiprocess_mode``. Empty the directory when the server starts.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_FILE_PREFIX = 'metrics_'
+_FILE_SUFFIX = '.db'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _sample_key(metric_name, sample_name, labels):
+    return json.dumps([metric_name, sample_name, labels], separators=(',', ':'))
+
+class _LocalValues:
+    """Values of a single-process server, in a dict."""
+    
+    def __init__(self):
+        self._values = {}
+    
+    def add(self, key, amount):
+        self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def set(self, key, value):
+        self._values[key] = value
+    
+    def items(self):
+        return list(self._values.items())
+    
+    def close(self):
+        pass
+
+class _MmapedValues:
+    """
+    Values of one process in a memory-mapped file.
+    
+    The file holds a used-bytes header and ``(key length, key, float64)``
+    entries with 8-byte aligned values, so other processes can read it at
+    any time; only the owning process writes.
+    """
+    
+    _INITIAL_SIZE = 64 * 1024
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        if self._capacity < self._INITIAL_SIZE:
+            self._file.truncate(self._INITIAL_SIZE)
+            self._capacity = self._INITIAL_SIZE
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('<I', self._mmap, 0)[0] or 8
+        self._positions = {key: position for key, _, position in _read_entries(self._mmap, self._used)}
+    
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+        
+        encoded = key.encode('utf-8')
+        padding = b' ' * ((8 - (4 + len(encoded)) % 8) % 8)
+        entry = struct.pack('<i', len(encoded)) + encoded + padding + struct.pack('<d', 0.0)
+        while self._used + len(entry) > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._mmap[self._used:self._used + len(entry)] = entry
+        self._used += len(entry)
+        struct.pack_into('<I', self._mmap, 0, self._used)  # Publish the entry once it is complete
+        position = self._positions[key] = self._used - 8
+        return position
+    
+    def add(self, key, amount):
+        position = self._position(key)
+        struct.pack_into('<d', self._mmap, position, struct.unpack_from('<d', self._mmap, position)[0] + amount)
+    
+    def set(self, key, value):
+        struct.pack_into('<d', self._mmap, self._position(key), value)
+    
+    def items(self):
+        return [(key, value) for key, value, _ in _read_entries(self._mmap, self._used)]
+    
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+def _read_entries(data, used):
+    """``(key, value, value position)`` of the entries in a metrics file's bytes."""
+    position = 8
+    while position < used:
+        length = struct.unpack_from('<i', data, position)[0]
+        position += 4
+        key = bytes(data[position:position + length]).decode('utf-8')
+        position += length + (8 - (4 + length) % 8) % 8
+        yield key, struct.unpack_from('<d', data, position)[0], position
+        position += 8
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+    return [(key, value) for key, value, _ in _read_entries(data, struct.unpack_from('<I', data, 0)[0])]
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class Registry:
+    """The declared metrics and the value store of this process."""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._store = _LocalValues()
+        self.multiprocess_dir = None
+    
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics[metric.name] = metric
+    
+    def get(self, name):
+        return self._metrics.get(name)
+    
+    def configure_multiprocess(self, directory):
+        """Write this process's values to ``directory`` (None keeps them in memory)."""
+        with self._lock:
+            if directory == self.multiprocess_dir:
+                return
+            self._store.close()
+            self.multiprocess_dir = directory
+            self._store = self._open_store()
+    
+    def _open_store(self):
+        if not self.multiprocess_dir:
+            return _LocalValues()
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        return _MmapedValues(os.path.join(self.multiprocess_dir, f"{_FILE_PREFIX}{os.getpid()}{_FILE_SUFFIX}"))
+    
+    def _after_fork(self):
+        # A forked worker must not write into its parent's file; it starts its own at zero
+        self._lock = threading.Lock()
+        if self.multiprocess_dir:
+            self._store = self._open_store()
+    
+    def add(self, *updates):
+        """Add ``(key, amount)`` updates atomically."""
+        with self._lock:
+            for key, amount in updates:
+                self._store.add(key, amount)
+    
+    def set(self, key, value):
+        with self._lock:
+            self._store.set(key, value)
+    
+    def collect(self):
+        """Current ``{key: value}`` of every sample, merged across processes."""
+        if not self.multiprocess_dir:
+            with self._lock:
+                return dict(self._store.items())
+        
+        merged = {}
+        gauge_values = {}
+        for filename in os.listdir(self.multiprocess_dir):
+            if not (filename.startswith(_FILE_PREFIX) and filename.endswith(_FILE_SUFFIX)):
+                continue
+            pid = int(filename[len(_FILE_PREFIX):-len(_FILE_SUFFIX)])
+            alive = None
+            try:
+                entries = _read_file(os.path.join(self.multiprocess_dir, filename))
+            except OSError as e:
+                logger.warning(f"Could not read metrics file {filename}: {e}")
+                continue
+            
+            for key, value in entries:
+                metric = self._metrics.get(json.loads(key)[0])
+                if metric is None:
+                    continue
+                if metric.type_name == 'gauge':
+                    if alive is None:
+                        alive = _process_alive(pid)
+                    if alive:
+                        gauge_values.setdefault(key, []).append(value)
+                else:
+                    merged[key] = merged.get(key, 0.0) + value
+        
+        for key, values in gauge_values.items():
+            mode = self._metrics[json.loads(key)[0]].multiprocess_mode
+            merged[key] = max(values) if mode == 'max' else sum(values)
+        return merged
+    
+    def render(self):
+        """All metrics in the Prometheus text format."""
+        samples = {}
+        for key, value in self.collect().items():
+            metric_name, sample_name, labels = json.loads(key)
+            samples.setdefault(metric_name, []).append((sample_name, labels, value))
+        
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric._render(samples.get(name, [])))
+        return '\n'.join(lines) + '\n'
+
+class _Metric:
+    type_name = None
+    
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry or REGISTRY
+        self._children = {}
+        self._lock = threading.Lock()
+        self._registry.register(self)
+    
+    def labels(self, *values, **labels):
+        """The child for one combination of label values."""
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._child(list(zip(self.labelnames, values)))
+        return child
+    
+    def _child(self, labels):
+        raise NotImplementedError
+    
+    def _render(self, samples):
+        return [
+            f"{sample_name}{_format_labels(labels)} {_format_value(value)}"
+            for sample_name, labels, value in sorted(samples, key=lambda sample: sample[1])
+        ]
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+class _CounterChild:
+    def __init__(self, metric, labels):
+        self._registry = metric._registry
+        self._key = _sample_key(metric.name, metric.name, labels)
+        self._registry.add((self._key, 0.0))
+    
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        self._registry.add((self._key, amount))
+
+class Counter(_Metric):
+    """Monotonically increasing count; name it ``..._total``."""
+    
+    type_name = 'counter'
+    
+    def _child(self, labels):
+        return _CounterChild(self, labels)
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+class _GaugeChild:
+    def __init__(self, metric, labels):
+        self._registry = metric._registry
+        self._key = _sample_key(metric.name, metric.name, labels)
+        self._registry.add((self._key, 0.0))
+    
+    def set(self, value):
+        self._registry.set(self._key, value)
+    
+    def inc(self, amount=1):
+        self._registry.add((self._key, amount))
+    
+    def dec(self, amount=1):
+        self._registry.add((self._key, -amount))
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. Across processes, ``multiprocess_mode``
+    'sum' adds the values of live processes and 'max' takes the largest.
+    """
+    
+    type_name = 'gauge'
+    
+    def __init__(self, name, documentation, labelnames=(), registry=None, multiprocess_mode='sum'):
+        if multiprocess_mode not in ('sum', 'max'):
+            raise ValueError(f"Unknown multiprocess mode {multiprocess_mode}")
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, labelnames, registry)
+    
+    def _child(self, labels):
+        return _GaugeChild(self, labels)
+    
+    def set(self, value):
+        self.labels().set(value)
+
+class _HistogramChild:
+    def __init__(self, metric, labels):
+        self._registry = metric._registry
+        self._bounds = metric.buckets
+        self._bucket_keys = [
+            _sample_key(metric.name, f"{metric.name}_bucket", labels + [('le', _format_value(bound))])
+            for bound in self._bounds + (math.inf,)
+        ]
+        self._sum_key = _sample_key(metric.name, f"{metric.name}_sum", labels)
+        self._count_key = _sample_key(metric.name, f"{metric.name}_count", labels)
+        self._registry.add(*((key, 0.0) for key in self._bucket_keys + [self._sum_key, self._count_key]))
+    
+    def observe(self, value):
+        # Buckets are stored per bucket and accumulated when rendered, so an observation is three additions
+        bucket_key = self._bucket_keys[bisect_left(self._bounds, value)]
+        self._registry.add((bucket_key, 1.0), (self._sum_key, value), (self._count_key, 1.0))
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative ``le`` buckets."""
+    
+    type_name = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if bound != math.inf))
+        super().__init__(name, documentation, labelnames, registry)
+    
+    def _child(self, labels):
+        return _HistogramChild(self, labels)
+    
+    def observe(self, value):
+        self.labels().observe(value)
+    
+    def _render(self, samples):
+        series = {}
+        for sample_name, labels, value in samples:
+            le = None
+            if sample_name.endswith('_bucket'):
+                le = dict(labels)['le']
+                labels = [(name, label) for name, label in labels if name != 'le']
+            entry = series.setdefault(tuple(map(tuple, labels)), {'buckets': {}, 'sum': 0.0, 'count': 0.0})
+            if le is not None:
+                entry['buckets'][le] = entry['buckets'].get(le, 0.0) + value
+            elif sample_name.endswith('_sum'):
+                entry['sum'] = value
+            else:
+                entry['count'] = value
+        
+        lines = []
+        for labels, entry in sorted(series.items()):
+            labels = list(labels)
+            cumulative = 0.0
+            for le in [_format_value(bound) for bound in self.buckets + (math.inf,)]:
+                cumulative += entry['buckets'].get(le, 0.0)
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(entry['count'])}")
+        return lines
+
+REGISTRY = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: REGISTRY._after_fork())
+
+# Application metrics
+REQUESTS = Counter('buyroll_http_requests_total', 'HTTP requests served.', ('endpoint', 'method', 'status'))
+REQUEST_DURATION = Histogram('buyroll_http_request_duration_seconds', 'Time to serve an HTTP request.',
+                             ('endpoint', 'method'))
+
+DB_QUERY_DURATION = Histogram('buyroll_db_query_duration_seconds', 'SQL statement execution time by fingerprint.',
+                              ('fingerprint', 'operation', 'table'),
+                              buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+DB_QUERY_INFO = Gauge('buyroll_db_query_info', 'Normalized SQL statement of each query fingerprint.',
+                      ('fingerprint', 'statement'), multiprocess_mode='max')
+
+CACHE_REQUESTS = Counter('buyroll_cache_requests_total', 'Cache lookups by result.', ('cache', 'result'))
+
+SYNC_RUNS = Counter('buyroll_sync_runs_total', 'Finished integration syncs.', ('platform', 'status'))
+SYNC_DURATION = Histogram('buyroll_sync_duration_seconds', 'Duration of finished integration syncs.', ('platform',),
+                          buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+SYNC_HTTP_CALLS = Counter('buyroll_sync_http_calls_total', 'HTTP calls made by integration syncs.', ('platform',))
+SYNC_RETRIES = Counter('buyroll_sync_retries_total', 'HTTP retries made by integration syncs.', ('platform',))
+SYNC_ORDERS_INSERTED = Counter('buyroll_sync_orders_inserted_total', 'Orders inserted by integration syncs.',
+                               ('platform',))
+
+SCHEDULER_QUEUE_DEPTH = Gauge('buyroll_scheduler_queue_depth', 'Integration syncs by scheduler state.', ('state',),
+                              multiprocess_mode='max')
+
+# Host metrics are the same in every process; process metrics are summed over the live workers
+SYSTEM_CPU = Gauge('buyroll_system_cpu_percent', 'Host CPU use since the previous sample.', multiprocess_mode='max')
+SYSTEM_MEMORY = Gauge('buyroll_system_memory_percent', 'Host memory in use.', multiprocess_mode='max')
+PROCESS_CPU = Gauge('buyroll_process_cpu_percent', 'CPU use of the worker processes since their previous sample.')
+PROCESS_RSS = Gauge('buyroll_process_resident_memory_bytes', 'Resident memory of the worker processes.')
+PROCESS_OPEN_FDS = Gauge('buyroll_process_open_fds', 'Open file descriptors of the worker processes.')
+PROCESS_THREADS = Gauge('buyroll_process_threads', 'Threads of the worker processes.')
+GC_COLLECTIONS = Counter('buyroll_gc_collections_total', 'Garbage collector runs.')
+GC_PAUSE = Counter('buyroll_gc_pause_seconds_total', 'Time spent in garbage collection.')
+DB_POOL_CHECKED_OUT = Gauge('buyroll_db_pool_checked_out', 'Database connections checked out of the pools.')
+DB_POOL_CHECKOUTS = Counter('buyroll_db_pool_checkouts_total', 'Database connection checkouts.')
+
+# Fingerprints beyond this many are reported as 'other' to bound the label cardinality
+MAX_QUERY_FINGERPRINTS = 500
+
+_fingerprints = set()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_NAMED_PARAMETER = re.compile(r'(?:%\(\w+\)s|:\w+|\$\d+|%s)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+["`\[]?(\w+)', re.IGNORECASE)
+
+@lru_cache(maxsize=4096)
+def query_fingerprint(statement):
+    """
+    ``(fingerprint, operation, table, normalized statement)`` of a SQL statement.
+    
+    Literals and parameters become ``?`` and IN lists collapse to one
+    placeholder, so executions of the same query share a fingerprint.
+    """
+    normalized = _STRING_LITERAL.sub('?', statement)
+    normalized = _NAMED_PARAMETER.sub('?', normalized)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _PLACEHOLDER_LIST.sub('(?)', ' '.join(normalized.split()))
+    fingerprint = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+    operation = normalized.split(' ', 1)[0].lower() if normalized else 'unknown'
+    match = _TABLE.search(normalized)
+    return fingerprint, operation, match.group(1).lower() if match else '', normalized
+
+def observe_query(statement, seconds):
+    fingerprint, operation, table, normalized = query_fingerprint(statement)
+    if fingerprint not in _fingerprints:
+        if len(_fingerprints) >= MAX_QUERY_FINGERPRINTS:
+            fingerprint, table = 'other', ''
+        else:
+            _fingerprints.add(fingerprint)
+            DB_QUERY_INFO.labels(fingerprint, normalized[:200]).set(1)
+    DB_QUERY_DURATION.labels(fingerprint, operation, table).observe(seconds)
+
+def observe_request(endpoint, method, status_code, seconds):
+    REQUESTS.labels(endpoint, method, status_code).inc()
+    REQUEST_DURATION.labels(endpoint, method).observe(seconds)
+
+def observe_cache(cache_name, hit):
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+def observe_sync_run(sync_run):
+    """Count a finished SyncRun."""
+    platform = sync_run.platform or 'unknown'
+    SYNC_RUNS.labels(platform, sync_run.status).inc()
+    if sync_run.started_at and sync_run.finished_at:
+        SYNC_DURATION.labels(platform).observe((sync_run.finished_at - sync_run.started_at).total_seconds())
+    SYNC_HTTP_CALLS.labels(platform).inc(sync_run.http_calls or 0)
+    SYNC_RETRIES.labels(platform).inc(sync_run.retries or 0)
+    SYNC_ORDERS_INSERTED.labels(platform).inc(sync_run.orders_inserted or 0)
+
+def set_scheduler_queue_depth(scheduled, in_flight, backing_off):
+    SCHEDULER_QUEUE_DEPTH.labels('scheduled').set(scheduled)
+    SCHEDULER_QUEUE_DEPTH.labels('in_flight').set(in_flight)
+    SCHEDULER_QUEUE_DEPTH.labels('backing_off').set(backing_off)
+
+_gc_reported = {'collections': 0, 'pause': 0.0}
+
+def observe_system_sample(sample):
+    """Publish a ``SystemSampler`` sample."""
+    SYSTEM_CPU.set(sample['cpu_percent'])
+    SYSTEM_MEMORY.set(sample['memory_percent'])
+    PROCESS_CPU.set(sample['process_cpu_percent'])
+    PROCESS_RSS.set(sample['rss_bytes'])
+    PROCESS_OPEN_FDS.set(sample['open_fds'])
+    PROCESS_THREADS.set(sample['threads'])
+    if sample['db_pool_checked_out'] >= 0:
+        DB_POOL_CHECKED_OUT.set(sample['db_pool_checked_out'])
+    
+    # The sample holds totals since the process started; the counters take the increase
+    GC_COLLECTIONS.inc(max(sample['gc_collections'] - _gc_reported['collections'], 0))
+    GC_PAUSE.inc(max(sample['gc_pause_seconds'] - _gc_reported['pause'], 0.0))
+    _gc_reported.update(collections=sample['gc_collections'], pause=sample['gc_pause_seconds'])
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._prometheus_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_prometheus_start', None)
+    if start is not None:
+        observe_query(statement, time.perf_counter() - start)
+
+def instrument_engine(engine):
+    """Time every statement executed on ``engine``."""
+    from sqlalchemy import event
+    
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+def init_prometheus(app):
+    """Instrument the app's database engine and register ``/metrics/prometheus``."""
+    from flask import Response
+    from app import db
+    
+    REGISTRY.configure_multiprocess(app.config.get('PROMETHEUS_MULTIPROC_DIR'))
+    with app.app_context():
+        instrument_engine(db.engine)
+    
+    @app.route('/metrics/prometheus')
+    def prometheus_metrics():
+        """Metrics of all worker processes in the Prometheus text format."""
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
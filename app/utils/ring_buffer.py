@@ -0,0 +1,147 @@
+"""
+Fixed-capacity columnar ring buffers for metric samples.
+
+Each column is a preallocated ``array.array`` (a NumPy array when NumPy is
+installed), so appending a sample is O(1), memory is fixed by the capacity
+whatever the load, and window queries work on contiguous numeric columns
+instead of lists of dicts.
+"""
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    np = None
+
+# array typecodes and the matching NumPy dtypes
+_DTYPES = {'d': 'float64', 'f': 'float32', 'q': 'int64', 'l': 'int64', 'i': 'int32', 'I': 'uint32', 'H': 'uint16'}
+
+def _allocate(typecode, capacity):
+    if NUMPY_AVAILABLE:
+        return np.zeros(capacity, dtype=_DTYPES[typecode])
+    return array(typecode, bytes(array(typecode).itemsize * capacity))
+
+def _concat(tail, head):
+    if NUMPY_AVAILABLE:
+        return np.concatenate((tail, head))
+    return tail + head
+
+class RingBuffer:
+    """
+    Ring buffer of samples stored column by column.
+    
+    Args:
+        capacity: Samples kept; the oldest is overwritten once full
+        columns: Sequence of ``(name, typecode)`` pairs, in append order
+    
+    The buffer does no locking; callers serialize ``append`` and
+    ``snapshot`` (both are short, fixed-cost operations).
+    """
+    
+    def __init__(self, capacity, columns):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self.column_names = [name for name, _ in columns]
+        self._columns = [_allocate(typecode, capacity) for _, typecode in columns]
+        self._next = 0
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    @property
+    def nbytes(self):
+        """Memory held by the columns."""
+        return sum(column.itemsize * len(column) for column in self._columns)
+    
+    def append(self, *values):
+        """Write one sample, given in column order."""
+        index = self._next
+        for column, value in zip(self._columns, values):
+            column[index] = value
+        self._next = (index + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+    
+    def snapshot(self):
+        """Copy of every column in insertion order, keyed by column name."""
+        if self._size < self.capacity:
+            # array slices are copies; NumPy slices are views and need an explicit copy
+            columns = [column[:self._size].copy() if NUMPY_AVAILABLE else column[:self._size]
+                       for column in self._columns]
+        else:
+            columns = [_concat(column[self._next:], column[:self._next]) for column in self._columns]
+        return dict(zip(self.column_names, columns))
+    
+    def row(self, index):
+        """Sample ``index`` in insertion order (negative counts from the newest) as a dict."""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Ring buffer index out of range")
+        position = (self._next - self._size + index) % self.capacity
+        return {name: column[position].item() if NUMPY_AVAILABLE else column[position]
+                for name, column in zip(self.column_names, self._columns)}
+    
+    def __getitem__(self, index):
+        return self.row(index)
+    
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+def window_start(timestamps, cutoff):
+    """Index of the first sample at or after ``cutoff`` in an ascending timestamp column."""
+    if NUMPY_AVAILABLE:
+        return int(np.searchsorted(timestamps, cutoff, side='left'))
+    return bisect_left(timestamps, cutoff)
+
+def column_stats(values):
+    """``(count, total, minimum, maximum)`` of a numeric column."""
+    if not len(values):
+        return 0, 0.0, 0.0, 0.0
+    if NUMPY_AVAILABLE:
+        return len(values), float(values.sum()), float(values.min()), float(values.max())
+    return len(values), float(sum(values)), float(min(values)), float(max(values))
+
+def grouped_stats(keys, values):
+    """Map each key id to ``(count, total, maximum)`` of its values."""
+    if not len(keys):
+        return {}
+    if NUMPY_AVAILABLE:
+        keys = keys.astype('int64')
+        counts = np.bincount(keys)
+        totals = np.bincount(keys, weights=values)
+        maxima = np.zeros(len(counts))
+        np.maximum.at(maxima, keys, values)
+        return {int(key): (int(counts[key]), float(totals[key]), float(maxima[key]))
+                for key in np.flatnonzero(counts)}
+    
+    stats = {}
+    for key, value in zip(keys, values):
+        count, total, maximum = stats.get(key, (0, 0.0, 0.0))
+        stats[key] = (count + 1, total + value, max(maximum, value))
+    return stats
+
+def value_counts(keys):
+    """Map each key to the number of times it occurs."""
+    if NUMPY_AVAILABLE:
+        unique, counts = np.unique(keys, return_counts=True)
+        return {int(key): int(count) for key, count in zip(unique, counts)}
+    counts = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def select(keys, values, threshold):
+    """Keys and values of the samples whose value is above ``threshold``."""
+    if NUMPY_AVAILABLE:
+        mask = values > threshold
+        return keys[mask], values[mask]
+    pairs = [(key, value) for key, value in zip(keys, values) if value > threshold]
+    return [key for key, _ in pairs], [value for _, value in pairs]
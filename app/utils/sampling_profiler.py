@@ -0,0 +1,321 @@
+"""
+Statistical profiler for running worker processes.
+
+While a profile runs, a background thread wakes up ``hz`` times a second,
+takes the stack of every thread serving a request from
+``sys._current_frames()`` and counts it under the request's endpoint. The
+result is a set of collapsed stacks (``endpoint;outer;...;inner count``)
+that flamegraph.pl, speedscope and similar tools read directly. Only the
+sampling thread does any work, so the cost to requests is the time it
+holds the GIL: about 20-50us per sample, well under 2% at 100 Hz.
+
+Profiles are started from the admin endpoint (profiling the worker that
+serves it) or with ``flask performance profile``, which drops a request
+file into ``PROFILER_DIR``; every worker started with ``PROFILER_ENABLED``
+watches that directory, profiles itself and writes its stacks back for the
+command to merge.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+REQUEST_FILE = 'request.json'
+
+class ProfileResult:
+    """Collapsed stack counts of one or more profiles."""
+    
+    def __init__(self, stacks=None, samples=0, duration=0.0, sampling_seconds=0.0, hz=0, processes=1):
+        self.stacks = stacks or {}  # (endpoint, collapsed stack) -> samples
+        self.samples = samples
+        self.duration = duration
+        self.sampling_seconds = sampling_seconds
+        self.hz = hz
+        self.processes = processes
+    
+    @property
+    def overhead_percent(self):
+        """Share of wall time the sampler held the GIL, per process."""
+        if not self.duration:
+            return 0.0
+        return round(self.sampling_seconds / self.duration / max(self.processes, 1) * 100, 3)
+    
+    def merge(self, other):
+        for key, count in other.stacks.items():
+            self.stacks[key] = self.stacks.get(key, 0) + count
+        self.samples += other.samples
+        self.duration = max(self.duration, other.duration)
+        self.sampling_seconds += other.sampling_seconds
+        self.hz = self.hz or other.hz
+        self.processes += other.processes
+        return self
+    
+    def collapsed(self):
+        """Flamegraph input: one ``endpoint;frame;...;frame count`` line per stack."""
+        lines = [f"{endpoint};{stack} {count}" if stack else f"{endpoint} {count}"
+                 for (endpoint, stack), count in self.stacks.items()]
+        return '\n'.join(sorted(lines)) + ('\n' if lines else '')
+    
+    def summary(self, limit=10):
+        """Samples per endpoint and the functions most often on top of the stack."""
+        endpoints = {}
+        for (endpoint, stack), count in self.stacks.items():
+            entry = endpoints.setdefault(endpoint, {'samples': 0, 'functions': {}})
+            entry['samples'] += count
+            leaf = stack.rsplit(';', 1)[-1]
+            entry['functions'][leaf] = entry['functions'].get(leaf, 0) + count
+        
+        return {
+            'samples': self.samples,
+            'duration_seconds': round(self.duration, 3),
+            'hz': self.hz,
+            'processes': self.processes,
+            'overhead_percent': self.overhead_percent,
+            'endpoints': {
+                endpoint: {
+                    'samples': entry['samples'],
+                    'top_functions': sorted(entry['functions'].items(), key=lambda item: item[1], reverse=True)[:limit]
+                }
+                for endpoint, entry in sorted(endpoints.items(), key=lambda item: item[1]['samples'], reverse=True)
+            }
+        }
+    
+    def to_dict(self):
+        return {
+            'stacks': [[endpoint, stack, count] for (endpoint, stack), count in self.stacks.items()],
+            'samples': self.samples,
+            'duration': self.duration,
+            'sampling_seconds': self.sampling_seconds,
+            'hz': self.hz
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            stacks={(endpoint, stack): count for endpoint, stack, count in data.get('stacks', [])},
+            samples=data.get('samples', 0),
+            duration=data.get('duration', 0.0),
+            sampling_seconds=data.get('sampling_seconds', 0.0),
+            hz=data.get('hz', 0)
+        )
+
+class SamplingProfiler:
+    """
+    Samples the stacks of request threads; one profile runs at a time.
+    
+    ``enter``/``leave`` are called from the request hooks to tell the
+    sampler which endpoint each thread is serving. Threads that aren't
+    serving a request are skipped unless ``all_threads`` is set, in which
+    case they are counted under their thread name.
+    """
+    
+    def __init__(self):
+        self._endpoints = {}  # Thread ident -> endpoint being served
+        self._labels = {}  # Code object -> frame label
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._result = None
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def enter(self, endpoint):
+        self._endpoints[threading.get_ident()] = endpoint or 'unmatched'
+    
+    def leave(self):
+        self._endpoints.pop(threading.get_ident(), None)
+    
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for marker in (f'{os.sep}site-packages{os.sep}', f'{os.sep}app{os.sep}'):
+                if marker in filename:
+                    filename = filename.split(marker, 1)[1]
+                    break
+            else:
+                filename = os.path.basename(filename)
+            label = self._labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+        return label
+    
+    def _collapse(self, frame, max_depth=128):
+        labels = []
+        while frame is not None and len(labels) < max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+    
+    def _sample(self, stacks, all_threads, thread_names):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            endpoint = self._endpoints.get(ident)
+            if endpoint is None:
+                if not all_threads:
+                    continue
+                endpoint = f"thread:{thread_names.get(ident, ident)}"
+            key = (endpoint, self._collapse(frame))
+            stacks[key] = stacks.get(key, 0) + 1
+    
+    def _run(self, seconds, hz, all_threads):
+        interval = 1.0 / hz
+        stacks = {}
+        samples = 0
+        sampling_seconds = 0.0
+        thread_names = {}
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_tick = start
+        
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if all_threads and samples % hz == 0:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            tick_start = time.perf_counter()
+            self._sample(stacks, all_threads, thread_names)
+            sampling_seconds += time.perf_counter() - tick_start
+            samples += 1
+            next_tick = max(next_tick + interval, time.perf_counter())
+            self._stop.wait(next_tick - time.perf_counter())
+        
+        self._result = ProfileResult(stacks, samples, time.perf_counter() - start, sampling_seconds, hz)
+        self._labels.clear()  # Don't keep code objects of reloaded modules alive
+    
+    def start(self, seconds, hz=100, all_threads=False):
+        """Start a profile in the background; raises RuntimeError if one is running."""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("A profile is already running")
+            self._stop.clear()
+            self._result = None
+            self._thread = threading.Thread(target=self._run, args=(seconds, max(int(hz), 1), all_threads),
+                                            name='sampling-profiler', daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """Stop the running profile early."""
+        self._stop.set()
+    
+    def wait(self, timeout=None):
+        """Wait for the profile to finish and return its ProfileResult."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self._result
+    
+    def profile(self, seconds, hz=100, all_threads=False):
+        """Profile this process for ``seconds`` and return the ProfileResult."""
+        self.start(seconds, hz, all_threads)
+        return self.wait()
+
+# Global sampling profiler
+sampling_profiler = SamplingProfiler()
+
+def request_profile(directory, seconds, hz=100, all_threads=False):
+    """Ask the workers watching ``directory`` to profile themselves; returns the request id."""
+    os.makedirs(directory, exist_ok=True)
+    profile_id = uuid.uuid4().hex[:12]
+    request_data = {'id': profile_id, 'seconds': seconds, 'hz': hz, 'all_threads': all_threads,
+                    'requested_at': time.time()}
+    temporary = os.path.join(directory, f".{REQUEST_FILE}.{profile_id}")
+    with open(temporary, 'w') as f:
+        json.dump(request_data, f)
+    os.replace(temporary, os.path.join(directory, REQUEST_FILE))  # Workers never see a partial file
+    return profile_id
+
+def collect_profiles(directory, profile_id):
+    """Merged ProfileResult of the workers that answered a request, or None."""
+    merged = None
+    prefix = f"profile-{profile_id}-"
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith(prefix) and filename.endswith('.json')):
+            continue
+        path = os.path.join(directory, filename)
+        with open(path) as f:
+            result = ProfileResult.from_dict(json.load(f))
+        os.remove(path)
+        merged = result if merged is None else merged.merge(result)
+    return merged
+
+class ProfileRequestWatcher:
+    """Runs profiles requested through a directory in this worker process."""
+    
+    def __init__(self, directory, max_seconds=300, poll_interval=1.0, profiler=None):
+        self.directory = directory
+        self.max_seconds = max_seconds
+        self.poll_interval = poll_interval
+        self.profiler = profiler or sampling_profiler
+        self._handled = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+    
+    def start(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='profile-request-watcher', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _loop(self):
+        path = os.path.join(self.directory, REQUEST_FILE)
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if os.path.exists(path):
+                    self.check(path)
+            except Exception as e:
+                logger.error(f"Error handling profile request: {e}")
+    
+    def check(self, path):
+        """Run the request in ``path`` unless it was handled or is stale; returns whether it ran."""
+        with open(path) as f:
+            request_data = json.load(f)
+        profile_id = request_data['id']
+        seconds = min(float(request_data.get('seconds', 10)), self.max_seconds)
+        if profile_id in self._handled or time.time() - request_data.get('requested_at', 0) > seconds:
+            return False
+        self._handled.add(profile_id)
+        
+        logger.info(f"Profiling for {seconds:.0f}s at {request_data.get('hz', 100)} Hz (request {profile_id})")
+        result = self.profiler.profile(seconds, request_data.get('hz', 100), request_data.get('all_threads', False))
+        target = os.path.join(self.directory, f"profile-{profile_id}-{os.getpid()}.json")
+        with open(target + '.tmp', 'w') as f:
+            json.dump(result.to_dict(), f)
+        os.replace(target + '.tmp', target)
+        return True
+
+_watcher = None
+
+def init_profiler(app):
+    """Watch ``PROFILER_DIR`` for profile requests when ``PROFILER_ENABLED`` is set."""
+    global _watcher
+    if not app.config.get('PROFILER_ENABLED'):
+        return
+    _watcher = ProfileRequestWatcher(app.config['PROFILER_DIR'], app.config.get('PROFILER_MAX_SECONDS', 300))
+    _watcher.start()
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: _watcher is not None and _watcher.start())  # Threads don't survive a fork
+
+def stop_watcher():
+    """Stop answering profile requests in this process (e.g. in the CLI that sends them)."""
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
@@ -1,20 +1,19 @@
+import heapq
+import random
 import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime, timedelta
 
-try:
-    import schedule
-    SCHEDULE_AVAILABLE = True
-except ImportError:
-    SCHEDULE_AVAILABLE = False
-    schedule = None
 from flask import current_app
 from app import db
 from app.models.store_integration import StoreIntegration
-from app.integrations.shopify import ShopifyClient
-from app.integrations.woocommerce import sync_woocommerce_orders
-from app.models.user import User
+from app.models.scheduler_lease import SyncRequest
+from app.utils.leader_election import create_leader_election
+from app.utils.prometheus import set_scheduler_queue_depth
+from app.utils.sync_telemetry import track_sync_run
 
 # Configure logging
 logging.basicConfig(
@@ -23,38 +22,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global flag to control the scheduler thread
-scheduler_running = False
-scheduler_thread = None
+def _sync_integration_record(integration):
+    """Dispatch a sync for an integration to its platform, recording a SyncRun."""
+    # Store clients are imported on the first sync, not when the worker boots
+    if integration.platform == 'shopify':
+        from app.integrations.shopify import sync_shopify_orders as sync
+        logger.info(f"Syncing Shopify integration {integration.id}")
+    elif integration.platform == 'woocommerce':
+        from app.integrations.woocommerce import sync_woocommerce_orders as sync
+        logger.info(f"Syncing WooCommerce integration {integration.id}")
+    else:
+        logger.warning(f"Unknown platform: {integration.platform}")
+        return False
+    
+    with track_sync_run(integration) as outcome:
+        outcome['success'] = sync(integration.id)
+    return outcome['success']
 
 def sync_all_integrations():
-    """Sync all store integrations that need updating."""
+    """Sync all store integrations that need updating, one after another."""
     with current_app.app_context():
-        # Get integrations that haven't been synced in the last 6 hours
-        six_hours_ago = datetime.utcnow() - timedelta(hours=6)
+        interval = current_app.config.get('SYNC_INTERVAL_SECONDS', 6 * 3600)
+        cutoff = datetime.utcnow() - timedelta(seconds=interval)
         integrations = StoreIntegration.query.filter(
-            (StoreIntegration.last_sync == None) | 
-            (StoreIntegration.last_sync < six_hours_ago)
+            (StoreIntegration.last_sync == None) |
+            (StoreIntegration.last_sync < cutoff)
         ).all()
         
         logger.info(f"Found {len(integrations)} integrations to sync")
         
+        if current_app.config.get('SYNC_ASYNC_ENABLED', False):
+            from app.services.async_sync import AsyncSyncRunner
+            
+            AsyncSyncRunner.from_app(current_app._get_current_object()).run(
+                [integration.id for integration in integrations]
+            )
+            return
+        
         for integration in integrations:
             try:
-                if integration.platform == 'shopify':
-                    logger.info(f"Syncing Shopify integration {integration.id}")
-                    user = User.query.get(integration.user_id)
-                    if user:
-                        client = ShopifyClient(integration)
-                        client.sync_orders_for_user(user)
-                    else:
-                        logger.error(f"User not found for integration: {integration.id}")
-                elif integration.platform == 'woocommerce':
-                    logger.info(f"Syncing WooCommerce integration {integration.id}")
-                    sync_woocommerce_orders(integration.id)
-                else:
-                    logger.warning(f"Unknown platform: {integration.platform}")
+                _sync_integration_record(integration)
             except Exception as e:
+                db.session.rollback()
                 logger.error(f"Error syncing integration {integration.id}: {e}")
 
 def sync_integration(integration_id):
@@ -66,86 +75,402 @@ def sync_integration(integration_id):
             return False
         
         try:
-            if integration.platform == 'shopify':
-                logger.info(f"Syncing Shopify integration {integration.id}")
-                user = User.query.get(integration.user_id)
-                if user:
-                    client = ShopifyClient(integration)
-                    count = client.sync_orders_for_user(user)
-                    return count > 0
-                else:
-                    logger.error(f"User not found for integration: {integration.id}")
-                    return False
-            elif integration.platform == 'woocommerce':
-                logger.info(f"Syncing WooCommerce integration {integration.id}")
-                return sync_woocommerce_orders(integration.id)
-            else:
-                logger.warning(f"Unknown platform: {integration.platform}")
-                return False
+            return bool(_sync_integration_record(integration))
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error syncing integration {integration.id}: {e}")
             return False
 
-def run_scheduler():
-    """Run the scheduler in a loop."""
-    global scheduler_running
+class IntegrationScheduler:
+    """
+    Priority-queue scheduler for integration syncs.
     
-    if not SCHEDULE_AVAILABLE:
-        logger.warning("Schedule module not available, scheduler disabled")
-        return
+    Each integration has its own next run time kept in a min-heap. Runs are
+    spread out with jitter, failures back off exponentially, and at most
+    ``max_concurrency`` syncs execute at once on a worker pool.
+    """
+    
+    def __init__(self, interval=6 * 3600, jitter=300, backoff_base=60, backoff_max=6 * 3600,
+                 max_concurrency=4, catchup_spread=300, refresh_interval=300, request_poll_interval=5):
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.catchup_spread = catchup_spread
+        self.refresh_interval = refresh_interval
+        self.request_poll_interval = request_poll_interval
+        
+        self._heap = []  # (next_sync_at timestamp, integration_id)
+        self._next_sync_at = {}  # integration_id -> timestamp; stale heap entries are skipped
+        self._failures = {}  # integration_id -> consecutive failures
+        self._in_flight = set()
+        self._rerun_requested = set()  # In-flight integrations scheduled again meanwhile
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self._executor = None
+        self._async_runner = None
+        self._app = None
+        self._last_refresh = 0
+        self._last_request_poll = 0
+        self.retention_interval = 24 * 3600
+        self._last_retention = 0
+        self._retention_thread = None
     
-    logger.info("Starting scheduler thread")
+    @property
+    def running(self):
+        return self._running and self._thread is not None and self._thread.is_alive()
     
-    # Schedule the sync job to run every hour
-    schedule.every(1).hours.do(sync_all_integrations)
+    def configure(self, app):
+        """Load scheduler settings from the app config."""
+        self.interval = app.config.get('SYNC_INTERVAL_SECONDS', self.interval)
+        self.jitter = app.config.get('SYNC_JITTER_SECONDS', self.jitter)
+        self.backoff_base = app.config.get('SYNC_BACKOFF_BASE_SECONDS', self.backoff_base)
+        self.backoff_max = app.config.get('SYNC_BACKOFF_MAX_SECONDS', self.backoff_max)
+        self.max_concurrency = app.config.get('SYNC_MAX_CONCURRENCY', self.max_concurrency)
+        self.catchup_spread = app.config.get('SYNC_CATCHUP_SPREAD_SECONDS', self.catchup_spread)
+        self.refresh_interval = app.config.get('SCHEDULER_REFRESH_SECONDS', self.refresh_interval)
+        self.request_poll_interval = app.config.get('SCHEDULER_REQUEST_POLL_SECONDS', self.request_poll_interval)
+        self.retention_interval = app.config.get('ERROR_LOG_RETENTION_INTERVAL_SECONDS', self.retention_interval)
     
-    # Run the scheduler loop
-    while scheduler_running:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+    def _jitter(self):
+        return random.uniform(0, self.jitter) if self.jitter else 0
     
-    logger.info("Scheduler thread stopped")
-
-def start_scheduler(app):
-    """Start the scheduler thread."""
-    global scheduler_running, scheduler_thread
+    def schedule(self, integration_id, run_at):
+        """Set the next run time for an integration (timestamp)."""
+        with self._lock:
+            if integration_id in self._in_flight:
+                # Never run the same integration twice at once; rerun when it finishes
+                self._rerun_requested.add(integration_id)
+                return
+            self._next_sync_at[integration_id] = run_at
+            heapq.heappush(self._heap, (run_at, integration_id))
+        self._wakeup.set()
     
-    if scheduler_thread and scheduler_thread.is_alive():
-        logger.warning("Scheduler is already running")
-        return
+    def schedule_now(self, integration_id):
+        """Run an integration as soon as a worker slot is free."""
+        self.schedule(integration_id, time.time())
+    
+    def get_next_sync_at(self, integration_id):
+        """Get the scheduled next run of an integration as a datetime."""
+        with self._lock:
+            run_at = self._next_sync_at.get(integration_id)
+        return datetime.utcfromtimestamp(run_at) if run_at is not None else None
+    
+    def refresh(self):
+        """
+        Pick up integrations that are not scheduled yet.
+        
+        New integrations are scheduled relative to their last sync; overdue
+        ones are spread over ``catchup_spread`` seconds so they don't all
+        fire in the same tick.
+        """
+        now = time.time()
+        integrations = db.session.query(StoreIntegration.id, StoreIntegration.last_sync).all()
+        known_ids = set()
+        
+        for integration_id, last_sync in integrations:
+            known_ids.add(integration_id)
+            with self._lock:
+                if integration_id in self._next_sync_at or integration_id in self._in_flight:
+                    continue
+            
+            if last_sync is None:
+                run_at = now + random.uniform(0, self.catchup_spread)
+            else:
+                due_at = (last_sync - datetime.utcfromtimestamp(0)).total_seconds() + self.interval
+                if due_at <= now:
+                    run_at = now + random.uniform(0, self.catchup_spread)
+                else:
+                    run_at = due_at + self._jitter()
+            self.schedule(integration_id, run_at)
+        
+        # Forget integrations that were deleted
+        with self._lock:
+            for integration_id in set(self._next_sync_at) - known_ids:
+                del self._next_sync_at[integration_id]
+                self._failures.pop(integration_id, None)
+        
+        self._last_refresh = now
+    
+    def drain_sync_requests(self):
+        """Schedule ad-hoc syncs that other processes queued for the leader."""
+        requests = db.session.query(SyncRequest.id, SyncRequest.integration_id).all()
+        if requests:
+            SyncRequest.query.filter(
+                SyncRequest.id.in_([request_id for request_id, _ in requests])
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            
+            for integration_id in {integration_id for _, integration_id in requests}:
+                self.schedule_now(integration_id)
+        
+        self._last_request_poll = time.time()
+        return len(requests)
+    
+    def _pop_due(self, now):
+        """Pop due integrations while worker slots are available."""
+        due = []
+        with self._lock:
+            while self._heap and len(self._in_flight) < self.max_concurrency:
+                run_at, integration_id = self._heap[0]
+                if self._next_sync_at.get(integration_id) != run_at:
+                    heapq.heappop(self._heap)  # Superseded entry
+                    continue
+                if run_at > now:
+                    break
+                heapq.heappop(self._heap)
+                del self._next_sync_at[integration_id]
+                self._in_flight.add(integration_id)
+                due.append(integration_id)
+        return due
+    
+    def _seconds_until_next(self, now):
+        with self._lock:
+            next_run = self._heap[0][0] if self._heap else now + self.refresh_interval
+            at_capacity = len(self._in_flight) >= self.max_concurrency
+        next_refresh = min(self._last_refresh + self.refresh_interval,
+                           self._last_request_poll + self.request_poll_interval)
+        if at_capacity:
+            return max(0, next_refresh - now)
+        return max(0, min(next_run, next_refresh) - now)
+    
+    def _run_job(self, integration_id):
+        """Run one sync on a worker thread and reschedule it."""
+        success = False
+        with self._app.app_context():
+            try:
+                success = sync_integration(integration_id)
+            except Exception as e:
+                logger.error(f"Error syncing integration {integration_id}: {e}")
+            finally:
+                db.session.remove()
+        
+        self._finish_job(integration_id, success)
+    
+    def _async_job_done(self, integration_id, future):
+        """Reschedule a sync that ran on the async runner."""
+        try:
+            success = bool(future.result())
+        except Exception as e:
+            logger.error(f"Error syncing integration {integration_id}: {e}")
+            success = False
+        self._finish_job(integration_id, success)
+    
+    def _finish_job(self, integration_id, success):
+        """Release a finished sync and schedule its next run."""
+        now = time.time()
+        with self._lock:
+            self._in_flight.discard(integration_id)
+            if integration_id in self._rerun_requested:
+                self._rerun_requested.discard(integration_id)
+                delay = 0
+            elif success:
+                self._failures.pop(integration_id, None)
+                delay = self.interval
+            else:
+                failures = self._failures.get(integration_id, 0) + 1
+                self._failures[integration_id] = failures
+                delay = min(self.backoff_base * (2 ** (failures - 1)), self.backoff_max)
+                logger.warning(f"Sync failed for integration {integration_id}, retrying in {delay:.0f}s")
+        self.schedule(integration_id, now + delay + (self._jitter() if delay else 0))
+        self._publish_queue_depth()
+    
+    def _run_error_retention(self):
+        """Archive and delete error logs past their retention."""
+        from app.services.error_retention import ErrorLogRetention
+        
+        with self._app.app_context():
+            try:
+                ErrorLogRetention.run(self._app)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error applying error log retention: {e}")
+            finally:
+                db.session.remove()
+    
+    def _start_due_retention(self, now):
+        """
+        Start the error log retention job when it is due.
+        
+        It runs on the leader only, on its own thread so a long archive never
+        takes one of the ``max_concurrency`` sync slots. At most one run goes
+        at a time; if the previous one is still going it is not started again.
+        """
+        if now - self._last_retention < self.retention_interval:
+            return False
+        if self._retention_thread is not None and self._retention_thread.is_alive():
+            return False
+        self._last_retention = now
+        self._retention_thread = threading.Thread(target=self._run_error_retention, name='error-retention',
+                                                  daemon=True)
+        self._retention_thread.start()
+        return True
+    
+    def _publish_queue_depth(self):
+        with self._lock:
+            depth = (len(self._next_sync_at), len(self._in_flight), len(self._failures))
+        set_scheduler_queue_depth(*depth)
     
-    scheduler_running = True
-    scheduler_thread = threading.Thread(target=run_scheduler)
-    scheduler_thread.daemon = True
-    scheduler_thread.start()
+    def _loop(self):
+        """Scheduler loop: dispatch due integrations, sleep until the next one."""
+        logger.info("Starting scheduler thread")
+        
+        while self._running:
+            now = time.time()
+            if now - self._last_refresh >= self.refresh_interval:
+                with self._app.app_context():
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logger.error(f"Error refreshing scheduled integrations: {e}")
+                    finally:
+                        db.session.remove()
+            
+            if now - self._last_request_poll >= self.request_poll_interval:
+                with self._app.app_context():
+                    try:
+                        self.drain_sync_requests()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Error picking up sync requests: {e}")
+                    finally:
+                        db.session.remove()
+            
+            self._start_due_retention(now)
+            
+            for integration_id in self._pop_due(now):
+                if self._async_runner is not None:
+                    future = self._async_runner.submit(integration_id)
+                    future.add_done_callback(partial(self._async_job_done, integration_id))
+                else:
+                    self._executor.submit(self._run_job, integration_id)
+            self._publish_queue_depth()
+            
+            self._wakeup.wait(self._seconds_until_next(time.time()))
+            self._wakeup.clear()
+        
+        logger.info("Scheduler thread stopped")
     
-    # Run an initial sync
-    with app.app_context():
-        sync_all_integrations()
+    def start(self, app):
+        """Start the scheduler; the initial catch-up runs in the background."""
+        if self.running:
+            logger.warning("Scheduler is already running")
+            return
+        
+        self._app = app
+        self.configure(app)
+        self._running = True
+        self._last_refresh = 0
+        self._last_request_poll = 0
+        self._last_retention = time.time() - self.retention_interval + 600  # First run ten minutes after startup
+        if app.config.get('SYNC_ASYNC_ENABLED', False):
+            # One event loop drives all syncs; worker threads are only used for database writes
+            from app.services.async_sync import AsyncSyncRunner
+            
+            self.max_concurrency = app.config.get('SYNC_ASYNC_CONCURRENCY', 200)
+            self._async_runner = AsyncSyncRunner.from_app(app)
+            self._async_runner.start()
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix='integration-sync')
+        self._thread = threading.Thread(target=self._loop, name='integration-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Scheduler started")
     
-    logger.info("Scheduler started")
+    def stop(self, timeout=5):
+        """Stop the scheduler and wait for running syncs to finish."""
+        if not self.running:
+            logger.warning("Scheduler is not running")
+            return
+        
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._async_runner is not None:
+            self._async_runner.stop(timeout=timeout)
+            self._async_runner = None
+        
+        set_scheduler_queue_depth(0, 0, 0)  # Another process may take over as leader
+        
+        if self._thread.is_alive():
+            logger.warning("Scheduler thread did not stop gracefully")
+        else:
+            logger.info("Scheduler stopped")
+            self._thread = None
+    
+    def get_status(self):
+        """Get queue depth and in-flight syncs."""
+        with self._lock:
+            return {
+                'running': self.running,
+                'scheduled': len(self._next_sync_at),
+                'in_flight': len(self._in_flight),
+                'backing_off': len(self._failures),
+                'max_concurrency': self.max_concurrency,
+                'async': self._async_runner is not None
+            }
 
-def stop_scheduler():
-    """Stop the scheduler thread."""
-    global scheduler_running, scheduler_thread
+# Global scheduler instance
+integration_scheduler = IntegrationScheduler()
+
+# Leader election deciding which process runs the scheduler
+scheduler_election = None
+
+def request_sync(integration_id):
+    """
+    Ask for an integration to be synced as soon as possible.
     
-    if not scheduler_thread or not scheduler_thread.is_alive():
-        logger.warning("Scheduler is not running")
+    The leader schedules it directly; other processes queue a request that
+    the leader picks up within ``SCHEDULER_REQUEST_POLL_SECONDS``.
+    """
+    if integration_scheduler.running:
+        integration_scheduler.schedule_now(integration_id)
         return
     
-    scheduler_running = False
-    scheduler_thread.join(timeout=5)
+    db.session.add(SyncRequest(integration_id=integration_id))
+    db.session.commit()
+
+def start_scheduler(app):
+    """Start the scheduler thread."""
+    integration_scheduler.start(app)
+
+def stop_scheduler():
+    """Stop the scheduler thread and give up leadership."""
+    global scheduler_election
     
-    if scheduler_thread.is_alive():
-        logger.warning("Scheduler thread did not stop gracefully")
-    else:
-        logger.info("Scheduler stopped")
-        scheduler_thread = None
+    if scheduler_election is not None:
+        scheduler_election.stop()  # Stops the scheduler through the demotion callback
+        scheduler_election = None
+    elif integration_scheduler.running:
+        integration_scheduler.stop()
+
+def get_scheduler_status():
+    """Get scheduler status including this process's leadership."""
+    status = integration_scheduler.get_status()
+    status['leader'] = scheduler_election.is_leader if scheduler_election else status['running']
+    status['holder_id'] = scheduler_election.holder_id if scheduler_election else None
+    return status
 
 def init_scheduler(app):
     """Initialize the scheduler for the Flask app."""
-    if not SCHEDULE_AVAILABLE:
-        logger.warning("Schedule module not available, scheduler initialization skipped")
+    global scheduler_election
+    
+    if not app.config.get('SCHEDULER_LEADER_ELECTION', True):
+        start_scheduler(app)
         return
     
-    start_scheduler(app)
\ No newline at end of file
+    if scheduler_election is None:
+        scheduler_election = create_leader_election(
+            app,
+            'integration-scheduler',
+            on_elected=lambda: integration_scheduler.start(app),
+            on_demoted=integration_scheduler.stop
+        )
+    scheduler_election.start(app)
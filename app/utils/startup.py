@@ -0,0 +1,83 @@
+"""
+Startup roles and timing.
+
+``create_app`` runs in web workers, in ``flask`` CLI commands and in tests.
+Only the web role creates missing tables, applies the SQLite PRAGMAs and
+starts the background threads (scheduler, webhook queue, error reports,
+metrics and system samplers); CLI commands load Flask-Migrate instead.
+``APP_ROLE`` sets the role; when it is unset, ``flask <command>`` other than
+``flask run`` is the CLI role and everything else is web.
+
+``create_app`` marks the end of each init step on a ``StartupTimer`` kept in
+``app.extensions['startup']``. ``flask performance startup-profile`` boots
+the app in a fresh interpreter with ``-X importtime`` and combines those
+steps with the import time of each module.
+"""
+
+import os
+import re
+import sys
+import time
+
+WEB = 'web'
+CLI = 'cli'
+
+def detect_role(config):
+    """The configured APP_ROLE, or the role implied by how the process was started."""
+    role = config.get('APP_ROLE')
+    if role:
+        return role
+    # Flask sets this for every `flask` command; `flask run` is the development web server
+    if os.environ.get('FLASK_RUN_FROM_CLI') and 'run' not in sys.argv[1:]:
+        return CLI
+    return WEB
+
+def runs_background_workers(app):
+    """Whether this process starts the scheduler and other background threads."""
+    return app.config.get('APP_ROLE', WEB) == WEB and not app.config.get('TESTING', False)
+
+class StartupTimer:
+    """Wall time of each ``create_app`` step."""
+    
+    def __init__(self, role):
+        self.role = role
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.steps = []  # (name, seconds)
+    
+    def mark(self, name):
+        """End the step called ``name``; it started where the previous one ended."""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+    
+    @property
+    def total_seconds(self):
+        return self._last - self.started
+    
+    def to_dict(self):
+        return {
+            'role': self.role,
+            'total_seconds': round(self.total_seconds, 6),
+            'steps': [{'name': name, 'seconds': round(seconds, 6)} for name, seconds in self.steps]
+        }
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)$')
+
+def import_component(module):
+    """Group modules by blueprint or app module, and third-party code by package."""
+    parts = module.split('.')
+    if parts[0] == 'app':
+        return '.'.join(parts[:3])
+    return parts[0]
+
+def parse_importtime(output):
+    """Seconds of import time per component from ``python -X importtime`` output."""
+    components = {}
+    for line in output.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            # Self time only, so a module isn't counted again in every package that imports it
+            component = import_component(match.group(2))
+            components[component] = components.get(component, 0.0) + int(match.group(1)) / 1e6
+    return components
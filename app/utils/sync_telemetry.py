@@ -0,0 +1,253 @@
+"""
+Per-execution telemetry for integration syncs.
+
+``track_sync_run`` opens a ``SyncRun`` row for one sync and installs a
+recorder in the current context (thread or asyncio task); the store clients and ingest functions
+report HTTP calls, bytes, retries, rate-limit waits and inserted rows to
+it through the module-level ``record_*`` helpers, which are no-ops when no
+sync is being tracked (e.g. for webhook deliveries).
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+from app import db
+from app.utils import prometheus
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('sync_run_recorder', default=None)
+
+class SyncRunRecorder:
+    """Counters for the sync running in this context."""
+    
+    def __init__(self):
+        self.pages = 0
+        self.orders_inserted = 0
+        self.products_inserted = 0
+        self.http_calls = 0
+        self.bytes_transferred = 0
+        self.retries = 0
+        self.rate_limit_waits = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.failure_reason = None
+    
+    def apply_to(self, sync_run):
+        """Copy the counters onto a SyncRun row."""
+        sync_run.pages = self.pages
+        sync_run.orders_inserted = self.orders_inserted
+        sync_run.products_inserted = self.products_inserted
+        sync_run.http_calls = self.http_calls
+        sync_run.bytes_transferred = self.bytes_transferred
+        sync_run.retries = self.retries
+        sync_run.rate_limit_waits = self.rate_limit_waits
+        sync_run.rate_limit_wait_seconds = round(self.rate_limit_wait_seconds, 3)
+
+def current_recorder():
+    """The recorder of the sync tracked in this context, or None."""
+    return _current.get()
+
+@contextmanager
+def recording(recorder):
+    """Report the block's calls and inserts to ``recorder``."""
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+def record_http_response(response, streamed=False):
+    """
+    Count one HTTP call and the size of its response body.
+    
+    A streamed body without ``Content-Length`` is not read here, which would
+    load it into memory; its reader reports it with ``record_bytes_transferred``.
+    """
+    recorder = current_recorder()
+    if recorder is None or response is None:
+        return
+    
+    recorder.http_calls += 1
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit():
+        recorder.bytes_transferred += int(content_length)
+    elif not streamed:
+        recorder.bytes_transferred += len(response.content or b'')
+
+def record_bytes_transferred(count):
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.bytes_transferred += count
+
+def record_page(count=1):
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.pages += count
+
+def record_retry():
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.retries += 1
+
+def record_rate_limit_wait(seconds):
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.rate_limit_waits += 1
+        recorder.rate_limit_wait_seconds += seconds
+
+def record_orders_inserted(count):
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.orders_inserted += count
+
+def record_products_inserted(count):
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.products_inserted += count
+
+def record_failure(reason):
+    """Note why the sync is about to give up; the first reason is kept."""
+    recorder = current_recorder()
+    if recorder is not None and not recorder.failure_reason:
+        recorder.failure_reason = reason
+
+def retry_after_seconds(response, default=1.0, maximum=60.0):
+    """Delay requested by a 429 response's Retry-After header (seconds or HTTP-date), capped at ``maximum``."""
+    value = response.headers.get('Retry-After', '')
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return max(0.0, min(default, maximum))
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, min(delay, maximum))
+
+@contextmanager
+def track_sync_run(integration):
+    """
+    Record a SyncRun for the sync executed inside the block.
+    
+    The block may set ``outcome['success']``; a falsy value, an exception or
+    a recorded failure reason marks the run as failed. Exceptions are
+    re-raised after the run is stored.
+    """
+    from app.models.sync_run import SyncRun
+    
+    sync_run = SyncRun(integration_id=integration.id, platform=integration.platform, status='running')
+    db.session.add(sync_run)
+    db.session.commit()
+    sync_run_id = sync_run.id
+    
+    recorder = SyncRunRecorder()
+    token = _current.set(recorder)
+    outcome = {'success': False}
+    error = None
+    try:
+        yield outcome
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        if error is not None:
+            db.session.rollback()
+        
+        try:
+            sync_run = SyncRun.query.get(sync_run_id)
+            recorder.apply_to(sync_run)
+            sync_run.finished_at = datetime.utcnow()
+            if error is not None:
+                sync_run.status = 'failed'
+                sync_run.failure_reason = recorder.failure_reason or f"{type(error).__name__}: {error}"
+            elif outcome.get('success'):
+                sync_run.status = 'success'
+            else:
+                sync_run.status = 'failed'
+                sync_run.failure_reason = recorder.failure_reason or 'Sync returned no result'
+            db.session.commit()
+            prometheus.observe_sync_run(sync_run)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not record sync run {sync_run_id}: {e}")
+
+def get_sync_cost_report(days=7, limit=20):
+    """
+    Rank integrations by the outbound API budget their syncs used.
+    
+    Stores are ordered by HTTP calls, then bytes transferred, over runs
+    started in the last ``days`` days. Aggregation happens in SQL.
+    """
+    from app.models.sync_run import SyncRun
+    from app.models.store_integration import StoreIntegration
+    
+    since = datetime.utcnow() - timedelta(days=days)
+    http_calls = db.func.sum(SyncRun.http_calls)
+    bytes_transferred = db.func.sum(SyncRun.bytes_transferred)
+    
+    rows = db.session.query(
+        SyncRun.integration_id,
+        StoreIntegration.platform,
+        StoreIntegration.store_url,
+        db.func.count(SyncRun.id),
+        db.func.sum(db.case((SyncRun.status == 'failed', 1), else_=0)),
+        http_calls,
+        bytes_transferred,
+        db.func.sum(SyncRun.pages),
+        db.func.sum(SyncRun.retries),
+        db.func.sum(SyncRun.rate_limit_waits),
+        db.func.sum(SyncRun.rate_limit_wait_seconds),
+        db.func.sum(SyncRun.orders_inserted),
+        db.func.sum(SyncRun.products_inserted),
+        db.func.max(SyncRun.started_at)
+    ).join(
+        StoreIntegration, StoreIntegration.id == SyncRun.integration_id
+    ).filter(
+        SyncRun.started_at >= since
+    ).group_by(
+        SyncRun.integration_id, StoreIntegration.platform, StoreIntegration.store_url
+    ).order_by(
+        http_calls.desc(), bytes_transferred.desc()
+    ).limit(limit).all()
+    
+    totals = db.session.query(
+        db.func.coalesce(http_calls, 0), db.func.coalesce(bytes_transferred, 0)
+    ).filter(SyncRun.started_at >= since).one()
+    total_calls = totals[0]
+    
+    stores = []
+    for (integration_id, platform, store_url, runs, failures, calls, transferred, pages, retries,
+         waits, wait_seconds, orders, products, last_run) in rows:
+        calls = calls or 0
+        orders = orders or 0
+        stores.append({
+            'integration_id': integration_id,
+            'platform': platform,
+            'store_url': store_url,
+            'runs': runs,
+            'failed_runs': failures or 0,
+            'http_calls': calls,
+            'bytes_transferred': transferred or 0,
+            'pages': pages or 0,
+            'retries': retries or 0,
+            'rate_limit_waits': waits or 0,
+            'rate_limit_wait_seconds': round(wait_seconds or 0.0, 3),
+            'orders_inserted': orders,
+            'products_inserted': products or 0,
+            'calls_per_order': round(calls / orders, 2) if orders else None,
+            'share_of_calls': round(calls / total_calls, 4) if total_calls else 0.0,
+            'last_run_at': last_run.isoformat() if last_run else None
+        })
+    
+    return {
+        'days': days,
+        'total_http_calls': total_calls,
+        'total_bytes_transferred': totals[1],
+        'stores': stores
+    }
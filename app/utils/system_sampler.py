@@ -0,0 +1,138 @@
+"""
+Interval-free sampling of host and process metrics.
+
+``psutil.cpu_percent(interval=1)`` sleeps for a second to measure CPU use.
+``SystemSampler`` instead remembers the CPU times of its previous tick and
+reports usage over the time in between, so a sample costs a few syscalls
+and never blocks. Besides host CPU, memory and disk it reports this
+process's RSS, open file descriptors and threads, garbage collector
+activity, and database connection pool checkouts. psutil is imported on
+the first sample rather than at startup.
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+
+from app.utils import prometheus
+
+logger = logging.getLogger(__name__)
+
+class SystemSampler:
+    """Samples host and process metrics; CPU usage is measured since the previous sample."""
+    
+    def __init__(self):
+        self._process = None  # psutil.Process of this process, created on the first sample
+        self._lock = threading.Lock()
+        self._previous = None  # (monotonic time, host CPU times, process CPU seconds)
+        self._engine = None
+        self.db_checkouts = 0
+        self.gc_pause_seconds = 0.0
+        self._gc_started = None
+        gc.callbacks.append(self._on_gc)
+    
+    def _on_gc(self, phase, info):
+        # Called by the interpreter around every collection, with the GIL held
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.gc_pause_seconds += time.perf_counter() - self._gc_started
+            self._gc_started = None
+    
+    def watch_engine(self, engine):
+        """Report the connection pool of ``engine`` and count its checkouts."""
+        from sqlalchemy import event
+        
+        if self._engine is engine:
+            return
+        self._engine = engine
+        if not event.contains(engine, 'checkout', self._on_checkout):
+            event.listen(engine, 'checkout', self._on_checkout)
+    
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.db_checkouts += 1
+        prometheus.DB_POOL_CHECKOUTS.inc()
+    
+    @staticmethod
+    def _busy_and_total(times):
+        total = sum(times)
+        # Guest time is already counted in user/nice on Linux
+        total -= getattr(times, 'guest', 0) + getattr(times, 'guest_nice', 0)
+        idle = times.idle + getattr(times, 'iowait', 0)
+        return total - idle, total
+    
+    def _cpu_usage(self, now, host_times, process_seconds):
+        with self._lock:
+            previous, self._previous = self._previous, (now, host_times, process_seconds)
+        
+        busy, total = self._busy_and_total(host_times)
+        if previous is None:
+            # First tick: averages since boot and since the process started
+            elapsed = max(time.time() - self._process.create_time(), 1e-6)
+            previous_busy = previous_total = previous_process = 0.0
+        else:
+            previous_now, previous_times, previous_process = previous
+            elapsed = max(now - previous_now, 1e-6)
+            previous_busy, previous_total = self._busy_and_total(previous_times)
+        
+        total_delta = total - previous_total
+        cpu_percent = (busy - previous_busy) / total_delta * 100 if total_delta > 0 else 0.0
+        process_cpu_percent = (process_seconds - previous_process) / elapsed * 100
+        return round(max(cpu_percent, 0.0), 1), round(max(process_cpu_percent, 0.0), 1)
+    
+    def _open_fds(self):
+        import psutil
+        
+        try:
+            return self._process.num_fds() if hasattr(self._process, 'num_fds') else self._process.num_handles()
+        except psutil.Error:
+            return -1
+    
+    def _pool_checked_out(self):
+        pool = self._engine.pool if self._engine is not None else None
+        checkedout = getattr(pool, 'checkedout', None)
+        return checkedout() if checkedout is not None else -1  # Single-connection pools don't count
+    
+    def sample(self):
+        """Take one sample; returns a dict of metric values."""
+        import psutil
+        
+        if self._process is None or self._process.pid != os.getpid():
+            # First sample, or a forked worker: measure this process, not the parent
+            self._process = psutil.Process()
+            with self._lock:
+                self._previous = None
+        
+        now = time.monotonic()
+        process_times = self._process.cpu_times()
+        cpu_percent, process_cpu_percent = self._cpu_usage(
+            now, psutil.cpu_times(), process_times.user + process_times.system
+        )
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        gc_stats = gc.get_stats()
+        
+        return {
+            'timestamp': now,
+            'cpu_percent': cpu_percent,
+            'process_cpu_percent': process_cpu_percent,
+            'memory_percent': memory.percent,
+            'memory_available': memory.available,
+            'disk_percent': disk.percent,
+            'disk_free': disk.free,
+            'load_average': os.getloadavg()[0] if hasattr(os, 'getloadavg') else -1.0,
+            'rss_bytes': self._process.memory_info().rss,
+            'open_fds': self._open_fds(),
+            'threads': self._process.num_threads(),
+            'gc_collections': sum(generation['collections'] for generation in gc_stats),
+            'gc_collected': sum(generation['collected'] for generation in gc_stats),
+            'gc_uncollectable': sum(generation['uncollectable'] for generation in gc_stats),
+            'gc_pause_seconds': round(self.gc_pause_seconds, 6),
+            'db_pool_checked_out': self._pool_checked_out(),
+            'db_pool_checkouts': self.db_checkouts
+        }
+
+# Global system sampler
+system_sampler = SystemSampler()
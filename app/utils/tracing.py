@@ -0,0 +1,307 @@
+"""
+Lightweight in-process request tracing.
+
+Every request gets a trace id and a tree of timed spans: SQL statements
+(from SQLAlchemy cursor events), cache gets and sets, outbound HTTP calls
+and Jinja template rendering. Recording a span is a couple of list
+operations; when no trace is active (background jobs, CLI) ``span`` is a
+no-op. Traces of requests slower than ``TRACE_SLOW_THRESHOLD_SECONDS`` are
+kept in a bounded buffer for ``/admin/api/traces`` and, with
+``TRACE_EXPORT_PATH`` set, appended to a file in the Chrome trace event
+format (open it in Perfetto, chrome://tracing or speedscope).
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('trace', default=None)
+
+# W3C trace context header: version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+
+SPAN_KINDS = ('db', 'cache', 'http', 'template')
+
+class Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes')
+    
+    def __init__(self, span_id, parent_id, name, kind, start, attributes):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.end = None
+        self.attributes = attributes
+    
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+    
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+class Trace:
+    """Spans of one request; span 0 is the request itself."""
+    
+    def __init__(self, name, trace_id=None, max_spans=500, attributes=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.max_spans = max_spans
+        self.dropped = 0
+        self.thread_id = threading.get_ident()
+        self.spans = [Span(0, None, name, 'request', time.perf_counter(), attributes or {})]
+        self._stack = [self.spans[0]]
+    
+    @property
+    def root(self):
+        return self.spans[0]
+    
+    @property
+    def duration(self):
+        return self.root.duration
+    
+    def open_span(self, name, kind, attributes):
+        """Start a child of the innermost open span; None once ``max_spans`` is reached."""
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return None
+        span = Span(len(self.spans), self._stack[-1].span_id, name, kind, time.perf_counter(), attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+    
+    def close_span(self, span):
+        if span is None:
+            return
+        span.end = time.perf_counter()
+        if span in self._stack:
+            # Spans closed out of order (e.g. a failed statement) also close the ones they enclose
+            while self._stack[-1] is not span:
+                self._stack.pop().end = span.end
+            self._stack.pop()
+    
+    def finish(self):
+        now = time.perf_counter()
+        for span in self._stack:
+            if span.end is None:
+                span.end = now
+        self._stack = []
+    
+    def breakdown(self):
+        """Seconds spent per span kind, counting nested spans of the same kind once, plus the rest as 'app'."""
+        totals = {kind: 0.0 for kind in SPAN_KINDS}
+        counts = {kind: 0 for kind in SPAN_KINDS}
+        kinds = {span.span_id: span.kind for span in self.spans}
+        for span in self.spans[1:]:
+            if span.kind not in totals:
+                continue
+            counts[span.kind] += 1
+            if kinds.get(span.parent_id) != span.kind:
+                totals[span.kind] += span.duration
+        other = self.duration - sum(totals.values())
+        result = {kind: {'seconds': round(totals[kind], 6), 'count': counts[kind]} for kind in SPAN_KINDS}
+        result['app'] = {'seconds': round(max(other, 0.0), 6), 'count': 1}
+        return result
+    
+    def summary(self):
+        root = self.root
+        return {
+            'trace_id': self.trace_id,
+            'name': root.name,
+            'started_at': self.started_at,
+            'duration': round(self.duration, 6),
+            'status_code': root.attributes.get('status_code'),
+            'spans': len(self.spans),
+            'dropped_spans': self.dropped,
+            'breakdown': self.breakdown()
+        }
+    
+    def to_dict(self):
+        """Summary plus the nested span tree, with offsets from the request start."""
+        origin = self.root.start
+        nodes = {}
+        for span in self.spans:
+            nodes[span.span_id] = {
+                'span_id': f"{span.span_id:016x}",
+                'name': span.name,
+                'kind': span.kind,
+                'offset': round(span.start - origin, 6),
+                'duration': round(span.duration, 6),
+                'attributes': span.attributes,
+                'children': []
+            }
+            if span.parent_id is not None:
+                nodes[span.parent_id]['children'].append(nodes[span.span_id])
+        return {**self.summary(), 'root': nodes[0]}
+    
+    def chrome_events(self, pid=None):
+        """Complete ('X') events of the Chrome trace event format, timestamps in microseconds."""
+        origin = self.root.start
+        start_us = self.started_at * 1e6
+        pid = pid if pid is not None else os.getpid()
+        return [
+            {
+                'name': span.name,
+                'cat': span.kind,
+                'ph': 'X',
+                'ts': round(start_us + (span.start - origin) * 1e6, 1),
+                'dur': round(span.duration * 1e6, 1),
+                'pid': pid,
+                'tid': self.thread_id,
+                'args': {'trace_id': self.trace_id, **span.attributes}
+            }
+            for span in self.spans
+        ]
+
+class Tracer:
+    """Starts request traces and keeps the slow ones."""
+    
+    def __init__(self, slow_threshold=0.5, buffer_size=100, max_spans=500, export_path=None):
+        self.enabled = True
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+        self.export_path = export_path
+        self._slow = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+    
+    def configure(self, config):
+        self.enabled = config.get('TRACING_ENABLED', True)
+        self.slow_threshold = config.get('TRACE_SLOW_THRESHOLD_SECONDS', 0.5)
+        self.max_spans = config.get('TRACE_MAX_SPANS', 500)
+        self.export_path = config.get('TRACE_EXPORT_PATH')
+        with self._lock:
+            self._slow = deque(self._slow, maxlen=config.get('TRACE_BUFFER_SIZE', 100))
+    
+    def start_trace(self, name, traceparent=None, **attributes):
+        """Start the trace of the current request; continues the caller's trace id if given."""
+        if not self.enabled:
+            return None
+        match = _TRACEPARENT.match(traceparent or '')
+        trace = Trace(name, match.group(1) if match else None, self.max_spans, attributes)
+        _current.set(trace)
+        return trace
+    
+    def finish_trace(self):
+        """End the current trace and keep it if it was slow; returns it."""
+        trace = _current.get()
+        if trace is None:
+            return None
+        _current.set(None)
+        trace.finish()
+        if trace.duration >= self.slow_threshold:
+            with self._lock:
+                self._slow.append(trace)
+            if self.export_path:
+                self._export(trace)
+        return trace
+    
+    def _export(self, trace):
+        # JSON array format without the closing bracket, which trace viewers accept, so
+        # events can be appended by several processes
+        try:
+            lines = ''.join(json.dumps(event, default=str) + ',\n' for event in trace.chrome_events())
+            new_file = not os.path.exists(self.export_path) or os.path.getsize(self.export_path) == 0
+            with open(self.export_path, 'a') as f:
+                f.write(('[\n' if new_file else '') + lines)
+        except OSError as e:
+            logger.warning(f"Could not export trace {trace.trace_id}: {e}")
+    
+    def slow_traces(self, limit=50):
+        """Summaries of the slowest kept traces, slowest first."""
+        with self._lock:
+            traces = list(self._slow)
+        return [trace.summary() for trace in sorted(traces, key=lambda t: t.duration, reverse=True)[:limit]]
+    
+    def get_trace(self, trace_id):
+        with self._lock:
+            for trace in self._slow:
+                if trace.trace_id == trace_id:
+                    return trace
+        return None
+    
+    def clear(self):
+        with self._lock:
+            self._slow.clear()
+
+# Global tracer
+tracer = Tracer()
+
+def current_trace():
+    return _current.get()
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    """Time the block as a child span of the current trace (a no-op outside traced requests)."""
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.open_span(name, kind, attributes)
+    try:
+        yield current
+    except Exception as e:
+        if current is not None:
+            current.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        trace.close_span(current)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current.get()
+    if trace is not None and context is not None:
+        context._trace_span = trace.open_span('sql', 'db', {'statement': statement[:500]})
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, '_trace_span', None)
+    if span is not None:
+        trace = _current.get()
+        if trace is not None:
+            span.attributes['rows'] = cursor.rowcount
+            trace.close_span(span)
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, '_trace_span', None)
+    trace = _current.get()
+    if span is not None and trace is not None:
+        span.attributes['error'] = type(exception_context.original_exception).__name__
+        trace.close_span(span)
+
+def _before_render_template(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is not None:
+        trace.open_span(f"render {template.name}", 'template', {'template': template.name})
+
+def _template_rendered(sender, template, context, **extra):
+    trace = _current.get()
+    if trace is None:
+        return
+    for span in reversed(trace._stack):
+        if span.kind == 'template':
+            trace.close_span(span)
+            break
+
+def init_tracing(app):
+    """Configure the tracer and hook it into the app's database engine and template rendering."""
+    from flask import before_render_template, template_rendered
+    from sqlalchemy import event
+    from app import db
+    
+    tracer.configure(app.config)
+    with app.app_context():
+        engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
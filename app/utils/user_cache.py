@@ -0,0 +1,163 @@
+"""
+Cache of the users Flask-Login loads for authenticated requests.
+
+``load_user`` runs on every authenticated request. It is served from a
+per-process cache of ``UserSnapshot`` tuples, keyed by user id and kept for
+``USER_CACHE_TTL_SECONDS``. Updating or deleting a user bumps its version
+in this process, and entries stamped with an older version are never
+served, including one cached by a request that read the row while the
+update was in flight. Other processes see the change once their copy
+expires, so keep the TTL short.
+
+Requests get a ``CachedUser`` that answers the snapshot's columns without
+a query. Anything else (relationships, ``check_password``, assignments)
+loads the ``User`` row on first use, and from then on every attribute
+comes from the row.
+"""
+
+import copy
+import threading
+import time
+from collections import namedtuple
+
+from flask_login import UserMixin
+
+from app import db
+
+SNAPSHOT_FIELDS = ('id', 'email', 'name', 'profile_image', 'created_at', 'last_login', 'settings',
+                   'is_active', 'is_email_verified', 'is_admin')
+
+UserSnapshot = namedtuple('UserSnapshot', SNAPSHOT_FIELDS)
+
+def snapshot_user(user):
+    """Immutable copy of the columns requests read from ``current_user``."""
+    values = {field: getattr(user, field) for field in SNAPSHOT_FIELDS if field != 'is_admin'}
+    values['settings'] = copy.deepcopy(user.settings)
+    values['is_admin'] = getattr(user, 'is_admin', False)  # Checked by admin_required; User may not define it
+    return UserSnapshot(**values)
+
+class CachedUser(UserMixin):
+    """``current_user`` backed by a snapshot; the User row is loaded on demand."""
+    
+    def __init__(self, snapshot, model, user=None):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_user', user)
+    
+    def _load(self):
+        user = self._user
+        if user is None:
+            user = db.session.get(self._model, self._snapshot.id)
+            if user is None:
+                raise AttributeError(f"User {self._snapshot.id} no longer exists")
+            object.__setattr__(self, '_user', user)
+        return user
+    
+    def __getattr__(self, name):
+        # Only called for names not defined on the class or set in __init__
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None and name in SNAPSHOT_FIELDS:
+            value = getattr(self._snapshot, name)
+            # Routes update settings in place before assigning them back
+            return copy.deepcopy(value) if name == 'settings' else value
+        return getattr(self._load(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+    
+    @property
+    def is_active(self):
+        return self._snapshot.is_active if self._user is None else self._user.is_active
+    
+    def get_id(self):
+        return str(self._snapshot.id)
+    
+    def __repr__(self):
+        return f"CachedUser('{self._snapshot.name}', '{self._snapshot.email}')"
+
+class UserCache:
+    """Version-stamped snapshots of users, expiring after ``ttl`` seconds."""
+    
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # User id -> (snapshot, version, expires at)
+        self._versions = {}  # User id -> times it was invalidated
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def configure(self, config):
+        self.ttl = config.get('USER_CACHE_TTL_SECONDS', 30)
+        self.max_entries = config.get('USER_CACHE_MAX_ENTRIES', 10000)
+        self.clear()  # Snapshots of another app's database
+    
+    def get(self, user_id):
+        """The cached snapshot of a user, or None if missing, expired or outdated."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        snapshot, version, expires = entry
+        if expires < time.monotonic() or version != self._versions.get(user_id, 0):
+            self._entries.pop(user_id, None)
+            return None
+        return snapshot
+    
+    def set(self, snapshot, version):
+        """Cache ``snapshot``, read while the user was at ``version``."""
+        now = time.monotonic()
+        with self._lock:
+            if version != self._versions.get(snapshot.id, 0):
+                return  # Invalidated while the row was being read
+            if len(self._entries) >= self.max_entries and snapshot.id not in self._entries:
+                for user_id in [user_id for user_id, entry in self._entries.items() if entry[2] < now]:
+                    del self._entries[user_id]
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[next(iter(self._entries))]  # Oldest entry
+            self._entries[snapshot.id] = (snapshot, version, now + self.ttl)
+    
+    def invalidate(self, user_id):
+        """Drop a user's snapshot; copies read before this call are never cached."""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+    
+    def load(self, user_id, model):
+        """The user as a CachedUser, querying ``model`` only on a miss; None if there is no such user."""
+        if not self.ttl:
+            return db.session.get(model, user_id)
+        
+        snapshot = self.get(user_id)
+        if snapshot is not None:
+            self.hits += 1
+            return CachedUser(snapshot, model)
+        
+        self.misses += 1
+        version = self._versions.get(user_id, 0)
+        user = db.session.get(model, user_id)
+        if user is None:
+            return None
+        snapshot = snapshot_user(user)
+        self.set(snapshot, version)
+        return CachedUser(snapshot, model, user)  # The row is already loaded for this request
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 2) if total else 0,
+            'ttl_seconds': self.ttl
+        }
+
+# Global user cache
+user_cache = UserCache()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -9,6 +10,10 @@ class Config:
     # Flask settings
     SECRET_KEY = os.environ.get('SECRET_KEY') or '3b1f45b0c645c4427a3b2a3e3e73c1ed3a3b2a3e3e73c1ed'
     
+    # Process role: 'web' creates tables and starts background workers, 'cli' skips both;
+    # detected when unset (`flask <command>` other than `flask run` is 'cli')
+    APP_ROLE = os.environ.get('APP_ROLE')
+    
     # Site URL for email links
     SITE_URL = os.environ.get('SITE_URL') or 'http://localhost:5000'
     
@@ -61,6 +66,122 @@ class Config:
     # Scheduler settings
     SCHEDULER_API_ENABLED = False
     SCHEDULER_TIMEZONE = 'UTC'
+    SYNC_INTERVAL_SECONDS = 6 * 3600  # Sync each integration every 6 hours
+    SYNC_JITTER_SECONDS = 300
+    SYNC_BACKOFF_BASE_SECONDS = 60  # Doubled after each consecutive failure
+    SYNC_BACKOFF_MAX_SECONDS = 6 * 3600
+    SYNC_MAX_CONCURRENCY = int(os.environ.get('SYNC_MAX_CONCURRENCY') or 4)
+    SYNC_CATCHUP_SPREAD_SECONDS = 300  # Spread overdue syncs at startup over this window
+    SYNC_ASYNC_ENABLED = os.environ.get('SYNC_ASYNC_ENABLED', 'false').lower() in ['true', 'on', '1']  # Fetch on one event loop
+    SYNC_ASYNC_CONCURRENCY = int(os.environ.get('SYNC_ASYNC_CONCURRENCY') or 200)  # Stores fetched at once in async mode
+    SYNC_DB_BATCH_SIZE = 50  # Async mode: fetched syncs written per transaction
+    SYNC_DB_BATCH_DELAY = 0.5  # Async mode: seconds a partial batch waits before it is written
+    SYNC_DB_WORKERS = 2
+    ASYNC_HTTP_CONNECTIONS_PER_HOST = 4
+    ASYNC_HTTP_MAX_RETRIES = 3
+    ASYNC_HTTP_TIMEOUT = 30
+    SCHEDULER_REFRESH_SECONDS = 300  # How often to pick up new integrations
+    SCHEDULER_REQUEST_POLL_SECONDS = 5  # How often the leader picks up ad-hoc sync requests
+    SCHEDULER_LEADER_ELECTION = True  # Only the elected process runs the scheduler
+    LEADER_ELECTION_BACKEND = os.environ.get('LEADER_ELECTION_BACKEND') or 'database'  # 'database' or 'file'
+    LEADER_ELECTION_LEASE_SECONDS = 30  # A dead leader is replaced after at most this long
+    LEADER_ELECTION_LOCK_DIR = os.environ.get('LEADER_ELECTION_LOCK_DIR') or '/tmp'
+    
+    # Logging; handlers run on a background thread fed by a bounded queue
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_FILE = os.environ.get('LOG_FILE', 'logs/app.log')
+    LOG_QUEUE_ENABLED = os.environ.get('LOG_QUEUE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    LOG_QUEUE_OVERFLOW = os.environ.get('LOG_QUEUE_OVERFLOW') or 'drop'  # 'drop' discards records below WARNING when full, 'block' waits
+    LOG_QUEUE_BLOCK_SECONDS = 1.0  # Longest a full queue holds up a record before it is dropped
+    LOG_ACCESS_SAMPLE_RATE = float(os.environ.get('LOG_ACCESS_SAMPLE_RATE') or 1.0)  # Share of requests with an access-log line
+    LOG_ACCESS_SLOW_SECONDS = 1.0  # Slower requests and server errors are always logged
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text'  # 'json' writes one JSON object per line (NDJSON)
+    LOG_JSON_FIELDS = [f.strip() for f in os.environ.get('LOG_JSON_FIELDS', '').split(',') if f.strip()] or None  # None keeps all
+    LOG_JSON_MAX_FIELD_LENGTH = int(os.environ.get('LOG_JSON_MAX_FIELD_LENGTH') or 2048)  # Longer strings are truncated
+    LOG_JSON_FAST_SERIALIZER = True  # Use orjson when it is installed
+    
+    # Error reporting; reports are stored, counted and emailed by a background worker
+    ERROR_REPORT_QUEUE_SIZE = 1000  # Reports beyond this are dropped during an error storm
+    ERROR_REPORT_FLUSH_SECONDS = 2.0
+    ERROR_DIGEST_WINDOW_SECONDS = int(os.environ.get('ERROR_DIGEST_WINDOW_SECONDS') or 300)  # One email per error group per window
+    ERROR_NOTIFICATION_EMAIL = os.environ.get('ERROR_NOTIFICATION_EMAIL')
+    ERROR_LOG_RETENTION_DAYS = int(os.environ.get('ERROR_LOG_RETENTION_DAYS') or 90)  # Older rows are archived and deleted; 0 keeps all
+    ERROR_LOG_ARCHIVE_DIR = os.environ.get('ERROR_LOG_ARCHIVE_DIR')  # Defaults to instance/error_archive
+    ERROR_LOG_RETENTION_CHUNK_SIZE = 1000  # Rows archived and deleted per transaction
+    ERROR_LOG_RETENTION_INTERVAL_SECONDS = 24 * 3600  # How often the scheduler leader applies retention
+    
+    # Performance monitoring settings (samples kept in memory, ~40 bytes each)
+    PERFORMANCE_REQUEST_BUFFER_SIZE = int(os.environ.get('PERFORMANCE_REQUEST_BUFFER_SIZE') or 100000)
+    PERFORMANCE_QUERY_BUFFER_SIZE = int(os.environ.get('PERFORMANCE_QUERY_BUFFER_SIZE') or 50000)
+    PERFORMANCE_SYSTEM_BUFFER_SIZE = 1440  # System samples kept (a day at one per minute)
+    PERFORMANCE_SYSTEM_SAMPLE_SECONDS = int(os.environ.get('PERFORMANCE_SYSTEM_SAMPLE_SECONDS') or 60)
+    
+    # Users loaded for authenticated requests are cached per process; changes made by
+    # other processes show up after the TTL (0 disables the cache)
+    USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS') or 30)
+    USER_CACHE_MAX_ENTRIES = 10000
+    
+    # Health checks and /metrics; business counts are refreshed in the background
+    HEALTH_DB_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_DB_TIMEOUT_SECONDS') or 2.0)  # Liveness SELECT 1 limit
+    METRICS_REFRESH_SECONDS = int(os.environ.get('METRICS_REFRESH_SECONDS') or 60)
+    METRICS_MAX_STALENESS_SECONDS = int(os.environ.get('METRICS_MAX_STALENESS_SECONDS') or 300)  # Older counts are recomputed on request
+    
+    # Sampling profiler; enabled workers run profiles requested by `flask performance profile`
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() in ['true', 'on', '1']
+    PROFILER_DIR = os.environ.get('PROFILER_DIR') or os.path.join(tempfile.gettempdir(), 'buyroll-profiler')
+    PROFILER_DEFAULT_HZ = 100
+    PROFILER_MAX_HZ = 250  # Keeps sampling overhead low on a serving worker
+    PROFILER_MAX_SECONDS = 300
+    
+    # Request tracing; span trees of slow requests are kept for /admin/api/traces
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() in ['true', 'on', '1']
+    TRACE_SLOW_THRESHOLD_SECONDS = float(os.environ.get('TRACE_SLOW_THRESHOLD_SECONDS') or 0.5)
+    TRACE_BUFFER_SIZE = 100
+    TRACE_MAX_SPANS = 500  # Per request; later spans are counted as dropped
+    TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH')  # Slow traces appended in Chrome trace event format
+    
+    # Prometheus metrics; with a directory set, every worker process writes its metrics there
+    # and /metrics/prometheus merges them (empty the directory when the server starts)
+    PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    
+    # Catalog ingest settings
+    CATALOG_INGEST_BATCH_SIZE = int(os.environ.get('CATALOG_INGEST_BATCH_SIZE') or 500)
+    CATALOG_INGEST_CONCURRENCY = int(os.environ.get('CATALOG_INGEST_CONCURRENCY') or 4)  # Pages fetched in parallel
+    
+    # Product image storage settings
+    PRODUCT_IMAGE_LOCAL_STORAGE = os.environ.get('PRODUCT_IMAGE_LOCAL_STORAGE', 'true').lower() in ['true', 'on', '1']
+    PRODUCT_IMAGE_ROOT = os.environ.get('PRODUCT_IMAGE_ROOT')  # Defaults to app/static/images/products
+    # URL the image root is served from; needed when PRODUCT_IMAGE_ROOT is outside the static folder
+    PRODUCT_IMAGE_URL_PREFIX = os.environ.get('PRODUCT_IMAGE_URL_PREFIX')
+    IMAGE_MAX_BYTES = 10 * 1024 * 1024
+    IMAGE_DOWNLOAD_TIMEOUT = 10
+    IMAGE_DOWNLOAD_WORKERS = 4
+    IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS') or 2)  # 0 resizes in-process
+    
+    # Outbound HTTP transport settings (store APIs, OAuth providers, image hosts)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT') or 5)
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT') or 30)
+    HTTP_MAX_RETRIES = 3  # Retries after a 429/5xx or connection error, honoring Retry-After
+    HTTP_BACKOFF_BASE = 0.5  # Seconds before the first retry; doubled and jittered per attempt
+    HTTP_BACKOFF_MAX = 30
+    HTTP_CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before a host fails fast
+    HTTP_CIRCUIT_RESET_SECONDS = 60  # How long an open circuit fails fast before a trial request
+    HTTP_POOL_MAXSIZE = 10  # Pooled connections per host
+    
+    # Store API HTTP cache settings
+    HTTP_CACHE_ENABLED = os.environ.get('HTTP_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    HTTP_CACHE_PATH = os.environ.get('HTTP_CACHE_PATH')  # Defaults to instance/http_cache.sqlite
+    HTTP_CACHE_TTL_SECONDS = 3600  # Products and customers are served from cache this long without a request
+    HTTP_CACHE_MAX_ENTRIES = 10000
+    HTTP_CACHE_MAX_BODY_BYTES = 1024 * 1024
+    
+    # Webhook ingestion queue settings
+    WEBHOOK_QUEUE_WORKERS = int(os.environ.get('WEBHOOK_QUEUE_WORKERS') or 2)
+    WEBHOOK_QUEUE_BATCH_SIZE = int(os.environ.get('WEBHOOK_QUEUE_BATCH_SIZE') or 50)
+    WEBHOOK_QUEUE_POLL_INTERVAL = float(os.environ.get('WEBHOOK_QUEUE_POLL_INTERVAL') or 2.0)
+    WEBHOOK_QUEUE_MAX_ATTEMPTS = 5
+    WEBHOOK_QUEUE_STALE_SECONDS = 300
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -72,6 +193,10 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
     SCHEDULER_API_ENABLED = False
+    PRODUCT_IMAGE_LOCAL_STORAGE = False
+    HTTP_CACHE_ENABLED = False
+    HTTP_BACKOFF_BASE = 0.01
+    METRICS_MAX_STALENESS_SECONDS = 0  # Counts are recomputed on every request
 
 class ProductionConfig(Config):
     DEBUG = False
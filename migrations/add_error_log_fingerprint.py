@@ -0,0 +1,32 @@
+"""
+Database migration to add the fingerprint column used to group error reports
+"""
+
+from sqlalchemy import inspect, text
+from app import db
+
+def upgrade():
+    """Add the indexed fingerprint column to error_logs."""
+    columns = [column['name'] for column in inspect(db.engine).get_columns('error_logs')]
+    if 'fingerprint' in columns:
+        print("✅ error_logs.fingerprint already exists")
+        return
+    
+    db.session.execute(text("ALTER TABLE error_logs ADD COLUMN fingerprint VARCHAR(16)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_error_logs_fingerprint ON error_logs (fingerprint)"))
+    db.session.commit()
+    print("✅ Added error_logs.fingerprint for error grouping")
+
+def downgrade():
+    """Drop the fingerprint column from error_logs."""
+    db.session.execute(text("DROP INDEX IF EXISTS ix_error_logs_fingerprint"))
+    db.session.execute(text("ALTER TABLE error_logs DROP COLUMN fingerprint"))
+    db.session.commit()
+    print("❌ Dropped error_logs.fingerprint")
+
+if __name__ == "__main__":
+    from app import create_app
+    
+    app = create_app()
+    with app.app_context():
+        upgrade()
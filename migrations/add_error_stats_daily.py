@@ -0,0 +1,52 @@
+"""
+Database migration to add the daily error rollup and the error_logs indexes used by the admin filters
+"""
+
+from sqlalchemy import inspect, text
+from app import db
+from app.models.error_log import ErrorLog, ErrorStatDaily
+
+def upgrade():
+    """Create error_stats_daily, rebuild it from error_logs and add the error_logs indexes."""
+    if not inspect(db.engine).has_table('error_stats_daily'):
+        ErrorStatDaily.__table__.create(db.engine)
+        print("✅ Created error_stats_daily")
+    
+    # create_app() may already have created the table empty, and rows added since then are
+    # only partial counts, so rebuild every day still in error_logs. Days whose rows were
+    # archived keep their counts.
+    db.session.execute(text("""
+        DELETE FROM error_stats_daily
+        WHERE day IN (SELECT DISTINCT DATE(timestamp) FROM error_logs)
+    """))
+    result = db.session.execute(text("""
+        INSERT INTO error_stats_daily (day, error_type, severity, error_count, resolved_count)
+        SELECT DATE(timestamp), error_type, severity, COUNT(*),
+               SUM(CASE WHEN resolved THEN 1 ELSE 0 END)
+        FROM error_logs
+        GROUP BY DATE(timestamp), error_type, severity
+    """))
+    db.session.commit()
+    print(f"✅ Backfilled error_stats_daily ({result.rowcount} rows)")
+    
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('error_logs')}
+    for index in ErrorLog.__table__.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+            print(f"✅ Created index {index.name}")
+
+def downgrade():
+    """Drop the error_logs indexes and error_stats_daily."""
+    for index in ErrorLog.__table__.indexes:
+        if index.name != 'ix_error_logs_fingerprint':
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    db.session.execute(text("DROP TABLE IF EXISTS error_stats_daily"))
+    db.session.commit()
+    print("❌ Dropped error_stats_daily and the error_logs filter indexes")
+
+if __name__ == "__main__":
+    from app import create_app
+    
+    app = create_app()
+    with app.app_context():
+        upgrade()
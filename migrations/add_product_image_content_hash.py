@@ -0,0 +1,30 @@
+"""
+Database migration to add the content_hash column used for diff-based image updates
+"""
+
+from sqlalchemy import inspect, text
+from app import db
+
+def upgrade():
+    """Add the content_hash column to product_images."""
+    columns = [column['name'] for column in inspect(db.engine).get_columns('product_images')]
+    if 'content_hash' in columns:
+        print("✅ product_images.content_hash already exists")
+        return
+    
+    db.session.execute(text("ALTER TABLE product_images ADD COLUMN content_hash VARCHAR(64)"))
+    db.session.commit()
+    print("✅ Added product_images.content_hash for image change detection")
+
+def downgrade():
+    """Drop the content_hash column from product_images."""
+    db.session.execute(text("ALTER TABLE product_images DROP COLUMN content_hash"))
+    db.session.commit()
+    print("❌ Dropped product_images.content_hash")
+
+if __name__ == "__main__":
+    from app import create_app
+    
+    app = create_app()
+    with app.app_context():
+        upgrade()
@@ -0,0 +1,60 @@
+"""
+Database migration to make (source, external_id) unique on products
+"""
+
+from sqlalchemy import inspect, text
+from app import db
+
+INDEX_NAME = 'uq_product_source_external_id'
+
+def merge_duplicate_products():
+    """Point purchases and images of duplicate products at the oldest copy and delete the rest."""
+    duplicates = db.session.execute(text("""
+        SELECT source, external_id, MIN(id) AS keep_id
+        FROM product
+        WHERE external_id IS NOT NULL
+        GROUP BY source, external_id
+        HAVING COUNT(*) > 1
+    """)).fetchall()
+    
+    removed = 0
+    for source, external_id, keep_id in duplicates:
+        params = {'source': source, 'external_id': external_id, 'keep_id': keep_id}
+        duplicate_ids = "SELECT id FROM product WHERE source = :source AND external_id = :external_id AND id != :keep_id"
+        
+        db.session.execute(text(f"UPDATE purchase SET product_id = :keep_id WHERE product_id IN ({duplicate_ids})"), params)
+        db.session.execute(text(f"DELETE FROM product_images WHERE product_id IN ({duplicate_ids})"), params)
+        removed += db.session.execute(text(
+            "DELETE FROM product WHERE source = :source AND external_id = :external_id AND id != :keep_id"
+        ), params).rowcount
+    
+    db.session.commit()
+    return removed
+
+def upgrade():
+    """Merge duplicate products and add the unique index."""
+    indexes = [index['name'] for index in inspect(db.engine).get_indexes('product')]
+    if INDEX_NAME in indexes:
+        print(f"✅ {INDEX_NAME} already exists")
+        return
+    
+    removed = merge_duplicate_products()
+    if removed:
+        print(f"🔄 Merged {removed} duplicate products")
+    
+    db.session.execute(text(f"CREATE UNIQUE INDEX {INDEX_NAME} ON product (source, external_id)"))
+    db.session.commit()
+    print(f"✅ Added unique index {INDEX_NAME}")
+
+def downgrade():
+    """Drop the unique index."""
+    db.session.execute(text(f"DROP INDEX {INDEX_NAME}"))
+    db.session.commit()
+    print(f"❌ Dropped {INDEX_NAME}")
+
+if __name__ == "__main__":
+    from app import create_app
+    
+    app = create_app()
+    with app.app_context():
+        upgrade()
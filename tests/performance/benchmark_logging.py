@@ -0,0 +1,169 @@
+"""
+Benchmark for request logging.
+
+Serves a trivial endpoint from several threads through the test client
+and reports requests per second with the handlers called on the request
+thread (the old setup, with its two log lines per request), with the
+queue-based handlers and one access line per request, and with the access
+log sampled at 10%. Console output goes to /dev/null and the log file to a
+temporary directory; point ``LOG_FILE`` at a slow disk to see the
+difference grow.
+
+``run_event_benchmark`` measures ``StructuredLogger`` events per second
+for an error report payload, written through a handler to /dev/null: the
+old ``json.dumps`` of the whole payload in a text line against the JSON
+formatter with the standard library and with the fast serializer.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import request
+
+from app import create_app
+from config import TestingConfig
+
+def _make_app(log_file, queue_enabled, sample_rate, legacy_lines):
+    class BenchmarkConfig(TestingConfig):
+        LOG_FILE = log_file
+        LOG_QUEUE_ENABLED = queue_enabled
+        LOG_ACCESS_SAMPLE_RATE = sample_rate
+    
+    app = create_app(BenchmarkConfig)
+    
+    if legacy_lines:
+        # The request and response lines the access log replaced
+        @app.before_request
+        def log_request_info():
+            app.logger.info(f"Request: {request.method} {request.path} from {request.remote_addr} "
+                            f"User-Agent: {request.headers.get('User-Agent', 'Unknown')}")
+        
+        @app.after_request
+        def log_response_info(response):
+            app.logger.info(f"Response: {response.status_code} for {request.method} {request.path}")
+            return response
+    
+    app.add_url_rule('/_benchmark', 'benchmark', lambda: 'ok')
+    return app
+
+def _serve(app, requests, threads):
+    per_thread = requests // threads
+    
+    def worker():
+        client = app.test_client()
+        for _ in range(per_thread):
+            client.get('/_benchmark')
+    
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads, time.perf_counter() - start
+
+def run_benchmark(requests=5000, threads=8):
+    """Run the benchmark and return requests per second per logging setup."""
+    from app.utils.logging_config import stop_logging
+    
+    setups = (
+        ('synchronous', False, 1.0, True),
+        ('queue', True, 1.0, False),
+        ('queue_sampled', True, 0.1, False),
+    )
+    results = {}
+    
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stderr(devnull):
+        for label, queue_enabled, sample_rate, legacy_lines in setups:
+            log_file = os.path.join(directory, f"{label}.log")
+            app = _make_app(log_file, queue_enabled, sample_rate, legacy_lines)
+            _serve(app, threads * 20, threads)  # Warm up
+            
+            served, seconds = _serve(app, requests, threads)
+            stop_logging()  # Queued records are written before the file is measured
+            results[label] = {
+                'requests': served,
+                'seconds': round(seconds, 3),
+                'requests_per_second': round(served / seconds, 1),
+                'log_bytes': os.path.getsize(log_file)
+            }
+    
+    return results
+
+def error_report_payload():
+    """An ErrorReporter payload with a traceback and request headers."""
+    return {
+        'error_type': 'OperationalError',
+        'error_message': 'database is locked',
+        'severity': 'high',
+        'context': {'endpoint': 'user.dashboard', 'retries': 3},
+        'user_id': 42,
+        'traceback': 'Traceback (most recent call last):\n' + '  File "app/routes/user.py", line 120, in dashboard\n' * 60,
+        'request_data': {
+            'url': 'https://buyroll.example/user/dashboard?page=2',
+            'method': 'GET',
+            'headers': {f'X-Header-{i}': 'x' * 40 for i in range(30)},
+            'args': {'page': '2'}
+        },
+        'environment': 'production'
+    }
+
+def _legacy_log_event(logger, level, event_type, message, **kwargs):
+    """The original log_event, kept as the reference implementation."""
+    from datetime import datetime
+    log_data = {'timestamp': datetime.utcnow().isoformat(), 'event_type': event_type, 'message': message,
+                'user_id': None, 'request_id': None, **kwargs}
+    logger.log(level, json.dumps(log_data))
+
+def run_event_benchmark(events=20000):
+    """Run the structured event benchmark and return events per second per setup."""
+    from app.utils.logging_config import (
+        StructuredLogger, JSONFormatter, TEXT_FORMAT, ORJSON_AVAILABLE, configure_json_logging
+    )
+    
+    payload = error_report_payload()
+    setups = [('legacy', logging.Formatter(TEXT_FORMAT), None), ('json', JSONFormatter(), False)]
+    if ORJSON_AVAILABLE:
+        setups.append(('json_fast', JSONFormatter(), True))
+    results = {}
+    
+    with open(os.devnull, 'w') as devnull:
+        for label, formatter, fast in setups:
+            logger = logging.getLogger(f'benchmark.{label}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = logging.StreamHandler(devnull)
+            handler.setFormatter(formatter)
+            logger.handlers = [handler]
+            
+            if fast is None:
+                emit = lambda: _legacy_log_event(logger, logging.ERROR, 'error_report', 'Error reported', **payload)
+            else:
+                configure_json_logging(max_field_length=2048, fast=fast)
+                structured = StructuredLogger(logger.name)
+                emit = lambda: structured.log_event(logging.ERROR, 'error_report', 'Error reported', **payload)
+            
+            start = time.perf_counter()
+            for _ in range(events):
+                emit()
+            seconds = time.perf_counter() - start
+            logger.handlers = []
+            results[label] = {'events': events, 'seconds': round(seconds, 3),
+                              'events_per_second': round(events / seconds, 1)}
+    
+    configure_json_logging()
+    return results
+
+if __name__ == '__main__':
+    for label, result in run_benchmark().items():
+        print(f"{label}: {result['requests']} requests in {result['seconds']:.2f}s "
+              f"({result['requests_per_second']:.0f} req/s, {result['log_bytes']} bytes logged)")
+    for label, result in run_event_benchmark().items():
+        print(f"{label}: {result['events']} events in {result['seconds']:.2f}s "
+              f"({result['events_per_second']:.0f} events/s)")
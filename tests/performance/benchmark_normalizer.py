@@ -0,0 +1,107 @@
+"""
+Benchmark for product category normalization.
+
+Compares the original linear substring scan, a single alternation regex
+and the memoized matcher on 1M category strings, both for a realistic
+catalog (few distinct strings) and for all-unique strings.
+"""
+
+import random
+import re
+import string
+import time
+
+from app.utils.product_normalizer import (
+    CATEGORY_MAPPING, normalize_category, normalize_categories, _match_category
+)
+
+def legacy_normalize_category(category_string):
+    """The original O(mapping keys) scan, kept as the reference implementation."""
+    if not category_string:
+        return 'Other'
+    
+    category_lower = category_string.lower()
+    if category_lower in CATEGORY_MAPPING:
+        return CATEGORY_MAPPING[category_lower]
+    
+    for key, value in CATEGORY_MAPPING.items():
+        if key in category_lower:
+            return value
+    
+    return 'Other'
+
+_KEYS = list(CATEGORY_MAPPING)
+_PRIORITY = {key: index for index, key in enumerate(_KEYS)}
+_ALTERNATION = re.compile('|'.join(re.escape(key) for key in _KEYS))
+
+def regex_normalize_category(category_string):
+    """Single alternation regex with the same first-key semantics, for comparison."""
+    if not category_string:
+        return 'Other'
+    
+    category_lower = category_string.lower()
+    if category_lower in CATEGORY_MAPPING:
+        return CATEGORY_MAPPING[category_lower]
+    
+    best = None
+    match = _ALTERNATION.search(category_lower)
+    while match:
+        priority = _PRIORITY[match.group()]
+        if best is None or priority < best:
+            best = priority
+        match = _ALTERNATION.search(category_lower, match.start() + 1)
+    
+    return CATEGORY_MAPPING[_KEYS[best]] if best is not None else 'Other'
+
+def generate_categories(count, distinct=2000, seed=42):
+    """Generate category strings drawn from ``distinct`` variants; 0 means all unique."""
+    rng = random.Random(seed)
+    words = list(CATEGORY_MAPPING) + ['Men', 'Women', 'Sale', 'New Arrivals', 'Gift Ideas', 'Outdoor Gear']
+    
+    def make():
+        parts = [rng.choice(words).title() for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.3:
+            parts.append(''.join(rng.choice(string.ascii_lowercase) for _ in range(8)))
+        return ' > '.join(parts)
+    
+    if not distinct:
+        return [make() for _ in range(count)]
+    
+    variants = [make() for _ in range(distinct)]
+    return [rng.choice(variants) for _ in range(count)]
+
+def _time(func, values):
+    start = time.perf_counter()
+    func(values)
+    return time.perf_counter() - start
+
+def run_benchmark(count=1_000_000):
+    """Run the benchmark and return timings in seconds."""
+    results = {}
+    
+    for label, distinct in (('catalog', 2000), ('unique', 0)):
+        values = generate_categories(count, distinct=distinct)
+        
+        _match_category.cache_clear()
+        legacy = _time(lambda vs: [legacy_normalize_category(v) for v in vs], values)
+        regex = _time(lambda vs: [regex_normalize_category(v) for v in vs], values)
+        memoized = _time(normalize_categories, values)
+        
+        sample = values[:10000]
+        assert [legacy_normalize_category(v) for v in sample] == [normalize_category(v) for v in sample]
+        
+        results[label] = {
+            'strings': count,
+            'legacy_seconds': round(legacy, 3),
+            'regex_seconds': round(regex, 3),
+            'memoized_seconds': round(memoized, 3),
+            'speedup': round(legacy / memoized, 2) if memoized else None
+        }
+    
+    return results
+
+if __name__ == '__main__':
+    for label, result in run_benchmark().items():
+        print(f"{label}: {result['strings']} strings, legacy {result['legacy_seconds']:.2f}s, "
+              f"regex {result['regex_seconds']:.2f}s, memoized {result['memoized_seconds']:.2f}s "
+              f"({result['speedup']}x)")
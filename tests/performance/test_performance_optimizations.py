@@ -202,7 +202,7 @@ class TestAssetOptimization:
                 # Non-existent file should return 'missing'
                 missing_hash = AssetOptimizer.get_file_hash('non_existent.css')
                 assert missing_hash == 'missing'
-                
+            
             finally:
                 os.unlink(temp_file)
     
@@ -286,7 +286,7 @@ class TestAssetOptimization:
                     content = f.read()
                     assert 'color:red' in content or 'color: red' in content
                     assert 'padding:10px' in content or 'padding: 10px' in content
-                
+            
             finally:
                 # Cleanup
                 for file_path in [css1_path, css2_path]:
@@ -315,12 +315,12 @@ class TestPerformanceMonitoring:
     def test_request_recording(self):
         """Test request performance recording."""
         monitor = PerformanceMonitor()
-        monitor.metrics['requests'] = []  # Clear existing data
+        monitor.clear_metrics()  # Clear existing data
         
         monitor.record_request('/test', 'GET', 0.5, 200, user_id=1)
         
         assert len(monitor.metrics['requests']) == 1
-        request = monitor.metrics['requests'][0]
+        request = monitor.get_request(0)
         
         assert request['endpoint'] == '/test'
         assert request['method'] == 'GET'
@@ -331,12 +331,12 @@ class TestPerformanceMonitoring:
     def test_database_query_recording(self):
         """Test database query performance recording."""
         monitor = PerformanceMonitor()
-        monitor.metrics['database_queries'] = []  # Clear existing data
+        monitor.clear_metrics()  # Clear existing data
         
         monitor.record_database_query('SELECT', 0.1, 'users')
         
         assert len(monitor.metrics['database_queries']) == 1
-        query = monitor.metrics['database_queries'][0]
+        query = monitor.get_database_query(0)
         
         assert query['query_type'] == 'SELECT'
         assert query['execution_time'] == 0.1
@@ -355,6 +355,50 @@ class TestPerformanceMonitoring:
         assert monitor.metrics['cache_hits'] == 2
         assert monitor.metrics['cache_misses'] == 1
     
+    def test_system_metrics_sampling_does_not_block(self):
+        """Test that system samples diff CPU times instead of sleeping, and land in the ring buffer."""
+        monitor = PerformanceMonitor(system_capacity=2)
+        
+        with patch('psutil.cpu_percent', side_effect=AssertionError("blocking call")):
+            start = time.perf_counter()
+            for _ in range(3):
+                monitor.record_system_metrics()
+            elapsed = time.perf_counter() - start
+        
+        assert elapsed < 0.5
+        assert len(monitor.metrics['system_metrics']) == 2
+        
+        latest = monitor.get_performance_summary()['system_stats']
+        assert 0 <= latest['cpu_percent'] <= 100
+        assert latest['rss_bytes'] > 0
+        assert latest['threads'] >= 1
+        assert latest['gc_collections'] >= 0
+        assert 'db_pool_checkouts' in latest
+    
+    def test_system_metrics_exported_to_prometheus(self, app, client):
+        """Test that the latest system sample is published as Prometheus gauges."""
+        performance_monitor.record_system_metrics()
+        
+        body = client.get('/metrics/prometheus').get_data(as_text=True)
+        assert 'buyroll_process_resident_memory_bytes ' in body
+        assert 'buyroll_process_open_fds ' in body
+        assert 'buyroll_gc_collections_total ' in body
+    
+    def test_metrics_scrape_reads_latest_system_sample(self, app):
+        """Test that collecting system metrics reads the buffer instead of taking a sample."""
+        from app.utils.monitoring import MetricsCollector
+        
+        monitor = PerformanceMonitor()
+        monitor.record_system_metrics()
+        with patch('app.utils.performance_monitor.performance_monitor', monitor), \
+                patch('app.utils.system_sampler.system_sampler.sample') as mock_sample:
+            metrics = MetricsCollector.get_system_metrics()
+            metrics = MetricsCollector.get_system_metrics()
+        
+        mock_sample.assert_not_called()
+        assert len(monitor.metrics['system_metrics']) == 1
+        assert metrics['process']['rss_bytes'] == monitor.get_system_sample(-1)['rss_bytes']
+    
     def test_performance_summary(self):
         """Test performance summary generation."""
         monitor = PerformanceMonitor()
@@ -380,7 +424,7 @@ class TestPerformanceMonitoring:
     def test_slow_endpoints_detection(self):
         """Test slow endpoints detection."""
         monitor = PerformanceMonitor()
-        monitor.metrics['requests'] = []  # Clear existing data
+        monitor.clear_metrics()  # Clear existing data
         
         # Add some slow requests
         monitor.record_request('/slow', 'GET', 2.0, 200)
@@ -394,6 +438,975 @@ class TestPerformanceMonitoring:
         assert endpoint == '/slow'
         assert stats['count'] == 2
         assert stats['avg_time'] == 2.5
+    
+    def test_ring_buffer_keeps_newest_samples(self):
+        """Test that request samples wrap around a fixed-capacity buffer and windows skip old samples."""
+        monitor = PerformanceMonitor(request_capacity=4)
+        
+        for i in range(6):
+            monitor.record_request(f'/page{i}', 'GET', 0.1 * (i + 1), 200)
+        
+        assert len(monitor.metrics['requests']) == 4
+        assert monitor.get_request(0)['endpoint'] == '/page2'
+        assert monitor.get_request(-1)['endpoint'] == '/page5'
+        assert monitor.get_request(-1)['user_id'] is None
+        
+        summary = monitor.get_performance_summary(minutes=60)['request_stats']
+        assert summary['total_requests'] == 4
+        assert summary['max_response_time'] == 0.6
+        assert summary['min_response_time'] == 0.3
+        assert set(summary['endpoint_performance']) == {'/page2', '/page3', '/page4', '/page5'}
+        
+        # Samples older than the window are cut off by timestamp
+        with patch('app.utils.performance_monitor.time.monotonic', return_value=time.monotonic() + 120):
+            assert monitor.get_performance_summary(minutes=1)['request_stats']['total_requests'] == 0
+            monitor.record_request('/late', 'GET', 0.2, 404)
+            late = monitor.get_performance_summary(minutes=1)['request_stats']
+        assert late['total_requests'] == 1
+        assert late['status_codes'] == {404: 1}
+    
+    def test_ring_buffer_memory_is_fixed(self):
+        """Test that buffer memory depends on the capacity only."""
+        from app.utils.ring_buffer import RingBuffer
+        
+        buffer = RingBuffer(1000, PerformanceMonitor.REQUEST_COLUMNS)
+        size = buffer.nbytes
+        for i in range(5000):
+            buffer.append(float(i), 1, 1, 0.01, 200, -1)
+        
+        assert buffer.nbytes == size
+        assert len(buffer) == 1000
+        assert buffer.snapshot()['timestamp'][0] == 4000.0
+
+class TestLatencyHistograms:
+    """Test mergeable latency histograms and tail percentiles."""
+    
+    def test_quantiles_within_relative_error(self):
+        """Test that histogram quantiles stay within the bucket error of exact quantiles."""
+        import random
+        from app.utils.latency_histogram import LatencyHistogram
+        
+        rng = random.Random(7)
+        samples = [rng.lognormvariate(-3, 1.2) for _ in range(20000)]
+        histogram = LatencyHistogram()
+        for sample in samples:
+            histogram.record(sample)
+        
+        ordered = sorted(samples)
+        for q in (0.5, 0.9, 0.99, 0.999):
+            exact = ordered[int(q * len(ordered)) - 1]
+            assert abs(histogram.quantile(q) - exact) / exact < 0.04
+    
+    def test_merged_workers_match_single_histogram(self):
+        """Test that per-worker exports merge into the same percentiles as one combined histogram."""
+        from app.utils.latency_histogram import merge_exports, summarize_windows
+        
+        now = time.time()
+        workers = [PerformanceMonitor(), PerformanceMonitor()]
+        combined = PerformanceMonitor()
+        for i in range(400):
+            latency = 0.01 * (i % 50 + 1)
+            workers[i % 2].record_request('main.index', 'GET', latency, 200)
+            combined.record_request('main.index', 'GET', latency, 200)
+        
+        merged = summarize_windows(merge_exports([worker.export_latency_histograms() for worker in workers]), now)
+        single = summarize_windows(merge_exports([combined.export_latency_histograms()]), now)
+        assert merged['endpoints']['main.index'] == single['endpoints']['main.index']
+        assert merged['overall']['1m']['count'] == 400
+    
+    def test_windows_drop_old_samples(self):
+        """Test that the 1m window forgets samples the 60m window still counts."""
+        from app.utils.latency_histogram import WindowedHistogram
+        
+        windowed = WindowedHistogram()
+        now = 1_000_000.0
+        windowed.record(2.0, now=now - 240)
+        windowed.record(0.1, now=now)
+        
+        assert windowed.window(60, now).count == 1
+        assert windowed.window(300, now).count == 2
+        assert windowed.window(300, now).quantile(0.99) == pytest.approx(2.0, rel=0.04)
+        
+        windowed.record(0.1, now=now + 3600)
+        assert 2.0 > windowed.window(3600, now + 3600).max
+    
+    def test_recommendations_use_p99(self):
+        """Test that a slow tail triggers a recommendation even when the average is fast."""
+        from app.utils.performance_monitor import get_performance_recommendations
+        
+        monitor = PerformanceMonitor()
+        for _ in range(980):
+            monitor.record_request('api.feed', 'GET', 0.05, 200)
+        for _ in range(20):
+            monitor.record_request('api.export', 'GET', 4.0, 200)
+        
+        summary = monitor.get_performance_summary()
+        assert summary['request_stats']['avg_response_time'] < 1.0
+        assert summary['latency_percentiles']['overall']['5m']['p99'] == pytest.approx(4.0, rel=0.04)
+        
+        with patch('app.utils.performance_monitor.performance_monitor', monitor):
+            recommendations = get_performance_recommendations()
+        response_time = [rec for rec in recommendations if rec['type'] == 'response_time']
+        assert len(response_time) == 1
+        assert 'api.export' in response_time[0]['message']
+    
+    def test_latency_cli_merges_worker_exports(self, app, tmp_path):
+        """Test that the latency command ranks endpoints from merged worker exports."""
+        paths = []
+        for worker in range(2):
+            monitor = PerformanceMonitor()
+            monitor.record_request('api.slow', 'GET', 1.5, 200)
+            monitor.record_request('api.fast', 'GET', 0.02, 200)
+            paths.append(monitor.export_metrics(str(tmp_path / f'worker{worker}.json')))
+        
+        result = app.test_cli_runner().invoke(args=['performance', 'latency', *paths])
+        assert '2 workers merged' in result.output
+        assert result.output.index('api.slow') < result.output.index('api.fast')
+
+class TestPrometheusMetrics:
+    """Test the Prometheus text-format metrics endpoint."""
+    
+    def test_scrape_exposes_request_and_query_metrics(self, app, client):
+        """Test that a scrape reports requests and query fingerprints without querying the database."""
+        from sqlalchemy import event
+        
+        client.get('/health')
+        
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                response = client.get('/metrics/prometheus')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+        
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        assert statements == []
+        
+        body = response.get_data(as_text=True)
+        assert '# TYPE buyroll_http_requests_total counter' in body
+        assert 'buyroll_http_requests_total{endpoint="health_check",method="GET",status="200"}' in body
+        assert 'buyroll_http_request_duration_seconds_bucket{endpoint="health_check",method="GET",le="+Inf"}' in body
+        assert 'buyroll_db_query_duration_seconds_count{fingerprint="' in body
+        assert '# TYPE buyroll_scheduler_queue_depth gauge' in body
+    
+    def test_query_fingerprint_normalizes_literals(self):
+        """Test that queries differing only in literals share a fingerprint."""
+        from app.utils.prometheus import query_fingerprint
+        
+        first = query_fingerprint("SELECT * FROM purchase WHERE user_id = 7 AND id IN (?, ?, ?)")
+        second = query_fingerprint("SELECT *\n  FROM purchase WHERE user_id = 12 AND id IN (?)")
+        assert first[0] == second[0]
+        assert first[1:3] == ('select', 'purchase')
+        assert "'secret'" not in query_fingerprint("UPDATE user SET name = 'secret' WHERE id = 1")[3]
+    
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that histogram buckets render cumulatively with sum and count."""
+        from app.utils.prometheus import Registry, Histogram
+        
+        registry = Registry()
+        histogram = Histogram('test_seconds', 'Test.', ('route',), registry=registry, buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.labels('a').observe(value)
+        
+        body = registry.render()
+        assert 'test_seconds_bucket{route="a",le="0.1"} 1' in body
+        assert 'test_seconds_bucket{route="a",le="1"} 3' in body
+        assert 'test_seconds_bucket{route="a",le="+Inf"} 4' in body
+        assert 'test_seconds_sum{route="a"} 6.05' in body
+        assert 'test_seconds_count{route="a"} 4' in body
+    
+    def test_multiprocess_files_are_merged(self, tmp_path):
+        """Test that counters of all worker files are summed and gauges of dead workers skipped."""
+        from app.utils.prometheus import Registry, Counter, Gauge, _MmapedValues, _sample_key
+        
+        registry = Registry()
+        requests_total = Counter('test_requests_total', 'Test.', ('status',), registry=registry)
+        queue_depth = Gauge('test_queue_depth', 'Test.', registry=registry, multiprocess_mode='max')
+        registry.configure_multiprocess(str(tmp_path))
+        requests_total.labels('200').inc(3)
+        queue_depth.set(2)
+        
+        # Another worker that has exited (pid numbers beyond pid_max are never alive)
+        other = _MmapedValues(str(tmp_path / 'metrics_99999999.db'))
+        for i in range(500):  # Enough keys to grow the file past its initial size
+            other.add(_sample_key('test_requests_total', 'test_requests_total', [['status', str(i)]]), 1)
+        other.set(_sample_key('test_queue_depth', 'test_queue_depth', []), 50)
+        other.close()
+        
+        body = registry.render()
+        registry.configure_multiprocess(None)
+        assert 'test_requests_total{status="200"} 4' in body
+        assert 'test_requests_total{status="499"} 1' in body
+        assert 'test_queue_depth 2' in body
+
+class TestSamplingProfiler:
+    """Test the statistical profiler."""
+    
+    @staticmethod
+    def _busy_request(profiler, endpoint, seconds):
+        import hashlib
+        import threading
+        
+        def serve():
+            profiler.enter(endpoint)
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                hashlib.sha256(b'x' * 10000).digest()
+            profiler.leave()
+        
+        thread = threading.Thread(target=serve)
+        thread.start()
+        return thread
+    
+    def test_profile_attributes_stacks_to_endpoints(self):
+        """Test that samples are collapsed per endpoint and the sampler stays under 2% overhead."""
+        from app.utils.sampling_profiler import SamplingProfiler
+        
+        profiler = SamplingProfiler()
+        thread = self._busy_request(profiler, 'api.feed', 0.8)
+        result = profiler.profile(0.5, hz=100)
+        thread.join()
+        
+        summary = result.summary()
+        assert 40 <= summary['samples'] <= 55
+        assert list(summary['endpoints']) == ['api.feed']
+        assert summary['overhead_percent'] < 2.0
+        
+        line = result.collapsed().splitlines()[0]
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('api.feed;')
+        assert stack.rsplit(';', 1)[1].startswith('serve (test_performance_optimizations.py:')
+        assert int(count) > 0
+    
+    def test_cli_requests_are_answered_by_watching_workers(self, tmp_path):
+        """Test that a profile requested through the directory is run by a worker and merged."""
+        from app.utils.sampling_profiler import (SamplingProfiler, ProfileRequestWatcher, request_profile,
+                                                 collect_profiles, REQUEST_FILE)
+        
+        profiler = SamplingProfiler()
+        watcher = ProfileRequestWatcher(str(tmp_path), profiler=profiler)
+        profile_id = request_profile(str(tmp_path), 0.3, hz=50)
+        
+        thread = self._busy_request(profiler, 'api.feed', 0.5)
+        assert watcher.check(str(tmp_path / REQUEST_FILE)) is True
+        assert watcher.check(str(tmp_path / REQUEST_FILE)) is False  # Already handled
+        thread.join()
+        
+        result = collect_profiles(str(tmp_path), profile_id)
+        assert result.processes == 1
+        assert result.summary()['endpoints']['api.feed']['samples'] > 0
+        assert collect_profiles(str(tmp_path), profile_id) is None
+    
+    def test_admin_profile_endpoint(self, authenticated_client):
+        """Test that admins can profile the serving worker."""
+        from app.models.user import User
+        
+        with patch.object(User, 'is_admin', True, create=True):
+            response = authenticated_client.get('/admin/api/profile?seconds=0.2&hz=50&all_threads=true')
+            collapsed = authenticated_client.get('/admin/api/profile?seconds=0.1&format=collapsed')
+            capped = authenticated_client.get('/admin/api/profile?seconds=0.05&hz=100000')
+        
+        assert response.status_code == 200
+        assert response.get_json()['hz'] == 50
+        assert capped.get_json()['hz'] == authenticated_client.application.config['PROFILER_MAX_HZ']
+        assert response.get_json()['samples'] > 0
+        assert collapsed.status_code == 200
+        assert collapsed.mimetype == 'text/plain'
+
+class TestRequestTracing:
+    """Test per-request tracing spans."""
+    
+    def test_slow_request_trace_is_kept(self, app, authenticated_client):
+        """Test that slow requests keep a span tree viewable through the admin endpoints."""
+        from app.models.user import User
+        from app.utils.tracing import tracer
+        
+        tracer.clear()
+        with patch.object(tracer, 'slow_threshold', 0):
+            response = authenticated_client.get('/', headers={
+                'traceparent': '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+            })
+        assert response.headers['X-Trace-Id'] == '4bf92f3577b34da6a3ce929d0e0e4736'
+        
+        with patch.object(User, 'is_admin', True, create=True):
+            listing = authenticated_client.get('/admin/api/traces').get_json()
+            detail = authenticated_client.get('/admin/api/traces/4bf92f3577b34da6a3ce929d0e0e4736').get_json()
+            chrome = authenticated_client.get('/admin/api/traces/4bf92f3577b34da6a3ce929d0e0e4736?format=chrome')
+        
+        summary = next(t for t in listing['traces'] if t['trace_id'] == '4bf92f3577b34da6a3ce929d0e0e4736')
+        assert summary['status_code'] == 200
+        assert summary['breakdown']['db']['count'] >= 1  # Loading the logged-in user
+        kinds = {child['kind'] for child in detail['root']['children']}
+        assert 'db' in kinds
+        events = chrome.get_json()['traceEvents']
+        assert events[0]['ph'] == 'X' and events[0]['cat'] == 'request'
+    
+    def test_spans_nest_and_break_down_by_kind(self, app):
+        """Test span nesting, the per-kind breakdown and the span cap."""
+        from app.utils.cache import cached, cache
+        from app.utils.tracing import Tracer, span
+        
+        tracer = Tracer(slow_threshold=0, max_spans=6)
+        
+        @cached(ttl=60, key_prefix='trace_test_')
+        def lookup(value):
+            with span('inner sql', 'db'):
+                time.sleep(0.01)
+            return value
+        
+        with app.app_context():
+            cache.clear()
+            trace = tracer.start_trace('job')
+            lookup(1)
+            lookup(1)
+            for _ in range(5):
+                with span('extra', 'http'):
+                    pass
+            tracer.finish_trace()
+        
+        names = [s.name for s in trace.spans]
+        assert names[:4] == ['job', 'cache.get', 'inner sql', 'cache.set']
+        assert trace.spans[1].attributes['hit'] is False
+        assert trace.spans[4].attributes['hit'] is True
+        assert trace.dropped == 4
+        
+        breakdown = trace.breakdown()
+        assert breakdown['db']['seconds'] >= 0.01
+        assert breakdown['cache']['count'] == 3
+        assert tracer.slow_traces()[0]['trace_id'] == trace.trace_id
+    
+    def test_export_appends_chrome_trace_events(self, tmp_path):
+        """Test that slow traces are appended to the export file in the Chrome trace format."""
+        from app.utils.tracing import Tracer, span
+        
+        path = tmp_path / 'traces.json'
+        tracer = Tracer(slow_threshold=0, export_path=str(path))
+        for _ in range(2):
+            tracer.start_trace('job')
+            with span('select', 'db'):
+                pass
+            tracer.finish_trace()
+        
+        # The viewers accept an unterminated array; close it to parse it here
+        events = json.loads(path.read_text().rstrip().rstrip(',') + ']')
+        assert [event['cat'] for event in events] == ['request', 'db', 'request', 'db']
+        assert all(event['dur'] >= 0 for event in events)
+
+class TestQueueLogging:
+    """Test queue-based logging and the sampled access log."""
+    
+    def test_handlers_run_on_listener_thread(self, app):
+        """Test that setup_logging installs a queue handler feeding a listener thread."""
+        import logging
+        from app.utils import logging_config
+        
+        root_handlers = logging.getLogger().handlers
+        assert logging_config._queue_handler in root_handlers
+        assert not any(isinstance(h, logging.handlers.RotatingFileHandler) for h in root_handlers)
+        assert logging_config._listener._thread.is_alive()
+        assert logging_config.logging_stats()['capacity'] == app.config['LOG_QUEUE_SIZE']
+    
+    def test_overflow_policy(self):
+        """Test that a full queue drops records below WARNING and times out on the rest."""
+        import logging
+        import queue
+        from app.utils.logging_config import BoundedQueueHandler
+        
+        def record(level):
+            return logging.LogRecord('test', level, __file__, 1, 'message', None, None)
+        
+        handler = BoundedQueueHandler(queue.Queue(maxsize=1), overflow='drop', block_seconds=0.01)
+        handler.emit(record(logging.INFO))
+        handler.emit(record(logging.INFO))
+        assert handler.dropped == 1
+        
+        start = time.perf_counter()
+        handler.emit(record(logging.ERROR))
+        assert handler.dropped == 2
+        assert time.perf_counter() - start >= 0.01  # Errors wait for space before being dropped
+        
+        handler.queue.get_nowait()
+        handler.emit(record(logging.ERROR))
+        assert handler.dropped == 2
+    
+    def test_one_sampled_access_line_per_request(self, app, client, caplog):
+        """Test the combined access line and its sampling."""
+        import logging
+        from app.utils.logging_config import should_log_access
+        
+        with caplog.at_level(logging.INFO, logger='buyroll.access'):
+            client.get('/?page=2', headers={'User-Agent': 'pytest', 'Referer': 'http://example.com/'})
+        
+        lines = [r.getMessage() for r in caplog.records if r.name == 'buyroll.access']
+        assert len(lines) == 1
+        assert '"GET /?page=2 HTTP/1.1"' in lines[0]
+        assert '"http://example.com/" "pytest"' in lines[0]
+        assert 'ms trace=' in lines[0]
+        
+        assert not should_log_access(200, 0.01, 0.0, 1.0)
+        assert should_log_access(500, 0.01, 0.0, 1.0)
+        assert should_log_access(200, 2.0, 0.0, 1.0)
+        assert should_log_access(404, 0.01, 1.0, 1.0)
+
+class TestStructuredLogging:
+    """Test the JSON formatter and structured events."""
+    
+    def test_json_formatter_writes_one_object_per_line(self):
+        """Test that plain records and exceptions become single-line JSON."""
+        import logging
+        from app.utils.logging_config import JSONFormatter
+        
+        try:
+            raise ValueError("bad\nvalue")
+        except ValueError:
+            import sys
+            record = logging.LogRecord('buyroll.app', logging.ERROR, __file__, 1, 'failed %s', ('twice',), sys.exc_info())
+        
+        line = JSONFormatter().format(record)
+        assert '\n' not in line
+        data = json.loads(line)
+        assert data['level'] == 'ERROR'
+        assert data['logger'] == 'buyroll.app'
+        assert data['message'] == 'failed twice'
+        assert 'ValueError: bad' in data['exception']
+    
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_event_whitelist_and_truncation(self, fast):
+        """Test that events are serialized once with only whitelisted fields and long strings cut."""
+        import logging
+        from datetime import datetime
+        from app.utils.logging_config import StructuredLogger, JSONFormatter, configure_json_logging
+        
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        structured = StructuredLogger('tests.structured')
+        structured.logger.addHandler(handler)
+        structured.logger.setLevel(logging.INFO)
+        configure_json_logging(fields=['order', 'when'], max_field_length=32, fast=fast)
+        try:
+            structured.log_event('INFO', 'order_synced', 'Order synced', order={'note': 'x' * 50, 'items': list(range(500))},
+                                 when=datetime(2024, 1, 2), headers={'Cookie': 'secret'})
+        finally:
+            configure_json_logging()
+            structured.logger.removeHandler(handler)
+        
+        assert len(records) == 1
+        line = JSONFormatter().format(records[0])
+        assert line == records[0].event_json
+        data = json.loads(line)
+        assert 'headers' not in data and 'user_id' not in data
+        assert data['event_type'] == 'order_synced'
+        assert data['order']['note'] == 'x' * 32 + '...[18 more]'
+        assert len(data['order']['items']) == 100
+        assert data['when'] == '2024-01-02T00:00:00'
+    
+    def test_error_report_omits_request_headers(self, app):
+        """Test that logged error reports keep a few request fields and no headers."""
+        from app.utils.error_reporting import ErrorReporter
+        
+        with app.test_request_context('/orders?page=2', headers={'Authorization': 'Bearer secret'}):
+            error_data = ErrorReporter._prepare_error_data(RuntimeError('boom'), {'step': 1}, None, 'low')
+            with patch('app.utils.error_reporting.app_logger') as mock_logger:
+                ErrorReporter._log_error(error_data)
+        
+        kwargs = mock_logger.log_event.call_args.kwargs
+        assert 'request_data' not in kwargs
+        assert kwargs['request']['url'].endswith('/orders?page=2')
+        assert 'secret' not in json.dumps(kwargs, default=str)
+
+class TestErrorReporting:
+    """Test background error reporting with fingerprints and digest windows."""
+    
+    @staticmethod
+    def _raise(message):
+        try:
+            raise ValueError(message)
+        except ValueError as e:
+            return e
+    
+    def test_fingerprint_groups_occurrences(self):
+        """Test that ids and numbers don't split an error group but the type does."""
+        from app.utils.error_reporting import error_fingerprint
+        
+        frames = ['orders.py:sync_orders']
+        assert error_fingerprint('ValueError', "Order 1001 for 'a@b.com' failed", frames) == \
+            error_fingerprint('ValueError', "Order 2002 for 'c@d.com' failed", frames)
+        assert error_fingerprint('ValueError', 'x', frames) != error_fingerprint('KeyError', 'x', frames)
+        assert error_fingerprint('ValueError', 'x', frames) != error_fingerprint('ValueError', 'x', ['other.py:run'])
+    
+    def test_one_digest_per_window(self):
+        """Test that a group is emailed once when its window closes, and only if severe."""
+        from app.utils.error_reporting import ErrorReportWorker, ErrorReporter
+        
+        worker = ErrorReportWorker(window_seconds=60)
+        severe = ErrorReporter._prepare_error_data(self._raise('locked 1'), None, None, 'medium')
+        minor = ErrorReporter._prepare_error_data(KeyError('missing'), None, None, 'low')
+        worker.aggregate([severe, {**severe, 'severity': 'critical'}, minor], now=1000)
+        worker.aggregate([severe], now=1030)
+        
+        assert worker.close_windows(now=1059) == []
+        digests = worker.close_windows(now=1060)
+        assert len(digests) == 1
+        assert digests[0]['count'] == 3
+        assert digests[0]['severity'] == 'critical'
+        assert worker.get_groups() == []
+    
+    def test_worker_batches_storage_and_pattern_counts(self, app):
+        """Test that an error storm is stored in batches with one digest email."""
+        from app.models.error_log import ErrorLog, ErrorPattern
+        from app.utils.error_reporting import ErrorReportWorker, ErrorReporter
+        
+        with app.app_context():
+            db.session.add(ErrorPattern(pattern_name='Locked', error_type='ValueError', pattern_regex='locked'))
+            db.session.commit()
+        app.config.update(MAIL_USERNAME='alerts@example.com', MAIL_PASSWORD='secret')
+        
+        worker = ErrorReportWorker(flush_interval=0.05, window_seconds=300)
+        with patch('app.utils.error_reporting.error_report_worker', worker), \
+                patch('app.utils.error_reporting.smtplib.SMTP') as mock_smtp:
+            worker.start(app)
+            for i in range(50):
+                assert ErrorReporter.report_error(self._raise(f'database locked after {i} tries'), severity='high')
+            worker.stop()
+        
+        with app.app_context():
+            errors = ErrorLog.query.all()
+            assert len(errors) == 50
+            assert len({error.fingerprint for error in errors}) == 1
+            assert ErrorPattern.query.one().occurrence_count == 50
+        
+        mock_smtp.assert_called_once()
+        sent = mock_smtp.return_value.send_message.call_args_list
+        assert len(sent) == 1
+        assert '(50x)' in sent[0].args[0]['Subject']
+    
+    def test_errors_grouped_without_worker(self, app):
+        """Test that without a worker reports are stored at once but a storm is mailed once, at exit."""
+        from app.models.error_log import ErrorLog
+        from app.utils.error_reporting import ErrorReportWorker, ErrorReporter
+        
+        app.config.update(MAIL_USERNAME='alerts@example.com', MAIL_PASSWORD='secret')
+        worker = ErrorReportWorker(window_seconds=300)
+        with patch('app.utils.error_reporting.error_report_worker', worker), \
+                patch('atexit.register') as mock_register, \
+                patch('app.utils.error_reporting.smtplib.SMTP') as mock_smtp:
+            for i in range(20):
+                assert ErrorReporter.report_error(self._raise(f'disk full on volume {i}'), severity='critical')
+            
+            with app.app_context():
+                assert ErrorLog.query.count() == 20
+            mock_smtp.assert_not_called()
+            mock_register.assert_called_once_with(worker.flush_open_windows)
+            
+            worker.flush_open_windows()
+        
+        sent = mock_smtp.return_value.send_message.call_args_list
+        assert len(sent) == 1
+        assert '(20x)' in sent[0].args[0]['Subject']
+        assert worker.get_groups() == []
+
+class TestErrorLogMaintenance:
+    """Test the daily error rollup and error log retention."""
+    
+    @staticmethod
+    def _add_errors(test_user, count, days_ago=0, error_type='ValueError', severity='high'):
+        from datetime import datetime, timedelta
+        from app.models.error_log import ErrorLog
+        
+        errors = [
+            ErrorLog(error_type=error_type, error_message=f'failure {i}', severity=severity, user_id=test_user.id,
+                     timestamp=datetime.utcnow() - timedelta(days=days_ago), traceback='Traceback ...')
+            for i in range(count)
+        ]
+        db.session.add_all(errors)
+        db.session.commit()
+        return errors
+    
+    def test_rollup_maintained_on_insert_and_resolve(self, app, test_user):
+        """Test that stats come from the rollup kept current by inserts and resolutions."""
+        from app.models.error_log import ErrorLog, ErrorStatDaily
+        
+        with app.app_context():
+            errors = self._add_errors(test_user, 3)
+            self._add_errors(test_user, 2, error_type='KeyError', severity='low')
+            self._add_errors(test_user, 4, days_ago=40)
+            errors[0].mark_resolved(test_user.id, 'fixed')
+            
+            assert db.session.query(db.func.sum(ErrorStatDaily.error_count)).scalar() == 9
+            stats = ErrorLog.get_error_stats(days=30)
+            assert stats['total_errors'] == 5
+            assert stats['resolved_errors'] == 1
+            assert stats['severity_breakdown'] == {'high': 3, 'low': 2}
+            assert list(stats['top_error_types']) == ['ValueError', 'KeyError']
+    
+    def test_error_list_counts_feedback_in_one_query(self, app, authenticated_client, test_user):
+        """Test that the error list API counts feedback with one grouped query instead of one per row."""
+        from app.models.error_log import ErrorLog, ErrorFeedback
+        from app.models.user import User
+        
+        with app.app_context():
+            errors = self._add_errors(test_user, 2)
+            db.session.add(ErrorFeedback(error_id=errors[0].id, user_id=test_user.id, message='again'))
+            db.session.commit()
+            first_id = errors[0].id
+            assert errors[0].to_dict()['feedback_count'] == 1
+            assert errors[1].to_dict(feedback_count=0)['feedback_count'] == 0
+        
+        with patch.object(User, 'is_admin', True, create=True), \
+                patch.object(ErrorLog, 'feedback') as mock_feedback:
+            response = authenticated_client.get('/admin/api/errors')
+        mock_feedback.count.assert_not_called()
+        
+        assert response.status_code == 200
+        counts = {error['id']: error['feedback_count'] for error in response.get_json()['errors']}
+        assert counts[first_id] == 1
+        assert sorted(counts.values()) == [0, 1]
+        assert 'request_data' not in response.get_json()['errors'][0]
+    
+    def test_retention_archives_and_deletes_in_chunks(self, app, test_user, tmp_path):
+        """Test that old rows and their feedback are archived to gzip NDJSON, then deleted."""
+        import gzip
+        from datetime import datetime, timedelta
+        from app.models.error_log import ErrorLog, ErrorFeedback, ErrorStatDaily
+        from app.services.error_retention import ErrorLogRetention
+        
+        with app.app_context():
+            old = self._add_errors(test_user, 5, days_ago=100)
+            self._add_errors(test_user, 2)
+            old_ids = [e.id for e in old]
+            db.session.add(ErrorFeedback(error_id=old_ids[0], user_id=test_user.id, message='seen'))
+            db.session.commit()
+            
+            result = ErrorLogRetention.archive(datetime.utcnow() - timedelta(days=90), str(tmp_path), chunk_size=2)
+            
+            assert result['archived'] == 5
+            assert ErrorLog.query.count() == 2
+            assert ErrorFeedback.query.count() == 0
+            assert db.session.query(db.func.sum(ErrorStatDaily.error_count)).scalar() == 7
+            
+            with gzip.open(result['path'], 'rt') as f:
+                archived = [json.loads(line) for line in f]
+            assert [row['id'] for row in archived] == old_ids
+            assert archived[0]['feedback'][0]['message'] == 'seen'
+            assert archived[0]['traceback'] == 'Traceback ...'
+    
+    def test_retention_runs_on_its_own_thread_once_at_a_time(self):
+        """Test that retention doesn't take a sync slot and isn't started while a run is going."""
+        import threading
+        from app.utils.scheduler import IntegrationScheduler
+        
+        release = threading.Event()
+        threads = []
+        
+        def fake_retention():
+            threads.append(threading.current_thread().name)
+            release.wait(5)
+        
+        scheduler = IntegrationScheduler(max_concurrency=1)
+        scheduler.retention_interval = 10
+        with patch.object(scheduler, '_run_error_retention', side_effect=fake_retention):
+            assert scheduler._start_due_retention(now=100) is True
+            assert scheduler._start_due_retention(now=105) is False  # Not due yet
+            assert scheduler._start_due_retention(now=200) is False  # Previous run still going
+            release.set()
+            scheduler._retention_thread.join(5)
+            assert scheduler._start_due_retention(now=200) is True
+            scheduler._retention_thread.join(5)
+        
+        assert threads == ['error-retention', 'error-retention']
+        assert scheduler._executor is None
+
+class TestHealthChecks:
+    """Test the liveness and readiness probes and the metrics refresher."""
+    
+    def test_liveness_runs_select_one_with_timeout(self, app, client):
+        """Test that liveness only runs SELECT 1 and that slow statements are aborted."""
+        from sqlalchemy import event, text
+        from sqlalchemy.exc import OperationalError
+        from app.utils.monitoring import HealthChecker
+        
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                response = client.get('/health/live')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+            
+            assert response.status_code == 200
+            assert statements == ['SELECT 1']
+            
+            with db.engine.connect() as connection:
+                HealthChecker._limit_statement_time(connection, 0.05)
+                with pytest.raises(OperationalError, match='interrupted'):
+                    connection.execute(text(
+                        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+                    ))
+    
+    def test_readiness_reports_exhausted_pool(self, app):
+        """Test that readiness fails when every pooled connection is checked out."""
+        import sqlite3
+        from sqlalchemy.pool import QueuePool
+        from app.utils.monitoring import HealthChecker
+        
+        pool = QueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0)
+        with patch('app.utils.monitoring.db') as mock_db:
+            mock_db.engine.pool = pool
+            assert HealthChecker.check_pool()['available'] == 1
+            
+            connection = pool.connect()
+            result = HealthChecker.check_pool()
+            assert result['status'] == 'critical'
+            assert result['checked_out'] == 1
+            
+            connection.close()
+            assert HealthChecker.check_pool()['status'] == 'healthy'
+    
+    def test_metrics_served_from_refresher(self, app, client, test_user):
+        """Test that business metrics and last syncs come from the refresher until they are stale."""
+        from datetime import datetime, timedelta
+        from app.models import StoreIntegration, SyncRun
+        from app.utils.monitoring import metrics_refresher
+        
+        with app.app_context():
+            integration = StoreIntegration(user_id=test_user.id, platform='shopify',
+                                           store_url='https://shop.example', access_token='token')
+            db.session.add(integration)
+            db.session.flush()
+            synced_at = datetime.utcnow() - timedelta(hours=2)
+            db.session.add_all([
+                SyncRun(integration_id=integration.id, platform='shopify', status='success',
+                        started_at=synced_at - timedelta(minutes=1), finished_at=synced_at),
+                SyncRun(integration_id=integration.id, platform='shopify', status='failed',
+                        started_at=datetime.utcnow(), finished_at=datetime.utcnow(), failure_reason='HTTP 500')
+            ])
+            db.session.commit()
+            
+            metrics_refresher.max_staleness = 300
+            try:
+                assert client.get('/metrics').get_json()['users']['total_users'] == 1
+                with patch('app.utils.monitoring.MetricsCollector.get_business_metrics') as mock_counts:
+                    data = client.get('/metrics').get_json()
+                    health = client.get('/health').get_json()
+                mock_counts.assert_not_called()
+            finally:
+                metrics_refresher.max_staleness = 0
+        
+        assert data['users']['total_users'] == 1
+        shopify = health['integrations']['shopify']
+        assert shopify['status'] == 'warning'
+        assert shopify['last_sync'] == synced_at.isoformat()
+        assert shopify['last_failure_reason'] == 'HTTP 500'
+        assert shopify['failed_runs_24h'] == 1
+
+class TestStartup:
+    """Test startup roles, deferred imports and the startup profile."""
+    
+    def test_role_detection(self, monkeypatch):
+        """Test that flask commands other than `flask run` boot in the CLI role unless APP_ROLE is set."""
+        from app.utils.startup import detect_role
+        
+        monkeypatch.delenv('FLASK_RUN_FROM_CLI', raising=False)
+        assert detect_role({}) == 'web'
+        monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+        monkeypatch.setattr('sys.argv', ['flask', 'performance', 'cache-stats'])
+        assert detect_role({}) == 'cli'
+        assert detect_role({'APP_ROLE': 'web'}) == 'web'
+        monkeypatch.setattr('sys.argv', ['flask', 'run', '--port', '5000'])
+        assert detect_role({}) == 'web'
+    
+    def test_cli_role_skips_schema_and_workers(self):
+        """Test that the CLI role creates no tables, starts no scheduler and loads Flask-Migrate."""
+        from sqlalchemy import inspect
+        from config import TestingConfig
+        from app.utils.logging_config import stop_logging
+        
+        class CliConfig(TestingConfig):
+            TESTING = False
+            APP_ROLE = 'cli'
+        
+        with patch('app.utils.scheduler.init_scheduler') as mock_init_scheduler, \
+                patch('app.utils.database_optimization.optimize_sqlite_settings') as mock_pragmas:
+            app = create_app(CliConfig)
+        stop_logging()
+        
+        mock_init_scheduler.assert_not_called()
+        mock_pragmas.assert_not_called()
+        assert 'migrate' in app.extensions
+        assert 'create_all' not in [step['name'] for step in app.extensions['startup'].to_dict()['steps']]
+        with app.app_context():
+            assert inspect(db.engine).get_table_names() == []
+    
+    def test_heavy_imports_deferred(self):
+        """Test that booting a web worker doesn't import psutil, PIL, woocommerce, requests or alembic."""
+        import subprocess
+        import sys
+        
+        script = ("import sys\nfrom app import create_app\ncreate_app('config.TestingConfig')\n"
+                  "print(','.join(m for m in ('psutil', 'PIL', 'woocommerce', 'oauthlib', 'requests', 'flask_migrate') "
+                  "if m in sys.modules))")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = {**os.environ, 'APP_ROLE': 'web', 'PYTHONPATH': root}
+        result = subprocess.run([sys.executable, '-c', script], cwd=root, env=env, capture_output=True, text=True)
+        
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1:] in ([], [''])
+    
+    def test_startup_profile_command(self, app):
+        """Test that startup-profile reports init steps and import time per component."""
+        from app.utils.startup import parse_importtime
+        
+        output = ("import time:       150 |        150 |     app.routes.admin\n"
+                  "import time:      2000 |       2500 |   sqlalchemy.orm\n"
+                  "import time:       500 |        500 | sqlalchemy\n")
+        assert parse_importtime(output) == {'app.routes.admin': 0.00015, 'sqlalchemy': 0.0025}
+        
+        result = app.test_cli_runner().invoke(
+            args=['performance', 'startup-profile', '--config', 'config.TestingConfig', '--limit', '50']
+        )
+        assert 'Booted in' in result.output, result.output
+        assert 'blueprints' in result.output
+        assert '  app.models.' in result.output
+        assert 'sqlalchemy' in result.output
+
+class TestUserCache:
+    """Test the cache of users loaded for authenticated requests."""
+    
+    @staticmethod
+    def _get_profile(client):
+        from flask import g
+        
+        # Requests share the app fixture's context; drop the user Flask-Login kept in g
+        g.pop('_login_user', None)
+        return client.get('/api/user/profile')
+    
+    def test_authenticated_requests_skip_user_query(self, app, authenticated_client, test_user):
+        """Test that only the first authenticated request queries the user table."""
+        from sqlalchemy import event
+        
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                first = self._get_profile(authenticated_client)
+                first_statements, statements[:] = list(statements), []
+                second = self._get_profile(authenticated_client)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+        
+        assert first.status_code == second.status_code == 200
+        assert second.get_json() == first.get_json()
+        assert any('FROM user' in statement for statement in first_statements)
+        assert statements == []
+    
+    def test_admin_check_served_from_snapshot(self, app, authenticated_client, test_user):
+        """Test that admin_required reads is_admin from the cached snapshot without a user query."""
+        from flask import g
+        from sqlalchemy import event
+        from app.models.user import User
+        
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with app.app_context(), patch.object(User, 'is_admin', True, create=True):
+            first = authenticated_client.get('/admin/api/errors/groups')
+            g.pop('_login_user', None)
+            db.session.expunge_all()  # Nothing for the next request to reuse from the identity map
+            
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                second = authenticated_client.get('/admin/api/errors/groups')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+        
+        assert first.status_code == second.status_code == 200
+        assert statements == []
+    
+    def test_user_changes_invalidate_cache(self, app, authenticated_client, test_user):
+        """Test that profile, settings and password changes are visible on the next request."""
+        from app.models.user import User
+        from app.utils.user_cache import user_cache
+        
+        assert self._get_profile(authenticated_client).get_json()['user']['name'] == 'Test User'
+        
+        # The requests share this test's session, as they would share a worker's cache
+        user = db.session.get(User, test_user.id)
+        user.name = 'Renamed User'
+        user.settings = {'privacy': {'share_purchases': False}}
+        db.session.commit()
+        
+        data = self._get_profile(authenticated_client).get_json()['user']
+        assert data['name'] == 'Renamed User'
+        assert data['settings'] == {'privacy': {'share_purchases': False}}
+        
+        assert user_cache.get(test_user.id) is not None
+        user.password_hash = User.hash_password('new-password')
+        db.session.commit()
+        assert user_cache.get(test_user.id) is None
+    
+    def test_snapshot_is_version_stamped_and_immutable(self, app, test_user):
+        """Test that a snapshot read before an invalidation is never cached, and reads can't change it."""
+        from app.models.user import User
+        from app.utils.user_cache import UserCache, CachedUser, snapshot_user
+        
+        cache = UserCache(ttl=30)
+        with app.app_context():
+            user = db.session.get(User, test_user.id)
+            user.settings = {'dashboard': {'layout': 'grid'}}
+            snapshot = snapshot_user(user)
+        
+        version = cache._versions.get(snapshot.id, 0)
+        cache.invalidate(snapshot.id)
+        cache.set(snapshot, version)
+        assert cache.get(snapshot.id) is None
+        
+        cache.set(snapshot, cache._versions[snapshot.id])
+        cached_user = CachedUser(cache.get(snapshot.id), User)
+        cached_user.settings['dashboard']['layout'] = 'list'
+        assert cache.get(snapshot.id).settings == {'dashboard': {'layout': 'grid'}}
+        assert cached_user.is_authenticated and cached_user.get_id() == str(test_user.id)
+        with pytest.raises(AttributeError):
+            snapshot.name = 'changed'
+
+class TestProductNormalization:
+    """Test memoized and batch product normalization."""
+    
+    def test_category_matcher_matches_legacy_scan(self):
+        """Test that the memoized matcher keeps the first-key-wins semantics."""
+        from app.utils.product_normalizer import normalize_category
+        from tests.performance.benchmark_normalizer import generate_categories, legacy_normalize_category
+        
+        values = generate_categories(5000, distinct=0) + ['Handbags', 'Headphones & Audio', 'E-Books', '', None]
+        
+        assert [normalize_category(v) for v in values] == [legacy_normalize_category(v) for v in values]
+    
+    def test_batch_helpers(self):
+        """Test batch price, currency and product normalization."""
+        from app.utils.product_normalizer import (
+            normalize_prices, normalize_currencies, normalize_products, normalize_price, normalize_currency
+        )
+        
+        prices = [10, 2.5, '$1,299.99', 'free', None]
+        assert normalize_prices(prices) == [normalize_price(p) for p in prices]
+        
+        currencies = ['usd', '€', 'xyz', None, 'usd']
+        assert normalize_currencies(currencies) == [normalize_currency(c) for c in currencies]
+        
+        products = normalize_products(iter([{'name': 'Runner', 'price': '5', 'categories': [{'name': 'Shoes'}]}]), 'woocommerce')
+        assert [p['category'] for p in products] == ['Shoes']
 
 class TestLoadTesting:
     """Test load testing functionality."""
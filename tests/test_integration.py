@@ -4,6 +4,7 @@ Tests the interaction between different components and services.
 """
 import pytest
 import json
+from unittest.mock import patch
 from datetime import datetime, timedelta
 from app import db
 from app.models.user import User
@@ -709,4 +710,666 @@ class TestAPIIntegration:
                 user_id=user.id, 
                 is_shared=True
             ).count()
-            assert user_shared_count == 2
\ No newline at end of file
+            assert user_shared_count == 2
+class TestWebhookQueueIntegration:
+    """Test webhook ingestion through the durable queue."""
+    
+    def _signed_shopify_post(self, client, payload, webhook_id, secret='shpss_test'):
+        import base64
+        import hashlib
+        import hmac
+        
+        body = json.dumps(payload).encode('utf-8')
+        signature = base64.b64encode(hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()).decode('utf-8')
+        return client.post(
+            '/integrations/webhooks/shopify',
+            data=body,
+            content_type='application/json',
+            headers={
+                'X-Shopify-Hmac-Sha256': signature,
+                'X-Shopify-Webhook-Id': webhook_id,
+                'X-Shopify-Topic': 'orders/create',
+                'X-Shopify-Shop-Domain': 'queue-shop.myshopify.com'
+            }
+        )
+    
+    def test_shopify_webhook_is_queued_and_processed(self, app, client):
+        """Test that a signed webhook is queued, deduplicated and ingested by the worker."""
+        from app.models.store_integration import StoreIntegration
+        from app.models.webhook_event import WebhookEvent
+        from app.services.webhook_queue import WebhookQueue
+        
+        app.config['SHOPIFY_API_SECRET'] = 'shpss_test'
+        
+        with app.app_context():
+            user = User(
+                email='webhook@example.com',
+                name='Webhook User',
+                password_hash=User.hash_password('testpassword')
+            )
+            db.session.add(user)
+            db.session.commit()
+            
+            db.session.add(StoreIntegration(
+                user_id=user.id,
+                platform='shopify',
+                store_url='queue-shop.myshopify.com',
+                access_token='token'
+            ))
+            db.session.commit()
+            
+            order = {
+                'id': 5001,
+                'name': '#5001',
+                'email': 'Webhook@Example.com',
+                'currency': 'USD',
+                'created_at': '2024-03-01T10:00:00Z',
+                'line_items': [
+                    {'product_id': 77, 'title': 'Queued Product', 'name': 'Queued Product', 'price': '12.50'}
+                ]
+            }
+            
+            response = self._signed_shopify_post(client, order, 'wh-1')
+            assert response.status_code == 200
+            assert response.get_json()['status'] == 'queued'
+            
+            # Retried deliveries carry the same webhook id
+            response = self._signed_shopify_post(client, order, 'wh-1')
+            assert response.get_json()['status'] == 'duplicate'
+            
+            # A second delivery of the same order is deduplicated by order id
+            self._signed_shopify_post(client, order, 'wh-2')
+            
+            # Bad signatures are rejected before anything is stored
+            response = self._signed_shopify_post(client, order, 'wh-3', secret='wrong')
+            assert response.status_code == 401
+            
+            assert WebhookQueue.get_metrics()['queue_depth'] == 2
+            assert Purchase.query.count() == 0
+            
+            with patch('app.integrations.shopify.ShopifyClient._make_api_request', return_value=None):
+                assert WebhookQueue.process_batch(batch_size=10) == 2
+            
+            assert Purchase.query.filter_by(user_id=user.id, order_id='5001').count() == 1
+            assert Product.query.filter_by(source='shopify', external_id='77').count() == 1
+            assert WebhookEvent.query.filter_by(status='done').count() == 2
+            assert WebhookQueue.get_metrics()['queue_depth'] == 0
+    
+    def test_webhook_metrics_require_admin(self, client, authenticated_client):
+        """Test that webhook queue metrics are only served to admins."""
+        from flask import g
+        from app.utils.user_cache import user_cache
+        
+        assert client.get('/admin/api/webhooks').status_code in (302, 401)
+        g.pop('_login_user', None)  # Requests share the app fixture's context
+        
+        response = authenticated_client.get('/admin/api/webhooks')
+        assert response.status_code == 302
+        
+        g.pop('_login_user', None)
+        user_cache.clear()  # The snapshot of the non-admin user
+        with patch.object(User, 'is_admin', True, create=True):
+            response = authenticated_client.get('/admin/api/webhooks')
+        assert response.status_code == 200
+        assert response.get_json()['queue_depth'] == 0
+
+class TestIntegrationScheduler:
+    """Test the priority-queue integration scheduler."""
+    
+    def test_scheduling_concurrency_and_backoff(self, app):
+        """Test that overdue integrations respect the concurrency cap and failures back off."""
+        import time
+        from app.models.store_integration import StoreIntegration
+        from app.utils.scheduler import IntegrationScheduler
+        
+        with app.app_context():
+            user = User(
+                email='scheduler@example.com',
+                name='Scheduler User',
+                password_hash=User.hash_password('testpassword')
+            )
+            db.session.add(user)
+            db.session.commit()
+            
+            for i in range(3):
+                db.session.add(StoreIntegration(
+                    user_id=user.id,
+                    platform='shopify',
+                    store_url=f'shop-{i}.myshopify.com',
+                    access_token='token',
+                    last_sync=None if i < 2 else datetime.utcnow()
+                ))
+            db.session.commit()
+            
+            scheduler = IntegrationScheduler(interval=3600, jitter=0, backoff_base=10,
+                                             max_concurrency=1, catchup_spread=0)
+            scheduler._app = app
+            scheduler.refresh()
+            
+            # Two overdue integrations, but only one slot
+            due = scheduler._pop_due(time.time())
+            assert len(due) == 1
+            assert scheduler._pop_due(time.time()) == []
+            
+            with patch('app.utils.scheduler.sync_integration', return_value=False):
+                before = time.time()
+                scheduler._run_job(due[0])
+            
+            # First failure backs off by backoff_base
+            next_run = scheduler._next_sync_at[due[0]]
+            assert before + 10 <= next_run <= time.time() + 10
+            
+            # The recently synced integration is scheduled an interval out
+            recent_id = StoreIntegration.query.filter_by(store_url='shop-2.myshopify.com').first().id
+            assert scheduler._next_sync_at[recent_id] > time.time() + 3000
+
+class TestSchedulerLeaderElection:
+    """Test leader election for the integration scheduler."""
+    
+    def test_lease_failover_and_sync_requests(self, app):
+        """Test that only one process leads, a lapsed lease fails over and requests reach the leader."""
+        from app.models.scheduler_lease import SchedulerLease, SyncRequest
+        from app.models.store_integration import StoreIntegration
+        from app.utils.leader_election import DatabaseLeaseElection, LeaderElection
+        from app.utils.scheduler import IntegrationScheduler, request_sync
+        
+        with pytest.raises(TypeError):
+            LeaderElection('test-scheduler')  # Backends must implement try_acquire and release
+        
+        with app.app_context():
+            first = DatabaseLeaseElection('test-scheduler', lease_seconds=30)
+            second = DatabaseLeaseElection('test-scheduler', lease_seconds=30)
+            
+            assert first.step() is True
+            assert second.step() is False
+            assert first.step() is True  # Renewal keeps the lease
+            
+            # The leader dies without releasing; once the lease lapses the follower takes over
+            lease = SchedulerLease.query.get('test-scheduler')
+            lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            
+            assert second.step() is True
+            assert first.step() is False
+            
+            user = User(
+                email='leader@example.com',
+                name='Leader User',
+                password_hash=User.hash_password('testpassword')
+            )
+            db.session.add(user)
+            db.session.commit()
+            integration = StoreIntegration(
+                user_id=user.id,
+                platform='shopify',
+                store_url='leader.myshopify.com',
+                access_token='token'
+            )
+            db.session.add(integration)
+            db.session.commit()
+            
+            # A non-leader process queues the request in the database
+            request_sync(integration.id)
+            request_sync(integration.id)
+            assert SyncRequest.query.count() == 2
+            
+            scheduler = IntegrationScheduler()
+            assert scheduler.drain_sync_requests() == 2
+            assert SyncRequest.query.count() == 0
+            assert scheduler.get_next_sync_at(integration.id) <= datetime.utcnow()
+    
+    def test_manual_syncs_are_requested_from_leader(self, app, runner, authenticated_client, test_user):
+        """Test that the sync endpoint and CLI command queue a request instead of syncing in-process."""
+        from app.models.scheduler_lease import SyncRequest
+        from app.models.store_integration import StoreIntegration
+        
+        with app.app_context():
+            integration = StoreIntegration(
+                user_id=test_user.id,
+                platform='shopify',
+                store_url='manual.myshopify.com',
+                access_token='token'
+            )
+            db.session.add(integration)
+            db.session.commit()
+            integration_id = integration.id
+        
+        with patch('app.utils.scheduler.sync_integration') as mock_sync:
+            response = authenticated_client.post(f'/integrations/{integration_id}/sync')
+            assert response.status_code == 202
+            assert authenticated_client.post('/integrations/999999/sync').status_code == 404
+            
+            result = runner.invoke(args=['performance', 'sync-integration', str(integration_id)])
+            assert 'Sync requested' in result.output
+            mock_sync.assert_not_called()
+        
+        with app.app_context():
+            assert [request.integration_id for request in SyncRequest.query.all()] == [integration_id] * 2
+
+class TestSyncRunTelemetry:
+    """Test per-execution sync telemetry and the sync cost report."""
+    
+    def test_sync_run_is_recorded_and_ranked(self, app, runner, authenticated_client, test_user):
+        """Test that a sync records calls, bytes, retries and inserts, and is ranked by cost."""
+        from unittest.mock import MagicMock
+        from app.models.store_integration import StoreIntegration
+        from app.models.sync_run import SyncRun
+        from app.utils.scheduler import sync_integration
+        
+        def fake_response(status_code, payload):
+            body = json.dumps(payload).encode('utf-8')
+            response = MagicMock(status_code=status_code, content=body,
+                                 headers={'Content-Length': str(len(body)), 'Retry-After': '0'})
+            response.json.return_value = payload
+            if status_code >= 400:
+                import requests
+                response.raise_for_status.side_effect = requests.exceptions.HTTPError(str(status_code))
+            return response
+        
+        order = {
+            'id': 9001,
+            'created_at': '2024-01-15T10:00:00Z',
+            'currency': 'USD',
+            'line_items': [{'product_id': 55, 'title': 'Lamp', 'price': '25.00'}]
+        }
+        responses = [
+            fake_response(429, {'errors': 'Exceeded call limit'}),
+            fake_response(200, {'orders': [order]}),
+            fake_response(200, {'product': {'images': []}})
+        ]
+        
+        with app.app_context():
+            busy = StoreIntegration(user_id=test_user.id, platform='shopify',
+                                    store_url='busy.myshopify.com', access_token='token')
+            broken = StoreIntegration(user_id=test_user.id, platform='shopify',
+                                      store_url='broken.myshopify.com', access_token='token')
+            db.session.add_all([busy, broken])
+            db.session.commit()
+            
+            with patch('app.utils.http_transport.requests.Session.request', side_effect=responses):
+                assert sync_integration(busy.id) is True
+            
+            run = SyncRun.query.filter_by(integration_id=busy.id).one()
+            assert run.status == 'success'
+            assert run.finished_at is not None
+            assert run.http_calls == 3
+            assert run.bytes_transferred == sum(len(r.content) for r in responses)
+            assert run.retries == 1
+            assert run.rate_limit_waits == 1
+            assert run.pages == 1
+            assert run.orders_inserted == 1
+            assert run.products_inserted == 1
+            
+            with patch('app.utils.http_transport.requests.Session.request',
+                       return_value=fake_response(401, {'errors': 'Invalid API key or access token'})):
+                assert sync_integration(broken.id) is False
+            
+            failed = SyncRun.query.filter_by(integration_id=broken.id).one()
+            assert failed.status == 'failed'
+            assert failed.failure_reason == 'Failed to get orders'
+            assert failed.http_calls == 1
+            busy_id = busy.id
+        
+        result = runner.invoke(args=['performance', 'sync-report'])
+        assert 'busy.myshopify.com' in result.output
+        assert result.output.index('busy.myshopify.com') < result.output.index('broken.myshopify.com')
+        
+        with patch.object(User, 'is_admin', True, create=True):
+            response = authenticated_client.get('/admin/api/sync-report?days=1')
+        assert response.status_code == 200
+        report = response.get_json()
+        assert report['total_http_calls'] == 4
+        assert report['stores'][0]['integration_id'] == busy_id
+        assert report['stores'][0]['share_of_calls'] == 0.75
+        assert report['stores'][1]['failed_runs'] == 1
+    
+    def test_streamed_download_is_counted_without_buffering(self, tmp_path):
+        """Test that a streamed body without Content-Length is counted as it is read, not loaded at once."""
+        from app.utils.http_transport import HTTPTransport
+        from app.utils.image_storage import stream_image
+        from app.utils.sync_telemetry import SyncRunRecorder, recording
+        
+        class StreamedResponse:
+            status_code = 200
+            headers = {'Content-Type': 'image/png'}  # Chunked, so no Content-Length
+            
+            @property
+            def content(self):
+                raise AssertionError("streamed body read into memory")
+            
+            def iter_content(self, chunk_size):
+                yield from (b'x' * chunk_size, b'x' * 100)
+            
+            def close(self):
+                pass
+        
+        recorder = SyncRunRecorder()
+        transport = HTTPTransport(max_retries=0)
+        with patch('app.utils.image_storage.get_transport', return_value=transport), \
+                patch('requests.Session.request', return_value=StreamedResponse()), recording(recorder):
+            content_hash, _ = stream_image('https://cdn.example.com/a.png', str(tmp_path), chunk_size=1024)
+        
+        assert content_hash
+        assert recorder.http_calls == 1
+        assert recorder.bytes_transferred == 1024 + 100
+
+class TestAsyncSyncRunner:
+    """Test the asyncio sync layer against an in-process fake store server."""
+    
+    @staticmethod
+    def _start_fake_store():
+        """Serve minimal Shopify and WooCommerce APIs on localhost; returns (server, stats)."""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlsplit, parse_qs
+        
+        stats = {'requests': 0, 'connections': set(), 'throttled': set()}
+        lock = threading.Lock()
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, so the client can pool connections
+            
+            def log_message(self, *args):
+                pass
+            
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with lock:
+                    stats['requests'] += 1
+                    stats['connections'].add(self.client_address)
+                    first_call = url.path not in stats['throttled']
+                    stats['throttled'].add(url.path)
+                
+                if url.path.endswith('/products/1.json') and first_call:
+                    return self._send(429, {'errors': 'Exceeded call limit'}, {'Retry-After': '0'})
+                
+                if url.path == '/admin/api/2023-01/orders.json':
+                    email = query.get('email', '')
+                    if query.get('page_info') == '2':
+                        return self._send(200, {'orders': [self._shopify_order(email, 2)]})
+                    next_link = f'<http://{self.headers["Host"]}{url.path}?page_info=2&email={email}>; rel="next"'
+                    return self._send(200, {'orders': [self._shopify_order(email, 1)]}, {'Link': next_link})
+                
+                if url.path.startswith('/admin/api/2023-01/products/'):
+                    product_id = url.path.rsplit('/', 1)[1].split('.')[0]
+                    return self._send(200, {'product': {'id': int(product_id), 'images': []}})
+                
+                if url.path == '/wp-json/wc/v3/customers':
+                    return self._send(200, [{'id': 7, 'email': query.get('email')}])
+                
+                if url.path == '/wp-json/wc/v3/orders':
+                    return self._send(200, [{
+                        'id': 8000 + int(query['customer']),
+                        'date_created': '2024-02-01T09:00:00',
+                        'line_items': [{'product_id': 30, 'name': 'Mug'}]
+                    }], {'X-WP-TotalPages': '1'})
+                
+                if url.path == '/wp-json/wc/v3/products/30':
+                    return self._send(200, {'id': 30, 'name': 'Mug', 'price': '12.00', 'images': []})
+                
+                self._send(404, {'error': 'not found'})
+            
+            @staticmethod
+            def _shopify_order(email, page):
+                order_id = abs(hash((email, page))) % 10 ** 9
+                return {
+                    'id': order_id,
+                    'created_at': '2024-01-15T10:00:00Z',
+                    'currency': 'USD',
+                    'line_items': [{'product_id': page, 'title': f'Product {page}', 'price': '10.00'}]
+                }
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, stats
+    
+    def test_concurrent_syncs_are_fetched_async_and_written_in_batches(self, app):
+        """Test that many stores sync concurrently over pooled connections with batched writes."""
+        from app.models.store_integration import StoreIntegration
+        from app.models.sync_run import SyncRun
+        from app.services.async_sync import AsyncSyncRunner
+        
+        server, stats = self._start_fake_store()
+        store_url = f'http://127.0.0.1:{server.server_address[1]}'
+        
+        try:
+            with app.app_context():
+                integration_ids = []
+                for i in range(24):
+                    user = User(
+                        email=f'async{i}@example.com',
+                        name=f'Async User {i}',
+                        password_hash='x'
+                    )
+                    db.session.add(user)
+                    db.session.flush()
+                    
+                    woo = i % 4 == 0
+                    integration = StoreIntegration(
+                        user_id=user.id,
+                        platform='woocommerce' if woo else 'shopify',
+                        store_url=store_url,
+                        access_token='token',
+                        store_metadata={'consumer_key': 'ck', 'consumer_secret': 'cs'} if woo else None
+                    )
+                    db.session.add(integration)
+                    db.session.flush()
+                    integration_ids.append(integration.id)
+                db.session.commit()
+            
+            runner = AsyncSyncRunner(app, concurrency=50, connections_per_host=3, batch_size=10,
+                                     batch_delay=0.05)
+            runner.start()
+            try:
+                transport = runner._transport
+                results = runner.run(integration_ids)
+            finally:
+                runner.stop()
+            
+            assert all(results.values())
+            
+            # All requests to the single fake host share at most 3 pooled connections
+            assert len(stats['connections']) <= 3
+            assert transport.stats['connections_reused'] > 0
+            
+            with app.app_context():
+                assert Purchase.query.filter_by(order_id=str(8007)).count() == 6
+                assert Product.query.filter_by(source='shopify').count() == 2
+                assert Product.query.filter_by(source='woocommerce', external_id='30').count() == 1
+                assert Purchase.query.count() == 18 * 2 + 6
+                assert StoreIntegration.query.filter(StoreIntegration.last_sync == None).count() == 0
+                
+                runs = SyncRun.query.all()
+                assert len(runs) == 24
+                assert all(run.status == 'success' for run in runs)
+                shopify_runs = [run for run in runs if run.platform == 'shopify']
+                assert all(run.pages == 2 for run in shopify_runs)
+                assert sum(run.orders_inserted for run in runs) == 18 * 2 + 6
+                assert sum(run.retries for run in runs) == 1
+                assert sum(run.http_calls for run in runs) == stats['requests']
+        finally:
+            server.shutdown()
+            server.server_close()
+    
+    def test_async_scheduler_creates_no_sync_thread_pool(self, app):
+        """Test that in async mode the scheduler doesn't size a thread pool by the async concurrency."""
+        from app.utils.scheduler import IntegrationScheduler
+        
+        app.config.update(SYNC_ASYNC_ENABLED=True, SYNC_ASYNC_CONCURRENCY=200)
+        scheduler = IntegrationScheduler(refresh_interval=3600, request_poll_interval=3600)
+        with patch('app.services.async_sync.AsyncSyncRunner.from_app') as mock_runner:
+            scheduler.start(app)
+            try:
+                assert scheduler.max_concurrency == 200
+                assert scheduler._executor is None
+                assert scheduler.get_status()['async'] is True
+            finally:
+                scheduler.stop()
+        mock_runner.return_value.stop.assert_called_once()
+
+class TestAsyncHTTPTransport:
+    """Test the asyncio HTTP transport against scripted raw HTTP responses."""
+    
+    @staticmethod
+    def _exchange(responses, requests):
+        """
+        Serve ``responses`` (raw bytes, close after sending) in order, one per
+        request, and run ``requests(transport, base_url)``; returns (result, transport, connections).
+        """
+        import asyncio
+        from app.utils.async_http import AsyncHTTPTransport
+        
+        pending = list(responses)
+        connections = []
+        
+        async def handle(reader, writer):
+            connections.append(writer)
+            while pending:
+                try:
+                    await reader.readuntil(b'\r\n\r\n')  # Request head; bodies are left unread
+                except asyncio.IncompleteReadError:
+                    break  # The client closed the connection
+                raw, close = pending.pop(0)
+                writer.write(raw)
+                await writer.drain()
+                if close:
+                    break
+            writer.close()
+        
+        async def main():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            transport = AsyncHTTPTransport(max_retries=2, backoff_base=0.01, backoff_max=0.5, timeout=5)
+            try:
+                return await requests(transport, f'http://127.0.0.1:{port}'), transport
+            finally:
+                await transport.close()
+                server.close()
+                await server.wait_closed()
+        
+        result, transport = asyncio.run(main())
+        return result, transport, connections
+    
+    def test_chunked_response_keeps_connection(self):
+        """Test that a chunked body with extensions and trailers is decoded and the connection reused."""
+        chunked = (b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n'
+                   b'7;ext=1\r\n{"order\r\n'
+                   b'B\r\ns": [1, 2]}\r\n'
+                   b'0\r\nX-Trailer: done\r\n\r\n')
+        plain = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'
+        
+        async def requests(transport, base_url):
+            first = await transport.request('GET', f'{base_url}/orders.json')
+            second = await transport.request('GET', f'{base_url}/orders.json')
+            return first, second
+        
+        (first, second), transport, connections = self._exchange([(chunked, False), (plain, False)], requests)
+        
+        assert first.json() == {'orders': [1, 2]}
+        assert second.json() == {}
+        assert len(connections) == 1
+        assert transport.stats['connections_reused'] == 1
+    
+    def test_idle_connection_closed_by_server_is_replaced(self):
+        """Test that a keep-alive connection the server closed is replaced without a retry."""
+        import asyncio
+        
+        response = b'HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\n{"ok": true}'
+        
+        async def requests(transport, base_url):
+            first = await transport.request('GET', f'{base_url}/a')
+            await asyncio.sleep(0.05)  # The server hangs up while the connection sits in the pool
+            second = await transport.request('GET', f'{base_url}/b')
+            return first, second
+        
+        (first, second), transport, connections = self._exchange([(response, True), (response, True)], requests)
+        
+        assert first.status_code == second.status_code == 200
+        assert second.json() == {'ok': True}
+        assert len(connections) == 2
+        assert transport.stats['connections_opened'] == 2
+        assert transport.stats['retries'] == 0
+    
+    def test_retry_after_http_date(self):
+        """Test that Retry-After given as an HTTP-date is honored and capped."""
+        import time
+        from email.utils import formatdate
+        from unittest.mock import MagicMock
+        from app.utils.sync_telemetry import retry_after_seconds
+        
+        def headers(value):
+            return MagicMock(headers={'Retry-After': value})
+        
+        assert 25 < retry_after_seconds(headers(formatdate(time.time() + 30, usegmt=True)), maximum=60) <= 30
+        assert retry_after_seconds(headers(formatdate(time.time() + 300, usegmt=True)), maximum=60) == 60
+        assert retry_after_seconds(headers(formatdate(time.time() - 30, usegmt=True))) == 0
+        assert retry_after_seconds(headers('soon'), default=2.5) == 2.5
+        
+        throttled = ('HTTP/1.1 429 Too Many Requests\r\nRetry-After: %s\r\nContent-Length: 0\r\n\r\n'
+                     % formatdate(time.time() - 1, usegmt=True)).encode('latin-1')
+        ok = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n[]'
+        
+        async def requests(transport, base_url):
+            return await transport.request('GET', f'{base_url}/products/1.json')
+        
+        response, transport, _ = self._exchange([(throttled, False), (ok, False)], requests)
+        
+        assert response.status_code == 200
+        assert transport.stats['retries'] == 1
+    
+    def test_writes_are_only_resent_when_safe(self):
+        """Test that a POST is retried after a 429 but not after a 5xx or a dropped response."""
+        unavailable = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n'
+        throttled = b'HTTP/1.1 429 Too Many Requests\r\nRetry-After: 0\r\nContent-Length: 0\r\n\r\n'
+        created = b'HTTP/1.1 201 Created\r\nContent-Length: 2\r\n\r\n{}'
+        
+        async def post(transport, base_url):
+            return await transport.request('POST', f'{base_url}/orders.json', json_body={'order': {}})
+        
+        response, transport, _ = self._exchange([(unavailable, False), (created, False)], post)
+        assert response.status_code == 503
+        assert transport.stats['retries'] == 0
+        
+        response, transport, _ = self._exchange([(throttled, False), (created, False)], post)
+        assert response.status_code == 201
+        assert transport.stats['retries'] == 1
+        
+        # The server hangs up after reading the request: it may have been applied
+        from app.utils.async_http import AsyncHTTPError
+        
+        with pytest.raises(AsyncHTTPError):
+            self._exchange([(b'', True), (created, False)], post)
+        
+        async def get(transport, base_url):
+            return await transport.request('GET', f'{base_url}/orders.json')
+        
+        response, transport, _ = self._exchange([(b'', True), (created, False)], get)
+        assert response.status_code == 201
+        assert transport.stats['retries'] == 1
+    
+    def test_write_retried_when_connection_never_opened(self):
+        """Test that a POST that could not connect is retried, since it was never sent."""
+        import asyncio
+        import socket
+        from app.utils.async_http import AsyncHTTPTransport, AsyncHTTPError
+        
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]  # Nothing listens here once the socket is closed
+        
+        transport = AsyncHTTPTransport(max_retries=2, backoff_base=0.01, timeout=5)
+        with pytest.raises(AsyncHTTPError):
+            asyncio.run(transport.request('POST', f'http://127.0.0.1:{port}/orders.json', json_body={}))
+        assert transport.stats['requests'] == 3
@@ -207,6 +207,36 @@ class TestProductModel:
             
             assert len(product.purchases) == 1
             assert product.purchases[0].user_id == user.id
+    
+    def test_source_external_id_is_unique(self, app):
+        """Test that a store product can only be stored once and upserts converge."""
+        from sqlalchemy.exc import IntegrityError
+        from app.utils.bulk_upsert import upsert_products
+        
+        with app.app_context():
+            db.session.add(Product(title='First', source='shopify', external_id='42', price=1))
+            db.session.commit()
+            
+            db.session.add(Product(title='Copy', source='shopify', external_id='42', price=1))
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+            
+            product_ids = upsert_products([
+                {'source': 'shopify', 'external_id': '42', 'title': 'Renamed', 'price': 2},
+                {'source': 'shopify', 'external_id': '43', 'title': 'New', 'price': 3},
+                {'source': 'shopify', 'external_id': '43', 'title': 'New again', 'price': 4}
+            ])
+            db.session.commit()
+            
+            assert Product.query.filter_by(source='shopify').count() == 2
+            assert Product.query.get(product_ids[('shopify', '42')]).title == 'Renamed'
+            assert Product.query.get(product_ids[('shopify', '43')]).title == 'New again'
+            
+            # Products without an external id are not constrained
+            db.session.add(Product(title='Manual', source='shopify', price=1))
+            db.session.add(Product(title='Manual', source='shopify', price=1))
+            db.session.commit()
 
 class TestPurchaseModel:
     """Test cases for the Purchase model."""
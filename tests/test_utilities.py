@@ -3,6 +3,7 @@ Unit tests for utility functions.
 """
 import pytest
 from datetime import datetime, timedelta
+from unittest.mock import patch
 from app.utils.forms import LoginForm, RegistrationForm, ResetPasswordForm
 from app.services.analytics_service import AnalyticsService
 from app.services.purchase_sharing_service import PurchaseSharingService
@@ -202,6 +203,396 @@ class TestPurchaseSharingService:
             assert feed_item['purchase']['id'] == purchase.id
             assert feed_item['user']['id'] == test_user.id
 
+class TestWooCommerceImageService:
+    """Test cases for diff-based WooCommerce image updates."""
+    
+    def _wc_data(self, images, date_modified='2024-01-02T00:00:00'):
+        return {
+            'id': 321,
+            'name': 'Diff Product',
+            'price': '10.00',
+            'images': images,
+            'date_modified': date_modified
+        }
+    
+    def test_unchanged_images_are_kept(self, app):
+        """Test that re-processing identical images does not touch rows or probe URLs."""
+        from app import db
+        from app.models.product_image import ProductImage
+        from app.services.woocommerce_image_service import WooCommerceImageService
+        
+        with app.app_context():
+            images = [
+                {'id': 1, 'src': 'https://shop.test/a.jpg', 'alt': 'A'},
+                {'id': 2, 'src': 'https://shop.test/b.jpg', 'alt': 'B'}
+            ]
+            with patch.object(WooCommerceImageService, '_verify_image_url', side_effect=lambda url, fallback: fallback) as probe:
+                product = WooCommerceImageService.create_product_from_wc_data(self._wc_data(images))
+                original_ids = sorted(image.id for image in ProductImage.query.filter_by(product_id=product.id))
+                probe.reset_mock()
+                
+                WooCommerceImageService.process_product_images(product, self._wc_data(images))
+                
+                assert probe.call_count == 0
+            
+            assert sorted(image.id for image in ProductImage.query.filter_by(product_id=product.id)) == original_ids
+    
+    def test_changed_images_are_diffed(self, app):
+        """Test that only changed, new and removed images are written."""
+        from app.models.product_image import ProductImage
+        from app.services.woocommerce_image_service import WooCommerceImageService
+        
+        with app.app_context():
+            images = [
+                {'id': 1, 'src': 'https://shop.test/a.jpg', 'alt': 'A'},
+                {'id': 2, 'src': 'https://shop.test/b.jpg', 'alt': 'B'}
+            ]
+            with patch.object(WooCommerceImageService, '_verify_image_url', side_effect=lambda url, fallback: fallback) as probe:
+                product = WooCommerceImageService.create_product_from_wc_data(self._wc_data(images))
+                kept = ProductImage.query.filter_by(product_id=product.id, external_image_id='1').first()
+                probe.reset_mock()
+                
+                new_images = [
+                    {'id': 1, 'src': 'https://shop.test/a.jpg', 'alt': 'A renamed'},
+                    {'id': 3, 'src': 'https://shop.test/c.jpg', 'alt': 'C'}
+                ]
+                WooCommerceImageService.process_product_images(product, self._wc_data(new_images))
+                
+                # Only the new image needs its size variants probed
+                assert probe.call_count == 3
+            
+            stored = ProductImage.query.filter_by(product_id=product.id).order_by(ProductImage.image_order).all()
+            assert [image.external_image_id for image in stored] == ['1', '3']
+            assert stored[0].id == kept.id
+            assert stored[0].alt_text == 'A renamed'
+            assert stored[0].is_primary is True
+    
+    def test_unmodified_product_is_skipped(self, app):
+        """Test that products with an unchanged date_modified are not reprocessed."""
+        from app.services.woocommerce_image_service import WooCommerceImageService
+        
+        with app.app_context():
+            images = [{'id': 1, 'src': 'https://shop.test/a.jpg', 'alt': 'A'}]
+            with patch.object(WooCommerceImageService, '_verify_image_url', side_effect=lambda url, fallback: fallback):
+                product = WooCommerceImageService.create_product_from_wc_data(
+                    self._wc_data(images, date_modified='2024-01-02T00:00:00Z')
+                )
+            
+            with patch.object(WooCommerceImageService, 'process_product_images') as process:
+                data = self._wc_data(images, date_modified='2024-01-02T00:00:00Z')
+                data['name'] = 'Renamed'
+                WooCommerceImageService.update_product_with_wc_data(product, data)
+                assert process.call_count == 0
+                assert product.title == 'Diff Product'
+                
+                data['date_modified'] = '2024-01-03T00:00:00Z'
+                WooCommerceImageService.update_product_with_wc_data(product, data)
+                assert process.call_count == 1
+                assert product.title == 'Renamed'
+    
+    def test_images_are_stored_locally_by_content_hash(self, app, tmp_path):
+        """Test that images are streamed to disk once and served from local derivatives."""
+        import io
+        import os
+        from unittest.mock import MagicMock
+        from PIL import Image
+        from app.models.product_image import ProductImage
+        from app.services.woocommerce_image_service import WooCommerceImageService
+        
+        buffer = io.BytesIO()
+        Image.new('RGBA', (800, 400), (255, 0, 0, 128)).save(buffer, 'PNG')
+        png = buffer.getvalue()
+        
+        def fake_get(method, url, **kwargs):
+            response = MagicMock()
+            if url.endswith('.html'):
+                response.status_code = 200
+                response.headers = {'Content-Type': 'text/html'}
+                return response
+            response.status_code = 200
+            response.headers = {'Content-Type': 'image/png', 'Content-Length': str(len(png))}
+            response.iter_content.side_effect = lambda chunk_size: (
+                png[i:i + chunk_size] for i in range(0, len(png), chunk_size)
+            )
+            return response
+        
+        app.config.update(PRODUCT_IMAGE_LOCAL_STORAGE=True, PRODUCT_IMAGE_ROOT=str(tmp_path),
+                          PRODUCT_IMAGE_URL_PREFIX='/media/products', IMAGE_PROCESS_WORKERS=1)
+        with app.app_context():
+            images = [
+                {'id': 1, 'src': 'https://shop.test/a.png', 'alt': 'A'},
+                {'id': 2, 'src': 'https://cdn.test/same-picture.png', 'alt': 'B'},
+                {'id': 3, 'src': 'https://shop.test/not-an-image.html', 'alt': 'C'}
+            ]
+            with patch('app.utils.http_transport.requests.Session.request', side_effect=fake_get) as get, \
+                 patch.object(WooCommerceImageService, '_verify_image_url',
+                              side_effect=lambda url, fallback: fallback) as probe:
+                product = WooCommerceImageService.create_product_from_wc_data(self._wc_data(images))
+                assert get.call_count == 3
+                assert probe.call_count == 3  # Only the rejected image falls back to WooCommerce sizes
+            
+            stored = ProductImage.query.filter_by(product_id=product.id).order_by(ProductImage.image_order).all()
+            assert stored[0].full_url == stored[1].full_url  # Same bytes, one stored file
+            assert stored[0].full_url.startswith('/media/products/')
+            assert stored[0].thumbnail_url.endswith('_150.jpg')
+            assert stored[0].get_webp_url('thumbnail').endswith('_150.webp')
+            assert stored[2].full_url == 'https://shop.test/not-an-image.html'
+            
+            stored_files = sorted(name for _, _, names in os.walk(tmp_path) for name in names)
+            assert len(stored_files) == 8  # Original, full WebP and 3 sizes x (JPEG, WebP)
+            
+            thumbnail = os.path.join(str(tmp_path), stored[0].thumbnail_url[len('/media/products/'):])
+            with Image.open(thumbnail) as image:
+                assert image.size == (150, 75)
+            
+            # Unchanged sources are not downloaded again
+            with patch('app.utils.http_transport.requests.Session.request', side_effect=fake_get) as get:
+                WooCommerceImageService.process_product_images(product, self._wc_data(images))
+                assert get.call_count == 0
+    
+    def test_image_url_prefix_follows_image_root(self, app, tmp_path):
+        """Test that image URLs match where the image root is served from."""
+        import os
+        from app.utils.image_storage import get_image_url_prefix
+        
+        with app.app_context():
+            assert get_image_url_prefix() == '/static/images/products/'
+            
+            app.config.update(PRODUCT_IMAGE_ROOT=os.path.join(app.static_folder, 'uploads', 'products'))
+            assert get_image_url_prefix() == '/static/uploads/products/'
+            
+            # A root outside the static folder is not served under /static
+            app.config.update(PRODUCT_IMAGE_ROOT=str(tmp_path))
+            with pytest.raises(ValueError):
+                get_image_url_prefix()
+            
+            app.config.update(PRODUCT_IMAGE_URL_PREFIX='https://cdn.example.com/products')
+            assert get_image_url_prefix() == 'https://cdn.example.com/products/'
+
+class TestCatalogIngestPipeline:
+    """Test cases for the streaming catalog ingest pipeline."""
+    
+    def _source(self, pages):
+        from app.services.catalog_ingest import CatalogSource, CatalogPage
+        
+        class FakeSource(CatalogSource):
+            source = 'woocommerce'
+            
+            def fetch_page(self, page):
+                self.http_calls += 1
+                return CatalogPage(pages[page - 1], page + 1 if page < len(pages) else None, len(pages))
+        
+        return FakeSource(page_size=2)
+    
+    def _product(self, product_id, name, price='5.00'):
+        return {'id': product_id, 'name': name, 'price': price, 'categories': [{'name': 'Shoes'}]}
+    
+    def test_pages_are_deduped_and_upserted(self, app):
+        """Test that products are deduplicated across pages and existing rows are updated."""
+        from app import db
+        from app.models.product import Product
+        from app.services.catalog_ingest import CatalogIngestPipeline
+        
+        with app.app_context():
+            db.session.add(Product(external_id='1', source='woocommerce', title='Old', price=1))
+            db.session.commit()
+            
+            pages = [
+                [self._product(1, 'Sneaker'), self._product(2, 'Boot')],
+                [self._product(2, 'Boot'), self._product(3, 'Sandal')],
+                [self._product(4, 'Loafer'), {'name': 'No id'}]
+            ]
+            stats = CatalogIngestPipeline(self._source(pages), batch_size=2, concurrency=3).run()
+            
+            assert stats['pages'] == 3
+            assert stats['fetched'] == 6
+            assert stats['duplicates'] == 1
+            assert stats['skipped'] == 1
+            assert stats['inserted'] == 3
+            assert stats['updated'] == 1
+            assert stats['rows_per_second'] > 0
+            
+            products = Product.query.filter_by(source='woocommerce').order_by(Product.external_id).all()
+            assert [p.external_id for p in products] == ['1', '2', '3', '4']
+            assert products[0].title == 'Sneaker'
+            assert products[0].category == 'Shoes'
+    
+    def test_numbered_pages_keep_order(self, app):
+        """Test that concurrently fetched pages are yielded in page order."""
+        pages = [[self._product(i, f'P{i}')] for i in range(1, 8)]
+        source = self._source(pages)
+        
+        fetched = [items[0]['id'] for items in source.pages(concurrency=4)]
+        
+        assert fetched == list(range(1, 8))
+        assert source.http_calls == 7
+
+class TestHTTPCache:
+    """Test the conditional-request cache used by the store clients."""
+    
+    @staticmethod
+    def _response(status_code, body=b'', headers=None):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        
+        response = Response()
+        response.status_code = status_code
+        response._content = body
+        response.headers = CaseInsensitiveDict(headers or {})
+        return response
+    
+    def test_revalidation_and_ttl_mode(self, tmp_path):
+        """Test that a 304 serves the stored body and TTL entries skip the request."""
+        from app.utils.http_cache import HTTPCache
+        
+        cache = HTTPCache(str(tmp_path / 'http_cache.sqlite'))
+        body = b'{"product": {"id": 1, "title": "Lamp"}}'
+        sent_headers = []
+        
+        def send(headers):
+            sent_headers.append(headers)
+            if headers.get('If-None-Match') == '"v1"':
+                return self._response(304)
+            return self._response(200, body, {'ETag': '"v1"', 'Content-Type': 'application/json'})
+        
+        url = 'https://shop.example.com/admin/api/products/1.json'
+        first = cache.fetch(url, send)
+        assert first.json()['product']['title'] == 'Lamp'
+        assert sent_headers[0] == {}
+        
+        second = cache.fetch(url, send)
+        assert sent_headers[1] == {'If-None-Match': '"v1"'}
+        assert second.status_code == 200
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.json() == first.json()
+        
+        # Other credentials don't share entries
+        cache.fetch(url, send, vary='other-token')
+        assert sent_headers[2] == {}
+        
+        # Without validators only TTL mode caches, and then skips the request entirely
+        plain = lambda headers: sent_headers.append(headers) or self._response(200, b'[]')
+        cache.fetch('https://woo.example.com/wp-json/wc/v3/customers', plain, params={'email': 'a@b.c'})
+        cache.fetch('https://woo.example.com/wp-json/wc/v3/customers', plain, params={'email': 'a@b.c'})
+        assert len(sent_headers) == 5
+        
+        cache.fetch('https://woo.example.com/wp-json/wc/v3/products/1', plain, ttl=60)
+        served = cache.fetch('https://woo.example.com/wp-json/wc/v3/products/1', plain, ttl=60)
+        assert len(sent_headers) == 6
+        assert served.json() == []
+        
+        stats = cache.get_stats()
+        assert stats['requests'] == 7
+        assert stats['revalidated_hits'] == 1
+        assert stats['ttl_hits'] == 1
+        assert stats['hit_ratio'] == round(2 / 7, 4)
+        assert stats['bytes_saved'] == len(body) + 2
+    
+    def test_shopify_client_sends_conditional_requests(self, app, tmp_path):
+        """Test that ShopifyClient GETs are revalidated through the cache."""
+        from app.integrations.shopify import ShopifyClient
+        from app.utils.http_cache import get_http_cache
+        
+        app.config['HTTP_CACHE_ENABLED'] = True
+        app.config['HTTP_CACHE_PATH'] = str(tmp_path / 'http_cache.sqlite')
+        responses = [
+            self._response(200, b'{"orders": [{"id": 1}]}', {'ETag': '"abc"'}),
+            self._response(304)
+        ]
+        
+        with app.app_context():
+            client = ShopifyClient(store_url='cached.myshopify.com', access_token='token')
+            with patch('app.utils.http_transport.requests.Session.request', side_effect=responses) as mock_get:
+                assert client.get_orders() == {'orders': [{'id': 1}]}
+                assert client.get_orders() == {'orders': [{'id': 1}]}
+            
+            assert mock_get.call_args_list[1].kwargs['headers']['If-None-Match'] == '"abc"'
+            assert get_http_cache().get_stats()['revalidated_hits'] == 1
+
+class TestHTTPTransport:
+    """Test cases for the shared outbound HTTP transport."""
+    
+    @staticmethod
+    def _response(status_code, headers=None):
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        
+        response = Response()
+        response.status_code = status_code
+        response._content = b'{}'
+        response._content_consumed = True
+        response.headers = CaseInsensitiveDict(headers or {})
+        return response
+    
+    def test_retries_honor_retry_after(self):
+        """Test that 429s wait for Retry-After and 5xx responses are retried with backoff."""
+        from app.utils.http_transport import HTTPTransport
+        
+        transport = HTTPTransport(max_retries=3, backoff_base=0.01, backoff_max=5)
+        responses = [self._response(429, {'Retry-After': '2'}), self._response(503), self._response(200)]
+        
+        with patch('app.utils.http_transport.requests.Session.request', side_effect=responses) as send, \
+             patch('app.utils.http_transport.time.sleep') as sleep:
+            response = transport.get('https://retry.test/orders', params={'page': 1})
+        
+        assert response.status_code == 200
+        assert send.call_count == 3
+        assert send.call_args.kwargs['timeout'] == (5, 30)
+        assert sleep.call_args_list[0].args[0] == 2.0
+        assert sleep.call_args_list[1].args[0] <= 0.02
+    
+    def test_post_is_not_retried_after_server_error(self):
+        """Test that a non-idempotent request is returned after a 5xx instead of being resent."""
+        from app.utils.http_transport import HTTPTransport
+        
+        transport = HTTPTransport(backoff_base=0.01)
+        with patch('app.utils.http_transport.requests.Session.request', return_value=self._response(502)) as send:
+            assert transport.post('https://retry.test/webhooks', json={}).status_code == 502
+        assert send.call_count == 1
+    
+    def test_circuit_opens_and_fails_fast(self):
+        """Test that a failing host trips its breaker and later calls fail without a request."""
+        import requests
+        from app.utils.http_transport import HTTPTransport, CircuitOpenError
+        
+        transport = HTTPTransport(max_retries=0, failure_threshold=2, reset_timeout=60)
+        with patch('app.utils.http_transport.requests.Session.request',
+                   side_effect=requests.exceptions.ConnectionError('refused')) as send:
+            for _ in range(2):
+                with pytest.raises(requests.exceptions.ConnectionError):
+                    transport.get('https://down.test/orders')
+            with pytest.raises(CircuitOpenError):
+                transport.get('https://down.test/orders')
+        
+        assert send.call_count == 2
+        assert transport.get_status()['down.test']['state'] == 'open'
+        
+        # Once the reset timeout passes, one trial request closes the circuit again
+        transport.breaker('down.test').opened_at -= 60
+        with patch('app.utils.http_transport.requests.Session.request', return_value=self._response(200)):
+            assert transport.get('https://down.test/orders').status_code == 200
+        assert transport.get_status()['down.test']['state'] == 'closed'
+    
+    def test_latency_histograms_per_host(self):
+        """Test that outbound calls feed per-host latency histograms into the performance monitor."""
+        from app.utils.http_transport import HTTPTransport
+        from app.utils.performance_monitor import PerformanceMonitor
+        
+        monitor = PerformanceMonitor()
+        transport = HTTPTransport(max_retries=0)
+        with patch('app.utils.performance_monitor.performance_monitor', monitor), \
+             patch('app.utils.http_transport.requests.Session.request',
+                   side_effect=[self._response(200), self._response(200), self._response(500)]):
+            transport.get('https://fast.test/a')
+            transport.get('https://fast.test/b')
+            transport.get('https://other.test/c')
+        
+        stats = monitor.get_performance_summary()['outbound_stats']
+        assert stats['fast.test']['count'] == 2
+        assert stats['fast.test']['p99'] == 0.05
+        assert stats['fast.test']['histogram']['0.05'] == 2
+        assert stats['other.test']['error_rate'] == 1.0
+
 class TestNotificationService:
     """Test cases for notification service utilities."""
     